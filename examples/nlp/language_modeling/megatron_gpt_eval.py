@@ -22,7 +22,12 @@ from torch.utils.data import DataLoader, Dataset
 
 from nemo.collections.nlp.models.language_modeling.megatron_gpt_model import MegatronGPTModel
 from nemo.collections.nlp.modules.common.megatron.megatron_init import fake_initialize_model_parallel
+from nemo.collections.nlp.modules.common.megatron.paged_kv_cache import PagedKVCache
 from nemo.collections.nlp.modules.common.megatron_web_server import get_demo
+from nemo.collections.nlp.modules.common.text_generation_scheduler import (
+    ContinuousBatchingScheduler,
+    MegatronGPTPagedModelRunner,
+)
 from nemo.collections.nlp.modules.common.text_generation_server import MegatronServer
 from nemo.collections.nlp.modules.common.text_generation_utils import generate
 from nemo.collections.nlp.modules.common.transformer.text_generation import LengthParam, SamplingParam
@@ -216,6 +221,9 @@ def main(cfg) -> None:
     except AttributeError:
         pass
 
+    # reuse the key-value memory of prompt prefixes shared across requests
+    model.set_kv_prefix_cache(cfg.get('kv_prefix_cache_tokens', 0))
+
     length_params: LengthParam = {
         "max_length": cfg.inference.tokens_to_generate,
         "min_length": cfg.inference.min_tokens_to_generate,
@@ -252,13 +260,30 @@ def main(cfg) -> None:
     print(response)
     print("***************************")
 
+    if model.kv_prefix_cache is not None:
+        print(f'KV prefix cache stats: {model.kv_prefix_cache.stats()}')
+
     # Third method of running text generation, use inference server
     if cfg.server:
         if parallel_state.is_pipeline_first_stage() and parallel_state.get_tensor_model_parallel_rank() == 0:
             if cfg.web_server:
                 thread = threading.Thread(target=get_demo, daemon=True, args=(cfg.share, cfg.username, cfg.password))
                 thread.start()
-            server = MegatronServer(model.cuda())
+            scheduler = None
+            continuous_batching = cfg.get('continuous_batching', {})
+            if continuous_batching.get('enabled', False):
+                # admit requests into the running batch at every step instead of generating fixed batches
+                scheduler = ContinuousBatchingScheduler(
+                    MegatronGPTPagedModelRunner(model.cuda()),
+                    PagedKVCache(continuous_batching.num_kv_blocks, continuous_batching.kv_block_size),
+                    eos_id=model.tokenizer.eos_id,
+                    max_batch_size=continuous_batching.max_batch_size,
+                    max_sequence_length=model.cfg.encoder_seq_length,
+                    vocab_size=model.tokenizer.vocab_size,
+                    device=torch.cuda.current_device(),
+                )
+                scheduler.start()
+            server = MegatronServer(model.cuda(), scheduler=scheduler)
             server.run("0.0.0.0", port=cfg.port)
 
         while True:
@@ -0,0 +1,46 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Converts the pickled batches of a tarred parallel dataset created by create_tarred_parallel_dataset.py
+to the compact binary batch format, which TarredTranslationDataset loads without unpickling.
+USAGE Example:
+    python convert_tarred_parallel_dataset_to_binary.py \
+        --metadata_path=tarred/metadata.tokens.16000.json --out_dir=tarred_binary --src_pad_id=0 --tgt_pad_id=0
+"""
+
+import argparse
+
+from nemo.collections.nlp.data.machine_translation.translation_batch_format import convert_tarred_dataset_to_binary
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert a tarred NMT dataset to binary batches')
+    parser.add_argument('--metadata_path', type=str, required=True, help='Path to the metadata of the dataset')
+    parser.add_argument(
+        '--out_dir', type=str, required=True, help='Path to store the converted dataset, may be the dataset directory'
+    )
+    parser.add_argument('--src_pad_id', type=int, default=0, help='Pad id of the encoder tokenizer')
+    parser.add_argument('--tgt_pad_id', type=int, default=0, help='Pad id of the decoder tokenizer')
+    parser.add_argument(
+        '--n_preproc_jobs', type=int, default=-2, help='Number of processes to use for converting the dataset.',
+    )
+    args = parser.parse_args()
+
+    convert_tarred_dataset_to_binary(
+        metadata_path=args.metadata_path,
+        out_dir=args.out_dir,
+        src_pad_id=args.src_pad_id,
+        tgt_pad_id=args.tgt_pad_id,
+        n_jobs=args.n_preproc_jobs,
+    )
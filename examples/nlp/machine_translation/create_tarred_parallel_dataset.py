@@ -105,6 +105,11 @@ if __name__ == '__main__':
         action="store_true",
         help='If True, this will not respect whitepsaces while learning BPE merges.',
     )
+    parser.add_argument(
+        '--binary_batches',
+        action="store_true",
+        help='Whether to store batches in the compact binary format instead of pickle files.',
+    )
     args = parser.parse_args()
     if not os.path.exists(args.out_dir):
         os.mkdir(args.out_dir)
@@ -184,4 +189,5 @@ if __name__ == '__main__':
         n_jobs=args.n_preproc_jobs,
         encoder_tokenizer_legacy=args.encoder_tokenizer_legacy,
         decoder_tokenizer_legacy=args.decoder_tokenizer_legacy,
+        binary_batches=args.binary_batches,
     )
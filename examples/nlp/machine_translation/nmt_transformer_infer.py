@@ -67,6 +67,7 @@ def translate_text(
             target_lang=args.target_lang,
             return_beam_scores=args.write_scores,
             log_timing=args.write_timing,
+            max_tokens=args.max_tokens,
         )
 
         if args.write_timing:
@@ -107,6 +108,13 @@ def main():
     parser.add_argument(
         "--batch_size", type=int, default=256, help="Number of sentences to batch together while translatiing."
     )
+    parser.add_argument(
+        "--max_tokens",
+        type=int,
+        default=None,
+        help="If set, sentences of the whole file are sorted by length and batched by the number of padded source "
+        "tokens times beam size instead of --batch_size sentences in the input order.",
+    )
     parser.add_argument("--beam_size", type=int, default=4, help="Beam size.")
     parser.add_argument(
         "--len_pen", type=float, default=0.6, help="Length Penalty. Ref: https://arxiv.org/abs/1609.08144"
@@ -170,6 +178,8 @@ def main():
 
     if (len(models) > 1) and (args.write_timing):
         raise RuntimeError("Cannot measure timing when more than 1 model is used")
+    if (len(models) > 1) and (args.max_tokens is not None):
+        raise RuntimeError("Cannot batch by --max_tokens when more than 1 model is used")
 
     src_text = []
     tgt_text = []
@@ -239,7 +249,7 @@ def main():
     with open(args.srctext, 'r') as src_f:
         for line in src_f:
             src_text.append(line.strip())
-            if len(src_text) == args.batch_size:
+            if args.max_tokens is None and len(src_text) == args.batch_size:
                 # warmup when measuring timing
                 if args.write_timing and (not all_timing):
                     print("running a warmup batch")
@@ -0,0 +1,101 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures the translation throughput of an NMT model's .nemo file over a text file, with batches of
+--batch_size sentences in the input order and with length sorted batches of at most --max_tokens
+padded source tokens times beam size.
+USAGE Example:
+    python nmt_translation_benchmark.py --model=[Path to .nemo file] --srctext=wmt14-de-en.src --max_tokens=16384
+"""
+
+import json
+import time
+from argparse import ArgumentParser
+
+import torch
+
+from nemo.collections.nlp.models.machine_translation.mt_enc_dec_model import MTEncDecModel
+from nemo.utils import logging
+
+
+def benchmark(model, batches, src_ids):
+    """ Translates the batches of sentence indices and returns the throughput """
+    # warmup on the first batch
+    list(model._translate_batches(src_ids, batches[:1]))
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start = time.time()
+    num_translated_tokens = 0
+    for _, translations in model._translate_batches(src_ids, batches):
+        num_translated_tokens += sum(len(translation.split()) for translation in translations)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    elapsed = time.time() - start
+
+    num_src_tokens = sum(len(ids) for ids in src_ids)
+    num_padded_tokens = sum(len(batch) * max(len(src_ids[i]) for i in batch) for batch in batches)
+    return {
+        "num_batches": len(batches),
+        "seconds": elapsed,
+        "sentences_per_second": len(src_ids) / elapsed,
+        "src_tokens_per_second": num_src_tokens / elapsed,
+        "tgt_words_per_second": num_translated_tokens / elapsed,
+        "src_padding_ratio": 1 - num_src_tokens / num_padded_tokens,
+    }
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--model", type=str, required=True, help="Path to .nemo model file")
+    parser.add_argument("--srctext", type=str, required=True, help="Path to the file to translate.")
+    parser.add_argument("--batch_size", type=int, default=256, help="Number of sentences in the input order batches.")
+    parser.add_argument(
+        "--max_tokens", type=int, default=16384, help="Number of padded source tokens times beam size in a batch."
+    )
+    parser.add_argument("--beam_size", type=int, default=4, help="Beam size.")
+    parser.add_argument("--max_sentences", type=int, default=None, help="Number of sentences to translate.")
+    parser.add_argument("--source_lang", type=str, default=None, help="Source language identifier ex: en,de,fr,es")
+    parser.add_argument("--target_lang", type=str, default=None, help="Target language identifier ex: en,de,fr,es")
+    parser.add_argument("--output", type=str, default=None, help="Path to a .json file to write the results to.")
+    args = parser.parse_args()
+    torch.set_grad_enabled(False)
+
+    model = MTEncDecModel.restore_from(restore_path=args.model).eval()
+    if torch.cuda.is_available():
+        model = model.cuda()
+    model.beam_search.beam_size = args.beam_size
+
+    with open(args.srctext, 'r') as src_f:
+        text = [line.strip() for line in src_f][: args.max_sentences]
+    prepend_ids = model._setup_translation(args.source_lang, args.target_lang)
+    src_ids = model.text_to_inference_ids(text, prepend_ids, model.source_processor, model.encoder_tokenizer)
+
+    results = {}
+    fixed_batches = [list(range(i, min(i + args.batch_size, len(text)))) for i in range(0, len(text), args.batch_size)]
+    results["fixed_batches"] = benchmark(model, fixed_batches, src_ids)
+    token_batches = model.pack_inference_batches([len(ids) for ids in src_ids], args.max_tokens, args.beam_size)
+    results["token_budget_batches"] = benchmark(model, token_batches, src_ids)
+    results["speedup"] = results["token_budget_batches"]["sentences_per_second"] / (
+        results["fixed_batches"]["sentences_per_second"]
+    )
+
+    logging.info(json.dumps(results, indent=2))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()  # noqa pylint: disable=no-value-for-parameter
@@ -0,0 +1,112 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures the inference throughput of a text classification or an intent and slot classification .nemo model over
+a text file with one query per line, with batches of --batch_size queries in the input order and with length sorted
+batches of at most --max_tokens padded tokens.
+USAGE Example:
+    python classification_inference_benchmark.py --model=[Path to .nemo file] --task=text_classification \
+        --queries=queries.txt --max_tokens=4096
+"""
+
+import json
+import time
+from argparse import ArgumentParser
+
+import torch
+from omegaconf import OmegaConf
+
+from nemo.collections.nlp.models import IntentSlotClassificationModel, TextClassificationModel
+from nemo.utils import logging
+
+
+def benchmark(predict_fn, queries):
+    """ Runs predict_fn on queries and returns the throughput """
+    # warmup
+    predict_fn(queries[:16])
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start = time.time()
+    predictions = predict_fn(queries)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    elapsed = time.time() - start
+    return {"seconds": elapsed, "queries_per_second": len(queries) / elapsed}, predictions
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--model", type=str, required=True, help="Path to .nemo model file")
+    parser.add_argument(
+        "--task", choices=["text_classification", "intent_slot_classification"], default="text_classification"
+    )
+    parser.add_argument("--queries", type=str, required=True, help="Path to a file with one query per line.")
+    parser.add_argument("--batch_size", type=int, default=64, help="Number of queries in the input order batches.")
+    parser.add_argument("--max_tokens", type=int, default=4096, help="Number of padded tokens in a sorted batch.")
+    parser.add_argument("--num_tokenizer_threads", type=int, default=4, help="Number of tokenizer threads.")
+    parser.add_argument("--max_queries", type=int, default=None, help="Number of queries to classify.")
+    parser.add_argument("--output", type=str, default=None, help="Path to a .json file to write the results to.")
+    args = parser.parse_args()
+
+    model_class = TextClassificationModel if args.task == "text_classification" else IntentSlotClassificationModel
+    model = model_class.restore_from(restore_path=args.model).eval()
+    if torch.cuda.is_available():
+        model = model.cuda()
+
+    with open(args.queries, 'r') as f:
+        queries = [line.strip() for line in f][: args.max_queries]
+
+    if args.task == "text_classification":
+
+        def predict_fn(max_tokens=None):
+            return lambda texts: model.classifytext(
+                texts,
+                batch_size=args.batch_size,
+                max_tokens=max_tokens,
+                num_tokenizer_threads=args.num_tokenizer_threads,
+            )
+
+    else:
+        test_ds = OmegaConf.create(
+            {
+                "batch_size": args.batch_size,
+                "shuffle": False,
+                "num_workers": 0,
+                "pin_memory": False,
+                "drop_last": False,
+            }
+        )
+
+        def predict_fn(max_tokens=None):
+            return lambda texts: model.predict_from_examples(
+                texts, test_ds, max_tokens=max_tokens, num_tokenizer_threads=args.num_tokenizer_threads
+            )
+
+    results = {}
+    results["fixed_batches"], fixed_predictions = benchmark(predict_fn(), queries)
+    results["token_budget_batches"], predictions = benchmark(predict_fn(args.max_tokens), queries)
+    results["speedup"] = (
+        results["token_budget_batches"]["queries_per_second"] / results["fixed_batches"]["queries_per_second"]
+    )
+    results["predictions_match"] = predictions == fixed_predictions
+
+    logging.info(json.dumps(results, indent=2))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()  # noqa pylint: disable=no-value-for-parameter
@@ -20,6 +20,10 @@ from typing import Dict, List, Union
 import torch.cuda
 
 from nemo.collections.nlp.models import PunctuationCapitalizationLexicalAudioModel, PunctuationCapitalizationModel
+from nemo.collections.nlp.models.token_classification import (
+    PunctuationCapitalizationOnnxRunner,
+    PunctuationCapitalizationTorchScriptRunner,
+)
 
 
 """
@@ -160,6 +164,21 @@ def get_args() -> argparse.Namespace:
     parser.add_argument(
         "--batch_size", "-b", type=int, default=128, help="Number of segments which are processed simultaneously.",
     )
+    parser.add_argument(
+        "--max_tokens",
+        type=int,
+        help="If set, segments are sorted by length and processed in batches of at most `--max_tokens` tokens "
+        "including padding instead of batches of `--batch_size` segments. Not supported with `--use_audio`.",
+    )
+    parser.add_argument(
+        "--exported_model",
+        type=Path,
+        help="Path to the model exported to .onnx or .ts file with `model.export()`. If set, the exported model is "
+        "run on CPU with onnxruntime or TorchScript. Requires `--max_tokens`.",
+    )
+    parser.add_argument(
+        "--num_threads", type=int, help="Number of CPU threads used to run the model from `--exported_model`.",
+    )
     parser.add_argument(
         "--save_labels_instead_of_text",
         "-B",
@@ -188,9 +207,21 @@ def get_args() -> argparse.Namespace:
         parser.error("--output_manifest requires --input_manifest")
     if args.use_audio and (args.input_manifest is None and args.audio_file is None):
         parser.error("--use_audio and --input_text require --audio_file")
+    if args.exported_model is not None and args.max_tokens is None:
+        parser.error("--exported_model requires --max_tokens")
+    if args.use_audio and args.max_tokens is not None:
+        parser.error("--max_tokens is not supported with --use_audio")
     if args.pretrained_name is None and args.model_path is None:
         setattr(args, default_model_parameter, default_model)
-    for name in ["input_manifest", "input_text", "output_manifest", "output_text", "model_path", "audio_file"]:
+    for name in [
+        "input_manifest",
+        "input_text",
+        "output_manifest",
+        "output_text",
+        "model_path",
+        "audio_file",
+        "exported_model",
+    ]:
         if getattr(args, name) is not None:
             setattr(args, name, getattr(args, name).expanduser())
     return args
@@ -257,6 +288,14 @@ def main() -> None:
             target_sr=args.sample_rate,
         )
     else:
+        runner = None
+        if args.exported_model is not None:
+            if args.exported_model.suffix == '.onnx':
+                runner = PunctuationCapitalizationOnnxRunner(str(args.exported_model), num_threads=args.num_threads)
+            else:
+                runner = PunctuationCapitalizationTorchScriptRunner(
+                    str(args.exported_model), num_threads=args.num_threads
+                )
         processed_texts = model.add_punctuation_capitalization(
             texts,
             batch_size=args.batch_size,
@@ -264,6 +303,8 @@ def main() -> None:
             step=args.step,
             margin=args.margin,
             return_labels=args.save_labels_instead_of_text,
+            max_tokens=args.max_tokens,
+            runner=runner,
         )
     if args.output_manifest is None:
         args.output_text.parent.mkdir(exist_ok=True, parents=True)
@@ -12,18 +12,24 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
+import json
 import os
+import shutil
 from collections import OrderedDict
 from statistics import mode
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
 
+import numpy as np
 import torch
+from tqdm import tqdm
 
 from nemo.collections.asr.parts.utils.offline_clustering import get_argmin_mat
 from nemo.collections.asr.parts.utils.speaker_utils import convert_rttm_line, prepare_split_data
 from nemo.collections.common.parts.preprocessing.collections import DiarizationSpeechLabel
 from nemo.core.classes import Dataset
 from nemo.core.neural_types import AudioSignal, EncodedRepresentation, LengthsType, NeuralType, ProbsType
+from nemo.utils import logging
 
 
 def get_scale_mapping_list(uniq_timestamps):
@@ -127,18 +133,148 @@ def assign_frame_level_spk_vector(rttm_timestamps, round_digits, frame_per_sec,
         total_fr_len = int(max(end_list) * (10 ** round_digits))
         spk_num = max(len(sorted_speakers), min_spks)
         speaker_mapping_dict = {rttm_key: x_int for x_int, rttm_key in enumerate(sorted_speakers)}
-        fr_level_target = torch.zeros(total_fr_len, spk_num)
 
         # If RTTM is not provided, then there is no speaker mapping dict in target_spks.
         # Thus, return a zero-filled tensor as a placeholder.
-        for count, (stt, end, spk_rttm_key) in enumerate(zip(stt_list, end_list, speaker_list)):
-            stt, end = round(stt, round_digits), round(end, round_digits)
-            spk = speaker_mapping_dict[spk_rttm_key]
-            stt_fr, end_fr = int(round(stt, 2) * frame_per_sec), int(round(end, round_digits) * frame_per_sec)
-            fr_level_target[stt_fr:end_fr, spk] = 1
+        spk = torch.tensor([speaker_mapping_dict[spk_rttm_key] for spk_rttm_key in speaker_list])
+        stt_fr = torch.tensor([int(round(round(stt, round_digits), 2) * frame_per_sec) for stt in stt_list])
+        end_fr = torch.tensor([int(round(end, round_digits) * frame_per_sec) for end in end_list])
+        stt_fr, end_fr = stt_fr.clamp(0, total_fr_len), end_fr.clamp(0, total_fr_len)
+        is_valid = end_fr > stt_fr
+
+        # Mark the start and end frame of every segment then fill the segments with a cumulative sum,
+        # instead of slicing the target matrix segment by segment.
+        boundaries = torch.zeros(total_fr_len + 1, spk_num)
+        boundaries.index_put_((stt_fr[is_valid], spk[is_valid]), torch.ones(int(is_valid.sum())), accumulate=True)
+        boundaries.index_put_((end_fr[is_valid], spk[is_valid]), -torch.ones(int(is_valid.sum())), accumulate=True)
+        fr_level_target = (torch.cumsum(boundaries, dim=0)[:total_fr_len] > 0).float()
         return fr_level_target
 
 
+class MSDDTargetCache:
+    """
+    Memory-mapped cache of the per-session multiscale training targets of `_AudioMSDDTrainDataset`.
+    Building the targets requires parsing RTTM files and mapping the segments of every scale to the base scale,
+    which otherwise happens in `__getitem__` at every epoch. The cache is built once and reused across epochs and
+    training runs, and every dataloader worker reads only the slices it needs.
+
+    The targets of all sessions are concatenated along the base-scale segment axis and saved as numpy files:
+        targets.npy (uint8):            (total base-scale segments, max_spks)
+        scale_mapping.npy (int32):      (total base-scale segments, scale_n)
+        ms_seg_timestamps.npy (int32):  (total base-scale segments, scale_n, 2)
+        clus_label_index.npy (int16):   (total segments of all scales,)
+        ms_seg_counts.npy (int32):      (number of sessions, scale_n)
+        seg_offsets.npy, clus_offsets.npy (int64): start offsets of each session in the concatenated arrays
+
+    Args:
+        cache_dir (str):
+            Path to a built cache folder (see `MSDDTargetCache.build`).
+    """
+
+    meta_file = 'meta.json'
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, self.meta_file), 'r') as f:
+            self.meta = json.load(f)
+        load = lambda name: np.load(os.path.join(cache_dir, f'{name}.npy'), mmap_mode='r')
+        self.targets = load('targets')
+        self.scale_mapping = load('scale_mapping')
+        self.ms_seg_timestamps = load('ms_seg_timestamps')
+        self.clus_label_index = load('clus_label_index')
+        self.ms_seg_counts = load('ms_seg_counts')
+        self.seg_offsets = load('seg_offsets')
+        self.clus_offsets = load('clus_offsets')
+
+    def __len__(self):
+        return self.meta['num_sessions']
+
+    def __getitem__(self, index: int) -> Tuple[torch.Tensor, ...]:
+        """
+        Returns:
+            clus_label_index, targets, scale_mapping, ms_seg_timestamps and ms_seg_counts of the session
+            with the same data types as the ones calculated by `_AudioMSDDTrainDataset`.
+        """
+        seg_stt, seg_end = self.seg_offsets[index], self.seg_offsets[index + 1]
+        clus_stt, clus_end = self.clus_offsets[index], self.clus_offsets[index + 1]
+        clus_label_index = torch.from_numpy(self.clus_label_index[clus_stt:clus_end].astype(np.int64))
+        targets = torch.from_numpy(self.targets[seg_stt:seg_end].astype(np.float32))
+        scale_mapping = torch.from_numpy(self.scale_mapping[seg_stt:seg_end].T.astype(np.int64))
+        ms_seg_timestamps = self.ms_seg_timestamps[seg_stt:seg_end].transpose(1, 0, 2)
+        ms_seg_timestamps = torch.from_numpy(ms_seg_timestamps.astype(np.float32))
+        ms_seg_counts = torch.from_numpy(self.ms_seg_counts[index].astype(np.int64))
+        return clus_label_index, targets, scale_mapping, ms_seg_timestamps, ms_seg_counts
+
+    @staticmethod
+    def get_cache_key(dataset: '_AudioMSDDTrainDataset') -> str:
+        """
+        Hash of everything the targets depend on: manifest contents, RTTM file sizes and modification times,
+        segmentation scales, feature frame rate and label threshold.
+        """
+        md5 = hashlib.md5()
+        for manifest_file in dataset.manifest_filepath.split(','):
+            with open(manifest_file, 'rb') as f:
+                md5.update(f.read())
+        for rttm_file in sorted(set(sample.rttm_file for sample in dataset.collection)):
+            stat = os.stat(rttm_file)
+            md5.update(f"{rttm_file}:{stat.st_size}:{stat.st_mtime_ns}".encode('utf-8'))
+        scale_dict = {int(k): list(v) for k, v in dataset.multiscale_args_dict['scale_dict'].items()}
+        config = [scale_dict, dataset.frame_per_sec, dataset.soft_label_thres, dataset.round_digits, dataset.max_spks]
+        md5.update(json.dumps(config, sort_keys=True).encode('utf-8'))
+        return md5.hexdigest()
+
+    @classmethod
+    def exists(cls, cache_dir: str) -> bool:
+        return os.path.exists(os.path.join(cache_dir, cls.meta_file))
+
+    @classmethod
+    def build(cls, dataset: '_AudioMSDDTrainDataset', cache_dir: str) -> 'MSDDTargetCache':
+        """
+        Calculate the targets of every session in `dataset` and save them to `cache_dir`.
+        Files are written to a temporary folder first, so a partially built cache is never loaded.
+        """
+        tmp_dir = cache_dir.rstrip('/') + '.tmp'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+
+        targets, scale_mapping, ms_seg_timestamps, clus_label_index, ms_seg_counts = [], [], [], [], []
+        seg_offsets, clus_offsets = [0], [0]
+        for index in tqdm(range(len(dataset.collection)), desc='Building MSDD target cache', leave=True):
+            sample = dataset.collection[index]
+            if sample.offset is None:
+                sample.offset = 0
+            sess_clus_label_index, sess_targets, sess_scale_mapping = dataset.parse_rttm_for_ms_targets(sample)
+            sess_ms_seg_timestamps, sess_ms_seg_counts = dataset.get_ms_seg_timestamps(sample)
+            targets.append(sess_targets.numpy().astype(np.uint8))
+            scale_mapping.append(sess_scale_mapping.numpy().T.astype(np.int32))
+            ms_seg_timestamps.append(sess_ms_seg_timestamps.numpy().transpose(1, 0, 2).astype(np.int32))
+            clus_label_index.append(sess_clus_label_index.numpy().astype(np.int16))
+            ms_seg_counts.append(sess_ms_seg_counts.numpy().astype(np.int32))
+            seg_offsets.append(seg_offsets[-1] + sess_targets.shape[0])
+            clus_offsets.append(clus_offsets[-1] + sess_clus_label_index.shape[0])
+
+        arrays = {
+            'targets': np.concatenate(targets),
+            'scale_mapping': np.concatenate(scale_mapping),
+            'ms_seg_timestamps': np.concatenate(ms_seg_timestamps),
+            'clus_label_index': np.concatenate(clus_label_index),
+            'ms_seg_counts': np.stack(ms_seg_counts),
+            'seg_offsets': np.array(seg_offsets, dtype=np.int64),
+            'clus_offsets': np.array(clus_offsets, dtype=np.int64),
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, f'{name}.npy'), array)
+        with open(os.path.join(tmp_dir, cls.meta_file), 'w') as f:
+            json.dump({'num_sessions': len(ms_seg_counts), 'manifest_filepath': dataset.manifest_filepath}, f)
+
+        if os.path.exists(cache_dir):
+            shutil.rmtree(cache_dir)
+        os.replace(tmp_dir, cache_dir)
+        logging.info(f"Saved MSDD targets of {len(ms_seg_counts)} sessions at {cache_dir}")
+        return cls(cache_dir)
+
+
 class _AudioMSDDTrainDataset(Dataset):
     """
     Dataset class that loads a json file containing paths to audio files,
@@ -172,6 +308,9 @@ class _AudioMSDDTrainDataset(Dataset):
             This variable should be True if dataloader is created for an inference task.
         random_flip (bool):
             If True, the two labels and input signals are randomly flipped per every epoch while training.
+        target_cache_dir (str):
+            If provided, the multiscale targets are built once and loaded from a memory-mapped cache
+            (see `MSDDTargetCache`) in this folder instead of being calculated from RTTM files at every epoch.
     """
 
     @property
@@ -202,6 +341,7 @@ class _AudioMSDDTrainDataset(Dataset):
         pairwise_infer: bool,
         random_flip: bool = True,
         global_rank: int = 0,
+        target_cache_dir: Optional[str] = None,
     ):
         super().__init__()
         self.collection = DiarizationSpeechLabel(
@@ -226,6 +366,28 @@ class _AudioMSDDTrainDataset(Dataset):
         self.multiscale_timestamp_dict = prepare_split_data(
             self.manifest_filepath, self.emb_dir, self.multiscale_args_dict, self.global_rank,
         )
+        self.target_cache = None
+        if target_cache_dir is not None:
+            self.target_cache = self.load_target_cache(target_cache_dir)
+
+    def load_target_cache(self, target_cache_dir: str) -> MSDDTargetCache:
+        """
+        Load the multiscale targets from the cache keyed by `MSDDTargetCache.get_cache_key`, or build the cache
+        on the global rank 0 if it does not exist yet.
+        """
+        cache_dir = os.path.join(target_cache_dir, MSDDTargetCache.get_cache_key(self))
+        is_distributed = torch.distributed.is_available() and torch.distributed.is_initialized()
+        if not MSDDTargetCache.exists(cache_dir) and (self.global_rank == 0 or not is_distributed):
+            MSDDTargetCache.build(self, cache_dir)
+        if is_distributed:
+            torch.distributed.barrier()
+        target_cache = MSDDTargetCache(cache_dir)
+        if len(target_cache) != len(self.collection):
+            raise ValueError(
+                f"MSDD target cache at {cache_dir} has {len(target_cache)} sessions but the manifest has "
+                f"{len(self.collection)} samples."
+            )
+        return target_cache
 
     def __len__(self):
         return len(self.collection)
@@ -410,10 +572,13 @@ class _AudioMSDDTrainDataset(Dataset):
         sample = self.collection[index]
         if sample.offset is None:
             sample.offset = 0
-        clus_label_index, targets, scale_mapping = self.parse_rttm_for_ms_targets(sample)
+        if self.target_cache is not None:
+            clus_label_index, targets, scale_mapping, ms_seg_timestamps, ms_seg_counts = self.target_cache[index]
+        else:
+            clus_label_index, targets, scale_mapping = self.parse_rttm_for_ms_targets(sample)
+            ms_seg_timestamps, ms_seg_counts = self.get_ms_seg_timestamps(sample)
         features = self.featurizer.process(sample.audio_file, offset=sample.offset, duration=sample.duration)
         feature_length = torch.tensor(features.shape[0]).long()
-        ms_seg_timestamps, ms_seg_counts = self.get_ms_seg_timestamps(sample)
         if self.random_flip:
             torch.manual_seed(index)
             flip = torch.cat([torch.randperm(self.max_spks), torch.tensor(-1).unsqueeze(0)])
@@ -756,6 +921,8 @@ class AudioToSpeechMSDDTrainDataset(_AudioMSDDTrainDataset):
             Number of embedding vectors that are trained with attached computational graphs.
         pairwise_infer (bool):
             This variable should be True if dataloader is created for an inference task.
+        target_cache_dir (str):
+            Folder for the memory-mapped cache of multiscale targets. If None, targets are calculated on the fly.
     """
 
     def __init__(
@@ -770,6 +937,7 @@ class AudioToSpeechMSDDTrainDataset(_AudioMSDDTrainDataset):
         emb_batch_size,
         pairwise_infer: bool,
         global_rank: int,
+        target_cache_dir: Optional[str] = None,
     ):
         super().__init__(
             manifest_filepath=manifest_filepath,
@@ -781,6 +949,7 @@ class AudioToSpeechMSDDTrainDataset(_AudioMSDDTrainDataset):
             emb_batch_size=emb_batch_size,
             pairwise_infer=pairwise_infer,
             global_rank=global_rank,
+            target_cache_dir=target_cache_dir,
         )
 
     def msdd_train_collate_fn(self, batch):
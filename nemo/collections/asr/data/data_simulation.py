@@ -16,6 +16,7 @@ import multiprocessing
 import os
 import shutil
 import warnings
+from collections import OrderedDict
 from typing import Dict, Iterable, List, Optional, Tuple, Union
 
 import h5py
@@ -26,11 +27,11 @@ import soundfile as sf
 import torch
 from numpy.random import default_rng
 from omegaconf import DictConfig, OmegaConf
-from scipy.signal import convolve
+from scipy.signal import convolve, fftconvolve
 from scipy.signal.windows import cosine, hamming, hann
 from scipy.spatial.transform import Rotation
 from scipy.stats import halfnorm
-from tqdm import tqdm, trange
+from tqdm import tqdm
 
 from nemo.collections.asr.parts.preprocessing.segment import AudioSegment
 from nemo.collections.asr.parts.utils.audio_utils import db2mag, mag2db, pow2db, rms
@@ -42,7 +43,7 @@ from nemo.collections.asr.parts.utils.manifest_utils import (
     write_manifest,
     write_text,
 )
-from nemo.collections.asr.parts.utils.speaker_utils import labels_to_rttmfile
+from nemo.collections.asr.parts.utils.speaker_utils import IntervalSet, labels_to_rttmfile
 from nemo.utils import logging
 
 try:
@@ -90,6 +91,86 @@ def clamp_max_list(target_list: List[float], max_val: float) -> List[float]:
     return [min(x, max_val) for x in target_list]
 
 
+def get_session_seed(random_seed: int, session_idx: int) -> int:
+    """
+    Derive the random seed of a simulated session from the global random seed and the session index,
+    so that every session is reproducible regardless of the number of workers and of the order in which
+    the sessions are generated.
+
+    Args:
+        random_seed (int):
+            Global random seed of the simulation
+        session_idx (int):
+            Index of the session
+
+    Returns:
+        (int) Random seed of the session
+    """
+    return int(np.random.SeedSequence([random_seed, session_idx]).generate_state(1)[0])
+
+
+class AudioFileCache(object):
+    """
+    Least-recently-used cache of decoded mono audio files. The source corpus of the simulator is usually far
+    larger than the memory, while a session only draws from the utterances of a few speakers, so the decoded
+    audio of these speakers is kept in memory and reused across sentences and sessions.
+
+    Args:
+        max_size (int): Maximum number of audio files kept in memory. If 0, audio files are not cached.
+    """
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def read(self, filepath: str) -> torch.Tensor:
+        """
+        Read a (mono) audio file, or return it from the cache if it has been read recently.
+
+        Args:
+            filepath (str): Path to the audio file
+        Returns:
+            audio_file (tensor): Audio samples of the file (averaged over the channels)
+        """
+        if filepath in self._cache:
+            self._cache.move_to_end(filepath)
+            return self._cache[filepath]
+        audio_file, sr = sf.read(filepath)
+        audio_file = torch.from_numpy(audio_file)
+        if audio_file.ndim > 1:
+            audio_file = torch.mean(audio_file, 1, False)
+        if self.max_size > 0:
+            self._cache[filepath] = audio_file
+            if len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return audio_file
+
+
+# Simulator used by the worker processes of `MultiSpeakerSimulator.generate_sessions`
+_SIMULATOR = None
+
+
+def _init_simulator_worker(simulator: 'MultiSpeakerSimulator'):
+    """
+    Initialize a worker process of `MultiSpeakerSimulator.generate_sessions`.
+    """
+    global _SIMULATOR
+    _SIMULATOR = simulator
+    # sessions are generated in parallel, so each worker should not spawn its own thread pool
+    torch.set_num_threads(1)
+
+
+def _simulate_session_worker(args: Tuple[int, str]) -> Tuple[str, int]:
+    """
+    Generate a single session in a worker process of `MultiSpeakerSimulator.generate_sessions`.
+    """
+    idx, basepath = args
+    return _SIMULATOR._simulate_session(idx, basepath)
+
+
 class MultiSpeakerSimulator(object):
     """
     Multispeaker Audio Session Simulator - Simulates multispeaker audio sessions using single-speaker audio files and 
@@ -101,7 +182,10 @@ class MultiSpeakerSimulator(object):
     Parameters:
     manifest_filepath (str): Manifest file with paths to single speaker audio files
     sr (int): Sampling rate of the input audio files from the manifest
-    random_seed (int): Seed to random number generator
+    random_seed (int): Seed to random number generator (the seed of each session is derived from this seed and the 
+                       session index)
+    num_workers (int): Number of worker processes used to generate sessions in parallel
+    audio_cache_size (int): Maximum number of decoded source audio files kept in memory by each worker
     session_config:
       num_speakers (int): Number of unique speakers per multispeaker audio session
       num_sessions (int): Number of sessions to simulate
@@ -175,6 +259,12 @@ class MultiSpeakerSimulator(object):
         self.segment_manifest_filepath = None
         # variable speaker volume
         self._volume = None
+        # manifest lines per speaker, used to draw the utterances of the speakers in a session
+        self._speaker_samples = {}
+        for file in self._manifest:
+            self._speaker_samples.setdefault(str(file['speaker_id']), []).append(file)
+        self._background_manifest = None
+        self._audio_cache = AudioFileCache(self._params.data_simulator.get('audio_cache_size', 256))
         self._check_args()  # error check arguments
 
     def _check_args(self):
@@ -275,12 +365,7 @@ class MultiSpeakerSimulator(object):
         """
         speaker_lists = {}
         for i in range(self._params.data_simulator.session_config.num_speakers):
-            speaker_lists[str(speaker_ids[i])] = []
-        # loop over manifest and add files corresponding to each speaker to each sublist
-        for file in self._manifest:
-            new_speaker_id = file['speaker_id']
-            if new_speaker_id in speaker_ids:
-                speaker_lists[str(new_speaker_id)].append(file)
+            speaker_lists[str(speaker_ids[i])] = self._speaker_samples[str(speaker_ids[i])]
         return speaker_lists
 
     def _load_speaker_sample(self, speaker_lists: List[dict], speaker_ids: List[str], speaker_turn: int) -> str:
@@ -509,7 +594,7 @@ class MultiSpeakerSimulator(object):
             max_sentence_duration_sr (int): Maximum length for sentence in terms of samples
         Returns:
             sentence_duration+nw (int): Running word count
-            len(self._sentence) (tensor): Current length of the audio file
+            self._sentence_len (int): Current length of the sentence
         """
         if (
             sentence_duration == 0
@@ -520,7 +605,7 @@ class MultiSpeakerSimulator(object):
             start_cutoff = 0
 
         # ensure the desired number of words are added and the length of the output session isn't exceeded
-        sentence_duration_sr = len(self._sentence)
+        sentence_duration_sr = self._sentence_len
         remaining_duration_sr = max_sentence_duration_sr - sentence_duration_sr
         remaining_duration = max_sentence_duration - sentence_duration
         prev_dur_sr, dur_sr = 0, 0
@@ -549,55 +634,41 @@ class MultiSpeakerSimulator(object):
             nw += 1
             prev_dur_sr = dur_sr
 
-        # add audio clip up to the final alignment
+        # add audio clip up to the final alignment (the clips are concatenated once the sentence is complete)
         if (
             sentence_duration == 0
         ) and self._params.data_simulator.session_params.window_type != None:  # cut off the start of the sentence
             if start_window_amount > 0:  # include window
                 window = self._get_window(start_window_amount, start=True)
-                self._sentence = torch.cat(
-                    (
-                        self._sentence,
-                        np.multiply(audio_file[start_cutoff : start_cutoff + start_window_amount], window),
-                    ),
-                    0,
+                self._append_to_sentence(
+                    np.multiply(audio_file[start_cutoff : start_cutoff + start_window_amount], window)
                 )
-            self._sentence = torch.cat(
-                (self._sentence, audio_file[start_cutoff + start_window_amount : start_cutoff + prev_dur_sr]), 0
-            )
+            self._append_to_sentence(audio_file[start_cutoff + start_window_amount : start_cutoff + prev_dur_sr])
         else:
-            self._sentence = torch.cat((self._sentence, audio_file[:prev_dur_sr]), 0)
+            self._append_to_sentence(audio_file[:prev_dur_sr])
 
         # windowing at the end of the sentence
         if (i < len(file['words'])) and self._params.data_simulator.session_params.window_type != None:
             release_buffer, end_window_amount = self._get_end_buffer_and_window(
                 prev_dur_sr, remaining_duration_sr, len(audio_file[start_cutoff + prev_dur_sr :])
             )
-            self._sentence = torch.cat(
-                (self._sentence, audio_file[start_cutoff + prev_dur_sr : start_cutoff + prev_dur_sr + release_buffer]),
-                0,
-            )
+            end_cutoff = start_cutoff + prev_dur_sr + release_buffer
+            self._append_to_sentence(audio_file[start_cutoff + prev_dur_sr : end_cutoff])
             if end_window_amount > 0:  # include window
                 window = self._get_window(end_window_amount, start=False)
-                self._sentence = torch.cat(
-                    (
-                        self._sentence,
-                        np.multiply(
-                            audio_file[
-                                start_cutoff
-                                + prev_dur_sr
-                                + release_buffer : start_cutoff
-                                + prev_dur_sr
-                                + release_buffer
-                                + end_window_amount
-                            ],
-                            window,
-                        ),
-                    ),
-                    0,
-                )
+                self._append_to_sentence(np.multiply(audio_file[end_cutoff : end_cutoff + end_window_amount], window))
+
+        return sentence_duration + nw, self._sentence_len
 
-        return sentence_duration + nw, len(self._sentence)
+    def _append_to_sentence(self, audio_clip: torch.Tensor):
+        """
+        Append an audio clip to the sentence that is being built.
+
+        Args:
+            audio_clip (tensor): Audio clip to append
+        """
+        self._sentence_clips.append(audio_clip)
+        self._sentence_len += len(audio_clip)
 
     def _build_sentence(
         self, speaker_turn: int, speaker_ids: List[str], speaker_lists: List[dict], max_sentence_duration_sr: int
@@ -622,7 +693,8 @@ class MultiSpeakerSimulator(object):
         )
 
         # initialize sentence, text, words, alignments
-        self._sentence = torch.zeros(0)
+        self._sentence_clips = [torch.zeros(0)]
+        self._sentence_len = 0
         self._text = ""
         self._words = []
         self._alignments = []
@@ -631,13 +703,12 @@ class MultiSpeakerSimulator(object):
         # build sentence
         while sentence_duration < sl and sentence_duration_sr < max_sentence_duration_sr:
             file = self._load_speaker_sample(speaker_lists, speaker_ids, speaker_turn)
-            audio_file, sr = sf.read(file['audio_filepath'])
-            audio_file = torch.from_numpy(audio_file)
-            if audio_file.ndim > 1:
-                audio_file = torch.mean(audio_file, 1, False)
+            audio_file = self._audio_cache.read(file['audio_filepath'])
             sentence_duration, sentence_duration_sr = self._add_file(
                 file, audio_file, sentence_duration, sl, max_sentence_duration_sr
             )
+        self._sentence = torch.cat(self._sentence_clips, 0)
+        self._sentence_clips = []
 
         # look for split locations
         splits = []
@@ -779,7 +850,9 @@ class MultiSpeakerSimulator(object):
             bg_array (tensor): Tensor containing background noise
         """
 
-        manifest = read_manifest(self._params.data_simulator.background_noise.background_manifest)
+        if self._background_manifest is None:
+            self._background_manifest = read_manifest(self._params.data_simulator.background_noise.background_manifest)
+        manifest = self._background_manifest
         bg_array = torch.zeros(len_array)
         desired_snr = self._params.data_simulator.background_noise.snr
         ratio = 10 ** (desired_snr / 20)
@@ -788,10 +861,7 @@ class MultiSpeakerSimulator(object):
         while running_len < len_array:  # build background audio stream (the same length as the full file)
             file_id = np.random.randint(0, len(manifest) - 1)
             file = manifest[file_id]
-            audio_file, sr = sf.read(file['audio_filepath'])
-            audio_file = torch.from_numpy(audio_file)
-            if audio_file.ndim > 1:
-                audio_file = torch.mean(audio_file, 1, False)
+            audio_file = self._audio_cache.read(file['audio_filepath'])
 
             if running_len + len(audio_file) < len_array:
                 end_audio_file = running_len + len(audio_file)
@@ -819,24 +889,26 @@ class MultiSpeakerSimulator(object):
         Returns:
             rttm_list (list): List of rttm entries
         """
+        split_buffer = self._params.data_simulator.session_params.split_buffer
+        words = np.array(self._words, dtype=str)
+        alignments = np.array(self._alignments, dtype=np.float64)
+
+        # look for split locations: silences (except the first and the last word) longer than two split buffers
+        silence_idx = np.nonzero(words[1:-1] == "")[0] + 1
+        silence_idx = silence_idx[alignments[silence_idx] - alignments[silence_idx - 1] > 2 * split_buffer]
+        silence_ranges = IntervalSet(
+            np.column_stack(
+                (start + alignments[silence_idx - 1] + split_buffer, start + alignments[silence_idx] - split_buffer)
+            )
+        )
+        # split utterance on silence
+        speech_ranges = IntervalSet([[start, end]]) - silence_ranges
+
         rttm_list = []
-        new_start = start
-        # look for split locations
-        for i in range(len(self._words)):
-            if self._words[i] == "" and i != 0 and i != len(self._words) - 1:
-                silence_length = self._alignments[i] - self._alignments[i - 1]
-                if (
-                    silence_length > 2 * self._params.data_simulator.session_params.split_buffer
-                ):  # split utterance on silence
-                    new_end = start + self._alignments[i - 1] + self._params.data_simulator.session_params.split_buffer
-                    s = float(round(new_start, self._params.data_simulator.outputs.output_precision))
-                    e = float(round(new_end, self._params.data_simulator.outputs.output_precision))
-                    rttm_list.append(f"{s} {e} {speaker_id}")
-                    new_start = start + self._alignments[i] - self._params.data_simulator.session_params.split_buffer
-
-        s = float(round(new_start, self._params.data_simulator.outputs.output_precision))
-        e = float(round(end, self._params.data_simulator.outputs.output_precision))
-        rttm_list.append(f"{s} {e} {speaker_id}")
+        for new_start, new_end in speech_ranges:
+            s = float(round(new_start, self._params.data_simulator.outputs.output_precision))
+            e = float(round(new_end, self._params.data_simulator.outputs.output_precision))
+            rttm_list.append(f"{s} {e} {speaker_id}")
         return rttm_list
 
     def _create_new_json_entry(
@@ -1053,12 +1125,37 @@ class MultiSpeakerSimulator(object):
         write_ctm(os.path.join(basepath, filename + '.ctm'), ctm_list)
         write_text(os.path.join(basepath, filename + '.txt'), ctm_list)
 
+    def _simulate_session(self, idx: int, basepath: str) -> Tuple[str, int]:
+        """
+        Generate the session with index `idx` using the random seed derived from the global random seed and `idx`.
+
+        Args:
+            idx (int): Index for current session (out of total number of sessions).
+            basepath (str): Path to output directory.
+        Returns:
+            filename (str): Filename for output files
+            num_missing (int): Number of requested speakers that are not included in the session
+        """
+        np.random.seed(get_session_seed(self._params.data_simulator.random_seed, idx))
+        self._furthest_sample = [0 for n in range(self._params.data_simulator.session_config.num_speakers)]
+        self._missing_overlap = 0
+
+        filename = self._params.data_simulator.outputs.output_filename + f"_{idx}"
+        self._generate_session(idx, basepath, filename)
+
+        num_missing = 0
+        for k in range(len(self._furthest_sample)):
+            if self._furthest_sample[k] == 0:
+                num_missing += 1
+        return filename, num_missing
+
     def generate_sessions(self):
         """
         Generate several multispeaker audio sessions and corresponding list files.
+        If `num_workers` is greater than 1, the sessions are generated in parallel. Each session is seeded
+        independently, so the output does not depend on the number of workers.
         """
         logging.info(f"Generating Diarization Sessions")
-        np.random.seed(self._params.data_simulator.random_seed)
         output_dir = self._params.data_simulator.outputs.output_dir
 
         # delete output directory if it exists or throw warning
@@ -1084,13 +1181,18 @@ class MultiSpeakerSimulator(object):
         ctmlist = open(os.path.join(basepath, "synthetic_ctm.list"), "w")
         textlist = open(os.path.join(basepath, "synthetic_txt.list"), "w")
 
-        for i in trange(self._params.data_simulator.session_config.num_sessions):
-            self._furthest_sample = [0 for n in range(self._params.data_simulator.session_config.num_speakers)]
-            self._missing_overlap = 0
-
-            filename = self._params.data_simulator.outputs.output_filename + f"_{i}"
-            self._generate_session(i, basepath, filename)
+        num_sessions = self._params.data_simulator.session_config.num_sessions
+        num_workers = self._params.data_simulator.get('num_workers', 1)
+        session_args = [(i, basepath) for i in range(num_sessions)]
+        if num_workers is not None and num_workers > 1:
+            logging.info(f'Simulate using {num_workers} workers')
+            pool = multiprocessing.Pool(processes=num_workers, initializer=_init_simulator_worker, initargs=(self,))
+            results = pool.imap(_simulate_session_worker, session_args)
+        else:
+            pool = None
+            results = (self._simulate_session(*args) for args in session_args)
 
+        for filename, num_missing in tqdm(results, total=num_sessions):
             wavlist.write(os.path.join(basepath, filename + '.wav\n'))
             rttmlist.write(os.path.join(basepath, filename + '.rttm\n'))
             jsonlist.write(os.path.join(basepath, filename + '.json\n'))
@@ -1098,15 +1200,14 @@ class MultiSpeakerSimulator(object):
             textlist.write(os.path.join(basepath, filename + '.txt\n'))
 
             # throw error if number of speakers is less than requested
-            num_missing = 0
-            for k in range(len(self._furthest_sample)):
-                if self._furthest_sample[k] == 0:
-                    num_missing += 1
             if num_missing != 0:
                 warnings.warn(
                     f"{self._params.data_simulator.session_config.num_speakers-num_missing} speakers were included in the clip instead of the requested amount of {self._params.data_simulator.session_config.num_speakers}"
                 )
 
+        if pool is not None:
+            pool.close()
+            pool.join()
         wavlist.close()
         rttmlist.close()
         jsonlist.close()
@@ -1335,16 +1436,24 @@ class RIRMultiSpeakerSimulator(MultiSpeakerSimulator):
             output_sound (list): List of tensors containing augmented audio
             length (int): Length of output audio channels (or of the longest if they have different lengths)
         """
+        num_channels = self._params.data_simulator.rir_generation.mic_config.num_channels
+        if self._params.data_simulator.rir_generation.toolkit == 'gpuRIR':
+            channel_rirs = [RIR[speaker_turn, channel, : len(input)] for channel in range(num_channels)]
+        elif self._params.data_simulator.rir_generation.toolkit == 'pyroomacoustics':
+            channel_rirs = [RIR[channel][speaker_turn][: len(input)] for channel in range(num_channels)]
+        rir_lens = [len(rir) for rir in channel_rirs]
+
+        # convolve all channels at once in the frequency domain (channel RIRs are zero-padded to the same length)
+        rir_matrix = np.zeros((num_channels, max(rir_lens)))
+        for channel, rir in enumerate(channel_rirs):
+            rir_matrix[channel, : rir_lens[channel]] = rir
+        output_matrix = fftconvolve(np.asarray(input)[np.newaxis, :], rir_matrix, axes=1)
+
         output_sound = []
-        length = 0
-        for channel in range(self._params.data_simulator.rir_generation.mic_config.num_channels):
-            if self._params.data_simulator.rir_generation.toolkit == 'gpuRIR':
-                out_channel = convolve(input, RIR[speaker_turn, channel, : len(input)]).tolist()
-            elif self._params.data_simulator.rir_generation.toolkit == 'pyroomacoustics':
-                out_channel = convolve(input, RIR[channel][speaker_turn][: len(input)]).tolist()
-            if len(out_channel) > length:
-                length = len(out_channel)
-            output_sound.append(torch.tensor(out_channel))
+        for channel in range(num_channels):
+            out_channel = output_matrix[channel, : len(input) + rir_lens[channel] - 1]
+            output_sound.append(torch.from_numpy(out_channel.astype(np.float32)))
+        length = max(len(out_channel) for out_channel in output_sound)
         return output_sound, length
 
     def _generate_session(self, idx: int, basepath: str, filename: str, enforce_counter: int = 2):
@@ -3048,10 +3157,8 @@ def convolve_rir(signal: np.ndarray, rir: np.ndarray) -> np.ndarray:
         # convolve and trim to length
         out = convolve(signal, rir)[:num_samples]
     elif rir.ndim == 2:
-        num_channels = rir.shape[1]
-        out = np.zeros((num_samples, num_channels))
-        for m in range(num_channels):
-            out[:, m] = convolve(signal, rir[:, m])[:num_samples]
+        # convolve all channels at once in the frequency domain
+        out = fftconvolve(signal[:, np.newaxis], rir, axes=0)[:num_samples]
     else:
         raise RuntimeError(f'RIR with {rir.ndim} not supported')
 
@@ -22,6 +22,7 @@ from pyannote.metrics.diarization import DiarizationErrorRate
 from scipy.optimize import linear_sum_assignment
 
 from nemo.collections.asr.metrics.wer import word_error_rate
+from nemo.collections.asr.parts.utils.speaker_utils import IntervalSet
 from nemo.utils import logging
 
 __all__ = [
@@ -39,14 +40,8 @@ def uem_timeline_from_file(uem_file, uniq_name=''):
      <UEM> file format
      UNIQ_SPEAKER_ID CHANNEL START_TIME END_TIME
     """
-    timeline = Timeline(uri=uniq_name)
-    with open(uem_file, 'r') as f:
-        lines = f.readlines()
-        for line in lines:
-            line = line.strip()
-            speaker_id, channel, start_time, end_time = line.split()
-            timeline.add(Segment(float(start_time), float(end_time)))
-
+    uem_ranges = IntervalSet.from_uem(uem_file)
+    timeline = Timeline(segments=[Segment(start_time, end_time) for start_time, end_time in uem_ranges], uri=uniq_name)
     return timeline
 
 
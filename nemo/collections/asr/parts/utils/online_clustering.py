@@ -31,7 +31,9 @@
 # https://arxiv.org/pdf/2003.02405.pdf and the implementation from
 # https://github.com/tango4j/Auto-Tuning-Spectral-Clustering.
 
-from typing import List, Tuple
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 import torch
@@ -41,6 +43,7 @@ from sklearn.preprocessing import OneHotEncoder
 
 from nemo.collections.asr.parts.utils.offline_clustering import (
     NMESC,
+    ScalerMinMax,
     SpectralClustering,
     getAffinityGraphMat,
     getCosAffinityMatrix,
@@ -1079,18 +1082,470 @@ class OnlineSpeakerClustering:
 
         else:
             mat = getCosAffinityMatrix(emb)
-            nmesc = NMESC(
-                mat,
-                max_num_speakers=self.max_num_speakers,
-                max_rp_threshold=self.max_rp_threshold,
-                sparse_search=True,
-                maj_vote_spk_count=False,
-                sparse_search_volume=self.sparse_search_volume,
-                fixed_thres=self.fixed_thres,
-                nme_mat_size=256,
-                device=emb.device,
-            )
-            est_num_of_spk, affinity_mat = self.online_spk_num_estimation(mat, nmesc, frame_index)
-            spectral_model = SpectralClustering(n_clusters=est_num_of_spk, cuda=cuda, device=emb.device)
-            Y = spectral_model.forward(affinity_mat).to(emb.device)
+            Y = self.forward_infer_affinity(mat=mat, frame_index=frame_index, cuda=cuda)
+        return Y
+
+    def forward_infer_affinity(self, mat: torch.Tensor, frame_index: int, cuda: bool = False) -> torch.Tensor:
+        """
+        Perform NME-SC on an already calculated (min-max normalized) cosine affinity matrix.
+
+        Args:
+            mat (Tensor):
+                Min-max normalized cosine affinity matrix of the embedding vectors to be clustered
+            frame_index (int):
+                Unique index for each segment (also each embedding vector)
+            cuda (bool):
+                Boolean that determines whether cuda is used or not
+
+        Returns:
+            Y (Tensor):
+                Speaker labels for the rows of `mat`
+        """
+        nmesc = NMESC(
+            mat,
+            max_num_speakers=self.max_num_speakers,
+            max_rp_threshold=self.max_rp_threshold,
+            sparse_search=True,
+            maj_vote_spk_count=False,
+            sparse_search_volume=self.sparse_search_volume,
+            fixed_thres=self.fixed_thres,
+            nme_mat_size=256,
+            device=mat.device,
+        )
+        est_num_of_spk, affinity_mat = self.online_spk_num_estimation(mat, nmesc, frame_index)
+        spectral_model = SpectralClustering(n_clusters=est_num_of_spk, cuda=cuda, device=mat.device)
+        Y = spectral_model.forward(affinity_mat).to(mat.device)
         return Y
+
+
+class IncrementalOnlineSpeakerClustering(OnlineSpeakerClustering):
+    """
+    Incremental online clustering with a fixed memory ceiling.
+
+    Instead of re-calculating the affinity matrix of the history buffer and reducing the embeddings with
+    `run_reducer` at every step, this class keeps the most recent `history_buffer_size + current_buffer_size`
+    embedding vectors in a pre-allocated ring buffer together with their raw cosine similarity matrix.
+    At each step, only the rows and columns of the new segments are updated, which is O(new segments x buffer size).
+    New segments are labeled by their closest running speaker centroid and the whole buffer is re-clustered with
+    NME-SC every `recluster_interval` steps to correct the labels and the centroids.
+
+    Incremental Processing Attributes:
+
+        emb_dim (int):
+            Dimension of speaker embedding vectors
+        new_speaker_threshold (float):
+            If the cosine similarity between a new segment and its closest speaker centroid is lower than this value,
+            a new speaker is registered (up to `max_num_speakers`).
+        recluster_interval (int):
+            Interval (in steps) of re-clustering the whole buffer with NME-SC. Set to 0 to disable re-clustering.
+        latency_stat_size (int):
+            Number of the most recent steps kept for the latency statistics.
+        device (torch.device):
+            Device on which the buffers are allocated
+        emb_buffer (Tensor):
+            Optional pre-allocated (buffer size x emb_dim) storage for embeddings.
+            Used by `OnlineSpeakerClusteringSessionManager` to batch many sessions.
+        affinity_buffer (Tensor):
+            Optional pre-allocated (buffer size x buffer size) storage for the cosine similarity matrix.
+    """
+
+    def __init__(
+        self,
+        max_num_speakers: int,
+        emb_dim: int = 192,
+        new_speaker_threshold: float = 0.5,
+        recluster_interval: int = 10,
+        latency_stat_size: int = 1000,
+        device: torch.device = torch.device('cpu'),
+        emb_buffer: Optional[torch.Tensor] = None,
+        affinity_buffer: Optional[torch.Tensor] = None,
+        **kwargs,
+    ):
+        super().__init__(max_num_speakers=max_num_speakers, **kwargs)
+        self.emb_dim = emb_dim
+        self.new_speaker_threshold = new_speaker_threshold
+        self.recluster_interval = recluster_interval
+        self.device = device
+        self.capacity = self.history_n + self.current_n
+
+        if emb_buffer is None:
+            emb_buffer = torch.zeros(self.capacity, emb_dim, device=device)
+        if affinity_buffer is None:
+            affinity_buffer = torch.zeros(self.capacity, self.capacity, device=device)
+        if emb_buffer.shape != (self.capacity, emb_dim) or affinity_buffer.shape != (self.capacity, self.capacity):
+            raise ValueError(
+                f"Pre-allocated buffers should have shapes {(self.capacity, emb_dim)} and "
+                f"{(self.capacity, self.capacity)} but got {tuple(emb_buffer.shape)} and {tuple(affinity_buffer.shape)}"
+            )
+        self.emb_buffer = emb_buffer
+        self.affinity_buffer = affinity_buffer
+        self.label_buffer = torch.zeros(self.capacity, dtype=torch.long, device=device)
+        self.segment_index_buffer = torch.zeros(self.capacity, dtype=torch.long, device=device)
+        self.centroid_sums = torch.zeros(max_num_speakers, emb_dim, device=device)
+        self.centroid_counts = torch.zeros(max_num_speakers, device=device)
+        self.num_speakers = 0
+        self.total_segments_processed_count = 0
+        self.step_count = 0
+        self.step_latency_ms = deque(maxlen=latency_stat_size)
+
+    @property
+    def num_buffered(self) -> int:
+        """
+        Number of valid segments in the ring buffer.
+        """
+        return min(self.total_segments_processed_count, self.capacity)
+
+    def get_memory_footprint(self) -> int:
+        """
+        Returns:
+            (int) Number of bytes allocated by the buffers, which does not grow with the session length.
+        """
+        tensors = [
+            self.emb_buffer,
+            self.affinity_buffer,
+            self.label_buffer,
+            self.segment_index_buffer,
+            self.centroid_sums,
+            self.centroid_counts,
+        ]
+        return sum(x.element_size() * x.nelement() for x in tensors)
+
+    def get_latency_stats(self) -> Dict[str, float]:
+        """
+        Returns:
+            (dict) Mean, median, 95th percentile and maximum latency of the most recent steps in milliseconds.
+        """
+        if len(self.step_latency_ms) == 0:
+            return {'num_steps': 0}
+        latency = np.array(self.step_latency_ms)
+        return {
+            'num_steps': int(self.step_count),
+            'mean_ms': float(latency.mean()),
+            'p50_ms': float(np.percentile(latency, 50)),
+            'p95_ms': float(np.percentile(latency, 95)),
+            'max_ms': float(latency.max()),
+        }
+
+    def get_buffered_labels(self) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Returns:
+            segment_indexes (Tensor):
+                Unique segment indexes of the segments in the buffer, sorted in time.
+            labels (Tensor):
+                Latest speaker labels of those segments. Labels can be corrected by re-clustering.
+        """
+        n = self.num_buffered
+        segment_indexes, order = torch.sort(self.segment_index_buffer[:n])
+        return segment_indexes, self.label_buffer[:n][order]
+
+    def _get_slots(self, n_new: int) -> torch.Tensor:
+        """
+        Ring buffer positions of the next `n_new` segments. `n_new` should not exceed the buffer size.
+        """
+        return (self.total_segments_processed_count + torch.arange(n_new, device=self.device)) % self.capacity
+
+    def _update_buffers(self, emb_norm: torch.Tensor, slots: torch.Tensor, sims: torch.Tensor):
+        """
+        Write the new normalized embeddings and their similarities to the ring buffer.
+
+        Args:
+            emb_norm (Tensor):
+                Normalized new embedding vectors (n_new x emb_dim)
+            slots (Tensor):
+                Ring buffer positions of the new embedding vectors
+            sims (Tensor):
+                Cosine similarity between the new embedding vectors and the buffer before the update
+                (n_new x buffer size)
+        """
+        # The slots being overwritten are replaced by the similarities among the new segments.
+        sims[:, slots] = torch.mm(emb_norm, emb_norm.t())
+        self.emb_buffer[slots] = emb_norm
+        self.affinity_buffer[slots, :] = sims
+        self.affinity_buffer[:, slots] = sims.t()
+        self.segment_index_buffer[slots] = self.total_segments_processed_count + torch.arange(
+            emb_norm.shape[0], device=self.device
+        )
+
+    def _assign_labels(self, emb_norm: torch.Tensor) -> torch.Tensor:
+        """
+        Label the new segments with their closest speaker centroid, and register new speakers for the segments that
+        are not close to any of the existing speakers.
+        """
+        n_new = emb_norm.shape[0]
+        if self.num_speakers > 0:
+            centroids = torch.nn.functional.normalize(self.centroid_sums[: self.num_speakers], dim=1)
+            scores, labels = torch.mm(emb_norm, centroids.t()).max(dim=1)
+            is_new_spk = scores < self.new_speaker_threshold
+        else:
+            labels = torch.zeros(n_new, dtype=torch.long, device=self.device)
+            is_new_spk = torch.ones(n_new, dtype=torch.bool, device=self.device)
+
+        # Only the rare segments that do not match any speaker are handled one by one.
+        created_spks, created_embs = [], []
+        for idx in torch.nonzero(is_new_spk).flatten().tolist():
+            if len(created_spks) > 0:
+                created_scores = torch.mv(torch.stack(created_embs), emb_norm[idx])
+                best = int(torch.argmax(created_scores))
+                if created_scores[best] >= self.new_speaker_threshold:
+                    labels[idx] = created_spks[best]
+                    continue
+            if self.num_speakers < self.max_num_speakers:
+                labels[idx] = self.num_speakers
+                created_spks.append(self.num_speakers)
+                created_embs.append(emb_norm[idx])
+                self.num_speakers += 1
+        return labels
+
+    def _finish_step(self, emb_norm: torch.Tensor, slots: torch.Tensor, sims: torch.Tensor) -> torch.Tensor:
+        """
+        Update the buffers, labels and speaker centroids with the new segments.
+        """
+        self._update_buffers(emb_norm, slots, sims)
+        labels = self._assign_labels(emb_norm)
+        self.label_buffer[slots] = labels
+        self.centroid_sums.index_add_(0, labels, emb_norm)
+        self.centroid_counts.index_add_(0, labels, torch.ones_like(labels, dtype=self.centroid_counts.dtype))
+        self.total_segments_processed_count += emb_norm.shape[0]
+        return labels
+
+    def _normalize(self, emb: torch.Tensor) -> torch.Tensor:
+        return torch.nn.functional.normalize(emb.float().to(self.device), dim=1)
+
+    def recluster(self, cuda: bool = False):
+        """
+        Re-cluster the segments in the buffer with NME-SC using the incrementally maintained affinity matrix,
+        then match the new cluster labels to the existing speaker indexes and correct the speaker centroids.
+        """
+        n = self.num_buffered
+        if n <= 1:
+            return
+        mat = self.affinity_buffer[:n, :n].clone()
+        mat.fill_diagonal_(1)
+        Y_new = self.forward_infer_affinity(mat=ScalerMinMax(mat), frame_index=self.step_count, cuda=cuda)
+        Y_new = Y_new.to(torch.long).to(self.device)
+        Y_old = self.label_buffer[:n]
+
+        # Hungarian matching on the co-occurrence counts between the new clusters and the existing speakers
+        n_new_clus = int(Y_new.max()) + 1
+        n_old_spk = max(self.num_speakers, 1)
+        cooccurrence = torch.bincount(Y_new * n_old_spk + Y_old, minlength=n_new_clus * n_old_spk)
+        cooccurrence = cooccurrence.reshape(n_new_clus, n_old_spk).cpu().numpy()
+        row_ind, col_ind = linear_sum_assignment(-cooccurrence)
+        mapping = cooccurrence.argmax(axis=1)
+        mapping[row_ind] = col_ind
+        for clus_idx in sorted(set(range(n_new_clus)) - set(row_ind.tolist())):
+            # Clusters without a matching speaker become new speakers if there is room.
+            if self.num_speakers < self.max_num_speakers:
+                mapping[clus_idx] = self.num_speakers
+                self.num_speakers += 1
+        Y_matched = torch.from_numpy(mapping).to(self.device)[Y_new]
+
+        emb = self.emb_buffer[:n]
+        ones = torch.ones(n, device=self.device)
+        self.centroid_sums.index_add_(0, Y_old, -emb)
+        self.centroid_counts.index_add_(0, Y_old, -ones)
+        self.centroid_sums.index_add_(0, Y_matched, emb)
+        self.centroid_counts.index_add_(0, Y_matched, ones)
+        self.label_buffer[:n] = Y_matched
+
+    def _maybe_recluster(self, cuda: bool = False):
+        self.step_count += 1
+        if self.recluster_interval > 0 and self.step_count % self.recluster_interval == 0:
+            self.recluster(cuda=cuda)
+
+    def _record_latency(self, start_time: float):
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+        self.step_latency_ms.append((time.perf_counter() - start_time) * 1000)
+
+    def forward_incremental(self, emb: torch.Tensor, cuda: bool = False) -> torch.Tensor:
+        """
+        Cluster the newly extracted speaker embeddings of a live stream.
+
+        Args:
+            emb (Tensor):
+                Embedding vectors of the new segments only (n_new x emb_dim)
+            cuda (bool):
+                Boolean that determines whether cuda is used for re-clustering
+
+        Returns:
+            labels (Tensor):
+                Speaker labels of the new segments
+        """
+        start_time = time.perf_counter()
+        labels = []
+        for emb_chunk in torch.split(self._normalize(emb), self.capacity):
+            slots = self._get_slots(emb_chunk.shape[0])
+            sims = torch.mm(emb_chunk, self.emb_buffer.t())
+            labels.append(self._finish_step(emb_chunk, slots, sims))
+        self._maybe_recluster(cuda=cuda)
+        self._record_latency(start_time)
+        return torch.cat(labels)
+
+
+class OnlineSpeakerClusteringSessionManager:
+    """
+    Run `IncrementalOnlineSpeakerClustering` for many concurrent live streams. The embedding and affinity buffers of
+    all sessions are allocated once as a single tensor, so the memory ceiling is fixed by `max_sessions`,
+    and the similarity update of all the sessions stepping together is done with a single batched matrix multiplication.
+
+    Args:
+        max_sessions (int):
+            Maximum number of concurrent sessions
+        max_num_speakers (int):
+            The upper bound for the number of speakers in each session
+        emb_dim (int):
+            Dimension of speaker embedding vectors
+        history_buffer_size (int):
+            History buffer size of each session
+        current_buffer_size (int):
+            Current buffer size of each session
+        device (torch.device):
+            Device on which the buffers are allocated
+        kwargs:
+            Other arguments passed to `IncrementalOnlineSpeakerClustering`
+    """
+
+    def __init__(
+        self,
+        max_sessions: int,
+        max_num_speakers: int,
+        emb_dim: int = 192,
+        history_buffer_size: int = 150,
+        current_buffer_size: int = 150,
+        device: torch.device = torch.device('cpu'),
+        **kwargs,
+    ):
+        self.max_sessions = max_sessions
+        self.max_num_speakers = max_num_speakers
+        self.emb_dim = emb_dim
+        self.history_buffer_size = history_buffer_size
+        self.current_buffer_size = current_buffer_size
+        self.device = device
+        self.clustering_kwargs = kwargs
+        self.capacity = history_buffer_size + current_buffer_size
+
+        self.emb_storage = torch.zeros(max_sessions, self.capacity, emb_dim, device=device)
+        self.affinity_storage = torch.zeros(max_sessions, self.capacity, self.capacity, device=device)
+        self.sessions: Dict[str, IncrementalOnlineSpeakerClustering] = {}
+        self.session_slots: Dict[str, int] = {}
+        self.free_slots = list(range(max_sessions))
+        self.step_latency_ms = deque(maxlen=kwargs.get('latency_stat_size', 1000))
+
+    def open_session(self, session_id: str) -> IncrementalOnlineSpeakerClustering:
+        """
+        Allocate a slot for a new live stream.
+        """
+        if session_id in self.sessions:
+            raise ValueError(f"Session {session_id} is already open.")
+        if len(self.free_slots) == 0:
+            raise RuntimeError(f"Cannot open session {session_id}: all {self.max_sessions} slots are in use.")
+        slot = self.free_slots.pop(0)
+        self.emb_storage[slot].zero_()
+        self.affinity_storage[slot].zero_()
+        self.sessions[session_id] = IncrementalOnlineSpeakerClustering(
+            max_num_speakers=self.max_num_speakers,
+            emb_dim=self.emb_dim,
+            history_buffer_size=self.history_buffer_size,
+            current_buffer_size=self.current_buffer_size,
+            device=self.device,
+            emb_buffer=self.emb_storage[slot],
+            affinity_buffer=self.affinity_storage[slot],
+            **self.clustering_kwargs,
+        )
+        self.session_slots[session_id] = slot
+        return self.sessions[session_id]
+
+    def close_session(self, session_id: str) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Release the slot of a finished live stream.
+
+        Returns:
+            Segment indexes and the latest speaker labels in the buffer of the closed session
+        """
+        segment_indexes, labels = self.sessions[session_id].get_buffered_labels()
+        del self.sessions[session_id]
+        self.free_slots.append(self.session_slots.pop(session_id))
+        return segment_indexes, labels
+
+    def get_memory_footprint(self) -> int:
+        """
+        Returns:
+            (int) Number of bytes allocated by the shared storage and the open sessions.
+        """
+        shared = sum(x.element_size() * x.nelement() for x in (self.emb_storage, self.affinity_storage))
+        per_session = sum(
+            x.element_size() * x.nelement()
+            for clus in self.sessions.values()
+            for x in (clus.label_buffer, clus.segment_index_buffer, clus.centroid_sums, clus.centroid_counts)
+        )
+        return shared + per_session
+
+    def get_latency_stats(self) -> Dict[str, float]:
+        """
+        Returns:
+            (dict) Latency statistics of the most recent batched steps in milliseconds.
+        """
+        if len(self.step_latency_ms) == 0:
+            return {'num_steps': 0}
+        latency = np.array(self.step_latency_ms)
+        return {
+            'num_steps': len(latency),
+            'num_sessions': len(self.sessions),
+            'mean_ms': float(latency.mean()),
+            'p50_ms': float(np.percentile(latency, 50)),
+            'p95_ms': float(np.percentile(latency, 95)),
+            'max_ms': float(latency.max()),
+        }
+
+    def step(self, session_embs: Dict[str, torch.Tensor], cuda: bool = False) -> Dict[str, torch.Tensor]:
+        """
+        Cluster the new embeddings of several sessions at once. Sessions are opened on their first step.
+
+        Args:
+            session_embs (dict):
+                Mapping from session id to the embedding vectors of its new segments (n_new x emb_dim)
+            cuda (bool):
+                Boolean that determines whether cuda is used for re-clustering
+
+        Returns:
+            (dict) Mapping from session id to the speaker labels of its new segments
+        """
+        start_time = time.perf_counter()
+        for session_id in session_embs:
+            if session_id not in self.sessions:
+                self.open_session(session_id)
+
+        pending = {
+            session_id: list(torch.split(self.sessions[session_id]._normalize(emb), self.capacity))
+            for session_id, emb in session_embs.items()
+        }
+        labels = {session_id: [] for session_id in session_embs}
+        while any(len(chunks) > 0 for chunks in pending.values()):
+            batch = [(session_id, chunks.pop(0)) for session_id, chunks in pending.items() if len(chunks) > 0]
+            batch.sort(key=lambda x: self.session_slots[x[0]])
+            max_new = max(chunk.shape[0] for _, chunk in batch)
+            padded = torch.zeros(len(batch), max_new, self.emb_dim, device=self.device)
+            for batch_idx, (_, chunk) in enumerate(batch):
+                padded[batch_idx, : chunk.shape[0]] = chunk
+
+            if len(batch) == self.max_sessions:
+                # Every slot is stepping, so the storage can be used without gathering.
+                emb_bufs = self.emb_storage
+            else:
+                slot_idx = [self.session_slots[session_id] for session_id, _ in batch]
+                emb_bufs = self.emb_storage[torch.tensor(slot_idx, device=self.device)]
+            sims = torch.bmm(padded, emb_bufs.transpose(1, 2))
+
+            for batch_idx, (session_id, chunk) in enumerate(batch):
+                clus = self.sessions[session_id]
+                slots = clus._get_slots(chunk.shape[0])
+                labels[session_id].append(clus._finish_step(chunk, slots, sims[batch_idx, : chunk.shape[0]]))
+
+        for session_id in session_embs:
+            self.sessions[session_id]._maybe_recluster(cuda=cuda)
+
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+        self.step_latency_ms.append((time.perf_counter() - start_time) * 1000)
+        return {session_id: torch.cat(session_labels) for session_id, session_labels in labels.items()}
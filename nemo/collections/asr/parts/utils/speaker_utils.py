@@ -13,11 +13,9 @@
 # limitations under the License.
 
 import json
-import math
 import os
 import shutil
 from copy import deepcopy
-from functools import reduce
 from typing import Dict, List, Tuple, Union
 
 import numpy as np
@@ -669,16 +667,17 @@ def combine_float_overlaps(ranges, decimals=5, margin=2):
             List containing the combined ranges.
             Example: [(10.2, 12.09)]
     """
-    ranges_int = []
-    for x in ranges:
-        stt, end = fl2int(x[0], decimals) + margin, fl2int(x[1], decimals)
-        if stt == end:
-            logging.warning(f"The range {stt}:{end} is too short to be combined thus skipped.")
-        else:
-            ranges_int.append([stt, end])
-    merged_ranges = combine_int_overlaps(ranges_int)
-    merged_ranges = [[int2fl(x[0] - margin, decimals), int2fl(x[1], decimals)] for x in merged_ranges]
-    return merged_ranges
+    if len(ranges) == 0:
+        return []
+    ranges_int = np.round(np.asarray(ranges, dtype=np.float64).reshape(-1, 2) * pow(10, decimals)).astype(np.int64)
+    ranges_int[:, 0] += margin
+    is_short = ranges_int[:, 0] == ranges_int[:, 1]
+    for stt, end in ranges_int[is_short].tolist():
+        logging.warning(f"The range {stt}:{end} is too short to be combined thus skipped.")
+    merged_ranges = merge_range_array(ranges_int[~is_short], gap=1)
+    merged_ranges[:, 0] -= margin
+    merged_ranges = np.round(merged_ranges / pow(10, decimals), decimals)
+    return merged_ranges.tolist()
 
 
 def combine_int_overlaps(ranges):
@@ -701,15 +700,10 @@ def combine_int_overlaps(ranges):
             Example: [(102, 120)]
 
     """
-    ranges = sorted(ranges, key=lambda x: x[0])
-    merged_list = reduce(
-        lambda x, element: x[:-1:] + [(min(*x[-1], *element), max(*x[-1], *element))]
-        if x[-1][1] >= element[0] - 1
-        else x + [element],
-        ranges[1::],
-        ranges[0:1],
-    )
-    return merged_list
+    if len(ranges) == 0:
+        return []
+    merged_list = merge_range_array(np.asarray(ranges, dtype=np.int64), gap=1)
+    return [tuple(x) for x in merged_list.tolist()]
 
 
 def fl2int(x, decimals=3):
@@ -726,6 +720,262 @@ def int2fl(x, decimals=3):
     return round(float(x / pow(10, decimals)), int(decimals))
 
 
+def merge_range_array(ranges: np.ndarray, gap: float = 0) -> np.ndarray:
+    """
+    Vectorized merging of ranges. Two ranges are merged if the start of the latter one is not greater than
+    the largest end of the preceding ranges plus `gap`.
+
+    Example:
+        gap = 0: [[1, 10], [10, 20], [21, 30]] -> [[1, 20], [21, 30]]
+        gap = 1: [[1, 10], [10, 20], [21, 30]] -> [[1, 30]]
+
+    Args:
+        ranges (np.ndarray):
+            Array of shape (N, 2) containing start and end values
+        gap (float):
+            The maximum gap between two ranges to be merged
+    Returns:
+        merged (np.ndarray):
+            Array of shape (M, 2) containing the merged ranges sorted by the start value
+    """
+    ranges = np.asarray(ranges).reshape(-1, 2)
+    if ranges.shape[0] <= 1:
+        return ranges.copy()
+    ranges = ranges[np.argsort(ranges[:, 0], kind='stable')]
+    running_end = np.maximum.accumulate(ranges[:, 1])
+    is_head = np.ones(ranges.shape[0], dtype=bool)
+    is_head[1:] = ranges[1:, 0] > running_end[:-1] + gap
+    head_idx = np.nonzero(is_head)[0]
+    tail_idx = np.append(head_idx[1:] - 1, ranges.shape[0] - 1)
+    return np.column_stack((ranges[head_idx, 0], running_end[tail_idx]))
+
+
+class IntervalSet:
+    """
+    A set of time intervals stored as sorted and non-overlapping numpy arrays of start and end times.
+    Touching intervals are merged, and intervals with non-positive duration are dropped.
+    Set operations (union, intersection and difference) are vectorized with a sweep over the sorted boundaries
+    instead of comparing each pair of ranges.
+
+    Example:
+        >>> a = IntervalSet([[0.0, 1.5], [1.0, 3.0], [5.0, 6.0]])
+        >>> a.to_list()
+        [[0.0, 3.0], [5.0, 6.0]]
+        >>> (a - IntervalSet([[2.0, 5.5]])).to_list()
+        [[0.0, 2.0], [5.5, 6.0]]
+
+    Args:
+        intervals (array-like):
+            Array-like of shape (N, 2) containing start and end times. Need not be sorted.
+    """
+
+    def __init__(self, intervals=None):
+        if intervals is None:
+            intervals = np.zeros((0, 2), dtype=np.float64)
+        intervals = np.asarray(intervals, dtype=np.float64).reshape(-1, 2)
+        intervals = intervals[intervals[:, 1] > intervals[:, 0]]
+        self._intervals = merge_range_array(intervals, gap=0)
+
+    @classmethod
+    def from_rttm(cls, rttm_file_path: str, speakers: List[str] = None) -> 'IntervalSet':
+        """
+        Load the union of the speech segments in an RTTM file (or a VAD table with `start dur label` lines).
+
+        Args:
+            rttm_file_path (str):
+                Path to the RTTM file
+            speakers (list):
+                If provided, only the segments of these speakers are included.
+        """
+        starts, ends, speaker_list = read_rttm_arrays(read_rttm_lines(rttm_file_path))
+        if speakers is not None:
+            mask = np.isin(speaker_list, speakers)
+            starts, ends = starts[mask], ends[mask]
+        return cls(np.column_stack((starts, ends)))
+
+    @classmethod
+    def from_uem(cls, uem_file_path: str) -> 'IntervalSet':
+        """
+        Load the scoring regions in a UEM file with `UNIQ_SPEAKER_ID CHANNEL START_TIME END_TIME` lines.
+        """
+        with open(uem_file_path, 'r') as f:
+            fields = [line.split() for line in f if line.strip()]
+        return cls([[float(x[2]), float(x[3])] for x in fields])
+
+    @property
+    def starts(self) -> np.ndarray:
+        return self._intervals[:, 0]
+
+    @property
+    def ends(self) -> np.ndarray:
+        return self._intervals[:, 1]
+
+    @property
+    def duration(self) -> float:
+        """
+        Total duration covered by the intervals.
+        """
+        return float(np.sum(self.ends - self.starts))
+
+    def __len__(self) -> int:
+        return self._intervals.shape[0]
+
+    def __iter__(self):
+        return iter(self._intervals.tolist())
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, IntervalSet) and np.array_equal(self._intervals, other._intervals)
+
+    def __repr__(self) -> str:
+        return f"IntervalSet({self.to_list()})"
+
+    def to_array(self) -> np.ndarray:
+        return self._intervals.copy()
+
+    def to_list(self) -> List[List[float]]:
+        return self._intervals.tolist()
+
+    def contains(self, points: np.ndarray) -> np.ndarray:
+        """
+        Check whether each of the given time points falls inside one of the intervals (start inclusive).
+        """
+        points = np.asarray(points, dtype=np.float64)
+        if len(self) == 0:
+            return np.zeros(points.shape, dtype=bool)
+        idx = np.searchsorted(self.starts, points, side='right') - 1
+        return (idx >= 0) & (points < self.ends[np.clip(idx, 0, None)])
+
+    def _sweep(self, other: 'IntervalSet', operator) -> 'IntervalSet':
+        """
+        Every elementary range between two consecutive boundaries of both sets is either fully inside or fully
+        outside each set, so a set operation is decided by checking the midpoints of the elementary ranges.
+        """
+        boundaries = np.unique(np.concatenate((self._intervals.ravel(), other._intervals.ravel())))
+        if boundaries.shape[0] < 2:
+            return IntervalSet()
+        midpoints = (boundaries[:-1] + boundaries[1:]) / 2
+        keep = operator(self.contains(midpoints), other.contains(midpoints))
+        return IntervalSet(np.column_stack((boundaries[:-1][keep], boundaries[1:][keep])))
+
+    def union(self, other: 'IntervalSet') -> 'IntervalSet':
+        return IntervalSet(np.concatenate((self._intervals, other._intervals)))
+
+    def intersection(self, other: 'IntervalSet') -> 'IntervalSet':
+        return self._sweep(other, np.logical_and)
+
+    def difference(self, other: 'IntervalSet') -> 'IntervalSet':
+        return self._sweep(other, lambda a, b: a & ~b)
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+    def clip(self, start: float, end: float) -> 'IntervalSet':
+        """
+        Crop the intervals to the range [start, end].
+        """
+        clipped = np.clip(self._intervals, start, end)
+        return IntervalSet(clipped)
+
+    def subsegments(self, window: float, shift: float, min_subsegment_duration: float = 0.0) -> np.ndarray:
+        """
+        Vectorized version of `get_subsegments` applied to every interval in the set.
+
+        Args:
+            window (float): window length for segments to subsegments length
+            shift (float): hop length for subsegments shift
+            min_subsegment_duration (float): exclude subsegments not longer than this duration value
+
+        Returns:
+            subsegments (np.ndarray): Array of shape (M, 2) containing start and duration of each subsegment
+        """
+        return get_subsegments_array(self.starts, self.ends - self.starts, window, shift, min_subsegment_duration)
+
+    def to_rttm_lines(self, uniq_id: str, speaker: str = 'speech', decimals: int = 3) -> List[str]:
+        """
+        Format the intervals as RTTM lines.
+        """
+        return [
+            f"SPEAKER {uniq_id} 1 {start:.{decimals}f} {end - start:.{decimals}f} <NA> <NA> {speaker} <NA> <NA>\n"
+            for start, end in self._intervals.tolist()
+        ]
+
+
+def read_rttm_arrays(rttm_lines: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Parse RTTM lines (or VAD table lines in `start dur label` format) into numpy arrays.
+
+    Args:
+        rttm_lines (list):
+            List containing RTTM lines in str format.
+    Returns:
+        starts (np.ndarray): start time of each segment
+        ends (np.ndarray): end time of each segment
+        speakers (np.ndarray): speaker label of each segment
+    """
+    fields = [line.split() for line in rttm_lines if line.strip()]
+    if len(fields) == 0:
+        return np.zeros(0), np.zeros(0), np.array([], dtype=str)
+    if len(fields[0]) > 3:
+        table = np.array([(x[3], x[4], x[7]) for x in fields])
+    else:
+        table = np.array([(x[0], x[1], x[2]) for x in fields])
+    starts = table[:, 0].astype(np.float64)
+    ends = starts + table[:, 1].astype(np.float64)
+    return starts, ends, table[:, 2]
+
+
+def rttm_to_interval_sets(rttm_file_path: str) -> Dict[str, IntervalSet]:
+    """
+    Load the speech segments of each speaker in an RTTM file.
+
+    Returns:
+        (dict): Mapping from speaker label to `IntervalSet`
+    """
+    starts, ends, speakers = read_rttm_arrays(read_rttm_lines(rttm_file_path))
+    ranges = np.column_stack((starts, ends))
+    return {str(spk): IntervalSet(ranges[speakers == spk]) for spk in np.unique(speakers)}
+
+
+def get_subsegments_array(
+    offsets: np.ndarray,
+    durations: np.ndarray,
+    window: float,
+    shift: float,
+    min_subsegment_duration: float = 0.0,
+    return_segment_index: bool = False,
+) -> Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]:
+    """
+    Vectorized version of `get_subsegments` for many segments at once.
+
+    Args:
+        offsets (np.ndarray): start time of each segment
+        durations (np.ndarray): duration of each segment
+        window (float): window length for segments to subsegments length
+        shift (float): hop length for subsegments shift
+        min_subsegment_duration (float): exclude subsegments not longer than this duration value
+        return_segment_index (bool): if True, also return the index of the segment each subsegment belongs to
+
+    Returns:
+        subsegments (np.ndarray): Array of shape (M, 2) containing start and duration of each subsegment
+        segment_index (np.ndarray): Index of the source segment of each subsegment (if return_segment_index is True)
+    """
+    offsets = np.asarray(offsets, dtype=np.float64).reshape(-1)
+    durations = np.asarray(durations, dtype=np.float64).reshape(-1)
+    if offsets.shape[0] == 0:
+        subsegments, seg_idx = np.zeros((0, 2)), np.zeros(0, dtype=np.int64)
+        return (subsegments, seg_idx) if return_segment_index else subsegments
+    slices = np.maximum(np.ceil((durations - window) / shift), 0).astype(np.int64) + 1
+    seg_idx = np.repeat(np.arange(offsets.shape[0]), slices)
+    slice_idx = np.arange(seg_idx.shape[0]) - np.repeat(np.cumsum(slices) - slices, slices)
+    starts = offsets[seg_idx] + slice_idx * shift
+    ends = np.minimum(starts + window, (offsets + durations)[seg_idx])
+    subsegments = np.column_stack((starts, ends - starts))
+    is_valid = subsegments[:, 1] > min_subsegment_duration
+    subsegments, seg_idx = subsegments[is_valid], seg_idx[is_valid]
+    return (subsegments, seg_idx) if return_segment_index else subsegments
+
+
 def getMergedRanges(label_list_A: List, label_list_B: List, decimals: int = 3) -> List:
     """
     Calculate the merged ranges between label_list_A and label_list_B.
@@ -775,15 +1025,16 @@ def getSubRangeList(target_range, source_range_list) -> List:
             List containing the overlap between target_range and
             source_range_list.
     """
-    if target_range == []:
+    if target_range == [] or len(source_range_list) == 0:
         return []
     else:
-        out_range = []
-        for s_range in source_range_list:
-            if isOverlap(s_range, target_range):
-                ovl_range = getOverlapRange(s_range, target_range)
-                out_range.append(ovl_range)
-        return out_range
+        source = np.asarray(source_range_list, dtype=np.float64).reshape(-1, 2)
+        target_stt, target_end = target_range
+        is_overlap = (source[:, 1] > target_stt) & (target_end > source[:, 0])
+        out_range = np.column_stack(
+            (np.maximum(source[is_overlap, 0], target_stt), np.minimum(source[is_overlap, 1], target_end))
+        )
+        return out_range.tolist()
 
 
 def write_rttm2manifest(
@@ -810,11 +1061,8 @@ def write_rttm2manifest(
             rttm_file_path = AUDIO_RTTM_MAP[uniq_id]['rttm_filepath']
             rttm_lines = read_rttm_lines(rttm_file_path)
             offset, duration = get_offset_and_duration(AUDIO_RTTM_MAP, uniq_id, decimals)
-            vad_start_end_list_raw = []
-            for line in rttm_lines:
-                start, dur = get_vad_out_from_rttm_line(line)
-                vad_start_end_list_raw.append([start, start + dur])
-            vad_start_end_list = combine_float_overlaps(vad_start_end_list_raw, decimals)
+            starts, ends, _ = read_rttm_arrays(rttm_lines)
+            vad_start_end_list = combine_float_overlaps(np.column_stack((starts, ends)), decimals)
             if len(vad_start_end_list) == 0:
                 logging.warning(f"File ID: {uniq_id}: The VAD label is not containing any speech segments.")
             elif duration <= 0:
@@ -854,29 +1102,28 @@ def segments_manifest_to_subsegments_manifest(
     with open(segments_manifest_file, 'r') as segments_manifest, open(
         subsegments_manifest_file, 'w'
     ) as subsegments_manifest:
-        segments = segments_manifest.readlines()
-        for segment in segments:
-            segment = segment.strip()
-            dic = json.loads(segment)
-            audio, offset, duration, label = dic['audio_filepath'], dic['offset'], dic['duration'], dic['label']
-            subsegments = get_subsegments(offset=offset, window=window, shift=shift, duration=duration)
-            if include_uniq_id and 'uniq_id' in dic:
-                uniq_id = dic['uniq_id']
-            else:
-                uniq_id = None
-            for subsegment in subsegments:
-                start, dur = subsegment
-                if dur > min_subsegment_duration:
-                    meta = {
-                        "audio_filepath": audio,
-                        "offset": start,
-                        "duration": dur,
-                        "label": label,
-                        "uniq_id": uniq_id,
-                    }
-
-                    json.dump(meta, subsegments_manifest)
-                    subsegments_manifest.write("\n")
+        segments = [json.loads(segment.strip()) for segment in segments_manifest.readlines()]
+        offsets = np.array([dic['offset'] for dic in segments])
+        durations = np.array([dic['duration'] for dic in segments])
+        subsegments, seg_idx = get_subsegments_array(
+            offsets,
+            durations,
+            window=window,
+            shift=shift,
+            min_subsegment_duration=min_subsegment_duration,
+            return_segment_index=True,
+        )
+        for (start, dur), idx in zip(subsegments.tolist(), seg_idx.tolist()):
+            dic = segments[idx]
+            meta = {
+                "audio_filepath": dic['audio_filepath'],
+                "offset": start,
+                "duration": dur,
+                "label": dic['label'],
+                "uniq_id": dic['uniq_id'] if include_uniq_id and 'uniq_id' in dic else None,
+            }
+            json.dump(meta, subsegments_manifest)
+            subsegments_manifest.write("\n")
 
     return subsegments_manifest_file
 
@@ -892,19 +1139,11 @@ def get_subsegments(offset: float, window: float, shift: float, duration: float)
     Returns:
         subsegments (List[tuple[float, float]]): subsegments generated for the segments as list of tuple of start and duration of each subsegment
     """
-    subsegments = []
-    start = offset
-    slice_end = start + duration
-    base = math.ceil((duration - window) / shift)
-    slices = 1 if base < 0 else base + 1
-    for slice_id in range(slices):
-        end = start + window
-        if end > slice_end:
-            end = slice_end
-        subsegments.append((start, end - start))
-        start = offset + (slice_id + 1) * shift
-
-    return subsegments
+    # subsegments of any duration are returned, the callers filter them
+    subsegments = get_subsegments_array(
+        np.array([offset]), np.array([duration]), window=window, shift=shift, min_subsegment_duration=-np.inf
+    )
+    return [tuple(x) for x in subsegments.tolist()]
 
 
 def get_scale_mapping_argmat(uniq_embs_and_timestamps: Dict[str, dict]) -> Dict[int, torch.Tensor]:
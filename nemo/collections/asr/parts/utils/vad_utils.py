@@ -33,6 +33,7 @@ from sklearn.model_selection import ParameterGrid
 from tqdm import tqdm
 
 from nemo.collections.asr.models import EncDecClassificationModel
+from nemo.collections.asr.parts.utils.speaker_utils import IntervalSet
 from nemo.utils import logging
 
 try:
@@ -891,6 +892,243 @@ def vad_tune_threshold_on_dev(
     return best_threshold, optimal_scores
 
 
+def get_vad_segments_support(segments: np.ndarray) -> np.ndarray:
+    """
+    Merge overlapping or touching segments into a sorted set of disjoint segments.
+    Segments with non-positive duration are dropped.
+    For example,
+    np.array([[3, 4], [0, 1.5], [1, 2]]) -> np.array([[0, 2], [3, 4]])
+    """
+    return IntervalSet(segments).to_array()
+
+
+def cal_vad_detection_error(reference: np.ndarray, hypothesis: np.ndarray) -> Tuple[float, float, float]:
+    """
+    Vectorized equivalent of pyannote.metrics.detection.DetectionErrorRate for a single file (no collar).
+    Args:
+        reference (np.ndarray): groundtruth speech segments in [[start1, end1], [start2, end2]] format.
+        hypothesis (np.ndarray): predicted speech segments in [[start1, end1], [start2, end2]] format.
+    Returns:
+        total (float): total duration of reference speech.
+        false_alarm (float): duration of hypothesis speech outside reference speech.
+        miss (float): duration of reference speech not covered by the hypothesis.
+    """
+    reference, hypothesis = IntervalSet(reference), IntervalSet(hypothesis)
+    intersection = (reference & hypothesis).duration
+    return reference.duration, hypothesis.duration - intersection, reference.duration - intersection
+
+
+def load_vad_tune_data(
+    paired_filenames: set, groundtruth_RTTM_dict: dict, vad_pred_dict: dict
+) -> Dict[str, Tuple[torch.Tensor, np.ndarray]]:
+    """
+    Load frame level predictions and groundtruth speech segments once, so they can be reused for every
+    parameter combination during threshold tuning.
+    Returns:
+        data (dict): mapping from filename to a tuple of (frame level predictions, reference speech segments).
+    """
+    data = {}
+    for filename in tqdm(sorted(paired_filenames), desc='loading vad predictions and rttms', leave=True):
+        sequence, _ = load_tensor_from_file(vad_pred_dict[filename])
+        reference = load_speech_segments_from_rttm(groundtruth_RTTM_dict[filename])
+        data[filename] = (sequence, get_vad_segments_support(np.array(reference, dtype=np.float64)))
+    return data
+
+
+def vad_evaluate_param_on_data(
+    param: dict, data: Dict[str, Tuple[torch.Tensor, np.ndarray]], frame_length_in_sec: float = 0.01
+) -> dict:
+    """
+    Binarize and filter the cached frame level predictions with one parameter combination and
+    compute the accumulated detection error over all files.
+    Returns:
+        perf (dict): dictionary with 'DetER (%)', 'FA (%)' and 'MISS (%)'.
+    """
+    total, false_alarm, miss = 0.0, 0.0, 0.0
+    for sequence, reference in data.values():
+        per_args = {"frame_length_in_sec": frame_length_in_sec, **param}
+        _, per_args_float = prepare_gen_segment_table(sequence, per_args)
+        preds = generate_vad_segment_table_per_tensor(sequence, per_args_float)
+        if preds.shape[0] == 0:
+            hypothesis = np.zeros((0, 2))
+        else:
+            preds = preds.numpy()
+            # same as the rttm-like table: [start, start + dur]
+            hypothesis = np.column_stack((preds[:, 0], preds[:, 0] + preds[:, 2]))
+        file_total, file_false_alarm, file_miss = cal_vad_detection_error(reference, hypothesis)
+        total += file_total
+        false_alarm += file_false_alarm
+        miss += file_miss
+
+    if total == 0:
+        raise ValueError("Groundtruth RTTM files do not contain any speech, detection error rate is undefined!")
+    return {
+        'DetER (%)': (false_alarm + miss) / total * 100,
+        'FA (%)': false_alarm / total * 100,
+        'MISS (%)': miss / total * 100,
+    }
+
+
+_VAD_TUNE_DATA = None
+_VAD_TUNE_FRAME_LENGTH = 0.01
+
+
+def _init_vad_tune_worker(data: dict, frame_length_in_sec: float):
+    """
+    Initializer of tuning workers. Cached data is shared once per worker instead of once per task.
+    """
+    global _VAD_TUNE_DATA, _VAD_TUNE_FRAME_LENGTH
+    _VAD_TUNE_DATA = data
+    _VAD_TUNE_FRAME_LENGTH = frame_length_in_sec
+    torch.set_num_threads(1)
+
+
+def _vad_evaluate_param_worker(param: dict) -> Tuple[dict, dict]:
+    try:
+        perf = vad_evaluate_param_on_data(param, _VAD_TUNE_DATA, _VAD_TUNE_FRAME_LENGTH)
+    except RuntimeError as e:
+        logging.warning(f"Pass {param}, with error {e}")
+        perf = None
+    return param, perf
+
+
+def get_parameter_steps(params: dict) -> Dict[str, float]:
+    """
+    Get the grid spacing of every tuned parameter that has more than one candidate value.
+    """
+    steps = {}
+    for key, values in params.items():
+        if key == "filter_speech_first":
+            continue
+        values = np.unique(np.asarray(values, dtype=np.float64))
+        if len(values) > 1:
+            steps[key] = float(np.min(np.diff(values)))
+    return steps
+
+
+def get_refined_parameter_grid(center: dict, steps: Dict[str, float]) -> list:
+    """
+    Get a local parameter grid around center, sampling each tuned parameter at center - step, center and center + step.
+    Thresholds are kept in their valid ranges (see check_if_param_valid).
+    """
+    local_params = {}
+    for key, value in center.items():
+        if key == "filter_speech_first":
+            local_params[key] = value
+        elif key in steps:
+            candidates = np.array([value - steps[key], value, value + steps[key]])
+            if key not in ("pad_onset", "pad_offset"):
+                candidates = candidates[candidates >= 0]
+            if key in ("onset", "offset"):
+                candidates = candidates[candidates <= 1]
+            local_params[key] = [round(float(x), 6) for x in np.unique(candidates)]
+        else:
+            local_params[key] = [value]
+    return get_parameter_grid(local_params)
+
+
+def _evaluate_parameter_grid(
+    params_grid: list, data: dict, frame_length_in_sec: float, num_workers: int, desc: str
+) -> List[Tuple[dict, dict]]:
+    if num_workers is not None and num_workers > 1:
+        with multiprocessing.Pool(
+            num_workers, initializer=_init_vad_tune_worker, initargs=(data, frame_length_in_sec)
+        ) as p:
+            results = list(
+                tqdm(p.imap(_vad_evaluate_param_worker, params_grid), total=len(params_grid), desc=desc, leave=True)
+            )
+    else:
+        _init_vad_tune_worker(data, frame_length_in_sec)
+        results = [_vad_evaluate_param_worker(param) for param in tqdm(params_grid, desc=desc, leave=True)]
+    return [(param, perf) for param, perf in results if perf is not None]
+
+
+def vad_tune_threshold_on_dev_parallel(
+    params: dict,
+    vad_pred: str,
+    groundtruth_RTTM: str,
+    result_file: str = "res",
+    vad_pred_method: str = "frame",
+    focus_metric: str = "DetER",
+    frame_length_in_sec: float = 0.01,
+    num_workers: int = 20,
+    num_refine_rounds: int = 0,
+    refine_top_k: int = 3,
+) -> Tuple[dict, dict]:
+    """
+    Tune thresholds on dev set, same as vad_tune_threshold_on_dev but faster.
+    Frame level predictions and groundtruth RTTMs are loaded only once, every parameter combination is evaluated
+    in a separate process with a vectorized detection error instead of pyannote, and no intermediate table files
+    are written. After the grid search, the grid around the refine_top_k best combinations is refined
+    num_refine_rounds times, halving the grid spacing every round.
+    Args:
+        params (dict): dictionary of parameters to be tuned on.
+        vad_pred (str): directory of vad predictions or a file contains the paths of them.
+        groundtruth_RTTM (str): directory of ground-truth rttm files or a file contains the paths of them.
+        result_file (str): filename (without extension) to store results of all evaluated combinations.
+        vad_pred_method (str): suffix of prediction file. Use to locate file. Should be either in "frame", "mean" or "median".
+        focus_metric (str): metrics we care most when tuning threshold. Should be either in "DetER", "FA", "MISS"
+        frame_length_in_sec (float): frame length.
+        num_workers (int): number of workers.
+        num_refine_rounds (int): number of adaptive refinement rounds after the initial grid search.
+        refine_top_k (int): number of best combinations to refine around in every round.
+    Returns:
+        best_threshold (dict): combination of thresholds that gives the lowest focus_metric.
+        optimal_scores (dict): scores of best_threshold.
+    """
+    if focus_metric not in ("DetER", "FA", "MISS"):
+        raise ValueError("Metric we care most should be only in 'DetER', 'FA' or 'MISS'!")
+    try:
+        check_if_param_valid(params)
+    except:
+        raise ValueError("Please check if the parameters are valid")
+
+    paired_filenames, groundtruth_RTTM_dict, vad_pred_dict = pred_rttm_map(vad_pred, groundtruth_RTTM, vad_pred_method)
+    data = load_vad_tune_data(paired_filenames, groundtruth_RTTM_dict, vad_pred_dict)
+
+    params_grid = get_parameter_grid(dict(params))
+    for param in params_grid:
+        for i in param:
+            if type(param[i]) == np.float64 or type(param[i]) == np.int64:
+                param[i] = float(param[i])
+
+    all_perf = {}
+    results = _evaluate_parameter_grid(params_grid, data, frame_length_in_sec, num_workers, desc='tuning thresholds')
+    all_perf.update({str(param): (param, perf) for param, perf in results})
+
+    steps = get_parameter_steps(params)
+    for refine_round in range(num_refine_rounds):
+        if not steps or not all_perf:
+            break
+        steps = {key: step / 2 for key, step in steps.items()}
+        ranked = sorted(all_perf.values(), key=lambda x: x[1][focus_metric + ' (%)'])
+        refined_grid = {}
+        for center, _ in ranked[:refine_top_k]:
+            for param in get_refined_parameter_grid(center, steps):
+                if str(param) not in all_perf:
+                    refined_grid[str(param)] = param
+        results = _evaluate_parameter_grid(
+            list(refined_grid.values()),
+            data,
+            frame_length_in_sec,
+            num_workers,
+            desc=f'refining thresholds, round {refine_round + 1}',
+        )
+        all_perf.update({str(param): (param, perf) for param, perf in results})
+
+    if not all_perf:
+        raise RuntimeError("None of the parameter combinations could be evaluated!")
+
+    # save results for analysis
+    with open(result_file + ".txt", "a", encoding='utf-8') as fp:
+        for param, perf in all_perf.values():
+            fp.write(f"{param}, {perf}\n")
+
+    best_threshold, optimal_scores = min(all_perf.values(), key=lambda x: x[1][focus_metric + ' (%)'])
+    logging.info(f"Evaluated {len(all_perf)} combinations, best {best_threshold}, {optimal_scores}")
+    return best_threshold, optimal_scores
+
+
 def check_if_param_valid(params: dict) -> bool:
     """
     Check if the parameters are valid.
@@ -14,60 +14,116 @@
 
 """Blendable dataset."""
 
+import hashlib
+import json
 import time
 
 import numpy as np
 import torch
 
+from nemo.collections.nlp.data.language_modeling.megatron.index_cache import IndexCache
 from nemo.utils import logging
 from nemo.utils.app_state import AppState
 
 
 class BlendableDataset(torch.utils.data.Dataset):
-    def __init__(self, datasets, weights, size):
+    """
+    Blends several datasets according to the given weights.
+
+    Args:
+        datasets (list): Datasets to blend.
+        weights (list or np.ndarray): Blending weights, one per dataset. A 2D array of shape
+            (num_epochs, num_datasets) reweights the datasets over time: the blended samples are split into
+            num_epochs consecutive, equally sized epochs, each blended with its own weights.
+        size (int): Number of blended samples.
+        index_cache_dir (str): If given, the blending indices are built once with exact ratios, stored under
+            this directory keyed by the weights and dataset sizes, and memory-mapped on first access by all
+            ranks and dataloader workers.
+        index_cache_timeout (float): Maximum number of seconds to wait for the rank building the cached indices.
+    """
+
+    def __init__(self, datasets, weights, size, index_cache_dir=None, index_cache_timeout=7200):
 
         self.datasets = datasets
         num_datasets = len(datasets)
-        assert num_datasets == len(weights)
 
         self.size = size
 
         # Normalize weights.
         weights = np.array(weights, dtype=np.float64)
-        sum_weights = np.sum(weights)
-        assert sum_weights > 0.0
+        if weights.ndim == 1:
+            weights = weights[None, :]
+        assert weights.ndim == 2 and weights.shape[1] == num_datasets
+        assert (weights >= 0.0).all()
+        sum_weights = np.sum(weights, axis=1, keepdims=True)
+        assert (sum_weights > 0.0).all()
         weights /= sum_weights
 
+        self.index_cache = None
+        self._dataset_index = None
+        self._dataset_sample_index = None
+
+        if index_cache_dir is not None:
+            self.index_cache = BlendingIndexCache(
+                index_cache_dir, weights, size, [len(ds) for ds in datasets], timeout=index_cache_timeout
+            )
+            self.index_cache.build_if_needed()
+            return
+
         # Build indecies.
         start_time = time.time()
-        assert num_datasets < 255
-        self.dataset_index = np.zeros(self.size, dtype=np.uint8)
-        self.dataset_sample_index = np.zeros(self.size, dtype=np.int64)
-        app_state = AppState()
-        try:
-            if app_state.local_rank == 0:
-                from nemo.collections.nlp.data.language_modeling.megatron.dataset_utils import compile_helper
-
-                compile_helper()
-            torch.distributed.barrier()
-            from nemo.collections.nlp.data.language_modeling.megatron import helpers
-        except ImportError:
-            raise ImportError(
-                f'Could not compile megatron dataset C++ helper functions and therefore cannot import helpers python file.'
+        if weights.shape[0] > 1 or num_datasets >= 255:
+            self._dataset_index, self._dataset_sample_index = build_exact_blending_indices(
+                weights, size, dataset_sizes=[len(ds) for ds in datasets]
+            )
+        else:
+            self._dataset_index = np.zeros(self.size, dtype=np.uint8)
+            self._dataset_sample_index = np.zeros(self.size, dtype=np.int64)
+            app_state = AppState()
+            try:
+                if app_state.local_rank == 0:
+                    from nemo.collections.nlp.data.language_modeling.megatron.dataset_utils import compile_helper
+
+                    compile_helper()
+                torch.distributed.barrier()
+                from nemo.collections.nlp.data.language_modeling.megatron import helpers
+            except ImportError:
+                raise ImportError(
+                    f'Could not compile megatron dataset C++ helper functions and therefore cannot import helpers python file.'
+                )
+
+            helpers.build_blending_indices(
+                self._dataset_index,
+                self._dataset_sample_index,
+                weights[0],
+                num_datasets,
+                self.size,
+                torch.distributed.get_rank() == 0,
             )
-
-        helpers.build_blending_indices(
-            self.dataset_index,
-            self.dataset_sample_index,
-            weights,
-            num_datasets,
-            self.size,
-            torch.distributed.get_rank() == 0,
-        )
         logging.info(
             '> elapsed time for building blendable dataset indices: ' '{:.2f} (sec)'.format(time.time() - start_time)
         )
 
+    @property
+    def dataset_index(self):
+        if self._dataset_index is None:
+            self._dataset_index, self._dataset_sample_index = self.index_cache.load()
+        return self._dataset_index
+
+    @property
+    def dataset_sample_index(self):
+        if self._dataset_sample_index is None:
+            self._dataset_index, self._dataset_sample_index = self.index_cache.load()
+        return self._dataset_sample_index
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.index_cache is not None:
+            # dataloader workers memory-map the cached indices themselves instead of receiving a copy
+            state['_dataset_index'] = None
+            state['_dataset_sample_index'] = None
+        return state
+
     def __len__(self):
         return self.size
 
@@ -77,6 +133,106 @@ class BlendableDataset(torch.utils.data.Dataset):
         return self.datasets[dataset_idx][sample_idx]
 
 
+def build_exact_blending_indices(weights, size, dataset_sizes=None):
+    """
+    Builds blending indices in which every dataset contributes exactly its share of the samples.
+
+    The number of samples of each dataset is rounded with the largest remainder method, and the samples of
+    each dataset are spread evenly over the blended samples, so any window of the blended samples is close
+    to the blending ratio. Samples are taken from each dataset in order, continuing across epochs.
+
+    Args:
+        weights (np.ndarray): Normalized weights of shape (num_epochs, num_datasets).
+        size (int): Number of blended samples, split evenly into num_epochs epochs.
+        dataset_sizes (list): If given, datasets sampled more often than their size are wrapped around.
+
+    Returns:
+        dataset_index, dataset_sample_index: dataset and sample within the dataset of every blended sample.
+    """
+    num_epochs, num_datasets = weights.shape
+    if num_datasets < np.iinfo(np.uint8).max:
+        index_dtype = np.uint8
+    elif num_datasets < np.iinfo(np.uint16).max:
+        index_dtype = np.uint16
+    else:
+        index_dtype = np.uint32
+    dataset_index = np.zeros(size, dtype=index_dtype)
+    dataset_sample_index = np.zeros(size, dtype=np.int64)
+
+    consumed = np.zeros(num_datasets, dtype=np.int64)
+    start = 0
+    for epoch in range(num_epochs):
+        epoch_size = size * (epoch + 1) // num_epochs - size * epoch // num_epochs
+
+        # Largest remainder rounding of the number of samples of every dataset.
+        exact = weights[epoch] * epoch_size
+        counts = np.floor(exact).astype(np.int64)
+        remainder_order = np.argsort(-(exact - counts), kind='stable')
+        counts[remainder_order[: epoch_size - counts.sum()]] += 1
+
+        # The k-th of n samples of a dataset goes to relative position (k + 0.5) / n within the epoch.
+        datasets = np.repeat(np.arange(num_datasets), counts)
+        local_index = np.arange(epoch_size, dtype=np.int64) - np.repeat(np.cumsum(counts) - counts, counts)
+        order = np.argsort((local_index + 0.5) / counts[datasets], kind='stable')
+
+        dataset_index[start : start + epoch_size] = datasets[order]
+        dataset_sample_index[start : start + epoch_size] = (consumed[datasets] + local_index)[order]
+        consumed += counts
+        start += epoch_size
+
+    if dataset_sizes is not None:
+        dataset_sizes = np.asarray(dataset_sizes, dtype=np.int64)
+        overflow = dataset_sample_index >= dataset_sizes[dataset_index]
+        if overflow.any():
+            logging.warning(
+                ' > {} blended samples exceed the size of their dataset and are wrapped around'.format(overflow.sum())
+            )
+            dataset_sample_index[overflow] %= dataset_sizes[dataset_index[overflow]]
+
+    return dataset_index, dataset_sample_index
+
+
+class BlendingIndexCache(IndexCache):
+    """
+    Cache of exact-ratio blending indices, shared by all ranks, dataloader workers and jobs.
+
+    The indices are stored in `cache_dir` under a key that hashes the weights, the number of samples and the
+    sizes of the blended datasets, and are built and published as described in IndexCache.
+
+    Args:
+        cache_dir (str): Directory of the cache.
+        weights (np.ndarray): Normalized weights of shape (num_epochs, num_datasets).
+        size (int): Number of blended samples.
+        dataset_sizes (list): Number of samples of every blended dataset.
+        timeout (float): Maximum number of seconds to wait for the builder rank.
+    """
+
+    version = 1
+    description = 'blending indices'
+    array_names = ['dataset_index', 'dataset_sample_index']
+
+    def __init__(self, cache_dir, weights, size, dataset_sizes, timeout=7200):
+        self.weights = weights
+        self.size = size
+        self.dataset_sizes = np.array(dataset_sizes, dtype=np.int64)
+
+        md5 = hashlib.md5()
+        md5.update(np.ascontiguousarray(weights, dtype=np.float64).tobytes())
+        md5.update(self.dataset_sizes.tobytes())
+        md5.update(json.dumps([self.version, int(size), list(weights.shape)]).encode('utf-8'))
+        super().__init__(cache_dir, 'blending', md5.hexdigest(), timeout=timeout)
+
+    def _build_arrays(self):
+        return build_exact_blending_indices(self.weights, self.size, dataset_sizes=self.dataset_sizes)
+
+    def _meta(self, arrays):
+        return {
+            'size': int(self.size),
+            'num_datasets': int(self.weights.shape[1]),
+            'num_epochs': int(self.weights.shape[0]),
+        }
+
+
 class MemoryEfficientBlendableDataset(torch.utils.data.Dataset):
     """
     A BlendableDataset implementation that uses less memory than the original implementation.
@@ -177,6 +177,64 @@ def is_start_piece(piece):
     return not piece.startswith("##")
 
 
+# word-start bitmaps of the vocabularies seen so far, keyed by the id of the vocab dict
+_WORD_START_BITMAPS = {}
+
+
+def get_word_start_bitmap(vocab_id_to_token_dict):
+    """Returns a boolean array that is True for the vocab ids of word-starting pieces, see is_start_piece.
+    The bitmap is computed once per vocab dict."""
+    cached = _WORD_START_BITMAPS.get(id(vocab_id_to_token_dict))
+    if cached is not None and cached[0] is vocab_id_to_token_dict:
+        return cached[1]
+
+    bitmap = np.zeros(max(vocab_id_to_token_dict.keys()) + 1, dtype=bool)
+    for vocab_id, piece in vocab_id_to_token_dict.items():
+        bitmap[vocab_id] = is_start_piece(piece)
+    # keep a reference to the dict so that its id is not reused
+    _WORD_START_BITMAPS[id(vocab_id_to_token_dict)] = (vocab_id_to_token_dict, bitmap)
+    return bitmap
+
+
+def _select_spans(cand_offsets, span_lengths, order, num_to_predict, blocked, min_span=1):
+    """Greedily selects non-overlapping spans of masking candidates.
+
+    Candidates are visited in the given order. A span starting at candidate ``idx`` covers up to
+    ``span_lengths[step]`` consecutive candidates, shortened (down to ``min_span`` candidates) until it fits in
+    the number of tokens left to predict, and is skipped if it still does not fit or overlaps a blocked token.
+
+    Args:
+        cand_offsets: candidate ``i`` covers the masking positions ``cand_offsets[i]:cand_offsets[i + 1]``
+        span_lengths: number of candidates of the span drawn at each step
+        order: order in which candidates are visited
+        num_to_predict: maximum number of positions to select
+        blocked: boolean array over the masking positions, updated with the selected positions
+
+    Returns:
+        list of selected (start, end) ranges of masking positions
+    """
+    num_candidates = len(cand_offsets) - 1
+    spans = []
+    num_selected = 0
+    for step, idx in enumerate(order):
+        if num_selected >= num_to_predict:
+            break
+        # positions covered by spans of min_span, ..., n candidates starting at idx
+        start = cand_offsets[idx]
+        ends = cand_offsets[np.minimum(idx + np.arange(min_span, span_lengths[step] + 1), num_candidates)]
+        # the longest of these spans that fits in the budget, span sizes are non decreasing
+        m = np.searchsorted(ends - start, num_to_predict - num_selected, side='right') - 1
+        if m < 0:
+            continue
+        end = ends[m]
+        if end == start or blocked[start:end].any():
+            continue
+        blocked[start:end] = True
+        spans.append((start, end))
+        num_selected += end - start
+    return spans
+
+
 def create_masked_lm_predictions(
     tokens,
     vocab_id_list,
@@ -201,37 +259,34 @@ def create_masked_lm_predictions(
 
     if not geometric_dist and mean_ngram_size is not None:
         raise ValueError(f"Mean ngram size is only supported for geometric distribution.")
+    if masking_style not in ["bert", "t5", "bart"]:
+        raise ValueError("invalid value of masking style")
 
-    cand_indexes = []
+    tokens_np = np.asarray(tokens, dtype=np.int64)
+    is_special = (tokens_np == cls_id) | (tokens_np == sep_id)
+    is_start = get_word_start_bitmap(vocab_id_to_token_dict)[tokens_np]
     # Note(mingdachen): We create a list for recording if the piece is
     # the starting piece of current token, where 1 means true, so that
     # on-the-fly whole word masking is possible.
-    token_boundary = [0] * len(tokens)
-
-    for (i, token) in enumerate(tokens):
-        if token == cls_id or token == sep_id:
-            token_boundary[i] = 1
-            continue
-        # Whole Word Masking means that if we mask all of the wordpieces
-        # corresponding to an original word.
-        #
-        # Note that Whole Word Masking does *not* change the training code
-        # at all -- we still predict each WordPiece independently, softmaxed
-        # over the entire vocabulary.
-        if whole_word_masking and len(cand_indexes) >= 1 and not is_start_piece(vocab_id_to_token_dict[token]):
-            cand_indexes[-1].append(i)
-        else:
-            cand_indexes.append([i])
-            if is_start_piece(vocab_id_to_token_dict[token]):
-                token_boundary[i] = 1
-
-    output_tokens = list(tokens)
-
-    masked_lm_positions = []
-    masked_lm_labels = []
+    token_boundary = (is_special | is_start).astype(np.int64).tolist()
+
+    # Candidates are the words (or single pieces without whole word masking) of the non special tokens.
+    # Whole Word Masking means that if we mask all of the wordpieces
+    # corresponding to an original word.
+    #
+    # Note that Whole Word Masking does *not* change the training code
+    # at all -- we still predict each WordPiece independently, softmaxed
+    # over the entire vocabulary.
+    positions = np.flatnonzero(~is_special)
+    new_candidate = is_start[positions] if whole_word_masking else np.ones(len(positions), dtype=bool)
+    new_candidate[:1] = True
+    cand_offsets = np.append(np.flatnonzero(new_candidate), len(positions))
+    num_candidates = len(cand_offsets) - 1
+
+    output_tokens = tokens_np.copy()
 
     if masked_lm_prob == 0:
-        return (output_tokens, masked_lm_positions, masked_lm_labels, token_boundary)
+        return (list(tokens), [], [], token_boundary)
 
     num_to_predict = min(max_predictions_per_seq, max(1, int(round(len(tokens) * masked_lm_prob))))
     if num_to_predict < 1:
@@ -248,151 +303,65 @@ def create_masked_lm_predictions(
         if favor_long_ngrams:
             pvals = pvals[::-1]
 
-    ngram_indexes = []
-    for idx in range(len(cand_indexes)):
-        ngram_index = []
-        for n in ngrams:
-            ngram_index.append(cand_indexes[idx : idx + n])
-        ngram_indexes.append(ngram_index)
-
-    np_rng.shuffle(ngram_indexes)
-
-    (masked_lms, masked_spans) = ([], [])
-    covered_indexes = set()
-    for cand_index_set in ngram_indexes:
-        if len(masked_lms) >= num_to_predict:
-            break
-        if not cand_index_set:
-            continue
-        # Note(mingdachen):
-        # Skip current piece if they are covered in lm masking or previous ngrams.
-        for index_set in cand_index_set[0]:
-            for index in index_set:
-                if index in covered_indexes:
-                    continue
-
+    def draw_span_lengths():
         if not geometric_dist:
-            n = np_rng.choice(
-                ngrams[: len(cand_index_set)],
-                p=pvals[: len(cand_index_set)] / pvals[: len(cand_index_set)].sum(keepdims=True),
-            )
-        else:
-            # Sampling "n" from the geometric distribution and clipping it to
-            # the max_ngrams. Using p=0.2 default from the SpanBERT paper
-            # https://arxiv.org/pdf/1907.10529.pdf (Sec 3.1)
-
-            # The expectation of a geometric distribution is E[X] = 1 / p
-            p = 1 / mean_ngram_size if mean_ngram_size is not None else 0.2
-            n = min(np_rng.geometric(p), max_ngram_size)
-
-        index_set = sum(cand_index_set[n - 1], [])
-        n -= 1
-        # Note(mingdachen):
-        # Repeatedly looking for a candidate that does not exceed the
-        # maximum number of predictions by trying shorter ngrams.
-        while len(masked_lms) + len(index_set) > num_to_predict:
-            if n == 0:
-                break
-            index_set = sum(cand_index_set[n - 1], [])
-            n -= 1
-        # If adding a whole-word mask would exceed the maximum number of
-        # predictions, then just skip this candidate.
-        if len(masked_lms) + len(index_set) > num_to_predict:
-            continue
-        is_any_index_covered = False
-        for index in index_set:
-            if index in covered_indexes:
-                is_any_index_covered = True
-                break
-        if is_any_index_covered:
-            continue
-        for index in index_set:
-            covered_indexes.add(index)
-            masked_token = None
-            if masking_style == "bert":
-                # 80% of the time, replace with [MASK]
-                if np_rng.random() < 0.8:
-                    masked_token = mask_id
-                else:
-                    # 10% of the time, keep original
-                    if np_rng.random() < 0.5:
-                        masked_token = tokens[index]
-                    # 10% of the time, replace with random word
-                    else:
-                        masked_token = vocab_id_list[np_rng.randint(0, len(vocab_id_list))]
-            elif masking_style == "t5":
-                masked_token = mask_id
-            elif masking_style == "bart":
-                masked_token = mask_id
-            else:
-                raise ValueError("invalid value of masking style")
+            return np_rng.choice(ngrams, size=num_candidates, p=pvals)
+        # Sampling "n" from the geometric distribution and clipping it to
+        # the max_ngrams. Using p=0.2 default from the SpanBERT paper
+        # https://arxiv.org/pdf/1907.10529.pdf (Sec 3.1)
+
+        # The expectation of a geometric distribution is E[X] = 1 / p
+        p = 1 / mean_ngram_size if mean_ngram_size is not None else 0.2
+        return np.minimum(np_rng.geometric(p, size=num_candidates), max_ngram_size)
+
+    # Note(mingdachen):
+    # Repeatedly looking for a candidate that does not exceed the
+    # maximum number of predictions by trying shorter ngrams.
+    covered = np.zeros(len(positions), dtype=bool)
+    spans = _select_spans(
+        cand_offsets, draw_span_lengths(), np_rng.permutation(num_candidates), num_to_predict, covered
+    )
 
-            output_tokens[index] = masked_token
-            masked_lms.append(MaskedLmInstance(index=index, label=tokens[index]))
+    masked_spans = [positions[start:end] for start, end in sorted(spans)]
+    masked_index = np.sort(np.concatenate(masked_spans)) if masked_spans else np.zeros(0, dtype=np.int64)
+    masked_labels = tokens_np[masked_index]
+    assert len(masked_index) <= num_to_predict
+
+    if masking_style == "bert":
+        # 80% of the time, replace with [MASK], 10% of the time, keep original,
+        # 10% of the time, replace with random word
+        replace_with_mask = np_rng.random_sample(len(masked_index)) < 0.8
+        keep_original = np_rng.random_sample(len(masked_index)) < 0.5
+        random_tokens = [vocab_id_list[i] for i in np_rng.randint(0, len(vocab_id_list), size=len(masked_index))]
+        output_tokens[masked_index] = np.where(
+            replace_with_mask, mask_id, np.where(keep_original, masked_labels, random_tokens)
+        )
+    else:
+        output_tokens[masked_index] = mask_id
 
-        masked_spans.append(MaskedLmInstance(index=index_set, label=[tokens[index] for index in index_set]))
+    masked_positions_list = [masked_index]
+    masked_labels_list = [masked_labels]
+    if permutation:
+        select_blocked = covered.copy()
+        select_spans = _select_spans(
+            cand_offsets, draw_span_lengths(), np_rng.permutation(num_candidates), num_to_predict, select_blocked
+        )
+        if select_spans:
+            select_indexes = np.sort(np.concatenate([positions[start:end] for start, end in select_spans]))
+            assert len(select_indexes) <= num_to_predict
+            permute_indexes = np_rng.permutation(select_indexes)
+            orig_token = output_tokens.copy()
+            output_tokens[select_indexes] = orig_token[permute_indexes]
+            masked_positions_list.append(select_indexes)
+            masked_labels_list.append(orig_token[select_indexes])
 
-    assert len(masked_lms) <= num_to_predict
-    np_rng.shuffle(ngram_indexes)
+    masked_positions = np.concatenate(masked_positions_list)
+    order = np.argsort(masked_positions, kind='stable')
+    masked_lm_positions = masked_positions[order].tolist()
+    masked_lm_labels = np.concatenate(masked_labels_list)[order].tolist()
+    masked_spans = [MaskedLmInstance(index=span.tolist(), label=tokens_np[span].tolist()) for span in masked_spans]
 
-    select_indexes = set()
-    if permutation:
-        for cand_index_set in ngram_indexes:
-            if len(select_indexes) >= num_to_predict:
-                break
-            if not cand_index_set:
-                continue
-            # Note(mingdachen):
-            # Skip current piece if they are covered in lm masking or previous ngrams.
-            for index_set in cand_index_set[0]:
-                for index in index_set:
-                    if index in covered_indexes or index in select_indexes:
-                        continue
-
-            n = np.random.choice(
-                ngrams[: len(cand_index_set)],
-                p=pvals[: len(cand_index_set)] / pvals[: len(cand_index_set)].sum(keepdims=True),
-            )
-            index_set = sum(cand_index_set[n - 1], [])
-            n -= 1
-
-            while len(select_indexes) + len(index_set) > num_to_predict:
-                if n == 0:
-                    break
-                index_set = sum(cand_index_set[n - 1], [])
-                n -= 1
-            # If adding a whole-word mask would exceed the maximum number of
-            # predictions, then just skip this candidate.
-            if len(select_indexes) + len(index_set) > num_to_predict:
-                continue
-            is_any_index_covered = False
-            for index in index_set:
-                if index in covered_indexes or index in select_indexes:
-                    is_any_index_covered = True
-                    break
-            if is_any_index_covered:
-                continue
-            for index in index_set:
-                select_indexes.add(index)
-        assert len(select_indexes) <= num_to_predict
-
-        select_indexes = sorted(select_indexes)
-        permute_indexes = list(select_indexes)
-        np_rng.shuffle(permute_indexes)
-        orig_token = list(output_tokens)
-
-        for src_i, tgt_i in zip(select_indexes, permute_indexes):
-            output_tokens[src_i] = orig_token[tgt_i]
-            masked_lms.append(MaskedLmInstance(index=src_i, label=orig_token[src_i]))
-
-    masked_lms = sorted(masked_lms, key=lambda x: x.index)
-    # Sort the spans by the index of the first span
-    masked_spans = sorted(masked_spans, key=lambda x: x.index[0])
-
-    for p in masked_lms:
-        masked_lm_positions.append(p.index)
-        masked_lm_labels.append(p.label)
-    return (output_tokens, masked_lm_positions, masked_lm_labels, token_boundary, masked_spans)
+    return (output_tokens.tolist(), masked_lm_positions, masked_lm_labels, token_boundary, masked_spans)
 
 
 def create_extreme_masked_lm_predictions(
@@ -408,102 +377,50 @@ def create_extreme_masked_lm_predictions(
 ):
     """Creates the predictions for the extreme span-masking UL2 objective.
     Note: Tokens here are vocab ids and not text tokens."""
-    output_tokens = list(tokens)
-
-    masked_lm_positions = []
-    masked_lm_labels = []
+    tokens_np = np.asarray(tokens, dtype=np.int64)
+    num_tokens = len(tokens_np)
 
-    num_to_predict = min(max_predictions_per_seq, max(1, int(round(len(tokens) * masked_lm_prob))))
+    num_to_predict = min(max_predictions_per_seq, max(1, int(round(num_tokens * masked_lm_prob))))
     # If the number of tokens to predict is less than the min ngram size, clam it to max predictions.
     min_ngram_size = int(min(num_to_predict, min_ngram_size))
 
-    ngrams = np.arange(min_ngram_size, max_ngram_size + 1, dtype=np.int64)
-    if span_length_distribution == "uniform":
-        pvals = np.array([1.0 / (max_ngram_size - min_ngram_size + 1)] * (max_ngram_size - min_ngram_size + 1))
-
-    ngram_indexes = []
-    cand_indexes = [[i] for i in range(len(tokens))]
-    for idx in range(len(cand_indexes)):
-        ngram_index = []
-        for n in ngrams:
-            ngram_index.append(cand_indexes[idx : idx + n])
-        ngram_indexes.append(ngram_index)
-
-    np_rng.shuffle(ngram_indexes)
-
-    (masked_lms, masked_spans) = ([], [])
-    covered_indexes = set()
-    for cand_index_set in ngram_indexes:
-        if len(masked_lms) >= num_to_predict:
-            break
-        if not cand_index_set:
-            continue
-        # Note(mingdachen):
-        # Skip current piece if they are covered in lm masking or previous ngrams.
-        for index_set in cand_index_set[0]:
-            for index in index_set:
-                if index in covered_indexes:
-                    continue
-
-        if span_length_distribution == LengthDistribution.uniform:
-            n = np_rng.choice(
-                ngrams[: len(cand_index_set)],
-                p=pvals[: len(cand_index_set)] / pvals[: len(cand_index_set)].sum(keepdims=True),
-            )
-        elif span_length_distribution == LengthDistribution.geometric:
-            # Sampling "n" from the geometric distribution and clipping it to
-            # the max_ngrams. Using p=0.2 default from the SpanBERT paper
-            # https://arxiv.org/pdf/1907.10529.pdf (Sec 3.1)
-
-            # The expectation of a geometric distribution is E[X] = 1 / p
-            p = 1 / mean_ngram_size if mean_ngram_size is not None else 0.2
-            n = np_rng.geometric(p)
-            n = int(np.clip(n, min_ngram_size, max_ngram_size))
-        elif span_length_distribution == LengthDistribution.truncated_normal:
-            # Sampling "n" from a truncated normal distribution.
-            mu = mean_ngram_size if mean_ngram_size is not None else (max_ngram_size - min_ngram_size) // 2
-            n = int(np.clip(np_rng.normal(loc=mu, scale=np.sqrt(mu)), min_ngram_size, max_ngram_size))
-
-        index_set = sum(cand_index_set[n - min_ngram_size], [])
-        n -= 1
-        # Note(mingdachen):
-        # Repeatedly looking for a candidate that does not exceed the
-        # maximum number of predictions by trying shorter ngrams.
-        while len(masked_lms) + len(index_set) > num_to_predict:
-            if n < min_ngram_size:
-                break
-            index_set = sum(cand_index_set[n - min_ngram_size], [])
-            n -= 1
-
-        # If adding a whole-word mask would exceed the maximum number of
-        # predictions, then just skip this candidate.
-        if len(masked_lms) + len(index_set) > num_to_predict:
-            continue
-        is_any_index_covered = False
-        for index in index_set:
-            if index in covered_indexes:
-                is_any_index_covered = True
-                break
-        if is_any_index_covered:
-            continue
-        for index in index_set:
-            covered_indexes.add(index)
-            output_tokens[index] = mask_id
-            masked_lms.append(MaskedLmInstance(index=index, label=tokens[index]))
-
-        masked_spans.append(MaskedLmInstance(index=index_set, label=[tokens[index] for index in index_set]))
+    if span_length_distribution == LengthDistribution.uniform:
+        span_lengths = np_rng.randint(min_ngram_size, max_ngram_size + 1, size=num_tokens)
+    elif span_length_distribution == LengthDistribution.geometric:
+        # Sampling "n" from the geometric distribution and clipping it to
+        # the max_ngrams. Using p=0.2 default from the SpanBERT paper
+        # https://arxiv.org/pdf/1907.10529.pdf (Sec 3.1)
+
+        # The expectation of a geometric distribution is E[X] = 1 / p
+        p = 1 / mean_ngram_size if mean_ngram_size is not None else 0.2
+        span_lengths = np.clip(np_rng.geometric(p, size=num_tokens), min_ngram_size, max_ngram_size)
+    elif span_length_distribution == LengthDistribution.truncated_normal:
+        # Sampling "n" from a truncated normal distribution.
+        mu = mean_ngram_size if mean_ngram_size is not None else (max_ngram_size - min_ngram_size) // 2
+        span_lengths = np_rng.normal(loc=mu, scale=np.sqrt(mu), size=num_tokens)
+        span_lengths = np.clip(span_lengths, min_ngram_size, max_ngram_size).astype(np.int64)
+    else:
+        raise ValueError(f"Invalid span length distribution: {span_length_distribution}")
+
+    # Every token is a masking candidate.
+    spans = _select_spans(
+        np.arange(num_tokens + 1),
+        span_lengths,
+        np_rng.permutation(num_tokens),
+        num_to_predict,
+        np.zeros(num_tokens, dtype=bool),
+        min_span=min_ngram_size,
+    )
 
-    assert len(masked_lms) <= num_to_predict
-    np_rng.shuffle(ngram_indexes)
+    masked_spans = [np.arange(start, end) for start, end in sorted(spans)]
+    masked_index = np.concatenate(masked_spans) if masked_spans else np.zeros(0, dtype=np.int64)
+    assert len(masked_index) <= num_to_predict
 
-    masked_lms = sorted(masked_lms, key=lambda x: x.index)
-    # Sort the spans by the index of the first span
-    masked_spans = sorted(masked_spans, key=lambda x: x.index[0])
+    output_tokens = tokens_np.copy()
+    output_tokens[masked_index] = mask_id
+    masked_spans = [MaskedLmInstance(index=span.tolist(), label=tokens_np[span].tolist()) for span in masked_spans]
 
-    for p in masked_lms:
-        masked_lm_positions.append(p.index)
-        masked_lm_labels.append(p.label)
-    return (output_tokens, masked_lm_positions, masked_lm_labels, masked_spans)
+    return (output_tokens.tolist(), masked_index.tolist(), tokens_np[masked_index].tolist(), masked_spans)
 
 
 def pad_and_convert_to_numpy(tokens, tokentypes, masked_positions, masked_labels, pad_id, max_seq_length):
@@ -14,6 +14,8 @@
 
 """GPT style dataset."""
 
+import hashlib
+import json
 import os
 import time
 
@@ -26,6 +28,7 @@ from nemo.collections.nlp.data.language_modeling.megatron.base_dataset_utils imp
     get_train_valid_test_split_,
 )
 from nemo.collections.nlp.data.language_modeling.megatron.blendable_dataset import BlendableDataset
+from nemo.collections.nlp.data.language_modeling.megatron.index_cache import IndexCache
 from nemo.collections.nlp.data.language_modeling.megatron.indexed_dataset import deallocate_indexed_dataset_memory
 from nemo.collections.nlp.data.language_modeling.megatron.indexed_dataset import make_dataset as make_indexed_dataset
 from nemo.core import Dataset
@@ -70,13 +73,44 @@ def build_dataset(cfg, trainer, data_prefix, data_impl, num_samples, seq_length,
         return _build_dataset(data_prefix[0], num_samples)
 
     else:
+        data_prefix = _apply_blend_epoch_weights(cfg, data_prefix)
         output = get_datasets_weights_and_num_samples(data_prefix, num_samples)
         prefixes, weights, datasets_num_samples = output
         datasets = []
         for i in range(len(prefixes)):
             dataset = _build_dataset(prefixes[i], datasets_num_samples[i])
             datasets.append(dataset)
-        return BlendableDataset(datasets, weights, num_samples)
+        return _build_blendable_dataset(cfg, datasets, weights, num_samples)
+
+
+def _apply_blend_epoch_weights(cfg, data_prefix):
+    """
+    When `cfg.data.blend_epoch_weights` reweights the blended datasets over time, replaces the weights in
+    `data_prefix` by the average weight of every dataset, so each dataset is built with enough samples.
+    """
+    epoch_weights = cfg.data.get('blend_epoch_weights', None)
+    if epoch_weights is None:
+        return data_prefix
+    epoch_weights = np.array([list(weights) for weights in epoch_weights], dtype=np.float64)
+    assert epoch_weights.shape[1] == len(data_prefix) // 2, "blend_epoch_weights needs a weight per data prefix"
+    mean_weights = (epoch_weights / epoch_weights.sum(axis=1, keepdims=True)).mean(axis=0)
+    data_prefix = list(data_prefix)
+    for i, weight in enumerate(mean_weights):
+        data_prefix[2 * i] = float(weight)
+    return data_prefix
+
+
+def _build_blendable_dataset(cfg, datasets, weights, num_samples):
+    epoch_weights = cfg.data.get('blend_epoch_weights', None)
+    if epoch_weights is not None:
+        weights = [list(epoch) for epoch in epoch_weights]
+    return BlendableDataset(
+        datasets,
+        weights,
+        num_samples,
+        index_cache_dir=cfg.data.get('index_cache_dir', None),
+        index_cache_timeout=cfg.data.get('index_cache_timeout', 7200),
+    )
 
 
 def build_train_valid_test_datasets(
@@ -155,6 +189,7 @@ def build_train_valid_test_datasets(
 
         # Blending dataset.
         # Parse the values.
+        data_prefix = _apply_blend_epoch_weights(cfg, data_prefix)
         output = get_datasets_weights_and_num_samples(data_prefix, train_valid_test_num_samples)
         prefixes, weights, datasets_train_valid_test_num_samples = output
 
@@ -187,13 +222,13 @@ def build_train_valid_test_datasets(
         # Blend.
         blending_train_dataset = None
         if train_datasets:
-            blending_train_dataset = BlendableDataset(train_datasets, weights, train_n)
+            blending_train_dataset = _build_blendable_dataset(cfg, train_datasets, weights, train_n)
         blending_valid_dataset = None
         if valid_datasets:
-            blending_valid_dataset = BlendableDataset(valid_datasets, weights, valid_n)
+            blending_valid_dataset = _build_blendable_dataset(cfg, valid_datasets, weights, valid_n)
         blending_test_dataset = None
         if test_datasets:
-            blending_test_dataset = BlendableDataset(test_datasets, weights, test_n)
+            blending_test_dataset = _build_blendable_dataset(cfg, test_datasets, weights, test_n)
 
         return (blending_train_dataset, blending_valid_dataset, blending_test_dataset)
 
@@ -314,6 +349,8 @@ class GPTDataset(Dataset):
 
         # save index mappings to a configurable dir
         self.index_mapping_dir = cfg.data.get('index_mapping_dir', None)
+        # content-addressed index mapping cache shared across splits, runs and jobs
+        self.index_cache_dir = cfg.data.get('index_cache_dir', None)
 
         # create index_mapping_dir on rank 0
         if torch.distributed.is_available() and torch.distributed.is_initialized():
@@ -323,20 +360,57 @@ class GPTDataset(Dataset):
             torch.distributed.barrier()
 
         # Build index mappings.
-        self.doc_idx, self.sample_idx, self.shuffle_idx = _build_index_mappings(
-            self.name,
-            data_prefix,
-            documents,
-            self.indexed_dataset.sizes,
-            num_samples,
-            seq_length,
-            seed,
-            index_mapping_dir=self.index_mapping_dir,
-            drop_last=drop_last,
-            add_extra_token=self.add_extra_token,
-        )
+        self.index_cache = None
+        if self.index_cache_dir is not None:
+            # the mappings are built by a single rank and loaded lazily by the others on first access
+            self.index_cache = IndexMappingCache(
+                self.index_cache_dir,
+                data_prefix,
+                documents,
+                self.indexed_dataset.sizes,
+                num_samples,
+                seq_length,
+                seed,
+                drop_last=drop_last,
+                add_extra_token=self.add_extra_token,
+                timeout=cfg.data.get('index_cache_timeout', 7200),
+            )
+            self.index_cache.build_if_needed()
+            self._doc_idx, self._sample_idx, self._shuffle_idx = None, None, None
+        else:
+            self._doc_idx, self._sample_idx, self._shuffle_idx = _build_index_mappings(
+                self.name,
+                data_prefix,
+                documents,
+                self.indexed_dataset.sizes,
+                num_samples,
+                seq_length,
+                seed,
+                index_mapping_dir=self.index_mapping_dir,
+                drop_last=drop_last,
+                add_extra_token=self.add_extra_token,
+            )
         deallocate_indexed_dataset_memory(self.indexed_dataset)
 
+    def _load_index_mappings(self):
+        if self._sample_idx is None:
+            self._doc_idx, self._sample_idx, self._shuffle_idx = self.index_cache.load()
+
+    @property
+    def doc_idx(self):
+        self._load_index_mappings()
+        return self._doc_idx
+
+    @property
+    def sample_idx(self):
+        self._load_index_mappings()
+        return self._sample_idx
+
+    @property
+    def shuffle_idx(self):
+        self._load_index_mappings()
+        return self._shuffle_idx
+
     def __len__(self):
         # -1 is due to data structure used to retieve the index:
         #    sample i --> [sample_idx[i], sample_idx[i+1])
@@ -457,6 +531,96 @@ def _create_ltor_masks_and_position_ids(
     return attention_mask, loss_mask, position_ids
 
 
+class IndexMappingCache(IndexCache):
+    """
+    Content-addressed cache of the index mappings (doc-idx, sample-idx and shuffle-idx) of GPT-style datasets.
+
+    The mappings are stored in `cache_dir` under a key that hashes everything they depend on: the indices and the
+    sizes of the documents (read from the .idx file), the number of samples, the sequence length, the seed and the
+    sample construction flags. The doc-idx stores document indices, so splits with different documents never share
+    the mappings, while runs and jobs with the same content share them regardless of the data file names.
+
+    The mappings of different datasets (train/validation/test splits and blended data prefixes) are built
+    concurrently on different ranks, see IndexCache. The C++ helpers are compiled once beforehand, on global
+    rank 0.
+
+    Args:
+        cache_dir (str): Directory of the cache.
+        data_prefix (str): Prefix of the data files, used only to make the file names readable.
+        documents (np.ndarray): Indices of the documents in the dataset.
+        sizes (np.ndarray): Number of tokens of every document of the indexed dataset.
+        num_samples (int): Number of samples.
+        seq_length (int): Sequence length.
+        seed (int): Random seed of the shuffles.
+        drop_last (bool): Drop the last incomplete sample.
+        add_extra_token (int): Number of extra tokens fetched for each sample.
+        timeout (float): Maximum number of seconds to wait for the builder rank.
+    """
+
+    version = 1
+    description = 'index mappings'
+    array_names = ['doc_idx', 'sample_idx', 'shuffle_idx']
+    requires_helpers = True
+
+    def __init__(
+        self,
+        cache_dir: str,
+        data_prefix: str,
+        documents: np.ndarray,
+        sizes: np.ndarray,
+        num_samples: int,
+        seq_length: int,
+        seed: int,
+        drop_last: bool = True,
+        add_extra_token: int = 1,
+        timeout: float = 7200,
+    ):
+        self.documents = documents
+        self.sizes = sizes
+        self.num_samples = num_samples
+        self.seq_length = seq_length
+        self.seed = seed
+        self.drop_last = drop_last
+        self.add_extra_token = add_extra_token
+
+        md5 = hashlib.md5()
+        md5.update(np.ascontiguousarray(documents, dtype=np.int64).tobytes())
+        md5.update(np.ascontiguousarray(sizes[documents], dtype=np.int32).tobytes())
+        config = [self.version, int(num_samples), int(seq_length), int(seed), bool(drop_last), int(add_extra_token)]
+        md5.update(json.dumps(config).encode('utf-8'))
+        name = '{}_indexmap'.format(os.path.basename(data_prefix))
+        super().__init__(cache_dir, name, md5.hexdigest(), timeout=timeout)
+
+    def _build_arrays(self):
+        return _build_index_mapping_arrays(
+            self.documents,
+            self.sizes,
+            self.num_samples,
+            self.seq_length,
+            self.seed,
+            drop_last=self.drop_last,
+            add_extra_token=self.add_extra_token,
+        )
+
+    def _meta(self, arrays):
+        return {
+            'num_samples': int(self.num_samples),
+            'seq_length': int(self.seq_length),
+            'seed': int(self.seed),
+            'total_samples': int(arrays[1].shape[0] - 1),
+        }
+
+    def build_if_needed(self):
+        super().build_if_needed()
+        # the document sizes are not needed anymore
+        self.documents, self.sizes = None, None
+
+    def load(self):
+        doc_idx, sample_idx, shuffle_idx = super().load()
+        logging.info('    total number of samples: {}'.format(sample_idx.shape[0]))
+        return doc_idx, sample_idx, shuffle_idx
+
+
 def _build_index_mappings(
     name,
     data_prefix,
@@ -478,8 +642,6 @@ def _build_index_mappings(
     # Number of tokens in each epoch and number of required epochs.
     tokens_per_epoch = _num_tokens(documents, sizes)
     num_epochs = _num_epochs(tokens_per_epoch, seq_length, num_samples, add_extra_token)
-    # rng state
-    np_rng = np.random.RandomState(seed=seed)
 
     # Filename of the index mappings.
     if index_mapping_dir is not None:
@@ -503,94 +665,15 @@ def _build_index_mappings(
         ):
 
             logging.info(' > WARNING: could not find index map files, building ' 'the indices on rank 0 ...')
+            from nemo.collections.nlp.data.language_modeling.megatron.dataset_utils import compile_helper
 
-            # For the last epoch, decide whether include the entire epoch
-            # in the global shuffle or not.
-
-            # If we need only one epoch, then separating last epoch  does
-            # not mean anything.
-            if num_epochs == 1:
-                separate_last_epoch = False
-                print(' > only one epoch required, setting ' 'separate_last_epoch to False', flush=True)
-
-            else:
-                # Get the number of samples for the last epoch
-                num_samples_from_epochs_minus_one = (
-                    (num_epochs - 1) * tokens_per_epoch - add_extra_token
-                ) // seq_length
-                last_epoch_num_samples = num_samples - num_samples_from_epochs_minus_one
-                assert last_epoch_num_samples >= 0, 'last epoch number of samples should be non-negative.'
-                num_samples_per_epoch = (tokens_per_epoch - add_extra_token) // seq_length
-                assert last_epoch_num_samples < (
-                    num_samples_per_epoch + 1
-                ), 'last epoch number of samples exceeded max value.'
-                # If we have less than 80% of the samples for the last epoch,
-                # seperate out the epoch and treat it differently.
-                # Note: the 80% number is just based on common sense and can
-                # be adjusted if needed.
-                separate_last_epoch = last_epoch_num_samples < int(0.80 * num_samples_per_epoch)
-                if separate_last_epoch:
-                    string = (
-                        ' > last epoch number of samples ({}) is smaller '
-                        'than 80% of number of samples per epoch ({}), '
-                        'setting separate_last_epoch to True'
-                    )
-                else:
-                    string = (
-                        ' > last epoch number of samples ({}) is larger '
-                        'than 80% of number of samples per epoch ({}), '
-                        'setting separate_last_epoch to False'
-                    )
-                print(string.format(last_epoch_num_samples, num_samples_per_epoch), flush=True)
-
-            # doc-idx.
-            start_time = time.time()
-            doc_idx = _build_doc_idx(documents, num_epochs, np_rng, separate_last_epoch)
-            np.save(doc_idx_filename, doc_idx, allow_pickle=True)
-            logging.info(
-                ' > elasped time to build and save doc-idx mapping '
-                '(seconds): {:4f}'.format(time.time() - start_time)
-            )
-            # sample-idx.
-            start_time = time.time()
-            # Use C++ implementation for speed.
-            # First compile and then import.
-            assert doc_idx.dtype == np.int32
-            assert sizes.dtype == np.int32
-            try:
-                from nemo.collections.nlp.data.language_modeling.megatron.dataset_utils import compile_helper
-
-                compile_helper()
-                from nemo.collections.nlp.data.language_modeling.megatron import helpers
-            except ImportError:
-                raise ImportError(
-                    f'Could not compile megatron dataset C++ helper functions and therefore cannot import helpers python file.'
-                )
-
-            sample_idx = helpers.build_sample_idx(
-                sizes, doc_idx, seq_length, num_epochs, tokens_per_epoch, drop_last, add_extra_token
+            compile_helper()
+            doc_idx, sample_idx, shuffle_idx = _build_index_mapping_arrays(
+                documents, sizes, num_samples, seq_length, seed, drop_last=drop_last, add_extra_token=add_extra_token
             )
-            # sample_idx = _build_sample_idx(sizes, doc_idx, seq_length,
-            #                              num_epochs, tokens_per_epoch, drop_last, add_extra_token)
+            np.save(doc_idx_filename, doc_idx, allow_pickle=True)
             np.save(sample_idx_filename, sample_idx, allow_pickle=True)
-            logging.info(
-                ' > elasped time to build and save sample-idx mapping '
-                '(seconds): {:4f}'.format(time.time() - start_time)
-            )
-            # shuffle-idx.
-            start_time = time.time()
-            # -1 is due to data structure used to retieve the index:
-            #    sample i --> [sample_idx[i], sample_idx[i+1])
-            if separate_last_epoch:
-                num_samples_ = num_samples_from_epochs_minus_one
-            else:
-                num_samples_ = sample_idx.shape[0] - 1
-            shuffle_idx = _build_shuffle_idx(num_samples_, sample_idx.shape[0] - 1, np_rng)
             np.save(shuffle_idx_filename, shuffle_idx, allow_pickle=True)
-            logging.info(
-                ' > elasped time to build and save shuffle-idx mapping'
-                ' (seconds): {:4f}'.format(time.time() - start_time)
-            )
 
     torch.distributed.barrier()
     counts = torch.cuda.LongTensor([1])
@@ -616,6 +699,87 @@ def _build_index_mappings(
     return doc_idx, sample_idx, shuffle_idx
 
 
+def _build_index_mapping_arrays(
+    documents, sizes, num_samples, seq_length, seed, drop_last: bool = True, add_extra_token: int = 1,
+):
+    """Build doc-idx, sample-idx, and shuffle-idx in memory (see `_build_index_mappings`)."""
+    # Number of tokens in each epoch and number of required epochs.
+    tokens_per_epoch = _num_tokens(documents, sizes)
+    num_epochs = _num_epochs(tokens_per_epoch, seq_length, num_samples, add_extra_token)
+    # rng state
+    np_rng = np.random.RandomState(seed=seed)
+
+    # For the last epoch, decide whether include the entire epoch
+    # in the global shuffle or not.
+
+    # If we need only one epoch, then separating last epoch  does
+    # not mean anything.
+    if num_epochs == 1:
+        separate_last_epoch = False
+        print(' > only one epoch required, setting ' 'separate_last_epoch to False', flush=True)
+
+    else:
+        # Get the number of samples for the last epoch
+        num_samples_from_epochs_minus_one = ((num_epochs - 1) * tokens_per_epoch - add_extra_token) // seq_length
+        last_epoch_num_samples = num_samples - num_samples_from_epochs_minus_one
+        assert last_epoch_num_samples >= 0, 'last epoch number of samples should be non-negative.'
+        num_samples_per_epoch = (tokens_per_epoch - add_extra_token) // seq_length
+        assert last_epoch_num_samples < (num_samples_per_epoch + 1), 'last epoch number of samples exceeded max value.'
+        # If we have less than 80% of the samples for the last epoch,
+        # seperate out the epoch and treat it differently.
+        # Note: the 80% number is just based on common sense and can
+        # be adjusted if needed.
+        separate_last_epoch = last_epoch_num_samples < int(0.80 * num_samples_per_epoch)
+        if separate_last_epoch:
+            string = (
+                ' > last epoch number of samples ({}) is smaller '
+                'than 80% of number of samples per epoch ({}), '
+                'setting separate_last_epoch to True'
+            )
+        else:
+            string = (
+                ' > last epoch number of samples ({}) is larger '
+                'than 80% of number of samples per epoch ({}), '
+                'setting separate_last_epoch to False'
+            )
+        print(string.format(last_epoch_num_samples, num_samples_per_epoch), flush=True)
+
+    # doc-idx.
+    start_time = time.time()
+    doc_idx = _build_doc_idx(documents, num_epochs, np_rng, separate_last_epoch)
+    logging.info(' > elasped time to build doc-idx mapping ' '(seconds): {:4f}'.format(time.time() - start_time))
+    # sample-idx.
+    start_time = time.time()
+    # Use C++ implementation for speed.
+    # The helpers are compiled by the caller on a single process.
+    assert doc_idx.dtype == np.int32
+    assert sizes.dtype == np.int32
+    try:
+        from nemo.collections.nlp.data.language_modeling.megatron import helpers
+    except ImportError:
+        raise ImportError(
+            f'Could not compile megatron dataset C++ helper functions and therefore cannot import helpers python file.'
+        )
+
+    sample_idx = helpers.build_sample_idx(
+        sizes, doc_idx, seq_length, num_epochs, tokens_per_epoch, drop_last, add_extra_token
+    )
+    # sample_idx = _build_sample_idx(sizes, doc_idx, seq_length,
+    #                              num_epochs, tokens_per_epoch, drop_last, add_extra_token)
+    logging.info(' > elasped time to build sample-idx mapping ' '(seconds): {:4f}'.format(time.time() - start_time))
+    # shuffle-idx.
+    start_time = time.time()
+    # -1 is due to data structure used to retieve the index:
+    #    sample i --> [sample_idx[i], sample_idx[i+1])
+    if separate_last_epoch:
+        num_samples_ = num_samples_from_epochs_minus_one
+    else:
+        num_samples_ = sample_idx.shape[0] - 1
+    shuffle_idx = _build_shuffle_idx(num_samples_, sample_idx.shape[0] - 1, np_rng)
+    logging.info(' > elasped time to build shuffle-idx mapping' ' (seconds): {:4f}'.format(time.time() - start_time))
+    return doc_idx, sample_idx, shuffle_idx
+
+
 def _num_tokens(documents, sizes):
     """Total number of tokens in the dataset."""
     return np.sum(sizes[documents])
@@ -366,12 +366,7 @@ class GPTPromptLearningDataset(Dataset):
         batch_loss_masks = []
         padded_input_ids = []
         for ids, answer_start_idx in zip(input_ids, answer_starts):
-            if answer_start_idx is not None:
-                # Loss mask where answer tokens are 1.0 and all other tokens are 0.0
-                loss_mask = [float(idx >= answer_start_idx) for idx in range(len(ids))]
-            else:
-                # Loss mask where virtual tokens are 0.0 and all other tokens are 1.0
-                loss_mask = [float(token_id not in self.pseudo_token_ids) for token_id in ids]
+            loss_mask = self._build_loss_mask(ids, answer_start_idx)
 
             # Pad to max length
             input_length = len(ids)
@@ -390,6 +385,82 @@ class GPTPromptLearningDataset(Dataset):
 
         return padded_input_ids, batch_loss_masks
 
+    def _build_loss_mask(self, ids, answer_start_idx):
+        """ Builds the loss mask of a single unpadded example """
+        if answer_start_idx is not None:
+            # Loss mask where answer tokens are 1.0 and all other tokens are 0.0
+            return [float(idx >= answer_start_idx) for idx in range(len(ids))]
+        # Loss mask where virtual tokens are 0.0 and all other tokens are 1.0
+        return [float(token_id not in self.pseudo_token_ids) for token_id in ids]
+
+    def packed_length(self, example):
+        """ Number of tokens an example occupies in a packed sequence, labels are shifted within each example """
+        return len(example[1]) - 1
+
+    def packing_group(self, example):
+        """ Only examples of the same task are packed together, the virtual prompt is looked up per sequence """
+        taskname_id = example[0]
+        return tuple(taskname_id) if isinstance(taskname_id, list) else taskname_id
+
+    def packed_collate_fn(self, batch, tp_workers=0, return_cu_seqlens=False):
+        """
+        Prepares input_ids, labels, loss mask, attention_mask, and position ids for a global batch of packed
+        sequences, see PackedSequenceDataset. Every element of ``batch`` is a list of examples of the same task.
+        Labels and loss masks are shifted within each example, position ids restart at every example and the
+        attention mask is causal within every example and blocks attention across examples.
+
+        Args:
+            batch: list of packed sequences, every packed sequence being a list of examples
+            tp_workers: pads the sequence length to a multiple of this number, needed for sequence parallel
+            return_cu_seqlens: additionally return the cumulative sequence lengths of the examples (and the
+                padding of every row) over the flattened batch, as used by variable-length attention kernels
+        """
+        taskname_ids = [examples[0][0] for examples in batch]
+        if self.virtual_prompt_source == VirtualPromptSource.PROMPT_ENCODER:
+            max_taskname_length = max(len(ids) for ids in taskname_ids)
+            taskname_ids = [ids + [self.pad_token_id] * (max_taskname_length - len(ids)) for ids in taskname_ids]
+        taskname_ids = torch.tensor(taskname_ids)
+
+        batch_max = max(sum(self.packed_length(example) for example in examples) for examples in batch)
+        if tp_workers > 1:
+            batch_max += (tp_workers - batch_max % tp_workers) % tp_workers
+
+        batch_size = len(batch)
+        input_ids = torch.full((batch_size, batch_max), self.pad_token_id, dtype=torch.long)
+        labels = torch.full((batch_size, batch_max), self.pad_token_id, dtype=torch.long)
+        loss_mask = torch.zeros((batch_size, batch_max), dtype=torch.float)
+        position_ids = torch.zeros((batch_size, batch_max), dtype=torch.long)
+        # Every example gets its own segment id, padding is a segment of its own
+        segment_ids = torch.full((batch_size, batch_max), -1, dtype=torch.long)
+        seqlens = []
+
+        for row, examples in enumerate(batch):
+            offset = 0
+            for segment, (_, ids, answer_start_idx) in enumerate(examples):
+                length = len(ids) - 1
+                example_loss_mask = self._build_loss_mask(ids, answer_start_idx)
+                input_ids[row, offset : offset + length] = torch.tensor(ids[:-1], dtype=torch.long)
+                labels[row, offset : offset + length] = torch.tensor(ids[1:], dtype=torch.long)
+                loss_mask[row, offset : offset + length] = torch.tensor(example_loss_mask[1:], dtype=torch.float)
+                position_ids[row, offset : offset + length] = torch.arange(length)
+                segment_ids[row, offset : offset + length] = segment
+                seqlens.append(length)
+                offset += length
+            if offset < batch_max:
+                seqlens.append(batch_max - offset)
+
+        causal_mask = torch.tril(torch.ones((batch_max, batch_max), dtype=torch.bool))
+        same_segment = segment_ids[:, :, None] == segment_ids[:, None, :]
+        # True marks positions that must not be attended to
+        attention_mask = ~(same_segment & causal_mask).view(batch_size, 1, batch_max, batch_max)
+
+        if return_cu_seqlens:
+            cu_seqlens = torch.zeros(len(seqlens) + 1, dtype=torch.int32)
+            cu_seqlens[1:] = torch.cumsum(torch.tensor(seqlens, dtype=torch.int32), dim=0)
+            return input_ids, labels, loss_mask, position_ids, attention_mask, taskname_ids, cu_seqlens
+
+        return input_ids, labels, loss_mask, position_ids, attention_mask, taskname_ids
+
     def inference_collate_fn(self, batch):
         """
         Used for loading inference data. 
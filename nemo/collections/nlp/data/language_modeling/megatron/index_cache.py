@@ -0,0 +1,154 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cache of dataset indices shared by all ranks, dataloader workers and jobs."""
+
+import json
+import os
+import time
+from typing import Tuple
+
+import numpy as np
+import torch
+
+from nemo.utils import logging
+from nemo.utils.get_rank import is_global_rank_zero
+
+_HELPERS_COMPILED = False
+
+
+def compile_helpers_once():
+    """
+    Compiles the C++ dataset helpers on global rank 0 while the other ranks wait at a barrier.
+    Must be called on all ranks, only the first call of a process compiles.
+    """
+    global _HELPERS_COMPILED
+    if _HELPERS_COMPILED:
+        return
+    if is_global_rank_zero():
+        from nemo.collections.nlp.data.language_modeling.megatron.dataset_utils import compile_helper
+
+        compile_helper()
+    if torch.distributed.is_available() and torch.distributed.is_initialized():
+        torch.distributed.barrier()
+    _HELPERS_COMPILED = True
+
+
+class IndexCache(object):
+    """
+    Base class of the caches of dataset indices.
+
+    The indices are stored in `cache_dir` under a key that hashes everything they depend on. Each set of indices
+    is built by a single rank, chosen from the key, so the indices of different datasets are built concurrently
+    on different ranks. The other ranks load them with mmap on first access, waiting until the builder rank has
+    published them. Files are written under temporary names and renamed, the meta file last, so partially
+    written indices are never loaded, even when several jobs share the cache.
+
+    Subclasses compute the key, and build and describe the arrays listed in `array_names`.
+
+    Args:
+        cache_dir (str): Directory of the cache.
+        name (str): Prefix of the file names, used only to make them readable.
+        key (str): Hash of everything the indices depend on.
+        timeout (float): Maximum number of seconds to wait for the builder rank.
+    """
+
+    # name of the indices in log messages
+    description = 'indices'
+    # names of the cached arrays, in the order they are built and loaded
+    array_names = []
+    # whether building the arrays needs the C++ dataset helpers
+    requires_helpers = False
+
+    def __init__(self, cache_dir: str, name: str, key: str, timeout: float = 7200):
+        self.cache_dir = cache_dir
+        self.key = key
+        self.prefix = os.path.join(cache_dir, '{}_{}'.format(name, key))
+        self.timeout = timeout
+
+    def _filename(self, name: str) -> str:
+        return '{}_{}'.format(self.prefix, name)
+
+    def _build_arrays(self) -> Tuple[np.ndarray, ...]:
+        """Build the arrays listed in `array_names`."""
+        raise NotImplementedError
+
+    def _meta(self, arrays: Tuple[np.ndarray, ...]) -> dict:
+        """Description of the arrays written to the meta file."""
+        return {}
+
+    def exists(self) -> bool:
+        # the meta file is published last
+        return os.path.isfile(self._filename('meta.json'))
+
+    def builder_rank(self) -> int:
+        if not (torch.distributed.is_available() and torch.distributed.is_initialized()):
+            return 0
+        return int(self.key[:8], 16) % torch.distributed.get_world_size()
+
+    def build_if_needed(self):
+        """Build the indices on the builder rank if they are not in the cache yet. Must be called on all ranks."""
+        if self.requires_helpers:
+            # builder ranks of different caches must not compile the helpers concurrently
+            compile_helpers_once()
+        rank = torch.distributed.get_rank() if torch.distributed.is_initialized() else 0
+        if self.exists():
+            logging.info(' > found {} in cache: {}'.format(self.description, self.prefix))
+        elif rank == self.builder_rank():
+            self.build()
+
+    def build(self):
+        """Build the indices and publish them in the cache. The C++ helpers must be compiled if required."""
+        logging.info(' > building {} on rank {}: {}'.format(self.description, self.builder_rank(), self.prefix))
+        os.makedirs(self.cache_dir, exist_ok=True)
+        start_time = time.time()
+        arrays = self._build_arrays()
+        for name, array in zip(self.array_names, arrays):
+            filename = self._filename('{}.npy'.format(name))
+            tmp_filename = '{}.tmp{}'.format(filename, os.getpid())
+            with open(tmp_filename, 'wb') as f:
+                np.save(f, array, allow_pickle=True)
+            os.replace(tmp_filename, filename)
+        build_time = time.time() - start_time
+
+        meta = dict(self._meta(arrays), build_time=build_time)
+        tmp_filename = '{}.tmp{}'.format(self._filename('meta.json'), os.getpid())
+        with open(tmp_filename, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_filename, self._filename('meta.json'))
+        logging.info(' > built and saved {} in {:3.3f} seconds'.format(self.description, build_time))
+
+    def load(self) -> Tuple[np.ndarray, ...]:
+        """Wait until the indices are in the cache and load them with mmap."""
+        start_time = time.time()
+        while not self.exists():
+            if time.time() - start_time > self.timeout:
+                raise TimeoutError(
+                    'The {} were not built by rank {} in {} seconds: {}'.format(
+                        self.description, self.builder_rank(), self.timeout, self.prefix
+                    )
+                )
+            time.sleep(1)
+        with open(self._filename('meta.json'), 'r') as f:
+            meta = json.load(f)
+        arrays = tuple(
+            np.load(self._filename('{}.npy'.format(name)), allow_pickle=True, mmap_mode='r')
+            for name in self.array_names
+        )
+        logging.info(
+            ' > loaded {} from {} in {:3.3f} seconds (built in {:3.3f} seconds)'.format(
+                self.description, self.prefix, time.time() - start_time, meta['build_time']
+            )
+        )
+        return arrays
@@ -342,18 +342,16 @@ class IndexedDatasetBuilder(object):
         begin = self.data_offsets[-1]
         for offset in index.data_offsets[1:]:
             self.data_offsets.append(begin + offset)
+        begin = len(self.sizes)
         self.sizes.extend(index.sizes)
+        for doc_idx in index.doc_idx[1:]:
+            self.doc_idx.append(begin + doc_idx)
         begin = self.dim_offsets[-1]
         for dim_offset in index.dim_offsets[1:]:
             self.dim_offsets.append(begin + dim_offset)
 
         with open(data_file_path(another_file), 'rb') as f:
-            while True:
-                data = f.read(1024)
-                if data:
-                    self.out_file.write(data)
-                else:
-                    break
+            shutil.copyfileobj(f, self.out_file)
 
     def finalize(self, index_file):
         self.out_file.close()
@@ -596,8 +594,10 @@ class MMapIndexedDatasetBuilder(object):
         index = MMapIndexedDataset.Index(index_file_path(another_file))
         assert index.dtype == self._dtype
 
-        for size in index.sizes:
-            self._sizes.append(size)
+        # document boundaries of the merged file are shifted by the number of items merged so far
+        offset = len(self._sizes)
+        self._sizes.extend(index.sizes.tolist())
+        self._doc_idx.extend((offset + index.doc_idx[1:]).tolist())
 
         # Concatenate data
         with open(data_file_path(another_file), 'rb') as f:
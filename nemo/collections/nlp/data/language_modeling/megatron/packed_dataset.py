@@ -0,0 +1,149 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Sequence packing for fine-tuning datasets made of short, variable-length examples."""
+
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from nemo.core import Dataset
+from nemo.utils import logging
+
+__all__ = ['PackedSequenceDataset', 'first_fit_decreasing']
+
+
+def first_fit_decreasing(lengths: List[int], capacity: int) -> List[List[int]]:
+    """
+    Bins items with the given lengths into bins of size ``capacity`` using the first-fit-decreasing heuristic.
+
+    Args:
+        lengths: length of every item
+        capacity: maximum total length of a bin
+
+    Returns:
+        list of bins, every bin being a list of positions into ``lengths``
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    bins, space = [], []
+    for i in order:
+        if lengths[i] > capacity:
+            raise ValueError(f"Item of length {lengths[i]} does not fit into a bin of size {capacity}")
+        for b in range(len(bins)):
+            if space[b] >= lengths[i]:
+                bins[b].append(i)
+                space[b] -= lengths[i]
+                break
+        else:
+            bins.append([i])
+            space.append(capacity - lengths[i])
+    return bins
+
+
+class PackedSequenceDataset(Dataset):
+    """
+    Wraps a map-style dataset of variable-length examples and packs several examples into every
+    item so that each item holds up to ``max_seq_length`` tokens.
+
+    Examples are visited in a (seeded) shuffled order and packed with first-fit-decreasing
+    inside a sliding window of ``shuffle_buffer_size`` examples, so the packing stays close to
+    the i.i.d. order of the unpacked dataset while wasting little space on padding.
+    Only examples with the same ``group_fn`` key are packed together, e.g. examples of the same task.
+
+    The wrapped dataset is expected to provide ``packed_collate_fn(batch, **kwargs)``, which turns a list of
+    packed items (every item being a list of examples) into model inputs with per-example position ids and
+    a block-diagonal attention mask.
+
+    Args:
+        dataset: dataset to pack, ``dataset[i]`` returns a single example
+        max_seq_length: maximum number of tokens in a packed item, as measured by ``length_fn``
+        length_fn: returns the number of tokens an example occupies in a packed item
+        group_fn: returns a hashable key, only examples with equal keys are packed together
+        shuffle_buffer_size: number of examples packed together at a time
+        shuffle: whether to shuffle the examples before packing
+        seed: seed for the shuffling
+    """
+
+    def __init__(
+        self,
+        dataset: Dataset,
+        max_seq_length: int,
+        length_fn: Callable,
+        group_fn: Optional[Callable] = None,
+        shuffle_buffer_size: int = 1024,
+        shuffle: bool = True,
+        seed: int = 1234,
+    ):
+        assert max_seq_length > 0, "Max sequence length should be greater than 0"
+        assert shuffle_buffer_size > 0, "Shuffle buffer size should be greater than 0"
+
+        self.dataset = dataset
+        self.max_seq_length = max_seq_length
+        self.length_fn = length_fn
+        self.group_fn = group_fn
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.shuffle = shuffle
+        self.seed = seed
+
+        self.bins = self.pack(seed)
+
+    def pack(self, seed: int) -> List[List[int]]:
+        """ Computes the packing of the wrapped dataset, returns a list of bins of dataset indices """
+        rng = np.random.RandomState(seed=seed)
+        order = rng.permutation(len(self.dataset)) if self.shuffle else np.arange(len(self.dataset))
+
+        bins = []
+        self.num_tokens = 0
+        for start in range(0, len(order), self.shuffle_buffer_size):
+            groups = OrderedDict()
+            for idx in order[start : start + self.shuffle_buffer_size]:
+                example = self.dataset[int(idx)]
+                key = self.group_fn(example) if self.group_fn is not None else None
+                groups.setdefault(key, ([], []))
+                groups[key][0].append(int(idx))
+                groups[key][1].append(self.length_fn(example))
+
+            buffer_bins = []
+            for indices, lengths in groups.values():
+                self.num_tokens += sum(lengths)
+                for positions in first_fit_decreasing(lengths, self.max_seq_length):
+                    buffer_bins.append([indices[p] for p in positions])
+
+            # first-fit-decreasing emits the longest examples first, shuffle to not correlate order and length
+            if self.shuffle:
+                rng.shuffle(buffer_bins)
+            bins.extend(buffer_bins)
+
+        logging.info(
+            f'Packed {len(self.dataset)} examples into {len(bins)} sequences of length {self.max_seq_length}, '
+            f'packing efficiency {self.packing_efficiency(bins):.2%}'
+        )
+        return bins
+
+    def packing_efficiency(self, bins: Optional[List[List[int]]] = None) -> float:
+        """ Fraction of the packed token slots that hold real tokens instead of padding """
+        bins = self.bins if bins is None else bins
+        if len(bins) == 0:
+            return 0.0
+        return self.num_tokens / (len(bins) * self.max_seq_length)
+
+    def __len__(self):
+        return len(self.bins)
+
+    def __getitem__(self, idx):
+        return [self.dataset[i] for i in self.bins[idx]]
+
+    def collate_fn(self, batch, **kwargs):
+        return self.dataset.packed_collate_fn(batch, **kwargs)
@@ -13,11 +13,13 @@
 # limitations under the License.
 
 import datetime
+import hashlib
 import json
 import multiprocessing as mp
 import os
 import pickle
 import time
+from collections import OrderedDict
 from functools import partial
 
 import numpy as np
@@ -27,8 +29,11 @@ from nemo.core import Dataset
 from nemo.utils import logging
 
 __all__ = ['TextMemMapDataset', 'CSVMemMapDataset', 'build_index_files']
-__idx_version__ = '0.2'  # index file version
+__idx_version__ = '0.3'  # index file version
 __idx_suffix__ = 'idx'  # index file suffix
+__tok_suffix__ = 'tok'  # tokenized sample cache suffix
+# text whose token ids are part of the tokenizer fingerprint
+_TOKENIZER_PROBE_TEXT = "The quick brown fox, 1234567890 JUMPS over the lazy dog!?\t  Ünïcödé 日本語 <s></s>"
 
 
 def _build_index_from_memdata(fn, newline_int):
@@ -61,9 +66,40 @@ def _build_index_from_memdata(fn, newline_int):
     return midx
 
 
+def _get_file_stat(fn):
+    """Returns the size and modification time of a file, used to detect changed data files"""
+    stat = os.stat(fn)
+    return dict(file_size=stat.st_size, file_mtime=stat.st_mtime)
+
+
+def _is_cache_current(fn, info_fn, **expected):
+    """Returns True if the cache described by info_fn was built from the current version of fn"""
+    if not os.path.exists(info_fn):
+        return False
+    with open(info_fn, 'rb') as f:
+        info = pickle.load(f)
+    expected.update(_get_file_stat(fn))
+    return all(info.get(key) == value for key, value in expected.items())
+
+
+def _get_distributed_rank_and_world_size():
+    if torch.distributed.is_available() and torch.distributed.is_initialized():
+        return torch.distributed.get_rank(), torch.distributed.get_world_size()
+    return 0, 1
+
+
 class TextMemMapDataset(Dataset):
     """
     Allow per-line lazy access to multiple text files using numpy memmap.
+
+    Index files are built next to the data files and rebuilt only for files whose size or modification time
+    changed. Index building is split across ranks, each rank indexing its share of the files.
+
+    With ``cache_tokenized=True`` the tokenized samples of every file are stored in a sidecar
+    MMapIndexedDataset (``<file>.tok.bin/.idx``), so samples are read as token ids instead of being parsed and
+    tokenized again on every access. Sidecars are built on the first use of a file (split across ranks like
+    the index files) and rebuilt when the file or the tokenizer changes. ``lru_cache_size`` keeps the most
+    recently accessed samples of every process in memory; cached samples are shared and must not be modified.
     """
 
     def __init__(
@@ -75,13 +111,18 @@ class TextMemMapDataset(Dataset):
         tokenizer=None,
         sort_dataset_paths=True,
         build_index_fn=_build_index_from_memdata,
+        cache_tokenized=False,
+        lru_cache_size=0,
     ):
         """
         build_index_fn - a callable build_index_fn(fn, newline_int) -> midx [np.array] that returns the index of newlines in a file fn
                          must be pickleable (to be used in multiprocessing.Pool.map)
+        cache_tokenized - store the tokenized samples in sidecar MMapIndexedDataset files, requires a tokenizer
+        lru_cache_size - number of recently accessed samples kept in memory by every process (0 to disable)
         """
         super().__init__()
         self.mdata_midx_list = []
+        self.token_cache_list = None
 
         # Make a single string into a list
         if isinstance(dataset_paths, str):
@@ -96,19 +137,25 @@ class TextMemMapDataset(Dataset):
         self._files_list = dataset_paths
         self._worker = workers
         self.tokenizer = tokenizer
+        self._tokenizer_fingerprint = None
         self._sort_dataset_paths = sort_dataset_paths
+        self._lru_cache_size = lru_cache_size
+        self._lru_cache = OrderedDict()
+
+        if cache_tokenized and tokenizer is None:
+            raise ValueError("cache_tokenized requires a tokenizer")
 
         if sort_dataset_paths:
             self._files_list = sorted(self._files_list)
 
         logging.info(f"Building data files")
-        # load all files into memmap
-        is_ditributed = torch.distributed.is_available() and torch.distributed.is_initialized()
-
-        if not is_ditributed or (is_ditributed and torch.distributed.get_rank() == 0):
-            build_index_files(dataset_paths, newline_int, workers=self._worker, build_index_fn=build_index_fn)
+        # every rank indexes its share of the files, unchanged files keep their index
+        rank, world_size = _get_distributed_rank_and_world_size()
+        rank_files = self._files_list[rank::world_size]
+        if rank_files:
+            build_index_files(rank_files, newline_int, workers=self._worker, build_index_fn=build_index_fn)
 
-        if is_ditributed:
+        if world_size > 1:
             torch.distributed.barrier()
 
         logging.info(f"Loading data files")
@@ -127,6 +174,9 @@ class TextMemMapDataset(Dataset):
         # figure out size of the dataset
         self._size = self.midx_bins[-1]
 
+        if cache_tokenized:
+            self._load_token_cache(rank, world_size)
+
     def __del__(self):
         if self.mdata_midx_list:
             for mdata, midx in self.mdata_midx_list:
@@ -142,10 +192,29 @@ class TextMemMapDataset(Dataset):
         if (idx >= len(self)) or (idx < 0):
             raise IndexError(f"Index {idx} if out of dataset range with {len(self)} samples")
 
+        if idx in self._lru_cache:
+            self._lru_cache.move_to_end(idx)
+            return self._lru_cache[idx]
+
         # Identify the file containing the record
         file_id = np.digitize(idx, self.midx_bins, right=False)
         base_idx = self.midx_bins[file_id - 1] if file_id > 0 else 0
         file_idx = idx - base_idx + self._header_lines
+
+        if self.token_cache_list is not None:
+            data = self.token_cache_list[file_id][file_idx - self._header_lines].tolist()
+        else:
+            data = self._get_sample_from_file(file_id, file_idx)
+
+        if self._lru_cache_size > 0:
+            self._lru_cache[idx] = data
+            if len(self._lru_cache) > self._lru_cache_size:
+                self._lru_cache.popitem(last=False)
+
+        return data
+
+    def _get_sample_from_file(self, file_id, file_idx):
+        """Reads and parses line file_idx of file file_id"""
         mdata, midx = self.mdata_midx_list[file_id]
         # load sample
         if file_idx == 0:
@@ -180,6 +249,84 @@ class TextMemMapDataset(Dataset):
 
         return data
 
+    def _get_tokenizer_fingerprint(self):
+        """
+        Identifies the tokenizer the sidecar token caches were built with: its class and vocabulary size, a hash
+        of its model or vocabulary when they are accessible, and the token ids of a fixed probe text
+        """
+        if self._tokenizer_fingerprint is None:
+            tokenizer_cls = type(self.tokenizer)
+            md5 = hashlib.md5()
+            md5.update(json.dumps([int(i) for i in self.tokenizer.text_to_ids(_TOKENIZER_PROBE_TEXT)]).encode())
+            backend = getattr(self.tokenizer, 'tokenizer', None)
+            if hasattr(backend, 'serialized_model_proto'):
+                # sentencepiece model
+                md5.update(backend.serialized_model_proto())
+            elif hasattr(backend, 'get_vocab'):
+                # huggingface vocabulary
+                md5.update(json.dumps(sorted(backend.get_vocab().items())).encode())
+            self._tokenizer_fingerprint = (
+                f"{tokenizer_cls.__module__}.{tokenizer_cls.__qualname__}:"
+                f"{getattr(self.tokenizer, 'vocab_size', None)}:{md5.hexdigest()}"
+            )
+        return self._tokenizer_fingerprint
+
+    def _token_cache_info(self):
+        return dict(
+            version=__idx_version__,
+            newline_int=self._newline_int,
+            header_lines=self._header_lines,
+            tokenizer=self._get_tokenizer_fingerprint(),
+        )
+
+    def _build_token_cache(self, file_id):
+        """Tokenizes all samples of a file into a sidecar MMapIndexedDataset"""
+        # imported here since indexed_dataset imports this module
+        from nemo.collections.nlp.data.language_modeling.megatron.indexed_dataset import make_builder
+
+        fn = self._files_list[file_id]
+        prefix = f"{fn}.{__tok_suffix__}"
+        tmp_prefix = f"{prefix}.tmp{os.getpid()}"
+        logging.info(f"Building tokenized sample cache for fn = {fn}")
+        start_time = time.time()
+
+        vocab_size = getattr(self.tokenizer, 'vocab_size', None)
+        builder = make_builder(tmp_prefix + ".bin", impl='mmap', vocab_size=vocab_size)
+        _, midx = self.mdata_midx_list[file_id]
+        for file_idx in range(self._header_lines, len(midx)):
+            ids = self._get_sample_from_file(file_id, file_idx)
+            builder.add_item(torch.tensor(ids, dtype=torch.int64))
+        builder.end_document()
+        builder.finalize(tmp_prefix + ".idx")
+
+        # publish the cache atomically, the info file last
+        os.replace(tmp_prefix + ".bin", prefix + ".bin")
+        os.replace(tmp_prefix + ".idx", prefix + ".idx")
+        info = self._token_cache_info()
+        info.update(_get_file_stat(fn))
+        with open(tmp_prefix + ".info", "wb") as f:
+            pickle.dump(info, f)
+        os.replace(tmp_prefix + ".info", prefix + ".info")
+        logging.info(
+            f'Time building tokenized sample cache for {fn}: {datetime.timedelta(seconds=time.time() - start_time)}'
+        )
+
+    def _load_token_cache(self, rank, world_size):
+        """Builds the missing or stale sidecar token caches of this rank's files and loads all of them"""
+        from nemo.collections.nlp.data.language_modeling.megatron.indexed_dataset import MMapIndexedDataset
+
+        for file_id in range(rank, len(self._files_list), world_size):
+            fn = self._files_list[file_id]
+            if not _is_cache_current(fn, f"{fn}.{__tok_suffix__}.info", **self._token_cache_info()):
+                self._build_token_cache(file_id)
+
+        if world_size > 1:
+            torch.distributed.barrier()
+
+        self.token_cache_list = [
+            MMapIndexedDataset(f"{fn}.{__tok_suffix__}", skip_warmup=True) for fn in self._files_list
+        ]
+
     def load_file(self, fn):
         """
         Loads a text file as np.int8.
@@ -239,7 +386,12 @@ class CSVMemMapDataset(TextMemMapDataset):
         sort_dataset_paths=True,
         data_col=1,
         data_sep=',',
+        cache_tokenized=False,
+        lru_cache_size=0,
     ):
+        # the CSV field must be known before the tokenized sample cache is built
+        self._data_col = data_col
+        self._data_sep = data_sep
         super().__init__(
             dataset_paths=dataset_paths,
             newline_int=newline_int,
@@ -247,9 +399,9 @@ class CSVMemMapDataset(TextMemMapDataset):
             workers=workers,
             tokenizer=tokenizer,
             sort_dataset_paths=sort_dataset_paths,
+            cache_tokenized=cache_tokenized,
+            lru_cache_size=lru_cache_size,
         )
-        self._data_col = data_col
-        self._data_sep = data_sep
 
     def _build_data_from_text(self, text):
         """Return a CSV field from text"""
@@ -265,7 +417,14 @@ class JSONLMemMapDataset(TextMemMapDataset):
     """
 
     def __init__(
-        self, dataset_paths, newline_int=10, header_lines=1, workers=None, tokenizer=None, sort_dataset_paths=True,
+        self,
+        dataset_paths,
+        newline_int=10,
+        header_lines=1,
+        workers=None,
+        tokenizer=None,
+        sort_dataset_paths=True,
+        lru_cache_size=0,
     ):
         super().__init__(
             dataset_paths=dataset_paths,
@@ -274,6 +433,7 @@ class JSONLMemMapDataset(TextMemMapDataset):
             workers=workers,
             tokenizer=tokenizer,
             sort_dataset_paths=sort_dataset_paths,
+            lru_cache_size=lru_cache_size,
         )
 
     def _build_data_from_text(self, text):
@@ -285,11 +445,14 @@ def _build_memmap_index_files(newline_int, build_index_fn, fn):
     """Helper function to build an index file"""
     idx_fn = f"{fn}.{__idx_suffix__}"
 
-    # create data map
-    if os.path.exists(idx_fn + ".npy"):
+    # keep the index of files that did not change since it was built
+    if os.path.exists(idx_fn + ".npy") and _is_cache_current(
+        fn, idx_fn + ".info", newline_int=newline_int, version=__idx_version__
+    ):
         return False
     else:
         logging.info(f"Building indexing for fn = {fn}")
+        file_stat = _get_file_stat(fn)
         # find all newline positions
         midx = build_index_fn(fn, newline_int)
         # validate midx
@@ -298,13 +461,18 @@ def _build_memmap_index_files(newline_int, build_index_fn, fn):
             raise TypeError(f"midx must be an integer array, but got type = {midx.dtype}")
 
         # create e metadata file
-        data = dict(newline_int=newline_int, version=__idx_version__)
+        data = dict(newline_int=newline_int, version=__idx_version__, **file_stat)
 
-        # save index as numpy array to enable memmap reading
+        # save index as numpy array to enable memmap reading, files are renamed so readers never see partial files
+        tmp_suffix = f".tmp{os.getpid()}"
         logging.info(f"Saving idx file = {idx_fn}.npy")
-        np.save(idx_fn + ".npy", midx, allow_pickle=True)
+        with open(idx_fn + ".npy" + tmp_suffix, "wb") as f:
+            np.save(f, midx, allow_pickle=True)
+        os.replace(idx_fn + ".npy" + tmp_suffix, idx_fn + ".npy")
         logging.info(f"Saving metadata file = {idx_fn}.info")
-        pickle.dump(data, open(idx_fn + ".info", "wb"))
+        with open(idx_fn + ".info" + tmp_suffix, "wb") as f:
+            pickle.dump(data, f)
+        os.replace(idx_fn + ".info" + tmp_suffix, idx_fn + ".info")
 
         return True
 
@@ -316,6 +484,7 @@ def build_index_files(dataset_paths, newline_int, workers=None, build_index_fn=_
 
     if workers is None:
         workers = max(1, os.cpu_count() // 2)
+    workers = min(workers, len(dataset_paths))
 
     logging.info(f"Processing {len(dataset_paths)} data files using {workers} workers")
     # load all files into memmap
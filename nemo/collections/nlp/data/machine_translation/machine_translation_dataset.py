@@ -27,6 +27,11 @@ import webdataset as wd
 from torch.utils.data import IterableDataset
 
 from nemo.collections.nlp.data.data_utils.data_preprocessing import dataset_to_ids
+from nemo.collections.nlp.data.machine_translation.translation_batch_format import (
+    BINARY_BATCH_EXTENSION,
+    decode_translation_batch,
+    is_binary_translation_batch,
+)
 from nemo.core import Dataset
 from nemo.utils import logging
 
@@ -61,6 +66,9 @@ class TranslationDataConfig:
     tar_shuffle_n: int = 100
     n_preproc_jobs: int = -2
     tar_file_prefix: str = 'parallel'
+    streaming_preproc: bool = False
+    preproc_seed: int = 0
+    binary_batches: bool = False
     concat_sampling_technique: Optional[str] = 'temperature'
     concat_sampling_temperature: Optional[int] = 5
     concat_sampling_probabilities: Optional[List[float]] = None
@@ -297,6 +305,8 @@ class TarredTranslationDataset(IterableDataset):
     A similar Dataset to the TranslationDataset, but which loads tarred tokenized pickle files.
     Accepts a single JSON metadata file containing the total number of batches
     as well as the path(s) to the tarball(s) containing the pickled parallel dataset batch files.
+    Batches can also be stored in the compact binary format of translation_batch_format.py,
+    which is loaded without unpickling, see convert_tarred_dataset_to_binary.
     Valid formats for the text_tar_filepaths argument include:
     (1) a single string that can be brace-expanded, e.g. 'path/to/text.tar' or 'path/to/text_{1..100}.tar', or
     (2) a list of file paths that will not be brace-expanded, e.g. ['text_1.tar', 'text_2.tar', ...].
@@ -429,16 +439,28 @@ class TarredTranslationDataset(IterableDataset):
         else:
             logging.info("WebDataset will not shuffle files within the tar files.")
 
-        self._dataset = self._dataset.rename(pkl='pkl', key='__key__').to_tuple('pkl', 'key').map(f=self._build_sample)
+        self._dataset = (
+            self._dataset.rename(pkl=f'pkl;{BINARY_BATCH_EXTENSION}', key='__key__')
+            .to_tuple('pkl', 'key')
+            .map(f=self._build_sample)
+        )
 
     def _build_sample(self, fname):
         # Load file
         pkl_file, _ = fname
-        pkl_file = io.BytesIO(pkl_file)
-        data = pickle.load(pkl_file)  # loads np.int64 vector
-        pkl_file.close()
-        src_ids = data["src"]
-        tgt = data["tgt"]
+        if is_binary_translation_batch(pkl_file):
+            # sentences of the file are padded with the pad id of the side they end up on
+            src_pad_id, tgt_pad_id = self.src_pad_id, self.tgt_pad_id
+            if self.reverse_lang_direction:
+                src_pad_id, tgt_pad_id = tgt_pad_id, src_pad_id
+            src_ids, tgt = decode_translation_batch(pkl_file, src_pad_id, tgt_pad_id)
+        else:
+            pkl_file = io.BytesIO(pkl_file)
+            data = pickle.load(pkl_file)  # loads np.int64 vector
+            pkl_file.close()
+            # batches can be stored with compact int16 or int32 token ids
+            src_ids = data["src"].astype(np.int64, copy=False)
+            tgt = data["tgt"].astype(np.int64, copy=False)
         if self.reverse_lang_direction:
             src_ids, tgt = tgt, src_ids
         labels = tgt[:, 1:]
@@ -0,0 +1,377 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Streaming builder of tarred parallel datasets for Neural Machine Translation."""
+
+import io
+import json
+import os
+import pickle
+import shutil
+import tarfile
+from itertools import islice
+from typing import Callable, List, Tuple
+
+import numpy as np
+from joblib import Parallel, delayed, effective_n_jobs
+
+from nemo.collections.common.tokenizers.huggingface.auto_tokenizer import AutoTokenizer
+from nemo.collections.common.tokenizers.sentencepiece_tokenizer import SentencePieceTokenizer
+from nemo.collections.common.tokenizers.youtokentome_tokenizer import YouTokenToMeTokenizer
+from nemo.collections.nlp.data.machine_translation.translation_batch_format import (
+    BINARY_BATCH_EXTENSION,
+    encode_translation_batch,
+)
+from nemo.utils import logging
+
+__all__ = ['build_parallel_tarred_dataset']
+
+# fixed pickle protocol so that the shards do not depend on the python version
+PICKLE_PROTOCOL = 4
+# number of sentence pairs whose lengths are converted to python ints at once when planning the batches
+_PLAN_CHUNK_SIZE = 1000000
+
+
+def texts_to_ids(tokenizer, texts: List[str]) -> List[List[int]]:
+    """ Tokenizes a list of sentences with a single call to the tokenizer library when it supports it """
+    if isinstance(tokenizer, YouTokenToMeTokenizer):
+        import youtokentome as yttm
+
+        return tokenizer.tokenizer.encode(
+            texts, output_type=yttm.OutputType.ID, dropout_prob=tokenizer.bpe_dropout, reverse=tokenizer.r2l
+        )
+    if isinstance(tokenizer, SentencePieceTokenizer) and not tokenizer.legacy:
+        return tokenizer.tokenizer.encode_as_ids(texts)
+    if isinstance(tokenizer, AutoTokenizer) and getattr(tokenizer.tokenizer, 'is_fast', False):
+        return tokenizer.tokenizer(texts, add_special_tokens=False)['input_ids']
+    return [tokenizer.text_to_ids(text) for text in texts]
+
+
+def token_dtype(*tokenizers) -> np.dtype:
+    """ Smallest integer type holding the token ids of the tokenizers """
+    max_id = max(max(getattr(t, 'vocab_size', 2 ** 31), t.pad_id, t.bos_id, t.eos_id) for t in tokenizers)
+    return np.dtype(np.int16) if max_id <= np.iinfo(np.int16).max else np.dtype(np.int32)
+
+
+def _get_fragment_offsets(filename: str, lines_per_fragment: int) -> Tuple[List[int], int]:
+    """ Returns the byte offsets of the fragments of a text file and its number of lines """
+    offsets, num_lines = [], 0
+    with open(filename, 'rb') as f:
+        while True:
+            if num_lines % lines_per_fragment == 0:
+                offset = f.tell()
+            line = f.readline()
+            if not line:
+                break
+            if num_lines % lines_per_fragment == 0:
+                offsets.append(offset)
+            num_lines += 1
+    return offsets, num_lines
+
+
+def _save_array(path: str, array: np.ndarray):
+    tmp_path = path + '.tmp.npy'
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+def _run_paths(work_dir: str, fragment_index: int) -> dict:
+    prefix = os.path.join(work_dir, f'run-{fragment_index}')
+    return {key: f'{prefix}.{key}.npy' for key in ['src', 'src_offsets', 'tgt', 'tgt_offsets']}
+
+
+def _tokenize_fragment(
+    src_fname,
+    tgt_fname,
+    src_offset,
+    tgt_offset,
+    num_lines,
+    work_dir,
+    fragment_index,
+    get_tokenizers,
+    dtype,
+    clean,
+    max_seq_length,
+    min_seq_length,
+    tokenization_batch_size,
+):
+    """
+    Tokenizes a fragment of the parallel corpus and writes it to disk as a run sorted by source and target length.
+    Returns the number of sentence pairs kept.
+    """
+    encoder_tokenizer, decoder_tokenizer = get_tokenizers()
+    src_ids, tgt_ids = [], []
+    with open(src_fname, 'rb') as src_f, open(tgt_fname, 'rb') as tgt_f:
+        src_f.seek(src_offset)
+        tgt_f.seek(tgt_offset)
+        lines = islice(zip(src_f, tgt_f), num_lines)
+        while True:
+            chunk = list(islice(lines, tokenization_batch_size))
+            if not chunk:
+                break
+            src_chunk = [src.decode('utf-8').rstrip('\n') for src, _ in chunk]
+            tgt_chunk = [tgt.decode('utf-8').rstrip('\n') for _, tgt in chunk]
+            for tokenizer, texts, ids in [
+                (encoder_tokenizer, src_chunk, src_ids),
+                (decoder_tokenizer, tgt_chunk, tgt_ids),
+            ]:
+                for sent_ids in texts_to_ids(tokenizer, texts):
+                    ids.append([tokenizer.bos_id] + sent_ids + [tokenizer.eos_id])
+
+    if clean:
+        # same filtering as the TranslationDataset used by MTDataPreproc.write_parallel_batches_to_tarfiles
+        kept = []
+        for i, (src, tgt) in enumerate(zip(src_ids, tgt_ids)):
+            src_len, tgt_len = len(src), len(tgt)
+            if max(src_len, tgt_len) > max_seq_length or min(src_len, tgt_len) < min_seq_length:
+                continue
+            if abs(src_len - tgt_len) > max_seq_length:
+                continue
+            ratio = max(src_len - 2, 1) / max(tgt_len - 2, 1)
+            if ratio > max_seq_length or ratio < (1 / max_seq_length):
+                continue
+            kept.append(i)
+        src_ids = [src_ids[i] for i in kept]
+        tgt_ids = [tgt_ids[i] for i in kept]
+
+    # stable sort, so that pairs of equal lengths keep the order of the corpus
+    src_lens = np.array([len(ids) for ids in src_ids], dtype=np.int64)
+    tgt_lens = np.array([len(ids) for ids in tgt_ids], dtype=np.int64)
+    order = np.lexsort((tgt_lens, src_lens))
+    paths = _run_paths(work_dir, fragment_index)
+    for key, ids, lens in [('src', src_ids, src_lens), ('tgt', tgt_ids, tgt_lens)]:
+        offsets = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum(lens[order], out=offsets[1:])
+        tokens = np.fromiter((token for i in order for token in ids[i]), dtype=dtype, count=int(offsets[-1]))
+        _save_array(paths[key], tokens)
+        _save_array(paths[f'{key}_offsets'], offsets)
+    return len(order)
+
+
+def _plan_batches(work_dir: str, num_fragments: int, tokens_in_batch: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Merges the sorted runs by source and target length and packs the sentence pairs into batches of
+    at most tokens_in_batch source plus target tokens. Like TranslationDataset.pack_data_into_batches,
+    a batch that overflows is cut to a multiple of 8 sentence pairs and the rest starts the next batch,
+    while a batch of up to 8 sentence pairs keeps the pair that overflows it.
+    Only the lengths are loaded, tokens stay in the runs. The lengths and the plan of all sentence pairs
+    are sorted in memory, which takes about 64 bytes per sentence pair, e.g. 6.4GB for 100M pairs.
+    Returns the (fragment, index) of every sentence pair in the batch order and the batch boundaries.
+    """
+    src_lens, tgt_lens, fragments, indices = [], [], [], []
+    for fragment_index in range(num_fragments):
+        paths = _run_paths(work_dir, fragment_index)
+        src_len = np.diff(np.load(paths['src_offsets']))
+        src_lens.append(src_len)
+        tgt_lens.append(np.diff(np.load(paths['tgt_offsets'])))
+        fragments.append(np.full(len(src_len), fragment_index, dtype=np.int32))
+        indices.append(np.arange(len(src_len), dtype=np.int64))
+    if num_fragments == 0:
+        return np.zeros((0, 2), dtype=np.int64), np.zeros(1, dtype=np.int64)
+    src_lens, tgt_lens = np.concatenate(src_lens), np.concatenate(tgt_lens)
+    fragments, indices = np.concatenate(fragments), np.concatenate(indices)
+    # ties are broken by the position in the corpus, so the plan does not depend on the fragment size
+    order = np.lexsort((indices, fragments, tgt_lens, src_lens))
+    refs = np.stack([fragments[order], indices[order]], axis=1)
+    del fragments, indices
+    src_lens, tgt_lens = src_lens[order], tgt_lens[order]
+    del order
+
+    boundaries = [0]
+    batch_src_len = batch_tgt_len = 0
+    # the lengths are converted to python ints in chunks to keep the memory of the loop bounded
+    for start in range(0, len(refs), _PLAN_CHUNK_SIZE):
+        chunk = slice(start, start + _PLAN_CHUNK_SIZE)
+        for position, (src_len, tgt_len) in enumerate(
+            zip(src_lens[chunk].tolist(), tgt_lens[chunk].tolist()), start=start
+        ):
+            batch_src_len, batch_tgt_len = max(batch_src_len, src_len), max(batch_tgt_len, tgt_len)
+            batch_size = position + 1 - boundaries[-1]
+            if batch_size * (batch_src_len + batch_tgt_len) > tokens_in_batch:
+                boundaries.append(boundaries[-1] + (8 * ((batch_size - 1) // 8) or batch_size))
+                rest = slice(boundaries[-1], position + 1)
+                batch_src_len = int(src_lens[rest].max(initial=0))
+                batch_tgt_len = int(tgt_lens[rest].max(initial=0))
+    if len(refs) > boundaries[-1]:
+        boundaries.append(len(refs))
+    return refs, np.array(boundaries, dtype=np.int64)
+
+
+def _sentences(runs, refs, key) -> List[np.ndarray]:
+    sentences = []
+    for fragment_index, index in refs:
+        offsets = runs[fragment_index][f'{key}_offsets']
+        sentences.append(runs[fragment_index][key][offsets[index] : offsets[index + 1]])
+    return sentences
+
+
+def _pad(sentences, pad_id, dtype) -> np.ndarray:
+    batch = np.full((len(sentences), max(len(s) for s in sentences)), pad_id, dtype=dtype)
+    for i, sentence in enumerate(sentences):
+        batch[i, : len(sentence)] = sentence
+    return batch
+
+
+def _write_shards(work_dir, shard_paths, shard_batches, num_fragments, src_pad_id, tgt_pad_id, dtype, binary_batches):
+    """ Writes the batches of the given shards straight into their tar files """
+    runs = [
+        {key: np.load(path, mmap_mode='r') for key, path in _run_paths(work_dir, i).items()}
+        for i in range(num_fragments)
+    ]
+    refs = np.load(os.path.join(work_dir, 'refs.npy'), mmap_mode='r')
+    boundaries = np.load(os.path.join(work_dir, 'boundaries.npy'))
+    for shard_path, batch_indices in zip(shard_paths, shard_batches):
+        tmp_path = shard_path + '.tmp'
+        with tarfile.open(tmp_path, 'w') as tar:
+            for batch_index in batch_indices:
+                batch_refs = refs[boundaries[batch_index] : boundaries[batch_index + 1]]
+                src_sentences = _sentences(runs, batch_refs, 'src')
+                tgt_sentences = _sentences(runs, batch_refs, 'tgt')
+                if binary_batches:
+                    data = encode_translation_batch(src_sentences, tgt_sentences, dtype)
+                    extension = BINARY_BATCH_EXTENSION
+                else:
+                    batch = {
+                        'src': _pad(src_sentences, src_pad_id, dtype),
+                        'tgt': _pad(tgt_sentences, tgt_pad_id, dtype),
+                    }
+                    data = pickle.dumps(batch, protocol=PICKLE_PROTOCOL)
+                    extension = 'pkl'
+                info = tarfile.TarInfo(name=f'batch-{batch_index}.{extension}')
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        os.replace(tmp_path, shard_path)
+
+
+def build_parallel_tarred_dataset(
+    src_fname: str,
+    tgt_fname: str,
+    out_dir: str,
+    get_tokenizers: Callable,
+    tokens_in_batch: int,
+    num_batches_per_tarfile: int,
+    clean: bool = False,
+    max_seq_length: int = 512,
+    min_seq_length: int = 1,
+    lines_per_dataset_fragment: int = 1000000,
+    n_jobs: int = -2,
+    tar_file_prefix: str = 'parallel',
+    seed: int = 0,
+    tokenization_batch_size: int = 10000,
+    binary_batches: bool = False,
+) -> Tuple[List[str], str]:
+    """
+    Creates a tarred dataset from large paired translation data in three streaming stages:
+    (1) fragments of the corpus are tokenized in parallel with batched tokenizer calls and written to disk
+        as runs of compact numpy token arrays sorted by length,
+    (2) the lengths of the runs are merged and packed into batches of about tokens_in_batch tokens,
+        which needs about 64 bytes of memory per sentence pair,
+    (3) the batches are shuffled with the seed, and every process writes the padded batches of its shards
+        straight into tar files.
+    The tar files only depend on the data, the tokenizers, the batching arguments and the seed, not on
+    n_jobs or lines_per_dataset_fragment. Batches left over after filling the last tar file are discarded.
+
+    Args:
+        src_fname: path to source text data
+        tgt_fname: path to target text data
+        out_dir: path to write tarred dataset
+        get_tokenizers: picklable function returning the encoder and decoder tokenizers,
+            which are created in every process as they can't be pickled
+        tokens_in_batch: tokens per batch per GPU, effectively batch size
+        num_batches_per_tarfile: number of batches within each tarfile
+        clean: whether to filter out sentence pairs by length
+        max_seq_length: maximum sequence length, if clean
+        min_seq_length: minimum sequence length, if clean
+        lines_per_dataset_fragment: number of lines tokenized by a single job
+        n_jobs: number of processes to use for data processing (-2 to use all but 2)
+        tar_file_prefix: add string prefix to tar files
+        seed: seed of the batch shuffling
+        tokenization_batch_size: number of sentences passed to the tokenizer at once
+        binary_batches: whether to write batches in the binary format of translation_batch_format.py
+            instead of pickled dicts of padded numpy arrays
+    Returns:
+        paths of the tar files and of the metadata file
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    work_dir = os.path.join(out_dir, 'preproc_work_dir')
+    os.makedirs(work_dir, exist_ok=True)
+
+    encoder_tokenizer, decoder_tokenizer = get_tokenizers()
+    dtype = token_dtype(encoder_tokenizer, decoder_tokenizer)
+    if getattr(encoder_tokenizer, 'bpe_dropout', 0.0) or getattr(decoder_tokenizer, 'bpe_dropout', 0.0):
+        logging.warning('BPE dropout is enabled, the tokenization and the tarred dataset are not deterministic.')
+
+    (src_offsets, num_src_lines), (tgt_offsets, num_tgt_lines) = Parallel(n_jobs=2)(
+        delayed(_get_fragment_offsets)(filename, lines_per_dataset_fragment) for filename in [src_fname, tgt_fname]
+    )
+    logging.info(f'Found {num_src_lines} source lines and  {num_tgt_lines} target lines.')
+    assert num_src_lines == num_tgt_lines, 'Number of source lines should equal number of target lines.'
+    num_fragments = len(src_offsets)
+    logging.info(f"Found {num_fragments} fragments to parallelize over.")
+
+    num_sentences = Parallel(n_jobs=n_jobs)(
+        delayed(_tokenize_fragment)(
+            src_fname=src_fname,
+            tgt_fname=tgt_fname,
+            src_offset=src_offsets[i],
+            tgt_offset=tgt_offsets[i],
+            num_lines=lines_per_dataset_fragment,
+            work_dir=work_dir,
+            fragment_index=i,
+            get_tokenizers=get_tokenizers,
+            dtype=dtype,
+            clean=clean,
+            max_seq_length=max_seq_length,
+            min_seq_length=min_seq_length,
+            tokenization_batch_size=tokenization_batch_size,
+        )
+        for i in range(num_fragments)
+    )
+    logging.info(f'Tokenized {sum(num_sentences)} sentence pairs.')
+
+    refs, boundaries = _plan_batches(work_dir, num_fragments, tokens_in_batch)
+    _save_array(os.path.join(work_dir, 'refs.npy'), refs)
+    _save_array(os.path.join(work_dir, 'boundaries.npy'), boundaries)
+    num_batches = len(boundaries) - 1
+    num_tar_files = num_batches // num_batches_per_tarfile
+    total_batches = num_tar_files * num_batches_per_tarfile
+    logging.info(f'Number of batches discarded: {num_batches - total_batches}, total batches kept: {total_batches}')
+
+    batch_order = np.random.RandomState(seed).permutation(num_batches)[:total_batches]
+    shard_batches = batch_order.reshape(num_tar_files, num_batches_per_tarfile).tolist()
+    tar_file_paths = [
+        os.path.join(out_dir, f'{tar_file_prefix}.batches.tokens.{tokens_in_batch}.{index}.tar')
+        for index in range(num_tar_files)
+    ]
+    # one writer per process, every process writes every num_writers-th shard
+    num_writers = max(min(effective_n_jobs(n_jobs), num_tar_files), 1)
+    Parallel(n_jobs=num_writers)(
+        delayed(_write_shards)(
+            work_dir,
+            tar_file_paths[rank::num_writers],
+            shard_batches[rank::num_writers],
+            num_fragments,
+            encoder_tokenizer.pad_id,
+            decoder_tokenizer.pad_id,
+            dtype,
+            binary_batches,
+        )
+        for rank in range(num_writers)
+    )
+    shutil.rmtree(work_dir)
+
+    metadata_path = os.path.join(out_dir, f'metadata.tokens.{tokens_in_batch}.json')
+    with open(metadata_path, 'w') as f:
+        json.dump({'num_batches': total_batches, 'tar_files': tar_file_paths}, f)
+    return tar_file_paths, metadata_path
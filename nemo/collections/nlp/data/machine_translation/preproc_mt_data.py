@@ -19,6 +19,7 @@ import os
 import pickle
 import tarfile
 import tempfile
+from functools import partial
 
 import youtokentome as yttm
 from joblib import Parallel, delayed
@@ -28,6 +29,8 @@ from pytorch_lightning import Trainer
 from nemo.collections.common.tokenizers.sentencepiece_tokenizer import SentencePieceTokenizer, create_spt_model
 from nemo.collections.nlp.data.language_modeling.sentence_dataset import SentenceDataset
 from nemo.collections.nlp.data.machine_translation.machine_translation_dataset import TranslationDataset
+from nemo.collections.nlp.data.machine_translation.parallel_tarred_dataset_builder import build_parallel_tarred_dataset
+from nemo.collections.nlp.data.machine_translation.translation_batch_format import convert_tarred_dataset_to_binary
 from nemo.collections.nlp.models.machine_translation.mt_enc_dec_config import MTEncDecModelConfig
 from nemo.collections.nlp.modules.common.tokenizer_utils import get_nmt_tokenizer, get_tokenizer
 from nemo.utils import logging
@@ -246,6 +249,9 @@ class MTDataPreproc:
                             world_size=self.world_size,
                             n_jobs=cfg.train_ds.get('n_preproc_jobs', -2),
                             tar_file_prefix=cfg.train_ds.get('tar_file_prefix', 'parallel'),
+                            streaming=cfg.train_ds.get('streaming_preproc', False),
+                            seed=cfg.train_ds.get('preproc_seed', 0),
+                            binary_batches=cfg.train_ds.get('binary_batches', False),
                         )
                         metadata_file_list.append(self.train_metadata_file)
                     # update config
@@ -389,6 +395,9 @@ class MTDataPreproc:
         tar_file_prefix='parallel',
         encoder_tokenizer_legacy=False,
         decoder_tokenizer_legacy=False,
+        streaming=False,
+        seed=0,
+        binary_batches=False,
     ):
         """Create tarred dataset from large paired translation data.
 
@@ -406,6 +415,10 @@ class MTDataPreproc:
             num_batches_per_tarfile (int): number of batches (pickle files) within each tarfile
             tar_file_prefix (str) : add string prefix to tar files 
             n_jobs (int): number of processes to use for data processing (-2 to use all but 2)
+            streaming (bool): whether to use the streaming builder, which writes deterministic
+                tar files of compact numpy batches (see build_parallel_tarred_dataset)
+            seed (int): seed of the batch shuffling of the streaming builder
+            binary_batches (bool): whether to store batches in the binary format of translation_batch_format.py
         """
 
         os.makedirs(out_dir, exist_ok=True)
@@ -418,6 +431,37 @@ class MTDataPreproc:
                 logging.info(
                     f'Tarred dataset detected: {tar_files_in_out_dir} and will be used. Remove if reprocessing.'
                 )
+            elif streaming:
+                build_parallel_tarred_dataset(
+                    src_fname=src_fname,
+                    tgt_fname=tgt_fname,
+                    out_dir=out_dir,
+                    get_tokenizers=partial(
+                        MTDataPreproc.get_preproc_enc_dec_tokenizers,
+                        encoder_tokenizer_name=encoder_tokenizer_name,
+                        encoder_tokenizer_model=encoder_tokenizer_model,
+                        encoder_bpe_dropout=encoder_bpe_dropout,
+                        encoder_model_name=encoder_model_name,
+                        encoder_r2l=encoder_tokenizer_r2l,
+                        decoder_tokenizer_name=decoder_tokenizer_name,
+                        decoder_tokenizer_model=decoder_tokenizer_model,
+                        decoder_bpe_dropout=decoder_bpe_dropout,
+                        decoder_model_name=decoder_model_name,
+                        decoder_r2l=decoder_tokenizer_r2l,
+                        encoder_tokenizer_legacy=encoder_tokenizer_legacy,
+                        decoder_tokenizer_legacy=decoder_tokenizer_legacy,
+                    ),
+                    tokens_in_batch=tokens_in_batch,
+                    num_batches_per_tarfile=num_batches_per_tarfile,
+                    clean=clean,
+                    max_seq_length=max_seq_length,
+                    min_seq_length=min_seq_length,
+                    lines_per_dataset_fragment=lines_per_dataset_fragment,
+                    n_jobs=n_jobs,
+                    tar_file_prefix=tar_file_prefix,
+                    seed=seed,
+                    binary_batches=binary_batches,
+                )
             else:
                 filenames = [src_fname, tgt_fname]
 
@@ -513,6 +557,30 @@ class MTDataPreproc:
                 metadata['tar_files'] = tar_file_paths
                 json.dump(metadata, open(metadata_path, 'w'))
 
+                if binary_batches:
+                    encoder_tokenizer, decoder_tokenizer = MTDataPreproc.get_preproc_enc_dec_tokenizers(
+                        encoder_tokenizer_name=encoder_tokenizer_name,
+                        encoder_tokenizer_model=encoder_tokenizer_model,
+                        encoder_bpe_dropout=encoder_bpe_dropout,
+                        encoder_model_name=encoder_model_name,
+                        encoder_r2l=encoder_tokenizer_r2l,
+                        decoder_tokenizer_name=decoder_tokenizer_name,
+                        decoder_tokenizer_model=decoder_tokenizer_model,
+                        decoder_bpe_dropout=decoder_bpe_dropout,
+                        decoder_model_name=decoder_model_name,
+                        decoder_r2l=decoder_tokenizer_r2l,
+                        encoder_tokenizer_legacy=encoder_tokenizer_legacy,
+                        decoder_tokenizer_legacy=decoder_tokenizer_legacy,
+                    )
+                    # converts the tar files in place
+                    convert_tarred_dataset_to_binary(
+                        metadata_path=metadata_path,
+                        out_dir=out_dir,
+                        src_pad_id=encoder_tokenizer.pad_id,
+                        tgt_pad_id=decoder_tokenizer.pad_id,
+                        n_jobs=n_jobs,
+                    )
+
         tar_file_paths = glob.glob(f'{out_dir}/*.tar')
 
         num_tar_files = len(tar_file_paths)
@@ -920,60 +988,35 @@ class MTDataPreproc:
         return encoder_tokenizer_model, decoder_tokenizer_model
 
     @staticmethod
-    def write_parallel_batches_to_tarfiles(
-        out_dir,
-        num_batches_per_tarfile,
-        clean,
-        max_seq_length,
-        min_seq_length,
-        src_fname,
-        tgt_fname,
-        num_tokens,
+    def get_preproc_enc_dec_tokenizers(
         encoder_tokenizer_name,
         encoder_tokenizer_model,
-        encoder_tokenizer_r2l,
         encoder_bpe_dropout,
         encoder_model_name,
+        encoder_r2l,
         decoder_tokenizer_name,
         decoder_tokenizer_model,
         decoder_bpe_dropout,
         decoder_model_name,
-        decoder_tokenizer_r2l,
-        fragment_index,
+        decoder_r2l,
         encoder_tokenizer_legacy=False,
         decoder_tokenizer_legacy=False,
     ):
         """
-        Writes current fragment of the overall parallel corpus to tarfiles by:
-        (1) Creating a minibatches using a TranslationDataset object.
-        (2) Writing each minibatch to a pickle file.
-        (3) Adding pickle files to a tarfile until it reaches num_batches_per_tarfile.
+        Returns the encoder and decoder tokenizers used to create tarred datasets,
+        with the special tokens missing from legacy sentencepiece tokenizers added.
         """
-
-        dataset = TranslationDataset(
-            dataset_src=src_fname,
-            dataset_tgt=tgt_fname,
-            tokens_in_batch=num_tokens,
-            clean=clean,
-            max_seq_length=max_seq_length,
-            min_seq_length=min_seq_length,
-            max_seq_length_diff=max_seq_length,
-            max_seq_length_ratio=max_seq_length,
-            cache_ids=False,
-            cache_data_per_node=False,
-            use_cache=False,
-        )
         encoder_tokenizer, decoder_tokenizer = MTDataPreproc.get_enc_dec_tokenizers(
             encoder_tokenizer_name=encoder_tokenizer_name,
             encoder_tokenizer_model=encoder_tokenizer_model,
             encoder_bpe_dropout=encoder_bpe_dropout,
             encoder_model_name=encoder_model_name,
-            encoder_r2l=encoder_tokenizer_r2l,
+            encoder_r2l=encoder_r2l,
             decoder_tokenizer_name=decoder_tokenizer_name,
             decoder_tokenizer_model=decoder_tokenizer_model,
             decoder_bpe_dropout=decoder_bpe_dropout,
             decoder_model_name=decoder_model_name,
-            decoder_r2l=decoder_tokenizer_r2l,
+            decoder_r2l=decoder_r2l,
             encoder_tokenizer_legacy=encoder_tokenizer_legacy,
             decoder_tokenizer_legacy=decoder_tokenizer_legacy,
         )
@@ -1022,6 +1065,67 @@ class MTDataPreproc:
                         else:
                             tok_model.add_special_tokens({'eos_token': '</s>'})
 
+        return encoder_tokenizer, decoder_tokenizer
+
+    @staticmethod
+    def write_parallel_batches_to_tarfiles(
+        out_dir,
+        num_batches_per_tarfile,
+        clean,
+        max_seq_length,
+        min_seq_length,
+        src_fname,
+        tgt_fname,
+        num_tokens,
+        encoder_tokenizer_name,
+        encoder_tokenizer_model,
+        encoder_tokenizer_r2l,
+        encoder_bpe_dropout,
+        encoder_model_name,
+        decoder_tokenizer_name,
+        decoder_tokenizer_model,
+        decoder_bpe_dropout,
+        decoder_model_name,
+        decoder_tokenizer_r2l,
+        fragment_index,
+        encoder_tokenizer_legacy=False,
+        decoder_tokenizer_legacy=False,
+    ):
+        """
+        Writes current fragment of the overall parallel corpus to tarfiles by:
+        (1) Creating a minibatches using a TranslationDataset object.
+        (2) Writing each minibatch to a pickle file.
+        (3) Adding pickle files to a tarfile until it reaches num_batches_per_tarfile.
+        """
+
+        dataset = TranslationDataset(
+            dataset_src=src_fname,
+            dataset_tgt=tgt_fname,
+            tokens_in_batch=num_tokens,
+            clean=clean,
+            max_seq_length=max_seq_length,
+            min_seq_length=min_seq_length,
+            max_seq_length_diff=max_seq_length,
+            max_seq_length_ratio=max_seq_length,
+            cache_ids=False,
+            cache_data_per_node=False,
+            use_cache=False,
+        )
+        encoder_tokenizer, decoder_tokenizer = MTDataPreproc.get_preproc_enc_dec_tokenizers(
+            encoder_tokenizer_name=encoder_tokenizer_name,
+            encoder_tokenizer_model=encoder_tokenizer_model,
+            encoder_bpe_dropout=encoder_bpe_dropout,
+            encoder_model_name=encoder_model_name,
+            encoder_r2l=encoder_tokenizer_r2l,
+            decoder_tokenizer_name=decoder_tokenizer_name,
+            decoder_tokenizer_model=decoder_tokenizer_model,
+            decoder_bpe_dropout=decoder_bpe_dropout,
+            decoder_model_name=decoder_model_name,
+            decoder_r2l=decoder_tokenizer_r2l,
+            encoder_tokenizer_legacy=encoder_tokenizer_legacy,
+            decoder_tokenizer_legacy=decoder_tokenizer_legacy,
+        )
+
         dataset.batchify(encoder_tokenizer, decoder_tokenizer)
 
         tar_file_ctr = 0
@@ -0,0 +1,190 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compact binary format of the batches of tarred parallel datasets, used instead of pickled dicts of numpy arrays.
+
+A batch is stored as:
+    - a fixed 32 bytes little endian header: magic, format version, token size in bytes (2 or 4),
+      number of sentence pairs, number of source tokens and number of target tokens,
+    - an int32 table of the source lengths followed by the target lengths of the sentence pairs,
+    - the unpadded source tokens followed by the unpadded target tokens, as int16 or int32.
+Every section is read with np.frombuffer without copying, and the tokens are padded in a single copy
+to the int64 batches returned by TarredTranslationDataset.
+"""
+
+import io
+import json
+import os
+import pickle
+import struct
+import tarfile
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from joblib import Parallel, delayed
+
+from nemo.utils import logging
+
+__all__ = [
+    'BINARY_BATCH_EXTENSION',
+    'encode_translation_batch',
+    'decode_translation_batch',
+    'is_binary_translation_batch',
+    'convert_tarred_dataset_to_binary',
+]
+
+BINARY_BATCH_MAGIC = b'NMTB'
+BINARY_BATCH_VERSION = 1
+BINARY_BATCH_EXTENSION = 'bin'
+_HEADER = struct.Struct('<4sHHIQQ4x')
+
+
+def _token_dtype(max_token_id: int) -> np.dtype:
+    return np.dtype('<i2') if max_token_id <= np.iinfo(np.int16).max else np.dtype('<i4')
+
+
+def _concatenate(sentences: Sequence[np.ndarray], dtype: np.dtype) -> np.ndarray:
+    if len(sentences) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.concatenate([np.asarray(sentence) for sentence in sentences]).astype(dtype, copy=False)
+
+
+def encode_translation_batch(
+    src_sentences: Sequence[np.ndarray], tgt_sentences: Sequence[np.ndarray], dtype: Optional[np.dtype] = None
+) -> bytes:
+    """
+    Encodes unpadded source and target token ids of a batch to the binary batch format.
+
+    Args:
+        src_sentences: token ids of the source sentences
+        tgt_sentences: token ids of the target sentences
+        dtype: int16 or int32, defaults to the smallest one holding the token ids of the batch
+    """
+    if len(src_sentences) != len(tgt_sentences):
+        raise ValueError(f'Got {len(src_sentences)} source sentences and {len(tgt_sentences)} target sentences.')
+    lengths = np.array(
+        [[len(sentence) for sentence in src_sentences], [len(sentence) for sentence in tgt_sentences]], dtype='<i4'
+    )
+    if dtype is None:
+        max_token_id = max(
+            [int(np.max(sentence)) for sentence in [*src_sentences, *tgt_sentences] if len(sentence)], default=0
+        )
+        dtype = _token_dtype(max_token_id)
+    dtype = np.dtype(dtype).newbyteorder('<')
+    if dtype.kind != 'i' or dtype.itemsize not in [2, 4]:
+        raise ValueError(f'Token ids can only be stored as int16 or int32, got {dtype}.')
+
+    src_tokens = _concatenate(src_sentences, dtype)
+    tgt_tokens = _concatenate(tgt_sentences, dtype)
+    header = _HEADER.pack(
+        BINARY_BATCH_MAGIC, BINARY_BATCH_VERSION, dtype.itemsize, len(src_sentences), src_tokens.size, tgt_tokens.size
+    )
+    return b''.join([header, lengths.tobytes(), src_tokens.tobytes(), tgt_tokens.tobytes()])
+
+
+def is_binary_translation_batch(buffer: bytes) -> bool:
+    """ Whether a tar member holds a binary batch rather than a pickled one """
+    return buffer[: len(BINARY_BATCH_MAGIC)] == BINARY_BATCH_MAGIC
+
+
+def _pad(tokens: np.ndarray, lengths: np.ndarray, pad_id: int) -> np.ndarray:
+    positions = np.arange(int(lengths.max()) if len(lengths) else 0)
+    mask = positions < lengths[:, None]
+    batch = np.full(mask.shape, pad_id, dtype=np.int64)
+    # boolean indexing fills the batch row by row, in the order of the concatenated sentences
+    batch[mask] = tokens
+    return batch
+
+
+def decode_translation_batch(buffer: bytes, src_pad_id: int, tgt_pad_id: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Decodes a binary batch to padded int64 source and target token ids.
+
+    Args:
+        buffer: the encoded batch
+        src_pad_id: id padding the source sentences
+        tgt_pad_id: id padding the target sentences
+    """
+    magic, version, itemsize, batch_size, num_src_tokens, num_tgt_tokens = _HEADER.unpack_from(buffer)
+    if magic != BINARY_BATCH_MAGIC:
+        raise ValueError('Buffer does not hold a binary translation batch.')
+    if version != BINARY_BATCH_VERSION:
+        raise ValueError(f'Unsupported binary translation batch version {version}.')
+
+    dtype = np.dtype(f'<i{itemsize}')
+    offset = _HEADER.size
+    lengths = np.frombuffer(buffer, dtype='<i4', count=2 * batch_size, offset=offset).reshape(2, batch_size)
+    offset += lengths.nbytes
+    src_tokens = np.frombuffer(buffer, dtype=dtype, count=num_src_tokens, offset=offset)
+    offset += src_tokens.nbytes
+    tgt_tokens = np.frombuffer(buffer, dtype=dtype, count=num_tgt_tokens, offset=offset)
+    return _pad(src_tokens, lengths[0], src_pad_id), _pad(tgt_tokens, lengths[1], tgt_pad_id)
+
+
+def _unpad(batch: np.ndarray, pad_id: int) -> List[np.ndarray]:
+    # only trailing padding is removed, sentences may hold pad_id tokens of their own
+    not_pad = batch != pad_id
+    lengths = np.where(not_pad.any(axis=1), batch.shape[1] - np.argmax(not_pad[:, ::-1], axis=1), 0)
+    return [sentence[:length] for sentence, length in zip(batch, lengths)]
+
+
+def _convert_tar_file(in_path: str, out_path: str, src_pad_id: int, tgt_pad_id: int):
+    tmp_path = out_path + '.tmp'
+    with tarfile.open(in_path, 'r') as in_tar, tarfile.open(tmp_path, 'w') as out_tar:
+        for member in in_tar.getmembers():
+            data = in_tar.extractfile(member).read()
+            if not is_binary_translation_batch(data):
+                batch = pickle.loads(data)
+                data = encode_translation_batch(_unpad(batch['src'], src_pad_id), _unpad(batch['tgt'], tgt_pad_id))
+            name, _ = os.path.splitext(member.name)
+            info = tarfile.TarInfo(name=f'{name}.{BINARY_BATCH_EXTENSION}')
+            info.size = len(data)
+            out_tar.addfile(info, io.BytesIO(data))
+    os.replace(tmp_path, out_path)
+
+
+def convert_tarred_dataset_to_binary(
+    metadata_path: str, out_dir: str, src_pad_id: int, tgt_pad_id: int, n_jobs: int = -2
+) -> str:
+    """
+    Converts the pickled batches of a tarred parallel dataset to binary batches.
+    Tar files keep their names, so converting to the directory of the dataset replaces it in place.
+
+    Args:
+        metadata_path: path to the metadata of the tarred dataset, listing the tar files
+        out_dir: directory to write the converted tar files and metadata to
+        src_pad_id: id padding the source sentences, i.e. the encoder tokenizer pad_id
+        tgt_pad_id: id padding the target sentences, i.e. the decoder tokenizer pad_id
+        n_jobs: number of processes converting tar files (-2 to use all but 2)
+    Returns:
+        path of the converted metadata
+    """
+    with open(metadata_path, 'r') as f:
+        metadata = json.load(f)
+    os.makedirs(out_dir, exist_ok=True)
+
+    tar_files = metadata['tar_files']
+    out_tar_files = [os.path.join(out_dir, os.path.basename(tar_file)) for tar_file in tar_files]
+    logging.info(f'Converting {len(tar_files)} tar files to binary batches in {out_dir}')
+    Parallel(n_jobs=n_jobs)(
+        delayed(_convert_tar_file)(tar_file, out_tar_file, src_pad_id, tgt_pad_id)
+        for tar_file, out_tar_file in zip(tar_files, out_tar_files)
+    )
+
+    metadata['tar_files'] = out_tar_files
+    out_metadata_path = os.path.join(out_dir, os.path.basename(metadata_path))
+    with open(out_metadata_path, 'w') as f:
+        json.dump(metadata, f)
+    return out_metadata_path
@@ -13,7 +13,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
+import hashlib
 import os
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 from tqdm import trange
@@ -23,6 +26,56 @@ from nemo.collections.nlp.data.question_answering.dataset.qa_dataset import QADa
 from nemo.collections.nlp.data.question_answering.input_example.qa_bert_input_example import BERTQAInputExample
 from nemo.utils import logging
 
+BERTQAContext = collections.namedtuple(
+    "BERTQAContext",
+    [
+        "doc_tokens",
+        "char_to_word_offset",
+        "all_doc_tokens",
+        "tok_to_orig_index",
+        "orig_to_tok_index",
+        "doc_span_features",
+    ],
+)
+BERTQADocSpanFeature = collections.namedtuple(
+    "BERTQADocSpanFeature", ["tokens", "input_ids", "orig_indices", "is_max_context"]
+)
+
+
+class BERTQAContextCache:
+    """
+    Caches contexts split into words and tokenized by :class:`BERTQADataset`, and features of doc spans of the
+    contexts. Contexts are identified by md5 hash of their text, so a cache can be shared by several datasets, e.g.
+    by several calls of :meth:`~nemo.collections.nlp.models.question_answering.qa_bert_model.BERTQAModel.inference`
+    with questions about the same documents. Datasets sharing a cache have to use the same tokenizer.
+
+    Args:
+        max_num_contexts: maximum number of cached contexts. Least recently used contexts are removed first.
+    """
+
+    def __init__(self, max_num_contexts: int = 1000):
+        self.max_num_contexts = max_num_contexts
+        self._contexts = collections.OrderedDict()
+
+    @staticmethod
+    def _get_key(context_text: str) -> str:
+        return hashlib.md5(context_text.encode('utf-8')).hexdigest()
+
+    def get(self, context_text: str) -> Optional[BERTQAContext]:
+        key = self._get_key(context_text)
+        context = self._contexts.get(key)
+        if context is not None:
+            self._contexts.move_to_end(key)
+        return context
+
+    def put(self, context_text: str, context: BERTQAContext):
+        self._contexts[self._get_key(context_text)] = context
+        while len(self._contexts) > self.max_num_contexts:
+            self._contexts.popitem(last=False)
+
+    def __len__(self):
+        return len(self._contexts)
+
 
 class BERTQADataset(QADataset):
     """ Creates a Dataset for BERT architecture based Exractive QA """
@@ -40,6 +93,7 @@ class BERTQADataset(QADataset):
         num_samples: int = -1,
         mode: str = TRAINING_MODE,
         use_cache: bool = False,
+        context_cache: Optional[BERTQAContextCache] = None,
     ):
         super().__init__(
             data_file=data_file, processor=processor, tokenizer=tokenizer, mode=mode, num_samples=num_samples
@@ -53,6 +107,7 @@ class BERTQADataset(QADataset):
         self.num_samples = num_samples
         self.mode = mode
         self.use_cache = use_cache
+        self.context_cache = context_cache
 
         # structures for hashing to reduce memory use
         self.input_mask_id = 0
@@ -109,6 +164,72 @@ class BERTQADataset(QADataset):
             )
         )
 
+    def __getstate__(self):
+        # the context cache is used only for conversion of examples to features and is not copied to workers
+        state = self.__dict__.copy()
+        state['context_cache'] = None
+        return state
+
+    def _get_context(self, context_text: str, text_to_tokens_dict: Dict[str, List[str]]) -> BERTQAContext:
+        """ Splits context into words and tokenizes words, or takes the result from ``self.context_cache`` """
+
+        if self.context_cache is not None:
+            context = self.context_cache.get(context_text)
+            if context is not None:
+                return context
+
+        doc_tokens, char_to_word_offset = QADataset.split_into_words(context_text)
+        tok_to_orig_index, orig_to_tok_index, all_doc_tokens = [], [], []
+
+        # the text to tokens step is the slowest step
+        for (i, token) in enumerate(doc_tokens):
+            orig_to_tok_index.append(len(all_doc_tokens))
+            if token not in text_to_tokens_dict:
+                text_to_tokens_dict[token] = self.tokenizer.text_to_tokens(token)
+            sub_tokens = text_to_tokens_dict[token]
+
+            for sub_token in sub_tokens:
+                tok_to_orig_index.append(i)
+                all_doc_tokens.append(sub_token)
+
+        context = BERTQAContext(
+            doc_tokens=doc_tokens,
+            char_to_word_offset=char_to_word_offset,
+            all_doc_tokens=all_doc_tokens,
+            tok_to_orig_index=tok_to_orig_index,
+            orig_to_tok_index=orig_to_tok_index,
+            doc_span_features={},
+        )
+        if self.context_cache is not None:
+            self.context_cache.put(context_text, context)
+        return context
+
+    def _get_doc_span_features(self, context: BERTQAContext, doc_spans: Tuple) -> List[BERTQADocSpanFeature]:
+        """ Returns tokens, token ids, word indices and max context flags of context tokens of doc spans """
+
+        if doc_spans in context.doc_span_features:
+            return context.doc_span_features[doc_spans]
+
+        doc_span_features = []
+        for (doc_span_index, doc_span) in enumerate(doc_spans):
+            split_token_indices = range(doc_span.start, doc_span.start + doc_span.length)
+            tokens = [context.all_doc_tokens[i] for i in split_token_indices]
+            doc_span_features.append(
+                BERTQADocSpanFeature(
+                    tokens=tokens,
+                    input_ids=self.tokenizer.tokens_to_ids(tokens),
+                    orig_indices=[context.tok_to_orig_index[i] for i in split_token_indices],
+                    is_max_context=[
+                        QADataset.check_is_max_context(doc_spans, doc_span_index, i) for i in split_token_indices
+                    ],
+                )
+            )
+
+        # doc spans depend on query length, so features of several doc span splits of a context are cached
+        if self.context_cache is not None:
+            context.doc_span_features[doc_spans] = doc_span_features
+        return doc_span_features
+
     def _convert_examples_to_features(self):
         """ Converts loaded examples to features """
 
@@ -117,6 +238,7 @@ class BERTQADataset(QADataset):
         has_groundtruth = self.mode != INFERENCE_MODE
         unique_id = 1000000000
         text_to_tokens_dict = {}
+        sep_ids = self.tokenizer.tokens_to_ids([self.tokenizer.sep_token])
         self.features = []
 
         for example_index in trange(len(self.examples)):
@@ -131,46 +253,27 @@ class BERTQADataset(QADataset):
                 ]
             query_tokens = text_to_tokens_dict[example.question_text]
 
-            # context: index of token -> index of word
-            tok_to_orig_index = []
-
+            context = self._get_context(self.processor.doc_id_to_context_text[example.context_id], text_to_tokens_dict)
+            # doc tokens is word separated context
+            doc_tokens = context.doc_tokens
             # context: index of word -> index of first token in token list
-            orig_to_tok_index = []
-
+            orig_to_tok_index = context.orig_to_tok_index
             # context without white spaces after tokenization
-            all_doc_tokens = []
+            all_doc_tokens = context.all_doc_tokens
 
-            # doc tokens is word separated context
-            (
-                doc_tokens,
-                char_to_word_offset,
-                start_position,
-                end_position,
-                context_text,
-            ) = QADataset.get_doc_tokens_and_offset_from_context_id(
-                example.context_id,
-                example.start_position_character,
-                example.is_impossible,
-                example.answer_text,
-                self.processor.doc_id_to_context_text,
-            )
+            # start_position is index of word, end_position inclusive
+            start_position, end_position = 0, 0
+            if example.start_position_character is not None and not example.is_impossible:
+                char_to_word_offset = context.char_to_word_offset
+                start_position = char_to_word_offset[example.start_position_character]
+                end_position_character = example.start_position_character + len(example.answer_text) - 1
+                end_position = char_to_word_offset[min(end_position_character, len(char_to_word_offset) - 1)]
 
             example.start_position = start_position
             example.end_position = end_position
             if self.mode != TRAINING_MODE:
                 example.doc_tokens = doc_tokens
 
-            # the text to tokens step is the slowest step
-            for (i, token) in enumerate(doc_tokens):
-                orig_to_tok_index.append(len(all_doc_tokens))
-                if token not in text_to_tokens_dict:
-                    text_to_tokens_dict[token] = self.tokenizer.text_to_tokens(token)
-                sub_tokens = text_to_tokens_dict[token]
-
-                for sub_token in sub_tokens:
-                    tok_to_orig_index.append(i)
-                    all_doc_tokens.append(sub_token)
-
             # idx of query token start and end in context
             tok_start_position = None
             tok_end_position = None
@@ -198,28 +301,27 @@ class BERTQADataset(QADataset):
 
             # make compatible for hashing
             doc_spans = tuple(doc_spans)
+            doc_span_features = self._get_doc_span_features(context, doc_spans)
 
-            for (doc_span_index, doc_span) in enumerate(doc_spans):
+            query_ids = self.tokenizer.tokens_to_ids(
+                [self.tokenizer.cls_token] + query_tokens + [self.tokenizer.sep_token]
+            )
+            for (doc_span_index, (doc_span, doc_span_feature)) in enumerate(zip(doc_spans, doc_span_features)):
 
                 tokens = [self.tokenizer.cls_token] + query_tokens + [self.tokenizer.sep_token]
-                segment_ids = [0 for i in range(len(tokens))]
-
-                token_is_max_context = {}
+                doc_offset = len(tokens)
+                segment_ids = [0] * doc_offset + [1] * (len(doc_span_feature.tokens) + 1)
 
                 # maps context tokens idx in final input -> word idx in context
-                token_to_orig_map = {}
-
-                for i in range(doc_span.length):
-                    split_token_index = doc_span.start + i
-                    token_to_orig_map[len(tokens)] = tok_to_orig_index[split_token_index]
-                    is_max_context = QADataset.check_is_max_context(doc_spans, doc_span_index, split_token_index)
-                    token_is_max_context[len(tokens)] = is_max_context
-                    tokens.append(all_doc_tokens[split_token_index])
-                    segment_ids.append(1)
-                tokens.append(self.tokenizer.sep_token)
-                segment_ids.append(1)
-
-                input_ids = self.tokenizer.tokens_to_ids(tokens)
+                token_to_orig_map = {
+                    doc_offset + i: orig_index for i, orig_index in enumerate(doc_span_feature.orig_indices)
+                }
+                token_is_max_context = {
+                    doc_offset + i: is_max_context for i, is_max_context in enumerate(doc_span_feature.is_max_context)
+                }
+                tokens += doc_span_feature.tokens + [self.tokenizer.sep_token]
+
+                input_ids = query_ids + doc_span_feature.input_ids + sep_ids
 
                 # The mask has 1 for real tokens and 0 for padding tokens.
                 # Only real tokens are attended to.
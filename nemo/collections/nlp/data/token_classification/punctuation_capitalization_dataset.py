@@ -48,6 +48,10 @@ from tqdm import tqdm
 
 from nemo.collections.common.tokenizers.tokenizer_spec import TokenizerSpec
 from nemo.collections.nlp.data.data_utils.data_preprocessing import get_label_stats, get_stats
+from nemo.collections.nlp.data.token_classification.punctuation_capitalization_mmap_features import (
+    MMAP_FEATURES_IDX_SUFFIX,
+    PunctuationCapitalizationMMapFeatures,
+)
 from nemo.core.classes import Dataset
 from nemo.core.neural_types import AudioSignal, ChannelType, LabelsType, LengthsType, MaskType, NeuralType
 from nemo.utils import logging
@@ -159,6 +163,12 @@ class PunctuationCapitalizationDataConfigBase:
     ``cache_dir`` and ``label_info_save_dir`` are separate parameters for the case when a cache is ready and this cache
     is stored in a read only directory. In this case you will separate ``label_info_save_dir``."""
 
+    use_mmap_features: bool = False
+    """Whether to save features into memory mapped ``.bin`` and ``.idx`` files instead of a pickle file. Memory mapped
+    features are opened without loading them into memory, so a dataset is set up quickly in all processes and data
+    loader workers share features via OS page cache. Batches are padded when they are requested instead of during
+    dataset creation. Cannot be used together with ``use_audio``."""
+
     get_label_frequences: bool = False
     """Whether to show and save label frequencies. Frequencies are showed if ``verbose`` parameter is ``True``. If
     ``get_label_frequencies=True``, then frequencies are saved into ``label_info_save_dir``"""
@@ -1003,6 +1013,10 @@ class BertPunctuationCapitalizationDataset(Dataset):
         sample_rate (:obj:`int`, `optional`, defaults to :obj:`None`): sample rate of audios. Can be used for up sampling or down sampling of audio.
         use_bucketing (:obj:`bool`, `optional`, defaults to :obj: `True`): If set to False dataset will return ``batch_size`` batches instead of ``number_of_tokens`` tokens.
         preload_audios (:obj:`bool`, `optional`, defaults to :obj: `True`): If set to True batches will include waveforms, if set to False will store audio_filepaths instead and load audios during ``collate_fn`` call
+        use_mmap_features (:obj:`bool`, `optional`, defaults to :obj:`False`): whether to store features in memory
+            mapped ``.bin`` and ``.idx`` files in ``cache_dir`` instead of a pickle file. Memory mapped features are
+            not loaded into memory and are shared by data loader workers. Batches are padded in :meth:`__getitem__`.
+            Cannot be used if ``use_audio=True``.
     """
 
     @property
@@ -1062,6 +1076,7 @@ class BertPunctuationCapitalizationDataset(Dataset):
         sample_rate: Optional[int] = None,
         use_bucketing: Optional[bool] = True,
         preload_audios: Optional[bool] = True,
+        use_mmap_features: bool = False,
     ) -> None:
         """ Initializes BertPunctuationCapitalizationDataset. """
         if isinstance(punct_label_ids, DictConfig):
@@ -1082,6 +1097,7 @@ class BertPunctuationCapitalizationDataset(Dataset):
             use_audio,
             audio_file,
             sample_rate,
+            use_mmap_features,
         )
 
         if punct_label_vocab_file is not None:
@@ -1110,13 +1126,19 @@ class BertPunctuationCapitalizationDataset(Dataset):
         self.sample_rate = sample_rate
         self.use_bucketing = use_bucketing
         self.preload_audios = preload_audios
+        self.use_mmap_features = use_mmap_features
 
         master_device = is_global_rank_zero()
         self.features_pkl = self._get_path_to_pkl_features(
             self.text_file, self.labels_file, cache_dir, max_seq_length, num_samples
         )
+        if use_mmap_features:
+            self.features_file = self.features_pkl.with_suffix(MMAP_FEATURES_IDX_SUFFIX)
+        else:
+            self.features_file = self.features_pkl
         features = None
-        if master_device and not (self.features_pkl.is_file() and use_cache):
+        self.mmap_features: Optional[PunctuationCapitalizationMMapFeatures] = None
+        if master_device and not (self.features_file.is_file() and use_cache):
             if verbose:
                 logging.info(
                     f'Processing {self.text_file}' + f' {self.audio_file if self.audio_file else ""} '.rstrip()
@@ -1159,27 +1181,60 @@ class BertPunctuationCapitalizationDataset(Dataset):
                 sample_rate=self.sample_rate,
                 preload_audios=self.preload_audios,
             )
-            self.features_pkl.parent.mkdir(parents=True, exist_ok=True)
+            if use_mmap_features:
+                input_ids, subtokens_mask, _, _, _, punct_labels, capit_labels = features
+                self.mmap_features = PunctuationCapitalizationMMapFeatures.save(
+                    self.features_file.with_suffix(''),
+                    input_ids,
+                    subtokens_mask,
+                    punct_labels,
+                    capit_labels,
+                    punct_label_ids,
+                    capit_label_ids,
+                )
+                # features are read from memory mapped files so that the master process uses as little memory as
+                # other processes
+                features = None
+                del input_ids, subtokens_mask, punct_labels, capit_labels
+            else:
+                self.features_pkl.parent.mkdir(parents=True, exist_ok=True)
 
-            # save features to a temp file first to make sure that non-master processes don't start reading the file
-            # until the master process is done with writing
-            ofd, tmp_features_pkl = tempfile.mkstemp(
-                suffix='.pkl', prefix=os.path.basename(self.features_pkl), dir=os.path.dirname(self.features_pkl)
-            )
-            with os.fdopen(ofd, 'wb') as temp_f:
-                pickle.dump(tuple(list(features) + [punct_label_ids, capit_label_ids]), temp_f)
+                # save features to a temp file first to make sure that non-master processes don't start reading the
+                # file until the master process is done with writing
+                ofd, tmp_features_pkl = tempfile.mkstemp(
+                    suffix='.pkl', prefix=os.path.basename(self.features_pkl), dir=os.path.dirname(self.features_pkl)
+                )
+                with os.fdopen(ofd, 'wb') as temp_f:
+                    pickle.dump(tuple(list(features) + [punct_label_ids, capit_label_ids]), temp_f)
 
-            os.rename(tmp_features_pkl, self.features_pkl)
+                os.rename(tmp_features_pkl, self.features_pkl)
 
             if self.verbose:
-                logging.info(f'Features saved to {self.features_pkl}')
+                logging.info(f'Features saved to {self.features_file}')
 
         # wait until the master process writes to the processed data files
         if not master_device:
-            while features is None and not os.path.exists(self.features_pkl):
+            while features is None and not os.path.exists(self.features_file):
                 sleep(10)
 
-        if features is None:
+        if use_mmap_features:
+            if self.mmap_features is None:
+                self.mmap_features = PunctuationCapitalizationMMapFeatures(self.features_file.with_suffix(''))
+                self._check_label_ids_loaded_from_pkl(
+                    punct_label_ids,
+                    capit_label_ids,
+                    self.mmap_features.punct_label_ids,
+                    self.mmap_features.capit_label_ids,
+                    punct_label_vocab_file,
+                    capit_label_vocab_file,
+                )
+                if tokenization_progress_queue is not None:
+                    tokenization_progress_queue.put(len(self.mmap_features))
+                if self.verbose:
+                    logging.info(f'Features restored from {self.features_file}')
+            punct_label_ids, capit_label_ids = self.mmap_features.punct_label_ids, self.mmap_features.capit_label_ids
+            features = (None,) * 7
+        elif features is None:
             features = pickle.load(self.features_pkl.open('rb'))
             li = features[-2:]
             self._check_label_ids_loaded_from_pkl(
@@ -1205,9 +1260,16 @@ class BertPunctuationCapitalizationDataset(Dataset):
         self.number_of_batches_is_multiple_of = number_of_batches_is_multiple_of
         self.batch_shuffling_random_state = np.random.RandomState(batch_shuffling_random_seed)
         if get_label_frequencies:
-            self.punct_label_frequencies = self._calculate_and_save_label_frequencies(self.punct_labels, 'punct')
-            self.capit_label_frequencies = self._calculate_and_save_label_frequencies(self.capit_labels, 'capit')
-        if self.use_bucketing:
+            if use_mmap_features:
+                punct_labels = [self.mmap_features.get_stream('punct_labels')]
+                capit_labels = [self.mmap_features.get_stream('capit_labels')]
+            else:
+                punct_labels, capit_labels = self.punct_labels, self.capit_labels
+            self.punct_label_frequencies = self._calculate_and_save_label_frequencies(punct_labels, 'punct')
+            self.capit_label_frequencies = self._calculate_and_save_label_frequencies(capit_labels, 'capit')
+        if use_mmap_features:
+            self.batches = self._mark_up_mmap_batches()
+        elif self.use_bucketing:
             self.batches = self._pack_into_batches(
                 input_ids=self.input_ids,
                 subtokens_mask=self.subtokens_mask,
@@ -1264,6 +1326,7 @@ class BertPunctuationCapitalizationDataset(Dataset):
         use_audio: bool = False,
         audio_file: Optional[Union[str, os.PathLike]] = None,
         sample_rate: Optional[int] = None,
+        use_mmap_features: bool = False,
     ) -> None:
         if torch.distributed.is_initialized() and torch.distributed.get_world_size() > 1 and not use_cache:
             raise ValueError(
@@ -1329,6 +1392,9 @@ class BertPunctuationCapitalizationDataset(Dataset):
         if use_audio and sample_rate < 1:
             raise ValueError(f'sample_rate set to {sample_rate} but it cannot be less than 1')
 
+        if use_audio and use_mmap_features:
+            raise ValueError("Parameters `use_audio` and `use_mmap_features` cannot be both `True`.")
+
     def _check_label_ids_loaded_from_pkl(
         self,
         parameter_punct_label_ids: Dict[str, int],
@@ -1340,7 +1406,7 @@ class BertPunctuationCapitalizationDataset(Dataset):
     ) -> None:
         if not isinstance(pkl_punct_label_ids, dict):
             raise ValueError(
-                f"Punctuation label ids loaded from features file {self.features_pkl} have wrong type "
+                f"Punctuation label ids loaded from features file {self.features_file} have wrong type "
                 f"{type(pkl_punct_label_ids)}"
             )
         if parameter_punct_label_ids is not None:
@@ -1351,11 +1417,11 @@ class BertPunctuationCapitalizationDataset(Dataset):
                     first_labels_desc="Punctuation labels passed in parameter `punct_label_ids`"
                     if punct_label_vocab_file is None
                     else f"Punctuation labels loaded from file {punct_label_vocab_file}",
-                    second_labels_desc=f"Punctuation label ids loaded from features file {self.features_pkl}",
+                    second_labels_desc=f"Punctuation label ids loaded from features file {self.features_file}",
                 )
         if not isinstance(pkl_capit_label_ids, dict):
             raise ValueError(
-                f"Capitalization label ids loaded from features file {self.features_pkl} has wrong type "
+                f"Capitalization label ids loaded from features file {self.features_file} has wrong type "
                 f"{type(pkl_capit_label_ids)}"
             )
         if parameter_capit_label_ids is not None:
@@ -1366,7 +1432,7 @@ class BertPunctuationCapitalizationDataset(Dataset):
                     first_labels_desc="Capitalization labels passed in parameter `capit_label_ids`"
                     if capit_label_vocab_file is None
                     else f"Capitalization labels loaded from file {capit_label_vocab_file}",
-                    second_labels_desc=f"Capitalization label ids loaded from features file {self.features_pkl}",
+                    second_labels_desc=f"Capitalization label ids loaded from features file {self.features_file}",
                 )
 
     @staticmethod
@@ -1446,9 +1512,13 @@ class BertPunctuationCapitalizationDataset(Dataset):
     def calc_batch_seq_length(queries: List[np.ndarray], length_is_multiple_of: int) -> int:
         return ceil(max([len(elem) for elem in queries]) / length_is_multiple_of) * length_is_multiple_of
 
+    @staticmethod
+    def _calc_batch_seq_length_from_lengths(lengths: Union[List[int], np.ndarray], length_is_multiple_of: int) -> int:
+        return ceil(max(lengths) / length_is_multiple_of) * length_is_multiple_of
+
     def _adjust_number_of_batches(
         self,
-        input_ids: List[np.ndarray],
+        lengths: Union[List[int], np.ndarray],
         batch_beginnings: List[int],
         batch_sizes: List[int],
         batch_seq_lengths: List[int],
@@ -1467,7 +1537,7 @@ class BertPunctuationCapitalizationDataset(Dataset):
         If dataset is too small to create enough batches, then a warning is shown.
 
         Args:
-            input_ids: tokenized queries of the dataset. `input_ids` are expected to be sorted by length in ascending
+            lengths: numbers of tokens in queries of the dataset. `lengths` are expected to be sorted in ascending
                 order.
             batch_beginnings: indices of first elements of batches created inside :meth:`_mark_up_batches` method.
                 Expected to be sorted in ascending order.
@@ -1476,7 +1546,7 @@ class BertPunctuationCapitalizationDataset(Dataset):
                 method.
 
         Returns:
-            batch_beginnings: a list of indices in ``input_ids`` of first samples of every batch
+            batch_beginnings: a list of indices in ``lengths`` of first samples of every batch
             batch_sizes: a list of numbers of samples in batches
             batch_seq_lengths: a list of sequence lengths after padding for every batch
         """
@@ -1512,15 +1582,17 @@ class BertPunctuationCapitalizationDataset(Dataset):
                         batch_sizes.append(ss)
                         batch_beginnings.append(bb + rb)
                         batch_seq_lengths.append(
-                            self.calc_batch_seq_length(input_ids[bb + rb : bb + rb + ss], length_is_multiple_of=8)
+                            self._calc_batch_seq_length_from_lengths(
+                                lengths[bb + rb : bb + rb + ss], length_is_multiple_of=8
+                            )
                         )
                         rb += ss
                         num_cut += 1
-                    assert len(input_ids[bb + rb : bb + bs]) > 0
+                    assert len(lengths[bb + rb : bb + bs]) > 0
                     batch_sizes[original_batch_index] = bs - rb
                     batch_beginnings[original_batch_index] = bb + rb
-                    batch_seq_lengths[original_batch_index] = self.calc_batch_seq_length(
-                        input_ids[bb + rb : bb + bs], length_is_multiple_of=8
+                    batch_seq_lengths[original_batch_index] = self._calc_batch_seq_length_from_lengths(
+                        lengths[bb + rb : bb + bs], length_is_multiple_of=8
                     )
                 original_batch_index -= 1
             # Keeping order of batches.
@@ -1535,7 +1607,16 @@ class BertPunctuationCapitalizationDataset(Dataset):
     def _mark_up_batches(self, input_ids: List[np.ndarray]) -> Tuple[List[int], List[int], List[int]]:
         """
         Computes indices of first samples in batch, batch sizes, seq lengths for batches. ``input_ids`` has to be
-        sorted by number of tokens in ascending order.
+        sorted by number of tokens in ascending order. See more in :meth:`_mark_up_batches_by_lengths`.
+        """
+        return self._mark_up_batches_by_lengths([len(inp) for inp in input_ids])
+
+    def _mark_up_batches_by_lengths(
+        self, lengths: Union[List[int], np.ndarray]
+    ) -> Tuple[List[int], List[int], List[int]]:
+        """
+        Computes indices of first samples in batch, batch sizes, seq lengths for batches. ``lengths`` has to be
+        sorted in ascending order.
 
         Batches are marked up with respect to following conditions:
             - total number of tokens in batch including paddings is less or equal to ``self.tokens_in_batch``
@@ -1546,11 +1627,10 @@ class BertPunctuationCapitalizationDataset(Dataset):
         ``self.batch_mark_up_progress_queue``. Otherwise, ``tqdm`` instance is created in this function.
 
         Args:
-            input_ids: a list of 1D int32 arrays. Elements of ``input_ids`` have to be sorted by length in ascending
-                order
+            lengths: numbers of tokens in queries sorted in ascending order
 
         Returns:
-            batch_beginnings: a list of indices in ``input_ids`` of first samples of every batch
+            batch_beginnings: a list of indices in ``lengths`` of first samples of every batch
             batch_sizes: a list of numbers of samples in batches
             batch_seq_lengths: a list of sequence lengths after padding for every batch
         """
@@ -1558,12 +1638,12 @@ class BertPunctuationCapitalizationDataset(Dataset):
         current_max_length = 0
         start = 0
         if self.batch_mark_up_progress_queue is None:
-            inp_iterator = tqdm(enumerate(input_ids), total=len(input_ids), desc="Batch mark up", unit="query")
+            inp_iterator = tqdm(enumerate(lengths), total=len(lengths), desc="Batch mark up", unit="query")
         else:
-            inp_iterator = enumerate(input_ids)
+            inp_iterator = enumerate(lengths)
             progress_made = 0
-        for i, inp in inp_iterator:
-            current_max_length = max(current_max_length, ceil(len(inp) / 8) * 8)
+        for i, length in inp_iterator:
+            current_max_length = max(current_max_length, ceil(length / 8) * 8)
             if current_max_length * (i + 1 - start) > self.tokens_in_batch:
                 batch_size = (i - start) // 8 * 8
                 if batch_size == 0:
@@ -1582,36 +1662,38 @@ class BertPunctuationCapitalizationDataset(Dataset):
                             f"{self.tokens_in_batch} tokens. Sequence number {i - 1} will not be added to batches."
                         )
                         start = i
-                        current_max_length = ceil(len(inp) / 8) * 8
+                        current_max_length = ceil(length / 8) * 8
                         continue
-                seq_length = self.calc_batch_seq_length(input_ids[start : start + batch_size], length_is_multiple_of=8)
+                seq_length = self._calc_batch_seq_length_from_lengths(
+                    lengths[start : start + batch_size], length_is_multiple_of=8
+                )
                 batch_beginnings.append(start)
                 batch_sizes.append(batch_size)
                 batch_seq_lengths.append(seq_length)
                 start += batch_size
-                current_max_length = self.calc_batch_seq_length(input_ids[start : i + 1], length_is_multiple_of=8)
+                current_max_length = self._calc_batch_seq_length_from_lengths(
+                    lengths[start : i + 1], length_is_multiple_of=8
+                )
             if self.batch_mark_up_progress_queue is not None:
                 progress_made += 1
                 if progress_made >= BATCH_MARK_UP_PROGRESS_REPORT_PERIOD:
                     self.batch_mark_up_progress_queue.put(progress_made)
                     progress_made = 0
-        if start < len(input_ids):
-            seq_length = self.calc_batch_seq_length(input_ids[start:], length_is_multiple_of=8)
+        if start < len(lengths):
+            seq_length = self._calc_batch_seq_length_from_lengths(lengths[start:], length_is_multiple_of=8)
             batch_beginnings.append(start)
-            batch_sizes.append(len(input_ids) - start)
+            batch_sizes.append(len(lengths) - start)
             batch_seq_lengths.append(seq_length)
             if self.batch_mark_up_progress_queue is not None:
                 self.batch_mark_up_progress_queue.put(progress_made)
         if len(batch_beginnings) % self.number_of_batches_is_multiple_of:
             batch_beginnings, batch_sizes, batch_seq_lengths = self._adjust_number_of_batches(
-                input_ids, batch_beginnings, batch_sizes, batch_seq_lengths
+                lengths, batch_beginnings, batch_sizes, batch_seq_lengths
             )
-        assert sum(batch_sizes) == len(input_ids)
+        assert sum(batch_sizes) == len(lengths)
         for i in range(len(batch_beginnings) - 1):
             assert batch_beginnings[i] + batch_sizes[i] == batch_beginnings[i + 1]
-            assert batch_seq_lengths[i] >= max(
-                [len(inp) for inp in input_ids[batch_beginnings[i] : batch_beginnings[i] + batch_sizes[i]]]
-            )
+            assert batch_seq_lengths[i] >= max(lengths[batch_beginnings[i] : batch_beginnings[i] + batch_sizes[i]])
         return batch_beginnings, batch_sizes, batch_seq_lengths
 
     def _form_batches(
@@ -1814,11 +1896,77 @@ class BertPunctuationCapitalizationDataset(Dataset):
         self.batch_shuffling_random_state.shuffle(batches)
         return batches
 
+    def _mark_up_mmap_batches(self) -> Union[List[np.ndarray], np.ndarray]:
+        """
+        Splits memory mapped queries into batches which satisfy conditions described in :meth:`_pack_into_batches`.
+        Queries are taken from precomputed length buckets, so only query lengths are read. Batches are padded in
+        :meth:`__getitem__`. If ``self.use_bucketing`` is ``False``, then every query forms a batch.
+
+        Returns:
+            indices of queries in batches. Batches are shuffled.
+        """
+        if not self.use_bucketing:
+            return np.arange(len(self.mmap_features)).reshape(-1, 1)
+        order = self.mmap_features.get_length_sorted_order(self.batch_shuffling_random_state)
+        batch_beginnings, batch_sizes, _ = self._mark_up_batches_by_lengths(self.mmap_features.lengths[order].tolist())
+        batches = [order[start : start + size] for start, size in zip(batch_beginnings, batch_sizes)]
+        if self.batch_building_progress_queue is not None:
+            # batches are built lazily, so there is no batch building progress to report
+            self.batch_building_progress_queue.put(len(order))
+        self.batch_shuffling_random_state.shuffle(batches)
+        return batches
+
+    def _get_mmap_batch(self, idx: int) -> Dict[str, np.ndarray]:
+        """Reads queries of batch ``idx`` from memory mapped features and pads them as :meth:`_pack_into_batches`."""
+        input_ids, subtokens_mask, punct_labels, capit_labels = zip(
+            *[self.mmap_features.get_query(i) for i in self.batches[idx]]
+        )
+        if not self.use_bucketing:
+            return {
+                "input_ids": np.array(input_ids[0]),
+                "subtokens_mask": np.array(subtokens_mask[0]),
+                "punct_labels": punct_labels[0].astype(np.int64),
+                "capit_labels": capit_labels[0].astype(np.int64),
+            }
+        length = self._calc_batch_seq_length_from_lengths([len(inp) for inp in input_ids], length_is_multiple_of=8)
+        batch_input_ids = pad(input_ids, length, self.tokenizer.pad_id)
+        batch_subtokens_mask = pad(subtokens_mask, length, False)
+        batch = {
+            "input_ids": batch_input_ids,
+            "subtokens_mask": batch_subtokens_mask,
+            "punct_labels": pad(punct_labels, length, self.punct_label_ids[self.pad_label]).astype(np.int64),
+            "capit_labels": pad(capit_labels, length, self.capit_label_ids[self.pad_label]).astype(np.int64),
+        }
+        if self.add_masks_and_segment_ids_to_batch:
+            batch_segment_ids, batch_input_mask, batch_loss_mask = create_masks_and_segment_ids(
+                batch_input_ids,
+                batch_subtokens_mask,
+                self.tokenizer.pad_id,
+                self.tokenizer.cls_id,
+                self.tokenizer.sep_id,
+                self.ignore_start_end,
+                self.ignore_extra_tokens,
+            )
+            batch['segment_ids'] = batch_segment_ids
+            batch['input_mask'] = batch_input_mask
+            batch['loss_mask'] = batch_loss_mask
+        return batch
+
+    @property
+    def features_files(self) -> List[Path]:
+        """Paths to files with cached features"""
+        if self.use_mmap_features:
+            return [self.mmap_features.bin_file, self.mmap_features.idx_file]
+        return [self.features_pkl]
+
     def repack_batches_with_shuffle(self) -> None:
         """A function for proper shuffling of a dataset. Pytorch data loader shuffling will only permute batches."""
         if not self.use_bucketing:
             return
         logging.info("Shuffling training dataset")
+        if self.use_mmap_features:
+            self.batches = self._mark_up_mmap_batches()
+            return
         self.batches = self._pack_into_batches(
             self.input_ids,
             self.subtokens_mask,
@@ -1997,4 +2145,6 @@ class BertPunctuationCapitalizationDataset(Dataset):
               - ``'features_length'`` (:obj:`numpy.ndarray`) :obj:`np.long` array of number of samples per audio.
               - ``'audio_filepaths'`` (:obj:`List`) :obj:`str` contains paths of audio files if ``self.preload_audio`` set to ``False``
         """
+        if self.use_mmap_features:
+            return self._get_mmap_batch(idx)
         return self.batches[idx]
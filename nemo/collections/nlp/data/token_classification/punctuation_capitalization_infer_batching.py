@@ -0,0 +1,229 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Helpers for high throughput punctuation and capitalization inference: queries are tokenized at once, split into the
+same overlapping segments as in
+:class:`~nemo.collections.nlp.data.token_classification.punctuation_capitalization_infer_dataset.BertPunctuationCapitalizationInferDataset`,
+segments are sorted by length and packed into batches of at most ``max_tokens`` tokens, and word probabilities of
+overlapping segments are merged with numpy instead of query by query.
+"""
+
+from typing import List, Tuple
+
+import numpy as np
+
+from nemo.collections.common.tokenizers import AutoTokenizer, TokenizerSpec
+from nemo.collections.nlp.data.token_classification.punctuation_capitalization_infer_dataset import (
+    _check_max_seq_length_and_margin_and_step,
+)
+from nemo.collections.nlp.parts.token_budget_inference import pack_by_tokens
+
+__all__ = [
+    'get_subtokens_and_word_masks',
+    'InferSegments',
+    'get_infer_segments',
+    'pack_segments',
+    'collate_segments',
+    'WordLogProbAccumulator',
+]
+
+
+def _tokenize_words(words: List[str], tokenizer: TokenizerSpec) -> List[List[int]]:
+    """ Tokenizes words separately, with a single call to a fast HuggingFace tokenizer if possible """
+    if isinstance(tokenizer, AutoTokenizer) and getattr(tokenizer.tokenizer, 'is_fast', False) and words:
+        return tokenizer.tokenizer(words, add_special_tokens=False)['input_ids']
+    return [tokenizer.tokens_to_ids(tokenizer.text_to_tokens(word)) for word in words]
+
+
+def get_subtokens_and_word_masks(
+    queries: List[str], tokenizer: TokenizerSpec
+) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+    """
+    Tokenizes queries word by word. Every distinct word is tokenized once.
+
+    Returns:
+        token ids of queries and boolean masks which elements are ``True`` for the first token of every word
+    """
+    vocab = {}
+    query_word_ids = []
+    for query in queries:
+        query_word_ids.append(np.array([vocab.setdefault(word, len(vocab)) for word in query.strip().split()]))
+    word_token_ids = _tokenize_words(list(vocab), tokenizer)
+
+    all_token_ids, all_word_masks = [], []
+    for word_ids in query_word_ids:
+        token_ids = [token_id for word_id in word_ids for token_id in word_token_ids[word_id]]
+        lengths = np.array([len(word_token_ids[word_id]) for word_id in word_ids], dtype=np.int64)
+        word_mask = np.zeros(len(token_ids), dtype=bool)
+        word_mask[np.cumsum(lengths) - lengths] = True
+        all_token_ids.append(np.array(token_ids, dtype=np.int64))
+        all_word_masks.append(word_mask)
+    return all_token_ids, all_word_masks
+
+
+class InferSegments:
+    """
+    Overlapping segments of queries.
+
+    Args:
+        input_ids: token ids of segments with ``[CLS]`` and ``[SEP]`` tokens
+        word_masks: boolean masks which elements are ``True`` for the first token of a word
+        query_ids: indices of queries to which segments belong
+        first_word_ids: indices of the first word of segments in all words of all queries
+        is_first: whether a segment is the first segment of a query
+        is_last: whether a segment is the last segment of a query
+        query_word_offsets: indices of the first word of queries in all words of all queries, with the total number
+            of words as the last element
+    """
+
+    def __init__(
+        self,
+        input_ids: List[np.ndarray],
+        word_masks: List[np.ndarray],
+        query_ids: np.ndarray,
+        first_word_ids: np.ndarray,
+        is_first: np.ndarray,
+        is_last: np.ndarray,
+        query_word_offsets: np.ndarray,
+    ):
+        self.input_ids = input_ids
+        self.word_masks = word_masks
+        self.query_ids = query_ids
+        self.first_word_ids = first_word_ids
+        self.is_first = is_first
+        self.is_last = is_last
+        self.query_word_offsets = query_word_offsets
+
+    def __len__(self) -> int:
+        return len(self.input_ids)
+
+
+def get_infer_segments(
+    queries: List[str], tokenizer: TokenizerSpec, max_seq_length: int = 64, step: int = 8, margin: int = 16
+) -> InferSegments:
+    """
+    Splits queries into the segments of
+    :func:`~nemo.collections.nlp.data.token_classification.punctuation_capitalization_infer_dataset.get_features_infer`
+    for the same ``max_seq_length``, ``step`` and ``margin``.
+    """
+    all_token_ids, all_word_masks = get_subtokens_and_word_masks(queries, tokenizer)
+    _check_max_seq_length_and_margin_and_step(max_seq_length, margin, step)
+    max_query_length = max(len(token_ids) for token_ids in all_token_ids)
+    if max_seq_length > max_query_length + 2:
+        # every query fits into a single segment
+        max_seq_length = max_query_length + 2
+        step = 1
+        length = max_seq_length - 2
+    else:
+        length = max_seq_length - 2
+        step = min(length - margin * 2, step)
+
+    input_ids, word_masks, query_ids, first_word_ids, is_first, is_last = [], [], [], [], [], []
+    query_word_offsets = np.zeros(len(queries) + 1, dtype=np.int64)
+    np.cumsum([np.count_nonzero(word_mask) for word_mask in all_word_masks], out=query_word_offsets[1:])
+    for query_id, (token_ids, word_mask) in enumerate(zip(all_token_ids, all_word_masks)):
+        preceding_words = np.concatenate([[0], np.cumsum(word_mask)])
+        starts = range(0, max(len(token_ids), length) - length + step, step)
+        for i, start in enumerate(starts):
+            input_ids.append(
+                np.concatenate([[tokenizer.cls_id], token_ids[start : start + length], [tokenizer.sep_id]])
+            )
+            word_masks.append(np.concatenate([[False], word_mask[start : start + length], [False]]))
+            query_ids.append(query_id)
+            first_word_ids.append(query_word_offsets[query_id] + preceding_words[start])
+            is_first.append(i == 0)
+            is_last.append(i == len(starts) - 1)
+    return InferSegments(
+        input_ids=input_ids,
+        word_masks=word_masks,
+        query_ids=np.array(query_ids, dtype=np.int64),
+        first_word_ids=np.array(first_word_ids, dtype=np.int64),
+        is_first=np.array(is_first, dtype=bool),
+        is_last=np.array(is_last, dtype=bool),
+        query_word_offsets=query_word_offsets,
+    )
+
+
+def pack_segments(lengths: List[int], max_tokens: int) -> List[List[int]]:
+    """
+    Sorts segments by length, longest first, and packs them into batches of at most ``max_tokens`` tokens
+    including padding. A segment longer than ``max_tokens`` forms a batch on its own.
+
+    Returns:
+        indices of segments in every batch
+    """
+    return pack_by_tokens(lengths, max_tokens)
+
+
+def collate_segments(segments: InferSegments, batch: List[int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Pads segments of a batch with zeros.
+
+    Returns:
+        ``input_ids``, ``attention_mask`` and ``word_mask`` arrays of shape ``[len(batch), max_segment_length]``
+    """
+    lengths = np.array([len(segments.input_ids[i]) for i in batch])
+    attention_mask = np.arange(lengths.max()) < lengths[:, None]
+    input_ids = np.zeros(attention_mask.shape, dtype=np.int64)
+    input_ids[attention_mask] = np.concatenate([segments.input_ids[i] for i in batch])
+    word_mask = np.zeros(attention_mask.shape, dtype=bool)
+    word_mask[attention_mask] = np.concatenate([segments.word_masks[i] for i in batch])
+    return input_ids, attention_mask.astype(np.int64), word_mask
+
+
+def _log_softmax(logits: np.ndarray) -> np.ndarray:
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    return logits - np.log(np.exp(logits).sum(axis=-1, keepdims=True))
+
+
+class WordLogProbAccumulator:
+    """
+    Accumulates punctuation or capitalization word log probabilities of segments. Log probabilities of a word from
+    overlapping segments are summed, which selects the same label as the product of probabilities in
+    :meth:`~nemo.collections.nlp.models.PunctuationCapitalizationModel.add_punctuation_capitalization`.
+
+    Args:
+        segments: segments of all queries
+        num_labels: number of labels
+        margin: number of tokens near edges of segments which probabilities are discarded
+    """
+
+    def __init__(self, segments: InferSegments, num_labels: int, margin: int):
+        self.segments = segments
+        self.margin = margin
+        self.log_probs = np.zeros((segments.query_word_offsets[-1], num_labels), dtype=np.float64)
+
+    def update(self, batch: List[int], logits: np.ndarray, word_mask: np.ndarray, attention_mask: np.ndarray):
+        """
+        Args:
+            batch: indices of segments
+            logits: a float array of shape ``[len(batch), max_segment_length, num_labels]``
+            word_mask: a boolean array of shape ``[len(batch), max_segment_length]``
+            attention_mask: an array of shape ``[len(batch), max_segment_length]``
+        """
+        positions = np.arange(word_mask.shape[1])
+        lengths = attention_mask.sum(axis=1)
+        is_first, is_last = self.segments.is_first[batch], self.segments.is_last[batch]
+        # left margin with [CLS] token is removed unless a segment is the first one, same for right margin and [SEP]
+        keep = word_mask & ((positions >= self.margin + 1) | is_first[:, None])
+        keep &= (positions < (lengths - self.margin - 1)[:, None]) | is_last[:, None]
+        word_ids = self.segments.first_word_ids[batch][:, None] + np.cumsum(word_mask, axis=1) - 1
+        np.add.at(self.log_probs, word_ids[keep], _log_softmax(logits[keep].astype(np.float64)))
+
+    def get_query_predictions(self) -> List[List[int]]:
+        """ Returns label ids of words of every query """
+        predictions = self.log_probs.argmax(axis=-1)
+        offsets = self.segments.query_word_offsets
+        return [predictions[offsets[i] : offsets[i + 1]].tolist() for i in range(len(offsets) - 1)]
@@ -0,0 +1,228 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Memory mapped punctuation and capitalization features. Features of a dataset are stored in a pair of files:
+
+  - ``<prefix>.bin`` contains token ids, punctuation labels, capitalization labels and subtokens masks of all queries
+    as 4 contiguous streams;
+  - ``<prefix>.idx`` contains a header with label ids and stream dtypes, offsets and lengths of queries, and
+    queries ordered by length with boundaries of groups of queries of equal length (length buckets).
+
+Both files are opened with :class:`numpy.memmap`, so a dataset opens without reading features and all data loader
+workers share the same pages of the OS page cache.
+"""
+
+import json
+import os
+import struct
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+__all__ = ['MMAP_FEATURES_BIN_SUFFIX', 'MMAP_FEATURES_IDX_SUFFIX', 'PunctuationCapitalizationMMapFeatures']
+
+MMAP_FEATURES_BIN_SUFFIX = '.bin'
+MMAP_FEATURES_IDX_SUFFIX = '.idx'
+_IDX_MAGIC = b'PCMMIDX\x00'
+_IDX_VERSION = 1
+# magic, version, number of queries, total number of tokens, header length
+_IDX_HEADER = struct.Struct('<8sQQQQ')
+
+
+def _smallest_label_dtype(label_ids: Dict[str, int]) -> np.dtype:
+    return np.dtype(np.uint8) if max(label_ids.values()) < 2 ** 8 else np.dtype(np.int32)
+
+
+def _write_atomically(path: Path, chunks: List[Union[bytes, np.ndarray]]) -> None:
+    # readers wait for the ``.idx`` file, so the file has to appear only after it is fully written
+    fd, tmp_path = tempfile.mkstemp(suffix=path.suffix, prefix=path.name, dir=path.parent)
+    with os.fdopen(fd, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk if isinstance(chunk, bytes) else chunk.tobytes(order='C'))
+    os.replace(tmp_path, path)
+
+
+class PunctuationCapitalizationMMapFeatures:
+    """
+    Read only memory mapped features created by :meth:`save`. Memory maps are opened lazily and are not pickled, so
+    every data loader worker opens its own memory maps.
+
+    Args:
+        prefix: a path to features files without ``.bin`` and ``.idx`` suffixes
+    """
+
+    def __init__(self, prefix: Union[str, os.PathLike]) -> None:
+        self.prefix = Path(prefix)
+        with self.idx_file.open('rb') as f:
+            magic, version, self.num_queries, self.num_tokens, header_length = _IDX_HEADER.unpack(
+                f.read(_IDX_HEADER.size)
+            )
+            if magic != _IDX_MAGIC or version != _IDX_VERSION:
+                raise ValueError(
+                    f"File {self.idx_file} is not a punctuation and capitalization features index of version "
+                    f"{_IDX_VERSION}."
+                )
+            header = json.loads(f.read(header_length).decode('utf-8'))
+        self.punct_label_ids: Dict[str, int] = header['punct_label_ids']
+        self.capit_label_ids: Dict[str, int] = header['capit_label_ids']
+        self._label_dtypes = (np.dtype(header['punct_labels_dtype']), np.dtype(header['capit_labels_dtype']))
+        self._num_length_buckets = header['num_length_buckets']
+        self._arrays_offset = _IDX_HEADER.size + header_length
+        self._idx = None
+        self._bin = None
+
+    @property
+    def bin_file(self) -> Path:
+        return self.prefix.with_name(self.prefix.name + MMAP_FEATURES_BIN_SUFFIX)
+
+    @property
+    def idx_file(self) -> Path:
+        return self.prefix.with_name(self.prefix.name + MMAP_FEATURES_IDX_SUFFIX)
+
+    @classmethod
+    def save(
+        cls,
+        prefix: Union[str, os.PathLike],
+        input_ids: List[np.ndarray],
+        subtokens_mask: List[np.ndarray],
+        punct_labels: List[np.ndarray],
+        capit_labels: List[np.ndarray],
+        punct_label_ids: Dict[str, int],
+        capit_label_ids: Dict[str, int],
+    ) -> 'PunctuationCapitalizationMMapFeatures':
+        """
+        Saves features returned by
+        :func:`~nemo.collections.nlp.data.token_classification.punctuation_capitalization_dataset._get_features`
+        into ``<prefix>.bin`` and ``<prefix>.idx`` files and opens them.
+        """
+        prefix = Path(prefix)
+        prefix.parent.mkdir(parents=True, exist_ok=True)
+        lengths = np.array([len(inp) for inp in input_ids], dtype=np.int32)
+        offsets = np.zeros(len(lengths), dtype=np.int64)
+        np.cumsum(lengths[:-1], out=offsets[1:])
+        order = np.argsort(lengths, kind='stable')
+        bucket_starts = np.flatnonzero(np.diff(lengths[order], prepend=-1)).astype(np.int64)
+        bucket_starts = np.append(bucket_starts, len(lengths))
+        punct_dtype, capit_dtype = _smallest_label_dtype(punct_label_ids), _smallest_label_dtype(capit_label_ids)
+
+        def concatenate(arrays: List[np.ndarray], dtype: np.dtype) -> np.ndarray:
+            return np.concatenate(arrays).astype(dtype) if arrays else np.zeros(0, dtype=dtype)
+
+        features = cls.__new__(cls)
+        features.prefix = prefix
+        _write_atomically(
+            features.bin_file,
+            [
+                concatenate(input_ids, np.int32),
+                concatenate(punct_labels, punct_dtype),
+                concatenate(capit_labels, capit_dtype),
+                concatenate(subtokens_mask, np.bool_),
+            ],
+        )
+        header = json.dumps(
+            {
+                'punct_label_ids': punct_label_ids,
+                'capit_label_ids': capit_label_ids,
+                'punct_labels_dtype': punct_dtype.str,
+                'capit_labels_dtype': capit_dtype.str,
+                'num_length_buckets': len(bucket_starts) - 1,
+            }
+        ).encode('utf-8')
+        # arrays are aligned to 8 bytes
+        header += b' ' * (-(_IDX_HEADER.size + len(header)) % 8)
+        _write_atomically(
+            features.idx_file,
+            [
+                _IDX_HEADER.pack(_IDX_MAGIC, _IDX_VERSION, len(lengths), int(lengths.sum()), len(header)),
+                header,
+                offsets,
+                order.astype(np.int64),
+                bucket_starts,
+                lengths,
+            ],
+        )
+        return cls(prefix)
+
+    def _open(self) -> None:
+        n, num_tokens = self.num_queries, self.num_tokens
+        idx = np.memmap(self.idx_file, mode='r', order='C')
+        offset = self._arrays_offset
+        self._idx = {}
+        for name, dtype, count in [
+            ('offsets', np.int64, n),
+            ('order', np.int64, n),
+            ('bucket_starts', np.int64, self._num_length_buckets + 1),
+            ('lengths', np.int32, n),
+        ]:
+            self._idx[name] = np.frombuffer(idx, dtype=dtype, count=count, offset=offset)
+            offset += self._idx[name].nbytes
+        bin_ = np.memmap(self.bin_file, mode='r', order='C') if num_tokens else np.zeros(0, dtype=np.uint8)
+        self._bin = {}
+        offset = 0
+        for name, dtype in zip(
+            ['input_ids', 'punct_labels', 'capit_labels', 'subtokens_mask'],
+            [np.dtype(np.int32), *self._label_dtypes, np.dtype(np.bool_)],
+        ):
+            self._bin[name] = np.frombuffer(bin_, dtype=dtype, count=num_tokens, offset=offset)
+            offset += num_tokens * dtype.itemsize
+
+    def _get_idx_array(self, name: str) -> np.ndarray:
+        if self._idx is None:
+            self._open()
+        return self._idx[name]
+
+    def get_stream(self, name: str) -> np.ndarray:
+        """
+        Returns a flat array of ``'input_ids'``, ``'subtokens_mask'``, ``'punct_labels'``, or ``'capit_labels'`` of
+        all queries.
+        """
+        if self._bin is None:
+            self._open()
+        return self._bin[name]
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """Numbers of tokens in queries"""
+        return self._get_idx_array('lengths')
+
+    def get_query(self, i: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Returns views of input ids, subtokens mask, punctuation labels, and capitalization labels of query ``i``"""
+        start = self._get_idx_array('offsets')[i]
+        end = start + self.lengths[i]
+        return tuple(
+            self.get_stream(name)[start:end]
+            for name in ['input_ids', 'subtokens_mask', 'punct_labels', 'capit_labels']
+        )
+
+    def get_length_sorted_order(self, random_state: np.random.RandomState) -> np.ndarray:
+        """
+        Returns indices of queries sorted by length. Queries of equal length are shuffled with ``random_state``, so
+        the result is distributed as the result of stable sorting of shuffled queries.
+        """
+        order = np.array(self._get_idx_array('order'))
+        bucket_starts = self._get_idx_array('bucket_starts')
+        for start, end in zip(bucket_starts[:-1], bucket_starts[1:]):
+            random_state.shuffle(order[start:end])
+        return order
+
+    def __len__(self) -> int:
+        return self.num_queries
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state['_idx'], state['_bin'] = None, None
+        return state
@@ -232,6 +232,8 @@ def process_fragment(
             use_audio=use_audio,
             use_bucketing=True,
             preload_audios=use_audio,
+            # padded batches are created one by one while writing tar files instead of keeping all of them in memory
+            use_mmap_features=not use_audio,
         )
     finally:
         if tmp_text is not None and os.path.exists(tmp_text):
@@ -240,7 +242,6 @@ def process_fragment(
             os.remove(tmp_labels)
         if tmp_audio is not None and os.path.exists(tmp_audio):
             os.remove(tmp_audio)
-    dataset.features_pkl.unlink()
     tar_ctr = 0
     current_file_name = output_dir / TAR_FRAGMENT_TMPL_IN_PROGRESS.format(fragment_idx=fragment_idx, file_idx=tar_ctr)
     current_num_batches = 0
@@ -267,6 +268,8 @@ def process_fragment(
             current_num_batches = 0
             sink = wds.TarWriter(str(current_file_name))
     sink.close()
+    for features_file in dataset.features_files:
+        features_file.unlink()
     writing_to_tar_progress_queue.put(progress_made)
     if progress_made > 0:
         new_file_name = output_dir / TAR_FRAGMENT_TMPL_TO_REPACK.format(
@@ -13,8 +13,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
 import os
-from typing import Optional
+from typing import List, Optional
 
 import numpy as np
 import torch
@@ -32,6 +33,7 @@ from nemo.collections.nlp.data.dialogue.dataset.dialogue_nearest_neighbour_datas
 from nemo.collections.nlp.metrics.classification_report import ClassificationReport
 from nemo.collections.nlp.metrics.dialogue_metrics import DialogueGenerationMetrics
 from nemo.collections.nlp.models.nlp_model import NLPModel
+from nemo.collections.nlp.parts.utils_funcs import tensor2list
 from nemo.core.classes.common import PretrainedModelInfo
 from nemo.utils import logging
 
@@ -47,6 +49,10 @@ class DialogueNearestNeighbourModel(NLPModel):
         if self.cfg.library == "huggingface":
             self.language_model = AutoModel.from_pretrained(self.cfg.language_model.pretrained_model_name)
 
+        # embeddings of the last encoded label set, saved in the state dict with the model
+        self._label_embeddings = None
+        self._label_embeddings_key = None
+
     def _setup_dataloader_from_config(self, cfg: DictConfig, dataset_split) -> 'torch.utils.data.DataLoader':
         if self._cfg.dataset.task == "zero_shot":
             self.data_processor = DialogueAssistantDataProcessor(
@@ -100,6 +106,94 @@ class DialogueNearestNeighbourModel(NLPModel):
         input_mask_expanded = attention_mask.unsqueeze(-1).expand(token_embeddings.size()).float()
         return torch.sum(token_embeddings * input_mask_expanded, 1) / torch.clamp(input_mask_expanded.sum(1), min=1e-9)
 
+    def _encode(self, input_ids, attention_mask):
+        """ Returns normalized sentence embeddings """
+        output = self.forward(input_ids=input_ids, attention_mask=attention_mask)
+        sentence_embeddings = DialogueNearestNeighbourModel.mean_pooling(output, attention_mask)
+        return F.normalize(sentence_embeddings, p=2, dim=1)
+
+    def get_label_embeddings(self, label_input_ids, label_attention_mask):
+        """
+        Returns normalized embeddings of tokenized labels. Embeddings of the last label set are cached and
+        recomputed only if tokenized labels change.
+        """
+        md5 = hashlib.md5()
+        md5.update(label_input_ids.cpu().numpy().tobytes())
+        md5.update(label_attention_mask.cpu().numpy().tobytes())
+        key = md5.digest()
+        if self._label_embeddings is None or self._label_embeddings_key != key:
+            self._label_embeddings = self._encode(label_input_ids, label_attention_mask)
+            self._label_embeddings_key = key
+        self._label_embeddings = self._label_embeddings.to(label_input_ids.device)
+        return self._label_embeddings
+
+    def _save_to_state_dict(self, destination, prefix, keep_vars):
+        super()._save_to_state_dict(destination, prefix, keep_vars)
+        if self._label_embeddings is not None:
+            destination[prefix + 'label_embeddings'] = self._label_embeddings.detach()
+            destination[prefix + 'label_embeddings_key'] = torch.tensor(
+                list(self._label_embeddings_key), dtype=torch.uint8
+            )
+
+    def _load_from_state_dict(
+        self, state_dict, prefix, local_metadata, strict, missing_keys, unexpected_keys, error_msgs
+    ):
+        # checkpoints without cached label embeddings are loaded as well, the embeddings of the previous
+        # weights are dropped then
+        label_embeddings = state_dict.pop(prefix + 'label_embeddings', None)
+        label_embeddings_key = state_dict.pop(prefix + 'label_embeddings_key', None)
+        if label_embeddings is not None and label_embeddings_key is not None:
+            self._label_embeddings = label_embeddings
+            self._label_embeddings_key = bytes(label_embeddings_key.tolist())
+        else:
+            self._label_embeddings = None
+            self._label_embeddings_key = None
+        super()._load_from_state_dict(
+            state_dict, prefix, local_metadata, strict, missing_keys, unexpected_keys, error_msgs
+        )
+
+    @torch.no_grad()
+    def predict(self, queries: List[str], candidate_labels: List[str], batch_size: int = 64) -> List[str]:
+        """
+        Returns the candidate label with the most similar embedding for each query. Label embeddings are computed
+        once per label set, and every batch of queries is scored against all labels with one matrix multiplication.
+
+        Args:
+            queries: utterances to classify
+            candidate_labels: intents, formatted with ``prompt_template`` as in the dataset
+            batch_size: number of queries encoded at once
+        """
+        mode = self.training
+        device = next(self.parameters()).device
+        try:
+            self.eval()
+            label_inputs = self.tokenizer.tokenizer(
+                ["{} {}".format(self.cfg.dataset.prompt_template, label) for label in candidate_labels],
+                padding='max_length',
+                truncation=True,
+                return_tensors='pt',
+                max_length=self.cfg.dataset.max_seq_length,
+            )
+            label_embeddings = self.get_label_embeddings(
+                label_inputs['input_ids'].to(device), label_inputs['attention_mask'].to(device)
+            )
+            predictions = []
+            for start in range(0, len(queries), batch_size):
+                query_inputs = self.tokenizer.tokenizer(
+                    queries[start : start + batch_size],
+                    padding=True,
+                    truncation=True,
+                    return_tensors='pt',
+                    max_length=self.cfg.dataset.max_seq_length,
+                )
+                query_embeddings = self._encode(
+                    query_inputs['input_ids'].to(device), query_inputs['attention_mask'].to(device)
+                )
+                predictions.extend(tensor2list(torch.argmax(query_embeddings @ label_embeddings.T, dim=1)))
+        finally:
+            self.train(mode=mode)
+        return [candidate_labels[i] for i in predictions]
+
     def validation_step(self, batch, batch_idx, mode='val'):
         """
         Lightning calls this inside the validation loop with the data from the validation dataloader
@@ -109,11 +203,11 @@ class DialogueNearestNeighbourModel(NLPModel):
         preds = []
         gts = []
         inputs = []
+        # utterances of the batch are encoded at once, candidate labels are usually the same for all utterances
+        query_embeddings = self._encode(input_ids[:, 0], input_mask[:, 0])
         for i in range(input_ids.size(0)):
-            output = self.forward(input_ids=input_ids[i], attention_mask=input_mask[i])
-            sentence_embeddings = DialogueNearestNeighbourModel.mean_pooling(output, input_mask[i])
-            sentence_embeddings = F.normalize(sentence_embeddings, p=2, dim=1)
-            cos_sim = F.cosine_similarity(sentence_embeddings[:1, :], sentence_embeddings[1:, :])
+            label_embeddings = self.get_label_embeddings(input_ids[i, 1:], input_mask[i, 1:])
+            cos_sim = label_embeddings @ query_embeddings[i]
             pred = torch.argmax(cos_sim).item() + 1
             gt = torch.argmax(labels[i][1:]).item() + 1
 
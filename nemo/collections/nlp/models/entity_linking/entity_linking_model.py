@@ -12,8 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
+import numpy as np
 import torch
 from omegaconf import DictConfig
 from pytorch_lightning import Trainer
@@ -22,6 +23,7 @@ from transformers import AutoTokenizer
 from nemo.collections.common.losses import MultiSimilarityLoss
 from nemo.collections.nlp.data import EntityLinkingDataset
 from nemo.collections.nlp.models.nlp_model import NLPModel
+from nemo.collections.nlp.parts.embedding_index import EmbeddingIndexMixin
 from nemo.core.classes.common import typecheck
 from nemo.core.classes.exportable import Exportable
 from nemo.core.neural_types import LogitsType, NeuralType
@@ -30,11 +32,14 @@ from nemo.utils import logging
 __all__ = ['EntityLinkingModel']
 
 
-class EntityLinkingModel(NLPModel, Exportable):
+class EntityLinkingModel(NLPModel, Exportable, EmbeddingIndexMixin):
     """
     Second stage pretraining of BERT based language model
     for entity linking task. An implementation of Liu et. al's
     NAACL 2021 paper Self-Alignment Pretraining for Biomedical Entity Representations.
+
+    Entity names can be added to an embedding index with ``add_to_embedding_index``,
+    e.g. with concept ids as ids, and linked to mentions with ``query``.
     """
 
     @property
@@ -172,6 +177,43 @@ class EntityLinkingModel(NLPModel, Exportable):
             drop_last=cfg.get("drop_last", False),
         )
 
+    @torch.no_grad()
+    def encode_index_texts(self, texts: List[str], batch_size: int = 64, max_seq_length: int = 512) -> np.ndarray:
+        """
+        Returns fp16 normalized embeddings of entity names or mentions.
+        Texts are batched in the order of their lengths to reduce padding.
+        """
+        mode = self.training
+        self.eval()
+        try:
+            order = np.argsort([len(text) for text in texts], kind="stable")
+            embeddings = np.zeros((len(texts), self.hidden_size), dtype=np.float16)
+            for start in range(0, len(texts), batch_size):
+                batch = order[start : start + batch_size]
+                model_input = self.tokenizer(
+                    [texts[i] for i in batch],
+                    add_special_tokens=True,
+                    padding=True,
+                    truncation=True,
+                    max_length=max_seq_length,
+                    return_token_type_ids=True,
+                    return_attention_mask=True,
+                    return_tensors="pt",
+                )
+                logits = self.forward(
+                    input_ids=model_input["input_ids"].to(self.device),
+                    token_type_ids=model_input["token_type_ids"].to(self.device),
+                    attention_mask=model_input["attention_mask"].to(self.device),
+                )
+                embeddings[batch] = logits.float().cpu().numpy()
+        finally:
+            self.train(mode=mode)
+        return embeddings
+
+    def encode_queries(self, queries: List[str], batch_size: int = 64) -> np.ndarray:
+        """Mentions are encoded as entity names"""
+        return self.encode_index_texts(queries, batch_size=batch_size)
+
     @classmethod
     def list_available_models(cls) -> Optional[Dict[str, str]]:
         pass
@@ -12,8 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
+import numpy as np
 import torch
 from omegaconf import DictConfig
 from pytorch_lightning import Trainer
@@ -22,17 +23,21 @@ from nemo.collections.common.losses import SmoothedCrossEntropyLoss
 from nemo.collections.nlp.data import BertInformationRetrievalDataset
 from nemo.collections.nlp.models.information_retrieval.base_ir_model import BaseIRModel
 from nemo.collections.nlp.modules.common.tokenizer_utils import get_tokenizer
+from nemo.collections.nlp.parts.embedding_index import EmbeddingIndexMixin
 from nemo.core.classes.common import typecheck
 from nemo.core.neural_types import ChannelType, LogitsType, MaskType, NeuralType
 
 __all__ = ["BertDPRModel"]
 
 
-class BertDPRModel(BaseIRModel):
+class BertDPRModel(BaseIRModel, EmbeddingIndexMixin):
     """
     Information retrieval model which encodes query and passage separately
     with two different BERT encoders and computes their similarity score
     as a dot-product between corresponding [CLS] token representations.
+
+    Passages encoded with the passage encoder can be added to an embedding index
+    with ``add_to_embedding_index`` and retrieved for queries with ``query``.
     """
 
     @property
@@ -107,6 +112,64 @@ class BertDPRModel(BaseIRModel):
 
         return scores, loss
 
+    @torch.no_grad()
+    def _encode_texts(self, encoder, texts: List[str], max_length: int, batch_size: int) -> np.ndarray:
+        """
+        Encodes texts as [CLS] text [SEP] and returns fp16 [CLS] token representations.
+        Texts are batched in the order of their lengths to reduce padding.
+        """
+        mode = self.training
+        self.eval()
+        try:
+            token_ids = [self.tokenizer.text_to_ids(text)[:max_length] for text in texts]
+            order = np.argsort([len(ids) for ids in token_ids], kind="stable")
+            embeddings = np.zeros((len(texts), encoder.config.hidden_size), dtype=np.float16)
+            for start in range(0, len(texts), batch_size):
+                batch = order[start : start + batch_size]
+                input_ids = torch.full(
+                    (len(batch), max(len(token_ids[i]) for i in batch) + 2), self.tokenizer.pad_id, dtype=torch.long
+                )
+                for row, i in enumerate(batch):
+                    bert_input = [self.tokenizer.cls_id] + token_ids[i] + [self.tokenizer.sep_id]
+                    input_ids[row, : len(bert_input)] = torch.tensor(bert_input)
+                input_ids = input_ids.to(self.device)
+                vectors = encoder(
+                    input_ids=input_ids,
+                    token_type_ids=torch.zeros_like(input_ids),
+                    attention_mask=(input_ids != self.tokenizer.pad_id).long(),
+                )[:, 0]
+                embeddings[batch] = vectors.float().cpu().numpy()
+        finally:
+            self.train(mode=mode)
+        return embeddings
+
+    def _get_max_length(self, name: str, default: int) -> int:
+        """Returns the maximum query or passage length of the training dataset config"""
+        train_ds = self._cfg.get("train_ds", None)
+        return train_ds.get(name, default) if train_ds is not None else default
+
+    def encode_index_texts(
+        self, texts: List[str], batch_size: int = 64, max_passage_length: Optional[int] = None
+    ) -> np.ndarray:
+        """
+        Encodes passages with the passage encoder, passages are truncated to ``max_passage_length`` tokens,
+        by default the length of the passages in training
+        """
+        if max_passage_length is None:
+            max_passage_length = self._get_max_length("max_passage_length", 190)
+        return self._encode_texts(self.p_encoder, texts, max_passage_length, batch_size)
+
+    def encode_queries(
+        self, queries: List[str], batch_size: int = 64, max_query_length: Optional[int] = None
+    ) -> np.ndarray:
+        """
+        Encodes queries with the query encoder, queries are truncated to ``max_query_length`` tokens,
+        by default the length of the queries in training
+        """
+        if max_query_length is None:
+            max_query_length = self._get_max_length("max_query_length", 31)
+        return self._encode_texts(self.q_encoder, queries, max_query_length, batch_size)
+
     def _setup_dataloader_from_config(self, cfg: DictConfig):
 
         dataset = BertInformationRetrievalDataset(
@@ -30,6 +30,11 @@ from nemo.collections.nlp.data.intent_slot_classification import (
 from nemo.collections.nlp.metrics.classification_report import ClassificationReport
 from nemo.collections.nlp.models.nlp_model import NLPModel
 from nemo.collections.nlp.modules.common import SequenceTokenClassifier
+from nemo.collections.nlp.parts.token_budget_inference import (
+    iterate_token_budget_batches,
+    pad_sequences,
+    tokenize_in_threads,
+)
 from nemo.collections.nlp.parts.utils_funcs import tensor2list
 from nemo.core.classes import typecheck
 from nemo.core.classes.common import PretrainedModelInfo
@@ -368,12 +373,90 @@ class IntentSlotClassificationModel(NLPModel):
             drop_last=test_ds.drop_last,
         )
 
-    def predict_from_examples(self, queries: List[str], test_ds) -> List[List[str]]:
+    @staticmethod
+    def _convert_predictions_to_labels(intent_logits, slot_logits, subtokens_mask, intent_labels, slot_labels):
+        """ Converts numerical outputs to Intent and Slot labels from the dictionaries """
+        predicted_intents = []
+        predicted_slots = []
+
+        # intents
+        intent_preds = tensor2list(torch.argmax(intent_logits, axis=-1))
+        for intent_num in intent_preds:
+            if intent_num < len(intent_labels):
+                predicted_intents.append(intent_labels[int(intent_num)])
+            else:
+                # should not happen
+                predicted_intents.append("Unknown Intent")
+
+        # slots
+        slot_preds = torch.argmax(slot_logits, axis=-1)
+
+        for slot_preds_query, mask_query in zip(slot_preds, subtokens_mask):
+            query_slots = ''
+            for slot, mask in zip(slot_preds_query, mask_query):
+                if mask == 1:
+                    if slot < len(slot_labels):
+                        query_slots += slot_labels[int(slot)] + ' '
+                    else:
+                        query_slots += 'Unknown_slot '
+            predicted_slots.append(query_slots.strip())
+        return predicted_intents, predicted_slots
+
+    def _query_to_input_ids_and_subtokens_mask(self, query: str):
+        """ Tokenizes a query as intent_slot_classification_dataset.get_features without padding """
+        subtokens = [self.tokenizer.cls_token]
+        subtokens_mask = [0]
+        for word in query.strip().split():
+            word_tokens = self.tokenizer.text_to_tokens(word)
+
+            # to handle emojis that could be neglected during tokenization
+            if len(word.strip()) > 0 and len(word_tokens) == 0:
+                word_tokens = [self.tokenizer.ids_to_tokens(self.tokenizer.unk_id)]
+
+            subtokens.extend(word_tokens)
+            subtokens_mask.extend([1] + [0] * (len(word_tokens) - 1))
+        subtokens.append(self.tokenizer.sep_token)
+        subtokens_mask.append(0)
+        return self.tokenizer.tokens_to_ids(subtokens), subtokens_mask
+
+    @torch.inference_mode()
+    def _predict_by_tokens(self, queries: List[str], max_tokens: int, num_tokenizer_threads: int):
+        """ Predicts intents and slots of queries in length sorted batches of at most max_tokens padded tokens """
+        predicted_intents = [None] * len(queries)
+        predicted_slots = [None] * len(queries)
+        device = next(self.parameters()).device
+        features = tokenize_in_threads(queries, self._query_to_input_ids_and_subtokens_mask, num_tokenizer_threads)
+        input_ids = [feature[0] for feature in features]
+        for batch, batch_input_ids, attention_mask in iterate_token_budget_batches(
+            input_ids, max_tokens, device, pad_id=self.tokenizer.pad_id
+        ):
+            intent_logits, slot_logits = self.forward(
+                input_ids=batch_input_ids,
+                token_type_ids=torch.zeros_like(batch_input_ids),
+                attention_mask=attention_mask,
+            )
+            batch_intents, batch_slots = self._convert_predictions_to_labels(
+                intent_logits,
+                slot_logits,
+                pad_sequences([features[i][1] for i in batch]),
+                self.cfg.data_desc.intent_labels,
+                self.cfg.data_desc.slot_labels,
+            )
+            for i, intent, slots in zip(batch, batch_intents, batch_slots):
+                predicted_intents[i], predicted_slots[i] = intent, slots
+        return predicted_intents, predicted_slots
+
+    def predict_from_examples(
+        self, queries: List[str], test_ds, max_tokens: Optional[int] = None, num_tokenizer_threads: int = 4
+    ) -> List[List[str]]:
         """
         Get prediction for the queries (intent and slots)
         Args:
             queries: text sequences
             test_ds: Dataset configuration section.
+            max_tokens: if set, queries are sorted by length and packed into batches of at most max_tokens padded
+                tokens instead of batches of test_ds.batch_size queries in the input order
+            num_tokenizer_threads: number of threads tokenizing queries if max_tokens is set
         Returns:
             predicted_intents, predicted_slots: model intent and slot predictions
         """
@@ -397,6 +480,9 @@ class IntentSlotClassificationModel(NLPModel):
             self.eval()
             self.to(device)
 
+            if max_tokens is not None:
+                return self._predict_by_tokens(queries, max_tokens, num_tokenizer_threads)
+
             # Dataset.
             infer_datalayer = self._setup_infer_dataloader(queries, test_ds)
 
@@ -410,29 +496,11 @@ class IntentSlotClassificationModel(NLPModel):
                 )
 
                 # predict intents and slots for these examples
-                # intents
-                intent_preds = tensor2list(torch.argmax(intent_logits, axis=-1))
-
-                # convert numerical outputs to Intent and Slot labels from the dictionaries
-                for intent_num in intent_preds:
-                    if intent_num < len(intent_labels):
-                        predicted_intents.append(intent_labels[int(intent_num)])
-                    else:
-                        # should not happen
-                        predicted_intents.append("Unknown Intent")
-
-                # slots
-                slot_preds = torch.argmax(slot_logits, axis=-1)
-
-                for slot_preds_query, mask_query in zip(slot_preds, subtokens_mask):
-                    query_slots = ''
-                    for slot, mask in zip(slot_preds_query, mask_query):
-                        if mask == 1:
-                            if slot < len(slot_labels):
-                                query_slots += slot_labels[int(slot)] + ' '
-                            else:
-                                query_slots += 'Unknown_slot '
-                    predicted_slots.append(query_slots.strip())
+                batch_intents, batch_slots = self._convert_predictions_to_labels(
+                    intent_logits, slot_logits, subtokens_mask, intent_labels, slot_labels
+                )
+                predicted_intents.extend(batch_intents)
+                predicted_slots.extend(batch_slots)
 
         finally:
             # set mode back to its original value
@@ -27,6 +27,7 @@ from nemo.collections.nlp.data.language_modeling.megatron.megatron_batch_sampler
 )
 from nemo.collections.nlp.models.language_modeling.megatron.gpt_model import GPTModel
 from nemo.collections.nlp.models.language_modeling.megatron_base_model import MegatronBaseModel
+from nemo.collections.nlp.modules.common.megatron.kv_prefix_cache import KVPrefixCache
 from nemo.collections.nlp.modules.common.megatron.module import Float16Module
 from nemo.collections.nlp.modules.common.megatron.utils import (
     average_losses_across_data_parallel_group,
@@ -138,6 +139,8 @@ class MegatronGPTModel(MegatronBaseModel, TextGeneration):
 
         # configuration used for inference
         self._inference_config = None
+        # cache of the key-value memory of context prefixes shared by generation requests
+        self.kv_prefix_cache = None
 
     def set_inference_config(self, inference_config):
         self._inference_config = inference_config
@@ -145,6 +148,19 @@ class MegatronGPTModel(MegatronBaseModel, TextGeneration):
     def get_inference_config(self):
         return self._inference_config
 
+    def set_kv_prefix_cache(self, max_tokens: int, min_prefix_length: int = 1):
+        """
+        Enables reusing the key-value memory of context prefixes (e.g. shared system prompts) across
+        generation requests. Set max_tokens to 0 to disable it.
+        Args:
+            max_tokens (int): maximum number of cached prefix tokens
+            min_prefix_length (int): shortest prefix that is worth reusing
+        """
+        if max_tokens > 0:
+            self.kv_prefix_cache = KVPrefixCache(max_tokens, min_prefix_length)
+        else:
+            self.kv_prefix_cache = None
+
     def model_provider_func(self, pre_process, post_process):
         """Model depends on pipeline paralellism."""
         model = GPTModel(
@@ -25,6 +25,7 @@ from pytorch_lightning.trainer.trainer import Trainer
 from torch import Tensor
 
 from nemo.collections.nlp.data.language_modeling.megatron.gpt_prompt_learning_dataset import GPTPromptLearningDataset
+from nemo.collections.nlp.data.language_modeling.megatron.packed_dataset import PackedSequenceDataset
 from nemo.collections.nlp.models.language_modeling.megatron_base_model import MegatronBaseModel
 from nemo.collections.nlp.models.language_modeling.megatron_gpt_model import MegatronGPTModel
 from nemo.collections.nlp.modules.common import (
@@ -500,18 +501,17 @@ class MegatronGPTPromptLearningModel(MegatronBaseModel, TextGeneration):
             taskname_embeddings = self.word_embeddings(taskname_ids)
             virtual_token_embeds = self.prompt_encoder(taskname_embeddings=taskname_embeddings)
 
-        # Create index template specifying where virtual token embeddings should be placed
-        batch_size, _, embedding_size = discrete_token_embeds.shape
-        virtual_token_index = virtual_token_locations.nonzero().reshape((batch_size, -1, 2))[:, :, 1][:, :, None]
-        virtual_token_index = virtual_token_index.expand(
-            batch_size, self.total_new_task_virtual_tokens, embedding_size
-        )
+        # Index of every virtual token within its prompt. Packed sequences hold several examples of the
+        # same task, so the virtual prompt repeats every `total_new_task_virtual_tokens` locations
+        batch_index, token_index = virtual_token_locations.nonzero(as_tuple=True)
+        prompt_index = (virtual_token_locations.cumsum(dim=1) - 1)[batch_index, token_index]
+        prompt_index = prompt_index % self.total_new_task_virtual_tokens
 
         # Make sure discrete_token_embeds and virtual_token_embeds share the same dtype
         discrete_token_embeds = discrete_token_embeds.type(virtual_token_embeds.dtype)
 
         # Insert virtual token embeddings where they belong amoung the discrete token embeddings
-        discrete_token_embeds.scatter_(1, virtual_token_index, virtual_token_embeds)
+        discrete_token_embeds[batch_index, token_index] = virtual_token_embeds[batch_index, prompt_index]
         input_embeds = discrete_token_embeds
 
         return input_embeds
@@ -768,6 +768,7 @@ class MegatronGPTPromptLearningModel(MegatronBaseModel, TextGeneration):
                 pin_memory=True,
                 cache_data_path=self.cfg.data.get('train_cache_data_path', None),
                 load_cache=self.cfg.data.get('load_cache', False),
+                pack_sequences=self.cfg.data.get('pack_sequences', False),
             )
 
     def setup_validation_data(self, validation_data_config=None):
@@ -823,6 +824,7 @@ class MegatronGPTPromptLearningModel(MegatronBaseModel, TextGeneration):
         get_dataset_only=False,
         cache_data_path=None,
         load_cache=False,
+        pack_sequences=False,
     ):
         dataset = GPTPromptLearningDataset(
             data=data,
@@ -841,6 +843,18 @@ class MegatronGPTPromptLearningModel(MegatronBaseModel, TextGeneration):
             load_cache=load_cache,
         )
 
+        if pack_sequences:
+            # Labels are shifted within each packed example, hence one token less than the model's sequence length
+            dataset = PackedSequenceDataset(
+                dataset,
+                max_seq_length=max_seq_length - 1,
+                length_fn=dataset.packed_length,
+                group_fn=dataset.packing_group,
+                shuffle_buffer_size=self.cfg.data.get('pack_shuffle_buffer_size', 1024),
+                shuffle=shuffle,
+                seed=self.cfg.get('seed', 1234),
+            )
+
         if get_dataset_only:
             return dataset
 
@@ -18,7 +18,7 @@ import os
 import random
 from math import ceil
 from pathlib import Path
-from typing import Dict, List, Optional, Union
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
 import numpy as np
 import torch
@@ -1047,9 +1047,15 @@ class MTEncDecModel(EncDecNLPModel, Exportable):
         decoder_tokenizer=None,
         device=None,
     ):
-        inputs = []
         processor = source_processor if not target else target_processor
         tokenizer = encoder_tokenizer if not target else decoder_tokenizer
+        inputs = cls.text_to_inference_ids(text, prepend_ids, processor, tokenizer)
+        return cls.pad_inference_ids(inputs, tokenizer.pad_id, device)
+
+    @classmethod
+    def text_to_inference_ids(cls, text, prepend_ids, processor, tokenizer) -> List[List[int]]:
+        """ Tokenizes sentences and adds <bos> and <eos> tokens """
+        inputs = []
         for txt in text:
             if processor is not None:
                 txt = processor.normalize(txt)
@@ -1057,16 +1063,115 @@ class MTEncDecModel(EncDecNLPModel, Exportable):
             ids = tokenizer.text_to_ids(txt)
             ids = prepend_ids + [tokenizer.bos_id] + ids + [tokenizer.eos_id]
             inputs.append(ids)
+        return inputs
+
+    @classmethod
+    def pad_inference_ids(cls, inputs, pad_id, device=None):
+        """ Pads a list of token ids to a batch of ids and its mask """
         max_len = max(len(txt) for txt in inputs)
-        src_ids_ = np.ones((len(inputs), max_len)) * tokenizer.pad_id
+        src_ids_ = np.ones((len(inputs), max_len)) * pad_id
         for i, txt in enumerate(inputs):
             src_ids_[i][: len(txt)] = txt
 
-        src_mask = torch.FloatTensor((src_ids_ != tokenizer.pad_id)).to(device)
+        src_mask = torch.FloatTensor((src_ids_ != pad_id)).to(device)
         src = torch.LongTensor(src_ids_).to(device)
 
         return src, src_mask
 
+    @staticmethod
+    def pack_inference_batches(lengths: List[int], max_tokens: int, beam_size: int = 1) -> List[List[int]]:
+        """
+        Sorts sentences by length and packs them into batches whose number of padded
+        source tokens times the beam size is at most max_tokens. A sentence exceeding
+        the budget on its own gets a batch of its own. Longer sentences come first,
+        so that a budget that does not fit into memory fails on the first batch.
+
+        Args:
+            lengths: number of tokens of every sentence
+            max_tokens: maximum number of padded source tokens times beam size in a batch
+            beam_size: number of hypotheses generated for every sentence
+        Returns:
+            list of batches, each one a list of sentence indices
+        """
+        batches, batch_len = [], 0
+        for idx in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+            if batches and (len(batches[-1]) + 1) * batch_len * beam_size <= max_tokens:
+                batches[-1].append(idx)
+            else:
+                batches.append([idx])
+                batch_len = lengths[idx]
+        return batches
+
+    def _setup_translation(self, source_lang: str = None, target_lang: str = None) -> List[int]:
+        """ Sets up the pre- and post-processing of the languages and returns the ids to prepend to the inputs """
+        # __TODO__: This will reset both source and target processors even if you want to reset just one.
+        if source_lang is not None or target_lang is not None:
+            self.source_processor, self.target_processor = MTEncDecModel.setup_pre_and_post_processing_utils(
+                source_lang, target_lang, self.encoder_tokenizer_library, self.decoder_tokenizer_library
+            )
+
+        prepend_ids = []
+        if self.multilingual:
+            if source_lang is None or target_lang is None:
+                raise ValueError("Expect source_lang and target_lang to infer for multilingual model.")
+            src_symbol = self.encoder_tokenizer.token_to_id('<' + source_lang + '>')
+            tgt_symbol = self.encoder_tokenizer.token_to_id('<' + target_lang + '>')
+            if src_symbol in self.multilingual_ids:
+                prepend_ids = [src_symbol]
+            elif tgt_symbol in self.multilingual_ids:
+                prepend_ids = [tgt_symbol]
+        return prepend_ids
+
+    def _translate_batches(
+        self, src_ids: List[List[int]], batches: List[List[int]], return_beam_scores: bool = False, cache={}
+    ) -> Iterator[Tuple[List[int], Union[List[str], Tuple[List[str], List[float], List[str]]]]]:
+        for indices in batches:
+            src, src_mask = self.pad_inference_ids(
+                [src_ids[i] for i in indices], self.encoder_tokenizer.pad_id, self.device
+            )
+            if return_beam_scores:
+                _, all_translations, scores, best_translations = self.batch_translate(
+                    src, src_mask, return_beam_scores=True, cache=cache,
+                )
+                yield indices, (all_translations, scores, best_translations)
+            else:
+                _, best_translations = self.batch_translate(src, src_mask, return_beam_scores=False, cache=cache)
+                yield indices, best_translations
+
+    @torch.no_grad()
+    def translate_stream(
+        self,
+        text: List[str],
+        source_lang: str = None,
+        target_lang: str = None,
+        return_beam_scores: bool = False,
+        max_tokens: int = 4096,
+    ) -> Iterator[Tuple[List[int], Union[List[str], Tuple[List[str], List[float], List[str]]]]]:
+        """
+        Translates list of sentences from source language to target language in batches of sentences
+        of similar length, and yields the translations of every batch as soon as it is done.
+        Args:
+            text: list of strings to translate
+            source_lang: if not "ignore", corresponding MosesTokenizer and MosesPunctNormalizer will be run
+            target_lang: if not "ignore", corresponding MosesDecokenizer will be run
+            return_beam_scores: if True, yields all the beam hypotheses and their scores as well.
+            max_tokens: maximum number of padded source tokens times beam size in a batch
+        Yields:
+            indices of the batch sentences in text and their translated strings,
+            or a tuple of all hypotheses, their scores and translated strings if return_beam_scores
+        """
+        prepend_ids = self._setup_translation(source_lang, target_lang)
+        src_ids = self.text_to_inference_ids(text, prepend_ids, self.source_processor, self.encoder_tokenizer)
+        batches = self.pack_inference_batches(
+            [len(ids) for ids in src_ids], max_tokens, getattr(self.beam_search, 'beam_size', 1)
+        )
+        mode = self.training
+        try:
+            self.eval()
+            yield from self._translate_batches(src_ids, batches, return_beam_scores=return_beam_scores)
+        finally:
+            self.train(mode=mode)
+
     @torch.no_grad()
     def translate(
         self,
@@ -1075,6 +1180,7 @@ class MTEncDecModel(EncDecNLPModel, Exportable):
         target_lang: str = None,
         return_beam_scores: bool = False,
         log_timing: bool = False,
+        max_tokens: Optional[int] = None,
     ) -> List[str]:
         """
         Translates list of sentences from source language to target language.
@@ -1085,26 +1191,13 @@ class MTEncDecModel(EncDecNLPModel, Exportable):
             target_lang: if not "ignore", corresponding MosesDecokenizer will be run
             return_beam_scores: if True, returns a list of translations and their corresponding beam scores.
             log_timing: if True, prints timing information.
+            max_tokens: if not None, sentences are sorted by length and translated in batches of at most
+                max_tokens padded source tokens times beam size, otherwise all of them in a single batch
         Returns:
             list of translated strings
         """
-        # __TODO__: This will reset both source and target processors even if you want to reset just one.
-        if source_lang is not None or target_lang is not None:
-            self.source_processor, self.target_processor = MTEncDecModel.setup_pre_and_post_processing_utils(
-                source_lang, target_lang, self.encoder_tokenizer_library, self.decoder_tokenizer_library
-            )
-
+        prepend_ids = self._setup_translation(source_lang, target_lang)
         mode = self.training
-        prepend_ids = []
-        if self.multilingual:
-            if source_lang is None or target_lang is None:
-                raise ValueError("Expect source_lang and target_lang to infer for multilingual model.")
-            src_symbol = self.encoder_tokenizer.token_to_id('<' + source_lang + '>')
-            tgt_symbol = self.encoder_tokenizer.token_to_id('<' + target_lang + '>')
-            if src_symbol in self.multilingual_ids:
-                prepend_ids = [src_symbol]
-            elif tgt_symbol in self.multilingual_ids:
-                prepend_ids = [tgt_symbol]
 
         if log_timing:
             timer = timers.NamedTimer()
@@ -1115,32 +1208,42 @@ class MTEncDecModel(EncDecNLPModel, Exportable):
             "timer": timer,
         }
 
+        src_ids = self.text_to_inference_ids(text, prepend_ids, self.source_processor, self.encoder_tokenizer)
+        if max_tokens is None:
+            batches = [list(range(len(src_ids)))]
+        else:
+            batches = self.pack_inference_batches(
+                [len(ids) for ids in src_ids], max_tokens, getattr(self.beam_search, 'beam_size', 1)
+            )
+
+        best_translations = [None] * len(src_ids)
+        all_translations = [None] * len(src_ids)
+        scores = [None] * len(src_ids)
         try:
             self.eval()
-            src, src_mask = MTEncDecModel.prepare_inference_batch(
-                text=text,
-                prepend_ids=prepend_ids,
-                target=False,
-                source_processor=self.source_processor,
-                target_processor=self.target_processor,
-                encoder_tokenizer=self.encoder_tokenizer,
-                decoder_tokenizer=self.decoder_tokenizer,
-                device=self.device,
-            )
-            if return_beam_scores:
-                _, all_translations, scores, best_translations = self.batch_translate(
-                    src, src_mask, return_beam_scores=True, cache=cache,
-                )
-                return_val = all_translations, scores, best_translations
-            else:
-                _, best_translations = self.batch_translate(src, src_mask, return_beam_scores=False, cache=cache)
-                return_val = best_translations
+            # restore the order of the input sentences
+            for indices, translations in self._translate_batches(src_ids, batches, return_beam_scores, cache):
+                if return_beam_scores:
+                    batch_all_translations, batch_scores, translations = translations
+                    beam_size = len(batch_all_translations) // len(indices)
+                    for i, idx in enumerate(indices):
+                        all_translations[idx] = batch_all_translations[i * beam_size : (i + 1) * beam_size]
+                        scores[idx] = batch_scores[i * beam_size : (i + 1) * beam_size]
+                for idx, translation in zip(indices, translations):
+                    best_translations[idx] = translation
         finally:
             self.train(mode=mode)
 
+        if return_beam_scores:
+            all_translations = list(itertools.chain.from_iterable(all_translations))
+            scores = list(itertools.chain.from_iterable(scores))
+            return_val = all_translations, scores, best_translations
+        else:
+            return_val = best_translations
+
         if log_timing:
             timing = timer.export()
-            timing["mean_src_length"] = src_mask.sum().cpu().item() / src_mask.shape[0]
+            timing["mean_src_length"] = sum(len(ids) for ids in src_ids) / len(src_ids)
             tgt, tgt_mask = self.prepare_inference_batch(
                 text=best_translations,
                 prepend_ids=prepend_ids,
@@ -12,8 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import bisect
 import collections
-from typing import List, Optional
+from typing import Dict, List, Optional, Union
 
 import numpy as np
 import torch
@@ -23,8 +24,8 @@ from transformers.models.bert.tokenization_bert import BasicTokenizer
 
 from nemo.collections.common.losses import SpanningLoss
 from nemo.collections.common.parts.utils import _compute_softmax
-from nemo.collections.nlp.data.question_answering.data_processor.qa_processing import QAProcessor
-from nemo.collections.nlp.data.question_answering.dataset.qa_bert_dataset import BERTQADataset
+from nemo.collections.nlp.data.question_answering.data_processor.qa_processing import INFERENCE_MODE, QAProcessor
+from nemo.collections.nlp.data.question_answering.dataset.qa_bert_dataset import BERTQAContextCache, BERTQADataset
 from nemo.collections.nlp.metrics.qa_metrics import QAMetrics
 from nemo.collections.nlp.models.question_answering.qa_base_model import BaseQAModel
 from nemo.collections.nlp.modules.common import TokenClassifier
@@ -32,6 +33,10 @@ from nemo.collections.nlp.parts.utils_funcs import tensor2list
 from nemo.core.classes.common import PretrainedModelInfo, typecheck
 from nemo.utils import logging
 
+_PrelimPrediction = collections.namedtuple(
+    "PrelimPrediction", ["feature_index", "start_index", "end_index", "start_logit", "end_logit"]
+)
+
 
 class BERTQAModel(BaseQAModel):
     """ BERT model with a QA (token classification) head """
@@ -51,6 +56,10 @@ class BERTQAModel(BaseQAModel):
 
         self.loss = SpanningLoss()
 
+        # contexts tokenized during inference, shared by calls of ``inference`` with ``cache_contexts=True``
+        self._context_cache = BERTQAContextCache()
+        self._use_context_cache = False
+
     def training_step(self, batch, batch_idx):
         input_ids, input_type_ids, input_mask, unique_ids, start_positions, end_positions = batch
         logits = self.forward(input_ids=input_ids, token_type_ids=input_type_ids, attention_mask=input_mask)
@@ -165,6 +174,8 @@ class BERTQAModel(BaseQAModel):
         num_samples: int = -1,
         output_nbest_file: Optional[str] = None,
         output_prediction_file: Optional[str] = None,
+        cache_contexts: bool = False,
+        batched_span_search: bool = False,
     ):
         """
         Get prediction for unlabeled inference data
@@ -175,6 +186,10 @@ class BERTQAModel(BaseQAModel):
             num_samples: number of samples to use of inference data. Default: -1 if all data should be used.
             output_nbest_file: optional output file for writing out nbest list
             output_prediction_file: optional output file for writing out predictions
+            cache_contexts: whether to reuse tokenized contexts and doc span features across questions and across
+                calls of ``inference``. Useful if many questions are asked about the same documents.
+            batched_span_search: whether to search for best answer spans of all questions with tensor operations
+                instead of per question Python loops. See :meth:`get_predictions`.
             
         Returns:
             model predictions, model nbest list
@@ -193,6 +208,7 @@ class BERTQAModel(BaseQAModel):
             logging_level = logging.get_verbosity()
             logging.set_verbosity(logging.WARNING)
 
+            self._use_context_cache = cache_contexts
             infer_datalayer = self.setup_inference_data(
                 file, batch_size=batch_size, num_samples=num_samples, num_workers=2,
             )
@@ -225,6 +241,7 @@ class BERTQAModel(BaseQAModel):
                 version_2_with_negative=self._cfg.dataset.version_2_with_negative,
                 null_score_diff_threshold=self._cfg.dataset.null_score_diff_threshold,
                 do_lower_case=self._cfg.dataset.do_lower_case,
+                batched_span_search=batched_span_search,
             )
 
             if output_prediction_file:
@@ -244,6 +261,7 @@ class BERTQAModel(BaseQAModel):
             # set mode back to its original value
             self.train(mode=mode)
             logging.set_verbosity(logging_level)
+            self._use_context_cache = False
 
         return all_predictions, all_nbest
 
@@ -292,7 +310,15 @@ class BERTQAModel(BaseQAModel):
         do_lower_case: bool,
         version_2_with_negative: bool,
         null_score_diff_threshold: float,
+        batched_span_search: bool = False,
     ):
+        """
+        Extracts n-best answers of examples from start and end logits of features.
+
+        If ``batched_span_search`` is ``True``, candidate spans of all features are scored and filtered with tensor
+        operations in :meth:`_get_batched_prelim_predictions`. The candidates are the same as in the per example
+        search, only order of candidates with equal logits can differ.
+        """
         example_index_to_features = collections.defaultdict(list)
 
         unique_id_to_pos = {}
@@ -302,9 +328,17 @@ class BERTQAModel(BaseQAModel):
         for feature in features:
             example_index_to_features[feature.example_index].append(feature)
 
-        _PrelimPrediction = collections.namedtuple(
-            "PrelimPrediction", ["feature_index", "start_index", "end_index", "start_logit", "end_logit"]
-        )
+        if batched_span_search:
+            example_index_to_prelim_predictions = self._get_batched_prelim_predictions(
+                example_index_to_features,
+                unique_id_to_pos,
+                start_logits,
+                end_logits,
+                min(len(examples), len(unique_ids)),
+                n_best_size,
+                max_answer_length,
+                version_2_with_negative,
+            )
 
         all_predictions = collections.OrderedDict()
         all_nbest_json = collections.OrderedDict()
@@ -324,70 +358,80 @@ class BERTQAModel(BaseQAModel):
                 example.answer_text,
                 processor.doc_id_to_context_text,
             )
-            prelim_predictions = []
-            # keep track of the minimum score of null start+end of position 0
-            # large and positive
-            score_null = 1000000
-            # the paragraph slice with min null score
-            min_null_feature_index = 0
-            # start logit at the slice with min null score
-            null_start_logit = 0
-            # end logit at the slice with min null score
-            null_end_logit = 0
-            for (feature_index, feature) in enumerate(curr_features):
-                pos = unique_id_to_pos[feature.unique_id]
-                start_indexes = self._get_best_indexes(start_logits[pos], n_best_size)
-                end_indexes = self._get_best_indexes(end_logits[pos], n_best_size)
-                # if we could have irrelevant answers,
-                # get the min score of irrelevant
-                if version_2_with_negative:
-                    feature_null_score = start_logits[pos][0] + end_logits[pos][0]
-                    if feature_null_score < score_null:
-                        score_null = feature_null_score
-                        min_null_feature_index = feature_index
-                        null_start_logit = start_logits[pos][0]
-                        null_end_logit = end_logits[pos][0]
-                for start_index in start_indexes:
-                    for end_index in end_indexes:
-                        # We could hypothetically create invalid predictions,
-                        # e.g., predict that the start of the span is in the
-                        # question. We throw out all invalid predictions.
-                        if start_index >= len(feature.tokens):
-                            continue
-                        if end_index >= len(feature.tokens):
-                            continue
-                        if start_index not in feature.token_to_orig_map:
-                            continue
-                        if end_index not in feature.token_to_orig_map:
-                            continue
-                        if not feature.token_is_max_context.get(start_index, False):
-                            continue
-                        if end_index < start_index:
-                            continue
-                        length = end_index - start_index + 1
-                        if length > max_answer_length:
-                            continue
-                        prelim_predictions.append(
-                            _PrelimPrediction(
-                                feature_index=feature_index,
-                                start_index=start_index,
-                                end_index=end_index,
-                                start_logit=start_logits[pos][start_index],
-                                end_logit=end_logits[pos][end_index],
+            if batched_span_search:
+                (
+                    prelim_predictions,
+                    score_null,
+                    null_start_logit,
+                    null_end_logit,
+                ) = example_index_to_prelim_predictions[example_index]
+            else:
+                prelim_predictions = []
+                # keep track of the minimum score of null start+end of position 0
+                # large and positive
+                score_null = 1000000
+                # the paragraph slice with min null score
+                min_null_feature_index = 0
+                # start logit at the slice with min null score
+                null_start_logit = 0
+                # end logit at the slice with min null score
+                null_end_logit = 0
+                for (feature_index, feature) in enumerate(curr_features):
+                    pos = unique_id_to_pos[feature.unique_id]
+                    start_indexes = self._get_best_indexes(start_logits[pos], n_best_size)
+                    end_indexes = self._get_best_indexes(end_logits[pos], n_best_size)
+                    # if we could have irrelevant answers,
+                    # get the min score of irrelevant
+                    if version_2_with_negative:
+                        feature_null_score = start_logits[pos][0] + end_logits[pos][0]
+                        if feature_null_score < score_null:
+                            score_null = feature_null_score
+                            min_null_feature_index = feature_index
+                            null_start_logit = start_logits[pos][0]
+                            null_end_logit = end_logits[pos][0]
+                    for start_index in start_indexes:
+                        for end_index in end_indexes:
+                            # We could hypothetically create invalid predictions,
+                            # e.g., predict that the start of the span is in the
+                            # question. We throw out all invalid predictions.
+                            if start_index >= len(feature.tokens):
+                                continue
+                            if end_index >= len(feature.tokens):
+                                continue
+                            if start_index not in feature.token_to_orig_map:
+                                continue
+                            if end_index not in feature.token_to_orig_map:
+                                continue
+                            if not feature.token_is_max_context.get(start_index, False):
+                                continue
+                            if end_index < start_index:
+                                continue
+                            length = end_index - start_index + 1
+                            if length > max_answer_length:
+                                continue
+                            prelim_predictions.append(
+                                _PrelimPrediction(
+                                    feature_index=feature_index,
+                                    start_index=start_index,
+                                    end_index=end_index,
+                                    start_logit=start_logits[pos][start_index],
+                                    end_logit=end_logits[pos][end_index],
+                                )
                             )
-                        )
 
-            if version_2_with_negative:
-                prelim_predictions.append(
-                    _PrelimPrediction(
-                        feature_index=min_null_feature_index,
-                        start_index=0,
-                        end_index=0,
-                        start_logit=null_start_logit,
-                        end_logit=null_end_logit,
+                if version_2_with_negative:
+                    prelim_predictions.append(
+                        _PrelimPrediction(
+                            feature_index=min_null_feature_index,
+                            start_index=0,
+                            end_index=0,
+                            start_logit=null_start_logit,
+                            end_logit=null_end_logit,
+                        )
                     )
+                prelim_predictions = sorted(
+                    prelim_predictions, key=lambda x: (x.start_logit + x.end_logit), reverse=True
                 )
-            prelim_predictions = sorted(prelim_predictions, key=lambda x: (x.start_logit + x.end_logit), reverse=True)
 
             _NbestPrediction = collections.namedtuple("NbestPrediction", ["text", "start_logit", "end_logit"])
 
@@ -486,6 +530,114 @@ class BERTQAModel(BaseQAModel):
 
         return all_predictions, all_nbest_json, scores_diff_json
 
+    @staticmethod
+    def _get_batched_prelim_predictions(
+        example_index_to_features: Dict[int, List],
+        unique_id_to_pos: Dict[int, int],
+        start_logits: Union[List[List[float]], torch.Tensor],
+        end_logits: Union[List[List[float]], torch.Tensor],
+        num_examples: int,
+        n_best_size: int,
+        max_answer_length: int,
+        version_2_with_negative: bool,
+    ) -> Dict[int, tuple]:
+        """
+        Finds candidate answer spans of first ``num_examples`` examples. Top ``n_best_size`` start and end positions
+        of all features are combined and filtered in a single batch of tensor operations.
+
+        Returns:
+            a dictionary mapping an example index to a tuple of preliminary predictions sorted by score, null score,
+            start logit and end logit of the null prediction
+        """
+        result = {}
+        features, example_indices, feature_indices = [], [], []
+        for example_index in range(num_examples):
+            curr_features = example_index_to_features[example_index]
+            features.extend(curr_features)
+            example_indices.extend([example_index] * len(curr_features))
+            feature_indices.extend(range(len(curr_features)))
+            result[example_index] = ([], 1000000, 0, 0)
+        if not features:
+            return result
+
+        positions = torch.tensor([unique_id_to_pos[feature.unique_id] for feature in features])
+        start_logits = torch.as_tensor(start_logits, dtype=torch.float64)[positions]
+        end_logits = torch.as_tensor(end_logits, dtype=torch.float64)[positions]
+        num_features, seq_length = start_logits.shape
+
+        # positions which can start or end an answer
+        start_allowed = torch.zeros(num_features, seq_length, dtype=torch.bool)
+        end_allowed = torch.zeros(num_features, seq_length, dtype=torch.bool)
+        for i, feature in enumerate(features):
+            start_allowed[i, [j for j, is_max in feature.token_is_max_context.items() if is_max]] = True
+            end_allowed[i, list(feature.token_to_orig_map)] = True
+        start_allowed &= end_allowed
+
+        k = min(n_best_size, seq_length)
+        top_start_logits, top_start_indexes = start_logits.topk(k, dim=1)
+        top_end_logits, top_end_indexes = end_logits.topk(k, dim=1)
+        span_lengths = top_end_indexes.unsqueeze(1) - top_start_indexes.unsqueeze(2) + 1
+        valid = (
+            start_allowed.gather(1, top_start_indexes).unsqueeze(2)
+            & end_allowed.gather(1, top_end_indexes).unsqueeze(1)
+            & (span_lengths >= 1)
+            & (span_lengths <= max_answer_length)
+        )
+        feature_ids, start_ranks, end_ranks = valid.nonzero(as_tuple=True)
+        span_start_logits = top_start_logits[feature_ids, start_ranks]
+        span_end_logits = top_end_logits[feature_ids, end_ranks]
+
+        # candidates are grouped by example and sorted by score as in the per example search
+        example_indices = np.array(example_indices)
+        feature_indices = np.array(feature_indices)
+        feature_ids, start_ranks, end_ranks = feature_ids.numpy(), start_ranks.numpy(), end_ranks.numpy()
+        scores = (span_start_logits + span_end_logits).numpy()
+        order = np.lexsort(
+            (end_ranks, start_ranks, feature_indices[feature_ids], -scores, example_indices[feature_ids])
+        )
+        span_start_indexes = top_start_indexes[feature_ids, start_ranks].tolist()
+        span_end_indexes = top_end_indexes[feature_ids, end_ranks].tolist()
+        span_start_logits, span_end_logits = span_start_logits.tolist(), span_end_logits.tolist()
+        for i in order.tolist():
+            feature_id = feature_ids[i]
+            result[example_indices[feature_id]][0].append(
+                _PrelimPrediction(
+                    feature_index=int(feature_indices[feature_id]),
+                    start_index=span_start_indexes[i],
+                    end_index=span_end_indexes[i],
+                    start_logit=span_start_logits[i],
+                    end_logit=span_end_logits[i],
+                )
+            )
+
+        if version_2_with_negative:
+            null_start_logits, null_end_logits = start_logits[:, 0].tolist(), end_logits[:, 0].tolist()
+            # the first feature with the minimum null score of an example
+            min_null_feature_ids = {}
+            for i, example_index in enumerate(example_indices.tolist()):
+                j = min_null_feature_ids.get(example_index)
+                if j is None or null_start_logits[i] + null_end_logits[i] < null_start_logits[j] + null_end_logits[j]:
+                    min_null_feature_ids[example_index] = i
+            for example_index, i in min_null_feature_ids.items():
+                prelim_predictions = result[example_index][0]
+                score_null = null_start_logits[i] + null_end_logits[i]
+                # the null prediction goes after other predictions with equal score
+                position = bisect.bisect_right(
+                    [-(pred.start_logit + pred.end_logit) for pred in prelim_predictions], -score_null
+                )
+                prelim_predictions.insert(
+                    position,
+                    _PrelimPrediction(
+                        feature_index=int(feature_indices[i]),
+                        start_index=0,
+                        end_index=0,
+                        start_logit=null_start_logits[i],
+                        end_logit=null_end_logits[i],
+                    ),
+                )
+                result[example_index] = (prelim_predictions, score_null, null_start_logits[i], null_end_logits[i])
+        return result
+
     def _setup_dataloader_from_config(self, cfg: DictConfig, mode: str):
         processor = QAProcessor(cfg.file, mode)
 
@@ -501,6 +653,7 @@ class BERTQAModel(BaseQAModel):
             num_samples=cfg.num_samples,
             mode=mode,
             use_cache=self._cfg.dataset.use_cache,
+            context_cache=self._context_cache if mode == INFERENCE_MODE and self._use_context_cache else None,
         )
 
         data_loader = torch.utils.data.DataLoader(
@@ -25,6 +25,7 @@ from nemo.collections.nlp.data.text_classification import TextClassificationData
 from nemo.collections.nlp.metrics.classification_report import ClassificationReport
 from nemo.collections.nlp.models.nlp_model import NLPModel
 from nemo.collections.nlp.modules.common import SequenceClassifier
+from nemo.collections.nlp.parts.token_budget_inference import iterate_token_budget_batches, tokenize_in_threads
 from nemo.collections.nlp.parts.utils_funcs import tensor2list
 from nemo.core.classes.common import typecheck
 from nemo.core.classes.exportable import Exportable
@@ -229,16 +230,28 @@ class TextClassificationModel(NLPModel, Exportable):
         )
 
     @torch.no_grad()
-    def classifytext(self, queries: List[str], batch_size: int = 1, max_seq_length: int = -1) -> List[int]:
+    def classifytext(
+        self,
+        queries: List[str],
+        batch_size: int = 1,
+        max_seq_length: int = -1,
+        max_tokens: Optional[int] = None,
+        num_tokenizer_threads: int = 4,
+    ) -> List[int]:
         """
         Get prediction for the queries
         Args:
             queries: text sequences
             batch_size: batch size to use during inference
             max_seq_length: sequences longer than max_seq_length will get truncated. default -1 disables truncation.
+            max_tokens: if set, queries are sorted by length and packed into batches of at most max_tokens padded
+                tokens instead of batches of batch_size queries in the input order
+            num_tokenizer_threads: number of threads tokenizing queries if max_tokens is set
         Returns:
             all_preds: model predictions
         """
+        if max_tokens is not None:
+            return self._classifytext_by_tokens(queries, max_seq_length, max_tokens, num_tokenizer_threads)
         # store predictions for all queries in a single list
         all_preds = []
         mode = self.training
@@ -268,6 +281,43 @@ class TextClassificationModel(NLPModel, Exportable):
             logging.set_verbosity(logging_level)
         return all_preds
 
+    def _query_to_input_ids(self, query: str, max_seq_length: int = -1) -> List[int]:
+        """ Tokenizes a query as TextClassificationDataset.get_features """
+        subtokens = [self.tokenizer.cls_token]
+        for word in query.strip().split():
+            subtokens.extend(self.tokenizer.text_to_tokens(word))
+        if max_seq_length > 0 and len(subtokens) + 1 > max_seq_length:
+            subtokens = subtokens[: max_seq_length - 1]
+        subtokens.append(self.tokenizer.sep_token)
+        return self.tokenizer.tokens_to_ids(subtokens)
+
+    @torch.inference_mode()
+    def _classifytext_by_tokens(
+        self, queries: List[str], max_seq_length: int, max_tokens: int, num_tokenizer_threads: int
+    ) -> List[int]:
+        """ Predicts classes of queries in length sorted batches of at most max_tokens padded tokens """
+        all_preds = [None] * len(queries)
+        mode = self.training
+        device = next(self.parameters()).device
+        try:
+            self.eval()
+            input_ids = tokenize_in_threads(
+                queries, lambda query: self._query_to_input_ids(query, max_seq_length), num_tokenizer_threads
+            )
+            for batch, batch_input_ids, attention_mask in iterate_token_budget_batches(
+                input_ids, max_tokens, device, pad_id=self.tokenizer.pad_id
+            ):
+                logits = self.forward(
+                    input_ids=batch_input_ids,
+                    token_type_ids=torch.zeros_like(batch_input_ids),
+                    attention_mask=attention_mask,
+                )
+                for i, pred in zip(batch, tensor2list(torch.argmax(logits, axis=-1))):
+                    all_preds[i] = pred
+        finally:
+            self.train(mode=mode)
+        return all_preds
+
     def _setup_infer_dataloader(
         self, cfg: Dict, queries: List[str], max_seq_length: int = -1
     ) -> 'torch.utils.data.DataLoader':
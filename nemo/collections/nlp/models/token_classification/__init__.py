@@ -20,4 +20,8 @@ from nemo.collections.nlp.models.token_classification.punctuation_capitalization
 from nemo.collections.nlp.models.token_classification.punctuation_capitalization_model import (
     PunctuationCapitalizationModel,
 )
+from nemo.collections.nlp.models.token_classification.punctuation_capitalization_runners import (
+    PunctuationCapitalizationOnnxRunner,
+    PunctuationCapitalizationTorchScriptRunner,
+)
 from nemo.collections.nlp.models.token_classification.token_classification_model import TokenClassificationModel
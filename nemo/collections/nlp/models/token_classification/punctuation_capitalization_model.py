@@ -16,7 +16,7 @@ import copy
 import warnings
 from math import ceil
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple, Union
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 import numpy as np
 import torch
@@ -34,6 +34,12 @@ from nemo.collections.nlp.data.token_classification.punctuation_capitalization_d
     load_label_ids,
     raise_not_equal_labels_error,
 )
+from nemo.collections.nlp.data.token_classification.punctuation_capitalization_infer_batching import (
+    WordLogProbAccumulator,
+    collate_segments,
+    get_infer_segments,
+    pack_segments,
+)
 from nemo.collections.nlp.data.token_classification.punctuation_capitalization_infer_dataset import (
     BertPunctuationCapitalizationInferDataset,
 )
@@ -875,6 +881,7 @@ class PunctuationCapitalizationModel(NLPModel, Exportable):
                 use_audio=cfg.use_audio,
                 use_bucketing=cfg.use_bucketing,
                 preload_audios=cfg.preload_audios,
+                use_mmap_features=cfg.get('use_mmap_features', False),
             )
         if cfg.shuffle and cfg.use_tarred_dataset:
             logging.warning(f"Shuffling in dataloader is not supported for tarred dataset.")
@@ -1103,6 +1110,8 @@ class PunctuationCapitalizationModel(NLPModel, Exportable):
         margin: int = 16,
         return_labels: bool = False,
         dataloader_kwargs: Dict[str, Any] = None,
+        max_tokens: Optional[int] = None,
+        runner: Optional[Callable] = None,
     ) -> List[str]:
         """
         Adds punctuation and capitalization to the queries. Use this method for inference.
@@ -1142,12 +1151,26 @@ class PunctuationCapitalizationModel(NLPModel, Exportable):
             dataloader_kwargs (:obj:`Dict[str, Any]`, `optional`): an optional dictionary with parameters of PyTorch
                 data loader. May include keys: ``'num_workers'``, ``'pin_memory'``, ``'worker_init_fn'``,
                 ``'prefetch_factor'``, ``'persistent_workers'``.
+            max_tokens (:obj:`int`, `optional`): if provided, all queries are tokenized at once, segments are sorted
+                by length and packed into batches of at most ``max_tokens`` tokens including padding, and
+                probabilities of overlapping segments are merged for all queries at once. Parameters ``batch_size``
+                and ``dataloader_kwargs`` are not used then.
+            runner (:obj:`Callable`, `optional`): a callable which computes punctuation and capitalization logits
+                from ``input_ids``, ``attention_mask``, ``token_type_ids`` numpy arrays instead of the model, e.g.
+                :class:`~nemo.collections.nlp.models.token_classification.punctuation_capitalization_runners.PunctuationCapitalizationOnnxRunner`
+                for an exported model. Requires ``max_tokens``.
         Returns:
             :obj:`List[str]`: a list of queries with restored capitalization and punctuation if
             ``return_labels=False``, else a list of punctuation and capitalization labels strings for all queries
         """
         if len(queries) == 0:
             return []
+        if max_tokens is not None:
+            return self._add_punctuation_capitalization_with_token_budget(
+                queries, max_seq_length, step, margin, return_labels, max_tokens, runner
+            )
+        if runner is not None:
+            raise ValueError("Parameter `runner` can only be used together with parameter `max_tokens`.")
         if batch_size is None:
             batch_size = len(queries)
             logging.info(f'Using batch size {batch_size} for inference')
@@ -1214,6 +1237,59 @@ class PunctuationCapitalizationModel(NLPModel, Exportable):
             self.train(mode=mode)
         return result
 
+    def _run_inference_batch(
+        self, input_ids: np.ndarray, attention_mask: np.ndarray, token_type_ids: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        d = self.device
+        with torch.no_grad():
+            punct_logits, capit_logits = self.forward(
+                input_ids=torch.from_numpy(input_ids).to(d),
+                token_type_ids=torch.from_numpy(token_type_ids).to(d),
+                attention_mask=torch.from_numpy(attention_mask).to(d),
+            )
+        return punct_logits.cpu().numpy(), capit_logits.cpu().numpy()
+
+    def _add_punctuation_capitalization_with_token_budget(
+        self,
+        queries: List[str],
+        max_seq_length: int,
+        step: int,
+        margin: int,
+        return_labels: bool,
+        max_tokens: int,
+        runner: Optional[Callable],
+    ) -> List[str]:
+        """
+        Splits queries into the same segments as :meth:`add_punctuation_capitalization`, processes segments in
+        length sorted batches of at most ``max_tokens`` tokens and sums word log probabilities of overlapping
+        segments, which selects the same labels as the product of probabilities.
+        """
+        mode = self.training
+        try:
+            self.eval()
+            segments = get_infer_segments(queries, self.tokenizer, max_seq_length, step, margin)
+            batches = pack_segments([len(input_ids) for input_ids in segments.input_ids], max_tokens)
+            punct_log_probs = WordLogProbAccumulator(segments, len(self.punct_label_ids), margin)
+            capit_log_probs = WordLogProbAccumulator(segments, len(self.capit_label_ids), margin)
+            if runner is None:
+                runner = self._run_inference_batch
+            for batch in tqdm(batches, unit="batch"):
+                input_ids, attention_mask, word_mask = collate_segments(segments, batch)
+                punct_logits, capit_logits = runner(input_ids, attention_mask, np.zeros_like(input_ids))
+                punct_log_probs.update(batch, punct_logits, word_mask, attention_mask)
+                capit_log_probs.update(batch, capit_logits, word_mask, attention_mask)
+        finally:
+            # set mode back to its original value
+            self.train(mode=mode)
+        all_punct_preds = punct_log_probs.get_query_predictions()
+        all_capit_preds = capit_log_probs.get_query_predictions()
+        return [
+            self._get_labels(all_punct_preds[i], all_capit_preds[i])
+            if return_labels
+            else self._apply_punct_capit_predictions(query, all_punct_preds[i], all_capit_preds[i])
+            for i, query in enumerate(queries)
+        ]
+
     @classmethod
     def list_available_models(cls) -> List[PretrainedModelInfo]:
         """
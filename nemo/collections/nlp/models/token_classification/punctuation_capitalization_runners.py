@@ -0,0 +1,83 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+CPU runners of exported punctuation and capitalization models, which can be passed as ``runner`` argument of
+:meth:`~nemo.collections.nlp.models.PunctuationCapitalizationModel.add_punctuation_capitalization`.
+A runner takes ``input_ids``, ``attention_mask`` and ``token_type_ids`` int64 numpy arrays of shape
+``[Batch, Time]`` and returns punctuation and capitalization logits numpy arrays.
+"""
+
+from typing import Optional, Tuple
+
+import numpy as np
+import torch
+
+__all__ = ['PunctuationCapitalizationOnnxRunner', 'PunctuationCapitalizationTorchScriptRunner']
+
+
+class PunctuationCapitalizationOnnxRunner:
+    """
+    Runs a model exported with ``model.export('punctuation_capitalization.onnx')`` with onnxruntime on CPU.
+
+    Args:
+        model_path: path to the ``.onnx`` file
+        num_threads: number of threads used by onnxruntime for a batch, defaults to onnxruntime default
+    """
+
+    def __init__(self, model_path: str, num_threads: Optional[int] = None):
+        try:
+            import onnxruntime
+        except (ModuleNotFoundError, ImportError):
+            raise ImportError("`onnxruntime` could not be imported, please install the library.")
+
+        session_options = onnxruntime.SessionOptions()
+        session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads is not None:
+            session_options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(
+            model_path, sess_options=session_options, providers=['CPUExecutionProvider']
+        )
+        self.input_names = [session_input.name for session_input in self.session.get_inputs()]
+
+    def __call__(
+        self, input_ids: np.ndarray, attention_mask: np.ndarray, token_type_ids: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        inputs = {'input_ids': input_ids, 'attention_mask': attention_mask, 'token_type_ids': token_type_ids}
+        punct_logits, capit_logits = self.session.run(None, {name: inputs[name] for name in self.input_names})
+        return punct_logits, capit_logits
+
+
+class PunctuationCapitalizationTorchScriptRunner:
+    """
+    Runs a model exported with ``model.export('punctuation_capitalization.ts')`` on CPU.
+
+    Args:
+        model_path: path to the ``.ts`` file
+        num_threads: number of threads used by PyTorch, defaults to PyTorch default
+    """
+
+    def __init__(self, model_path: str, num_threads: Optional[int] = None):
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+        self.model = torch.jit.load(model_path, map_location='cpu').eval()
+
+    def __call__(
+        self, input_ids: np.ndarray, attention_mask: np.ndarray, token_type_ids: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        with torch.no_grad():
+            punct_logits, capit_logits = self.model(
+                torch.from_numpy(input_ids), torch.from_numpy(attention_mask), torch.from_numpy(token_type_ids)
+            )
+        return punct_logits.float().numpy(), capit_logits.float().numpy()
@@ -14,6 +14,7 @@
 # limitations under the License.
 
 import os
+from collections import OrderedDict
 from typing import Dict, List, Optional, Union
 
 import numpy as np
@@ -27,6 +28,7 @@ from nemo.collections.nlp.data.zero_shot_intent_recognition.zero_shot_intent_dat
     calc_class_weights_from_dataloader,
 )
 from nemo.collections.nlp.models import TextClassificationModel
+from nemo.collections.nlp.parts.token_budget_inference import pack_by_tokens, pad_sequences, tokenize_in_threads
 from nemo.core.classes.common import PretrainedModelInfo
 from nemo.utils import logging
 
@@ -36,8 +38,12 @@ __all__ = ['ZeroShotIntentModel']
 class ZeroShotIntentModel(TextClassificationModel):
     """TextClassificationModel to be trained on two- or three-class textual entailment data, to be used for zero shot intent recognition."""
 
+    # number of tokenized hypotheses kept between predict calls
+    HYPOTHESIS_CACHE_SIZE = 10000
+
     def __init__(self, cfg: DictConfig, trainer: Trainer = None):
         super().__init__(cfg=cfg, trainer=trainer)
+        self._hypothesis_ids_cache = OrderedDict()
 
     def _setup_dataloader_from_config(self, cfg: DictConfig) -> 'torch.utils.data.DataLoader':
         data_dir = self._cfg.dataset.data_dir
@@ -154,6 +160,8 @@ class ZeroShotIntentModel(TextClassificationModel):
         multi_label=True,
         entailment_idx=1,
         contradiction_idx=0,
+        max_tokens: Optional[int] = None,
+        num_tokenizer_threads: int = 4,
     ) -> List[Dict]:
 
         """
@@ -187,6 +195,10 @@ class ZeroShotIntentModel(TextClassificationModel):
              using NeMo's glue_benchmark.py or zero_shot_intent_model.py use an index of 1 by default.
             contradiction_idx: the index of the "contradiction" class in the trained model; models trained on MNLI
              using NeMo's glue_benchmark.py or zero_shot_intent_model.py use an index of 0 by default.
+            max_tokens: if set, ``batch_size`` is ignored, query and label pairs of all queries are sorted by length
+                and packed into batches of at most ``max_tokens`` padded tokens. Every query and every hypothesis is
+                tokenized once, and tokenized hypotheses are cached between calls.
+            num_tokenizer_threads: number of threads tokenizing queries if ``max_tokens`` is set.
 
         Returns:
             list of dictionaries; one dict per input query. Each dict has keys "sentence", "labels", "scores".
@@ -213,27 +225,32 @@ class ZeroShotIntentModel(TextClassificationModel):
             self.eval()
             self.to(device)
 
-            infer_datalayer = self._setup_infer_dataloader(
-                queries,
-                candidate_labels,
-                hypothesis_template=hypothesis_template,
-                batch_size=batch_size,
-                max_seq_length=self._cfg.dataset.max_seq_length,
-            )
+            if max_tokens is not None:
+                outputs = self._get_pair_logits_by_tokens(
+                    queries, candidate_labels, hypothesis_template, max_tokens, num_tokenizer_threads, device
+                )
+            else:
+                infer_datalayer = self._setup_infer_dataloader(
+                    queries,
+                    candidate_labels,
+                    hypothesis_template=hypothesis_template,
+                    batch_size=batch_size,
+                    max_seq_length=self._cfg.dataset.max_seq_length,
+                )
 
-            all_batch_logits = []
-            for batch in infer_datalayer:
-                input_ids, input_type_ids, input_mask, _ = batch
+                all_batch_logits = []
+                for batch in infer_datalayer:
+                    input_ids, input_type_ids, input_mask, _ = batch
 
-                logits = self.forward(
-                    input_ids=input_ids.to(device),
-                    token_type_ids=input_type_ids.to(device),
-                    attention_mask=input_mask.to(device),
-                )
-                all_batch_logits.append(logits.detach().cpu().numpy())
+                    logits = self.forward(
+                        input_ids=input_ids.to(device),
+                        token_type_ids=input_type_ids.to(device),
+                        attention_mask=input_mask.to(device),
+                    )
+                    all_batch_logits.append(logits.detach().cpu().numpy())
 
-            all_logits = np.concatenate(all_batch_logits)
-            outputs = all_logits.reshape((len(queries), len(candidate_labels), -1))
+                all_logits = np.concatenate(all_batch_logits)
+                outputs = all_logits.reshape((len(queries), len(candidate_labels), -1))
 
             if not multi_label:
                 # softmax the "entailment" logits over all candidate labels
@@ -261,6 +278,84 @@ class ZeroShotIntentModel(TextClassificationModel):
             self.train(mode=mode)
         return result
 
+    def _get_hypothesis_ids(self, hypothesis: str) -> List[int]:
+        """Returns token ids of a hypothesis, tokenized hypotheses are kept in an LRU cache"""
+        if hypothesis in self._hypothesis_ids_cache:
+            self._hypothesis_ids_cache.move_to_end(hypothesis)
+        else:
+            self._hypothesis_ids_cache[hypothesis] = self.tokenizer.tokens_to_ids(
+                self.tokenizer.text_to_tokens(hypothesis)
+            )
+            if len(self._hypothesis_ids_cache) > self.HYPOTHESIS_CACHE_SIZE:
+                self._hypothesis_ids_cache.popitem(last=False)
+        return self._hypothesis_ids_cache[hypothesis]
+
+    def _build_pair_features(self, query_ids: List[int], hypothesis_ids: List[int]):
+        """
+        Returns input ids and segment ids of a query and hypothesis pair, built the same way as
+        :class:`ZeroShotIntentInferenceDataset` builds them but without padding.
+        """
+        tokenizer = self.tokenizer
+        sep_token_extra = tokenizer.eos_token if 'roberta' in tokenizer.name.lower() else None
+        cls_id, eos_id = tokenizer.tokens_to_ids([tokenizer.cls_token, tokenizer.eos_token])
+        # the same truncation as in GLUEDataset._truncate_seq_pair: the longer sequence is truncated first
+        max_length = self._cfg.dataset.max_seq_length - (4 if sep_token_extra else 3)
+        len_a, len_b = len(query_ids), len(hypothesis_ids)
+        while len_a + len_b > max_length:
+            if len_a > len_b:
+                len_a -= 1
+            else:
+                len_b -= 1
+        input_ids = [cls_id] + query_ids[:len_a] + [eos_id]
+        if sep_token_extra:
+            input_ids += tokenizer.tokens_to_ids([sep_token_extra])
+        segment_ids = [0] * len(input_ids) + [1] * (len_b + 1)
+        input_ids += hypothesis_ids[:len_b] + [eos_id]
+        return input_ids, segment_ids
+
+    @torch.inference_mode()
+    def _get_pair_logits_by_tokens(
+        self,
+        queries: List[str],
+        candidate_labels: List[str],
+        hypothesis_template: str,
+        max_tokens: int,
+        num_tokenizer_threads: int,
+        device: str,
+    ) -> np.ndarray:
+        """
+        Returns logits of all query and label pairs as an array of shape
+        ``[len(queries), len(candidate_labels), num_classes]``. Pairs of all queries are batched together.
+        """
+
+        def tokenize(query):
+            return self.tokenizer.tokens_to_ids(self.tokenizer.text_to_tokens(query))
+
+        queries_ids = tokenize_in_threads(queries, tokenize, num_tokenizer_threads)
+        hypotheses_ids = [self._get_hypothesis_ids(hypothesis_template.format(label)) for label in candidate_labels]
+        pairs = [
+            self._build_pair_features(query_ids, hypothesis_ids)
+            for query_ids in queries_ids
+            for hypothesis_ids in hypotheses_ids
+        ]
+        pad_id = self.tokenizer.tokens_to_ids([self.tokenizer.pad_token])[0]
+
+        all_logits = None
+        for batch in pack_by_tokens([len(input_ids) for input_ids, _ in pairs], max_tokens):
+            input_ids = pad_sequences([pairs[i][0] for i in batch], pad_value=pad_id)
+            segment_ids = pad_sequences([pairs[i][1] for i in batch])
+            input_mask = pad_sequences([np.ones(len(pairs[i][0]), dtype=np.int64) for i in batch])
+            logits = self.forward(
+                input_ids=torch.from_numpy(input_ids).to(device),
+                token_type_ids=torch.from_numpy(segment_ids).to(device),
+                attention_mask=torch.from_numpy(input_mask).to(device),
+            )
+            logits = logits.float().cpu().numpy()
+            if all_logits is None:
+                all_logits = np.zeros((len(pairs), logits.shape[-1]), dtype=logits.dtype)
+            all_logits[batch] = logits
+        return all_logits.reshape((len(queries), len(candidate_labels), -1))
+
     @classmethod
     def list_available_models(cls) -> List[PretrainedModelInfo]:
         """
@@ -0,0 +1,249 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Prefix cache of the inference key/value memory, shared by generation requests with common prompts."""
+
+from typing import Dict, List, Optional, Tuple
+
+import torch
+
+__all__ = ['KVPrefixCache']
+
+
+class _RadixNode:
+    """ A node of the radix tree holding the key/value memory of a segment of tokens """
+
+    __slots__ = ['tokens', 'keys', 'values', 'logprobs', 'children', 'parent', 'last_access']
+
+    def __init__(self, tokens, keys, values, logprobs, parent):
+        # tokens of the segment, the path from the root gives the full prefix
+        self.tokens = tokens
+        # per layer tensors of shape [len(tokens), num_heads, head_size]
+        self.keys = keys
+        self.values = values
+        # log prob of the token following every position, NaN if the following token is not in the tree
+        self.logprobs = logprobs
+        self.children = {}
+        self.parent = parent
+        self.last_access = 0
+
+    def split(self, length):
+        """ Splits the node at `length`, the node keeps the head and a new child gets the tail """
+        child = _RadixNode(
+            self.tokens[length:],
+            [k[length:].clone() for k in self.keys],
+            [v[length:].clone() for v in self.values],
+            None if self.logprobs is None else self.logprobs[length:].clone(),
+            self,
+        )
+        child.children = self.children
+        for grandchild in child.children.values():
+            grandchild.parent = child
+        child.last_access = self.last_access
+        self.tokens = self.tokens[:length]
+        self.keys = [k[:length].clone() for k in self.keys]
+        self.values = [v[:length].clone() for v in self.values]
+        self.logprobs = None if self.logprobs is None else self.logprobs[:length].clone()
+        self.children = {child.tokens[0]: child}
+
+
+class KVPrefixCache:
+    """
+    Caches the per-layer key/value inference memory of token prefixes in a radix tree, so that generation
+    requests sharing a prompt prefix (system prompts, few-shot templates) skip recomputing it.
+
+    The least recently used leaves are evicted once the cache holds more than `max_tokens` tokens. The
+    eviction only depends on the token sequences, so every model parallel rank keeps an identical tree
+    even though the ranks hold different layers or heads.
+
+    Besides the key/value memory, the cache keeps the log probs of the context tokens, which are part of
+    the generation output. They are only available on the last pipeline stage.
+
+    Args:
+        max_tokens: maximum number of cached tokens
+        min_prefix_length: shortest prefix that is worth reusing
+    """
+
+    def __init__(self, max_tokens: int, min_prefix_length: int = 1):
+        assert max_tokens > 0, "Max tokens should be greater than 0"
+        self.max_tokens = max_tokens
+        self.min_prefix_length = max(min_prefix_length, 1)
+        self.reset()
+
+    def reset(self):
+        self.root = _RadixNode((), [], [], None, None)
+        self.num_tokens = 0
+        self.memory_bytes = 0
+        self.num_lookups = 0
+        self.num_hits = 0
+        self.lookup_tokens = 0
+        self.reused_tokens = 0
+        self._clock = 0
+
+    def _tick(self):
+        self._clock += 1
+        return self._clock
+
+    def _match(self, tokens: Tuple[int]) -> Tuple[int, List[Tuple[_RadixNode, int]]]:
+        """ Returns the number of matched tokens and the matched (node, length) segments """
+        node, matched, path = self.root, 0, []
+        now = self._tick()
+        while matched < len(tokens):
+            child = node.children.get(tokens[matched])
+            if child is None:
+                break
+            length = 0
+            segment = child.tokens
+            while length < len(segment) and matched + length < len(tokens):
+                if segment[length] != tokens[matched + length]:
+                    break
+                length += 1
+            child.last_access = now
+            path.append((child, length))
+            matched += length
+            if length < len(segment):
+                break
+            node = child
+        return matched, path
+
+    def lookup(
+        self, batch_tokens: List[List[int]], max_length: int
+    ) -> Tuple[int, List[torch.Tensor], List[torch.Tensor], Optional[torch.Tensor]]:
+        """
+        Finds the longest cached prefix shared by all the sequences of a batch.
+        The prefix is shorter than the matched tokens, so that the log prob of the token following it is cached.
+
+        Args:
+            batch_tokens: token ids of every sequence of the batch
+            max_length: maximum prefix length to reuse
+        Returns:
+            the prefix length, the per layer keys and values of shape [prefix_length, batch, num_heads, head_size]
+            and the prefix log probs of shape [batch, prefix_length], None if not kept on this rank
+        """
+        paths, prefix_length = [], max_length
+        for tokens in batch_tokens:
+            matched, path = self._match(tuple(tokens[:max_length]))
+            paths.append(path)
+            prefix_length = min(prefix_length, matched - 1)
+        self.num_lookups += len(batch_tokens)
+        self.lookup_tokens += len(batch_tokens) * max_length
+        if prefix_length < self.min_prefix_length:
+            return 0, [], [], None
+        self.num_hits += len(batch_tokens)
+        self.reused_tokens += len(batch_tokens) * prefix_length
+
+        def gather(path, attribute, layer=None):
+            segments = []
+            for node, length in path:
+                tensor = getattr(node, attribute)
+                segments.append(tensor[layer][:length] if layer is not None else tensor[:length])
+            return torch.cat(segments, dim=0)[:prefix_length]
+
+        num_layers = len(self.root.children[batch_tokens[0][0]].keys)
+        keys = [torch.stack([gather(path, 'keys', i) for path in paths], dim=1) for i in range(num_layers)]
+        values = [torch.stack([gather(path, 'values', i) for path in paths], dim=1) for i in range(num_layers)]
+        logprobs = None
+        if all(node.logprobs is not None for path in paths for node, _ in path):
+            logprobs = torch.stack([gather(path, 'logprobs') for path in paths], dim=0)
+        return prefix_length, keys, values, logprobs
+
+    def insert(
+        self,
+        tokens: List[int],
+        keys: List[torch.Tensor],
+        values: List[torch.Tensor],
+        logprobs: Optional[torch.Tensor] = None,
+    ):
+        """
+        Adds the key/value memory of a token sequence to the cache.
+
+        Args:
+            tokens: token ids of the sequence
+            keys: per layer keys of shape [len(tokens), num_heads, head_size]
+            values: per layer values of shape [len(tokens), num_heads, head_size]
+            logprobs: log prob of the token following every position, the last one may be missing
+        """
+        tokens = tuple(tokens)
+        if len(tokens) == 0:
+            return
+        if logprobs is not None:
+            logprobs = logprobs.float()
+            if len(logprobs) < len(tokens):
+                missing = logprobs.new_full((len(tokens) - len(logprobs),), float('nan'))
+                logprobs = torch.cat([logprobs, missing])
+        now = self._tick()
+        node, matched = self.root, 0
+        while matched < len(tokens):
+            child = node.children.get(tokens[matched])
+            if child is None:
+                child = _RadixNode(
+                    tokens[matched:],
+                    [k[matched:].detach().clone() for k in keys],
+                    [v[matched:].detach().clone() for v in values],
+                    None if logprobs is None else logprobs[matched:].clone(),
+                    node,
+                )
+                node.children[tokens[matched]] = child
+                child.last_access = now
+                self.num_tokens += len(child.tokens)
+                self.memory_bytes += self._node_bytes(child)
+                break
+            length = 0
+            while length < len(child.tokens) and matched + length < len(tokens):
+                if child.tokens[length] != tokens[matched + length]:
+                    break
+                length += 1
+            if length < len(child.tokens):
+                child.split(length)
+            if child.logprobs is not None and logprobs is not None:
+                # fill in the log probs of tokens that had no following token so far
+                known = child.logprobs.isnan().logical_not()
+                child.logprobs = torch.where(known, child.logprobs, logprobs[matched : matched + length])
+            child.last_access = now
+            node = child
+            matched += length
+        self._evict()
+
+    @staticmethod
+    def _node_bytes(node: _RadixNode) -> int:
+        tensors = node.keys + node.values + ([node.logprobs] if node.logprobs is not None else [])
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+    def _leaves(self) -> List[_RadixNode]:
+        leaves, stack = [], [self.root]
+        while stack:
+            node = stack.pop()
+            if node.children:
+                stack.extend(node.children.values())
+            elif node is not self.root:
+                leaves.append(node)
+        return leaves
+
+    def _evict(self):
+        while self.num_tokens > self.max_tokens:
+            # ties are broken by the tokens, so that every rank evicts the same leaf
+            leaf = min(self._leaves(), key=lambda node: (node.last_access, node.tokens))
+            del leaf.parent.children[leaf.tokens[0]]
+            self.num_tokens -= len(leaf.tokens)
+            self.memory_bytes -= self._node_bytes(leaf)
+
+    def stats(self) -> Dict[str, float]:
+        """ Hit rate, reused tokens and memory of the cache """
+        return {
+            'hit_rate': self.num_hits / max(self.num_lookups, 1),
+            'token_hit_rate': self.reused_tokens / max(self.lookup_tokens, 1),
+            'reused_tokens': self.reused_tokens,
+            'cached_tokens': self.num_tokens,
+            'memory_bytes': self.memory_bytes,
+        }
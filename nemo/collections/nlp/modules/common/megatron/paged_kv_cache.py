@@ -0,0 +1,144 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Paged inference key/value memory for batches whose sequences start and finish at different steps."""
+
+from collections import deque
+from typing import Hashable, List, Optional, Tuple
+
+import torch
+
+__all__ = ['PagedKVCache']
+
+
+class PagedKVCache:
+    """
+    Keeps the inference key/value memory of every sequence in fixed size blocks of a shared pool, so that
+    sequences can join and leave a running batch at any step, and the memory of a finished sequence is
+    reused right away by the next one.
+
+    Every step adds the same number of new tokens to each of its sequences, `begin_step` maps them to
+    slots of the pool. Every attention layer then calls `update` with the keys and values of the new
+    tokens and gets back the keys, values and attention mask over the whole sequences.
+
+    Args:
+        num_blocks: number of blocks in the pool
+        block_size: number of tokens in a block
+    """
+
+    def __init__(self, num_blocks: int, block_size: int = 16):
+        assert num_blocks > 0, "Number of blocks should be greater than 0"
+        assert block_size > 0, "Block size should be greater than 0"
+        self.num_blocks = num_blocks
+        self.block_size = block_size
+        self.free_blocks = deque(range(num_blocks))
+        self.block_tables = {}
+        self.seq_lengths = {}
+        self.key_pools = {}
+        self.value_pools = {}
+        self._step = None
+
+    @property
+    def num_free_blocks(self) -> int:
+        return len(self.free_blocks)
+
+    def blocks_needed(self, num_tokens: int) -> int:
+        return -(-num_tokens // self.block_size)
+
+    def can_append(self, seq_id: Hashable, num_tokens: int = 1) -> bool:
+        """ Whether there are enough free blocks to add `num_tokens` tokens to a (new) sequence """
+        length = self.seq_lengths.get(seq_id, 0)
+        num_blocks = len(self.block_tables.get(seq_id, []))
+        return self.blocks_needed(length + num_tokens) - num_blocks <= self.num_free_blocks
+
+    def free(self, seq_id: Hashable):
+        """ Returns the blocks of a sequence to the pool """
+        self.free_blocks.extend(self.block_tables.pop(seq_id, []))
+        self.seq_lengths.pop(seq_id, None)
+
+    def _slots(self, seq_id: Hashable, start: int, end: int) -> List[int]:
+        table = self.block_tables[seq_id]
+        return [table[i // self.block_size] * self.block_size + i % self.block_size for i in range(start, end)]
+
+    def begin_step(self, seq_ids: List[Hashable], num_new_tokens: int, device: Optional[torch.device] = None):
+        """
+        Reserves the slots of the `num_new_tokens` tokens that the step adds to every sequence.
+        Raises a RuntimeError if the pool runs out of blocks, check `can_append` first.
+        """
+        lengths_before, new_slots, all_slots = [], [], []
+        for seq_id in seq_ids:
+            length = self.seq_lengths.get(seq_id, 0)
+            table = self.block_tables.setdefault(seq_id, [])
+            while len(table) * self.block_size < length + num_new_tokens:
+                if not self.free_blocks:
+                    raise RuntimeError(f'Paged KV cache is out of blocks, {self.num_blocks} blocks are in use')
+                table.append(self.free_blocks.popleft())
+            self.seq_lengths[seq_id] = length + num_new_tokens
+            lengths_before.append(length)
+            new_slots.append(self._slots(seq_id, length, length + num_new_tokens))
+            all_slots.append(self._slots(seq_id, 0, length + num_new_tokens))
+
+        max_length = max(len(slots) for slots in all_slots)
+        lengths_before = torch.tensor(lengths_before, dtype=torch.long, device=device)
+        lengths_after = lengths_before + num_new_tokens
+        # padded positions point at slot 0 and are masked out
+        gather_slots = torch.tensor(
+            [slots + [0] * (max_length - len(slots)) for slots in all_slots], dtype=torch.long, device=device
+        )
+        query_positions = lengths_before[:, None] + torch.arange(num_new_tokens, device=device)[None, :]
+        key_positions = torch.arange(max_length, device=device)
+        # [b, 1, sq, sk], True for the masked out positions
+        attention_mask = (key_positions[None, None, :] > query_positions[:, :, None]) | (
+            key_positions[None, None, :] >= lengths_after[:, None, None]
+        )
+        self._step = {
+            # [sq, b] slots of the new tokens, in the order of the [sq, b, ...] layer inputs
+            'new_slots': torch.tensor(new_slots, dtype=torch.long, device=device).t().reshape(-1),
+            # [sk, b] slots of all the tokens
+            'gather_slots': gather_slots.t(),
+            'attention_mask': attention_mask.unsqueeze(1),
+        }
+
+    def update(
+        self, layer: Hashable, key: torch.Tensor, value: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """
+        Stores the keys and values of the new tokens of a layer.
+
+        Args:
+            layer: identifies the layer, e.g. the attention module
+            key: keys of the new tokens of shape [sq, b, num_heads, head_size]
+            value: values of the new tokens of shape [sq, b, num_heads, head_size]
+        Returns:
+            the keys and values of all the tokens of shape [sk, b, num_heads, head_size]
+            and the attention mask of shape [b, 1, sq, sk], True for the masked out positions
+        """
+        assert self._step is not None, "begin_step should be called before update"
+        if layer not in self.key_pools:
+            shape = (self.num_blocks * self.block_size,) + tuple(key.shape[2:])
+            self.key_pools[layer] = torch.zeros(shape, dtype=key.dtype, device=key.device)
+            self.value_pools[layer] = torch.zeros(shape, dtype=value.dtype, device=value.device)
+        key_pool, value_pool = self.key_pools[layer], self.value_pools[layer]
+        new_slots = self._step['new_slots'].to(key.device)
+        key_pool[new_slots] = key.reshape((-1,) + tuple(key.shape[2:])).to(key_pool.dtype)
+        value_pool[new_slots] = value.reshape((-1,) + tuple(value.shape[2:])).to(value_pool.dtype)
+        gather_slots = self._step['gather_slots'].to(key.device)
+        return key_pool[gather_slots], value_pool[gather_slots], self._step['attention_mask'].to(key.device)
+
+    def end_step(self):
+        self._step = None
+
+    def memory_bytes(self) -> int:
+        pools = list(self.key_pools.values()) + list(self.value_pools.values())
+        return sum(pool.numel() * pool.element_size() for pool in pools)
@@ -14,18 +14,22 @@
 
 import abc
 import base64
+import io
 import json
 import logging
 import pickle
+import queue
 import threading
 import time
-from typing import List, Union
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List, Optional, Tuple, Union
 
 import faiss
 import numpy as np
 import requests
 import torch
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flask_restful import Api, Resource
 from sentence_transformers import SentenceTransformer
 
@@ -37,6 +41,9 @@ log.setLevel(logging.ERROR)
 
 lock = threading.Lock()
 headers = {"Content-Type": "application/json"}
+binary_headers = {"Content-Type": "application/octet-stream"}
+# response header of the batched endpoint with the number of changes of the retrieval index
+INDEX_GENERATION_HEADER = 'X-Index-Generation'
 
 PORT_NUM = 17179
 PORT_NUM_DYN = 17180
@@ -48,6 +55,167 @@ def request_data(data, port=PORT_NUM):
     return resp.json()
 
 
+def array_to_bytes(array: np.ndarray) -> bytes:
+    """ Serializes a numpy array into the binary payload of the batched endpoint, without pickling """
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def bytes_to_array(data: bytes) -> np.ndarray:
+    """ Deserializes the binary payload of the batched endpoint """
+    return np.load(io.BytesIO(data), allow_pickle=False)
+
+
+def request_knn_batch(sentences: List[str], neighbors: int, port=PORT_NUM, session=None) -> np.ndarray:
+    """
+    Queries the batched `/knn_batch` endpoint of a retrieval server.
+    The query sentences are sent and the neighbor tokens are received as binary numpy arrays.
+    Returns an array of shape [len(sentences), neighbors, 2 * chunk_size]
+    """
+    return request_knn_batch_with_generation(sentences, neighbors, port, session)[0]
+
+
+def request_knn_batch_with_generation(
+    sentences: List[str], neighbors: int, port=PORT_NUM, session=None
+) -> Tuple[np.ndarray, int]:
+    """
+    Same as `request_knn_batch`, also returns the generation of the server index, which changes whenever
+    documents are added to the index or the index is reset.
+    """
+    session = requests if session is None else session
+    resp = session.put(
+        'http://localhost:{}/knn_batch'.format(port),
+        params={'neighbors': neighbors},
+        data=array_to_bytes(np.array(sentences, dtype=np.str_)),
+        headers=binary_headers,
+    )
+    resp.raise_for_status()
+    return bytes_to_array(resp.content), int(resp.headers.get(INDEX_GENERATION_HEADER, 0))
+
+
+class RetrievalClient:
+    """
+    Asynchronous, batched client of the retrieval servers.
+    Queries issued concurrently (e.g. by several generation requests) within `batch_window` seconds are
+    coalesced into a single request to the batched binary endpoint. The neighbors of recent query chunks
+    are kept in a bounded LRU cache, the query chunk determines its embedding and therefore its neighbors.
+    The cache is dropped whenever a response reports a new generation of the server index, i.e. after
+    documents were added to the index or the index was reset by any client.
+    """
+
+    def __init__(
+        self, port: int, cache_size: int = 10000, batch_window: float = 0.002, max_batch_size: int = 256,
+    ):
+        self.port = port
+        self.cache_size = cache_size
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # bumped on every invalidation, so that in-flight results of a stale index are not cached
+        self._cache_version = 0
+        # generation of the server index the cached neighbors were retrieved from
+        self._index_generation = None
+        self._queue = queue.Queue()
+        self._session = requests.Session()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def clear_cache(self):
+        with self._cache_lock:
+            self._cache.clear()
+            self._cache_version += 1
+
+    def _lookup(self, sentence: str, neighbors: int) -> Optional[np.ndarray]:
+        with self._cache_lock:
+            result = self._cache.get(sentence)
+            if result is None or len(result) < neighbors:
+                return None
+            self._cache.move_to_end(sentence)
+            # faiss returns the neighbors sorted by distance, the first k of a larger query are the k nearest
+            return result[:neighbors]
+
+    def _store(self, results: dict, version: int, generation: int):
+        with self._cache_lock:
+            if generation != self._index_generation:
+                # the index was updated after the cached neighbors were retrieved
+                self._cache.clear()
+                self._cache_version += 1
+                self._index_generation = generation
+                version = self._cache_version
+            if self.cache_size <= 0 or version != self._cache_version:
+                return
+            for sentence, result in results.items():
+                # copy the rows, so the cache doesn't keep the whole response arrays alive
+                self._cache[sentence] = result.copy()
+                self._cache.move_to_end(sentence)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def get_knn_async(self, sentences: List[str], neighbors: int) -> Future:
+        """
+        Returns a future of the neighbor tokens of shape [len(sentences), neighbors, 2 * chunk_size]
+        """
+        future = Future()
+        cached = [self._lookup(sentence, neighbors) for sentence in sentences]
+        if len(sentences) > 0 and all(result is not None for result in cached):
+            future.set_result(np.stack(cached, axis=0))
+        else:
+            self._queue.put((sentences, neighbors, cached, future))
+        return future
+
+    def get_knn(self, sentences: List[str], neighbors: int) -> np.ndarray:
+        return self.get_knn_async(sentences, neighbors).result()
+
+    def _run(self):
+        while True:
+            pending = [self._queue.get()]
+            num_sentences = len(pending[0][0])
+            deadline = time.time() + self.batch_window
+            while num_sentences < self.max_batch_size:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                pending.append(item)
+                num_sentences += len(item[0])
+            try:
+                self._process(pending)
+            except Exception as e:
+                for _, _, _, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _process(self, pending):
+        with self._cache_lock:
+            version = self._cache_version
+        # query the largest number of neighbors once for all the coalesced requests
+        neighbors = max(item[1] for item in pending)
+        queries = list(
+            OrderedDict.fromkeys(
+                sentence
+                for sentences, _, cached, _ in pending
+                for sentence, result in zip(sentences, cached)
+                if result is None
+            )
+        )
+        fetched = {}
+        if len(queries) > 0:
+            knn, generation = request_knn_batch_with_generation(queries, neighbors, self.port, self._session)
+            fetched = dict(zip(queries, knn))
+            self._store(fetched, version, generation)
+        for sentences, k, cached, future in pending:
+            results = [result if result is not None else fetched[s][:k] for s, result in zip(sentences, cached)]
+            if len(results) == 0:
+                future.set_result(np.zeros((0, k, 0), dtype=np.int64))
+            else:
+                future.set_result(np.stack(results, axis=0))
+
+
 class RetrievalService:
     """
     Abstract class for Retrieval Service. 
@@ -57,6 +225,17 @@ class RetrievalService:
     def get_knn(self, query: Union[List[str], str, torch.Tensor], neighbors: int):
         pass
 
+    def get_knn_async(self, query: Union[List[str], str, torch.Tensor], neighbors: int) -> Future:
+        """
+        Returns a future of the KNN tokens. Services without an asynchronous client resolve it synchronously.
+        """
+        future = Future()
+        try:
+            future.set_result(self.get_knn(query, neighbors))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
     @abc.abstractmethod
     def add_docs_to_index(self, docs: List[str], add_eos: bool = True):
         """
@@ -78,10 +257,13 @@ class ChunkStore:
         self._count = 0
         self.no_retrieval = np.ones(2 * chunk_size, dtype=np.int64) * pad_id
         self.store[-1] = self.no_retrieval
+        # number of changes of the store, reported to the clients to invalidate their caches
+        self.generation = 0
 
     def add(self, chunk):
         self.store[self._count] = chunk
         self._count += 1
+        self.generation += 1
 
     def get_chunk(self, neighbor_id):
         return self.store[neighbor_id]
@@ -90,6 +272,7 @@ class ChunkStore:
         self._count = 0
         self.store = {}
         self.store[-1] = self.no_retrieval
+        self.generation += 1
 
 
 class SentenceBertResource(Resource):
@@ -196,6 +379,8 @@ class FaissRetrievalResource(Resource):
         self.ds = ds
 
     def put(self):
+        if request.path.endswith('/knn_batch'):
+            return self.put_batch()
         data = request.get_json()
         sentences = data['sentences']
         num_neighbors = data['neighbors']
@@ -204,6 +389,25 @@ class FaissRetrievalResource(Resource):
         return jsonify(neighbors.tolist())
         # check keys
 
+    def put_batch(self):
+        """
+        Batched KNN query, the sentences and the neighbor tokens are exchanged as binary numpy arrays.
+        """
+        sentences = bytes_to_array(request.get_data()).tolist()
+        num_neighbors = int(request.args['neighbors'])
+        with lock:  # Need to get lock to keep multiple threads from hitting code
+            neighbors = self.get_knn(sentences, num_neighbors)
+            generation = self.index_generation()
+        return Response(
+            array_to_bytes(neighbors),
+            mimetype='application/octet-stream',
+            headers={INDEX_GENERATION_HEADER: str(generation)},
+        )
+
+    def index_generation(self) -> int:
+        """ The static index never changes """
+        return 0
+
     def get_knn(self, query: Union[List[str], str, torch.Tensor], neighbors: int):
         single_sentence = False
         if isinstance(query, str):
@@ -265,7 +469,7 @@ class RetrievalServer(object):
         self.ds = MMapRetrievalIndexedDataset(retrieval_index)
         api = Api(self.app)
         api.add_resource(
-            FaissRetrievalResource, '/knn', resource_class_args=[self.index, self.tokenizer, self.ds,],
+            FaissRetrievalResource, '/knn', '/knn_batch', resource_class_args=[self.index, self.tokenizer, self.ds,],
         )
 
     def run(self, url, port=PORT_NUM):
@@ -289,6 +493,8 @@ class DynamicRetrievalResource(FaissRetrievalResource):
         self.ds = store
 
     def put(self):
+        if request.path.endswith('/knn_batch'):
+            return self.put_batch()
         data = request.get_json()
         if 'neighbors' in data:
             sentences = data['sentences']
@@ -313,6 +519,9 @@ class DynamicRetrievalResource(FaissRetrievalResource):
         self.index.reset()
         self.ds.reset()
 
+    def index_generation(self) -> int:
+        return self.ds.generation
+
     def add_docs_to_index(self, docs: List[str], add_eos: bool = True):
         """
         Add documents to the Faiss index
@@ -380,6 +589,7 @@ class DynamicRetrievalServer(object):
         api.add_resource(
             DynamicRetrievalResource,
             '/knn',
+            '/knn_batch',
             resource_class_args=[self.index, self.tokenizer, self.chunk_size, self.stride, self.store,],
         )
 
@@ -387,15 +597,39 @@ class DynamicRetrievalServer(object):
         threading.Thread(target=lambda: self.app.run(host=url, threaded=True, port=port)).start()
 
 
+def _client_get_knn_async(client, tokenizer, no_retrieval, query, neighbors) -> Future:
+    if isinstance(query, str):
+        query = [query]
+    elif isinstance(query, torch.Tensor):
+        sentence_list = []
+        for q in query:
+            text = tokenizer.ids_to_text(q)
+            sentence_list.append(text)
+        query = sentence_list
+    if neighbors == 0:
+        # use padding
+        future = Future()
+        future.set_result(np.repeat(no_retrieval, len(query), 0).astype(np.int64))
+        return future
+    return client.get_knn_async(query, neighbors)
+
+
 class FaissRetrievalService(RetrievalService):
     """
     Top level static retrieval service class.
     It starts the server at rank 0 worker, currently doesn't support multiple nodes yet.
-    It implements the retrieval services interface, has a simple client to do KNN queries.
+    It implements the retrieval services interface, has an asynchronous batched client to do KNN queries.
     """
 
     def __init__(
-        self, faiss_index: str, faiss_devices: str, nprobe: int, retrieval_index: str, tokenizer: TokenizerSpec,
+        self,
+        faiss_index: str,
+        faiss_devices: str,
+        nprobe: int,
+        retrieval_index: str,
+        tokenizer: TokenizerSpec,
+        neighbor_cache_size: int = 10000,
+        batch_window: float = 0.002,
     ):
         self.updatable = False
         self.tokenizer = tokenizer
@@ -408,34 +642,37 @@ class FaissRetrievalService(RetrievalService):
             server = RetrievalServer(faiss_index, faiss_devices, nprobe, retrieval_index, tokenizer)
             server.run("0.0.0.0")
         torch.distributed.barrier()
+        self.client = RetrievalClient(PORT_NUM, cache_size=neighbor_cache_size, batch_window=batch_window)
 
     def get_knn(self, query: Union[List[str], str, torch.Tensor], neighbors):
-        if isinstance(query, torch.Tensor):
-            sentence_list = []
-            for q in query:
-                text = self.tokenizer.ids_to_text(q)
-                sentence_list.append(text)
-            query = sentence_list
-        if neighbors == 0:
-            # use padding
-            return np.repeat(self.no_retrieval, len(query), 0).astype(np.int64)
-        data = {'sentences': query}
-        data['neighbors'] = neighbors
-        result = request_data(data, PORT_NUM)
-        result = np.array(result)
+        result = self.get_knn_async(query, neighbors).result()
+        if isinstance(query, str):
+            # unpack the single sentence input
+            return result[0]
         return result
 
+    def get_knn_async(self, query: Union[List[str], str, torch.Tensor], neighbors) -> Future:
+        return _client_get_knn_async(self.client, self.tokenizer, self.no_retrieval, query, neighbors)
+
 
 class DynamicFaissRetrievalService(RetrievalService):
     """
     Top level dynamic retrieval service class.
     It starts the server at rank 0 worker, currently doesn't support multiple nodes yet.
-    It implements the retrieval services interface, has a simple client to add, reset and query
-    the dynamic retrieval index.
+    It implements the retrieval services interface, has a simple client to add, reset and an asynchronous
+    batched client to query the dynamic retrieval index.
+    The index can be updated by other clients (e.g. the web demo), and queries whose neighbors are all cached
+    never reach the server to learn about it, so the neighbor cache is disabled by default.
     """
 
     def __init__(
-        self, faiss_devices: str, tokenizer: TokenizerSpec, chunk_size: int, stride: int,
+        self,
+        faiss_devices: str,
+        tokenizer: TokenizerSpec,
+        chunk_size: int,
+        stride: int,
+        neighbor_cache_size: int = 0,
+        batch_window: float = 0.002,
     ):
         self.updatable = True
         self.tokenizer = tokenizer
@@ -447,23 +684,18 @@ class DynamicFaissRetrievalService(RetrievalService):
             server = DynamicRetrievalServer(faiss_devices, tokenizer, chunk_size, stride)
             server.run("0.0.0.0")
         torch.distributed.barrier()
+        self.client = RetrievalClient(PORT_NUM_DYN, cache_size=neighbor_cache_size, batch_window=batch_window)
 
     def get_knn(self, query: Union[List[str], str, torch.Tensor], neighbors):
-        if isinstance(query, torch.Tensor):
-            sentence_list = []
-            for q in query:
-                text = self.tokenizer.ids_to_text(q)
-                sentence_list.append(text)
-            query = sentence_list
-        if neighbors == 0:
-            # use padding
-            return np.repeat(self.no_retrieval, len(query), 0).astype(np.int64)
-        data = {'sentences': query}
-        data['neighbors'] = neighbors
-        result = request_data(data, PORT_NUM_DYN)
-        result = np.array(result)
+        result = self.get_knn_async(query, neighbors).result()
+        if isinstance(query, str):
+            # unpack the single sentence input
+            return result[0]
         return result
 
+    def get_knn_async(self, query: Union[List[str], str, torch.Tensor], neighbors) -> Future:
+        return _client_get_knn_async(self.client, self.tokenizer, self.no_retrieval, query, neighbors)
+
     def add_docs_to_index(self, query: List[str], add_eos: bool = True):
         """
         Add documents to the Faiss index
@@ -478,7 +710,10 @@ class DynamicFaissRetrievalService(RetrievalService):
                 sentence_list.append(text)
             query = sentence_list
         data = {'sentences': query, 'add_eos': add_eos}
-        return request_data(data, PORT_NUM_DYN)
+        output = request_data(data, PORT_NUM_DYN)
+        # the neighbors of the cached queries may change with the new documents
+        self.client.clear_cache()
+        return output
 
 
 class ComboRetrievalService(RetrievalService):
@@ -486,6 +721,7 @@ class ComboRetrievalService(RetrievalService):
     Top level retrieval service class.
     It combines other retrieval services as a combo retrieval service.
     It uses `weights` to determine the number of neighbors for each of the retrieval service members.
+    The member services are queried in parallel.
     """
 
     def __init__(self, retrieval_services, weights):
@@ -505,7 +741,7 @@ class ComboRetrievalService(RetrievalService):
         if neighbors == 0:
             return self.retrieval_services[0].get_knn(query, 0)
         total_neighbors = 0
-        results = []
+        futures = []
         for i, service in enumerate(self.retrieval_services):
             k = int(neighbors * self.weights[i])
             if i == len(self.retrieval_services) - 1:
@@ -514,9 +750,12 @@ class ComboRetrievalService(RetrievalService):
             if k == 0:
                 # empty, skip it
                 continue
-            result = service.get_knn(query, k)
-            results.append(result)
-        return np.concatenate(results, axis=1)
+            futures.append(service.get_knn_async(query, k))
+        result = np.concatenate([future.result() for future in futures], axis=1)
+        if isinstance(query, str):
+            # unpack the single sentence input
+            return result[0]
+        return result
 
     def add_docs_to_index(self, query: List[str], add_eos: bool = True):
         """
@@ -761,6 +761,10 @@ class ParallelAttention(MegatronModule, adapter_mixins.AdapterModuleMixin):
         self.inference_key_memory = None
         self.inference_value_memory = None
         self.inference_current_sequence_len = 0
+        # (key, value) of a cached context prefix, loaded into the memory when it is allocated
+        self.inference_prefix_key_value = None
+        # paged key-value memory used by continuous batching instead of the inference memory above
+        self.inference_paged_kv = None
 
         # relative position embedding
         self.layer_type = layer_type
@@ -897,6 +901,13 @@ class ParallelAttention(MegatronModule, adapter_mixins.AdapterModuleMixin):
                 inference_max_sequence_len, hidden_states.size(1), hidden_states.dtype
             )
             self.inference_current_sequence_len = 0
+            if self.inference_prefix_key_value is not None:
+                # reuse the key-values of a cached context prefix, only the rest of the context is computed
+                prefix_key, prefix_value = self.inference_prefix_key_value
+                self.inference_key_memory[: prefix_key.size(0), ...] = prefix_key
+                self.inference_value_memory[: prefix_value.size(0), ...] = prefix_value
+                self.inference_current_sequence_len = prefix_key.size(0)
+                self.inference_prefix_key_value = None
 
         # Some consistency check.
         if inference_max_sequence_len:
@@ -973,7 +984,11 @@ class ParallelAttention(MegatronModule, adapter_mixins.AdapterModuleMixin):
         if rotary_pos_emb is not None:
             rotary_pos_emb = rotary_pos_emb if isinstance(rotary_pos_emb, tuple) else ((rotary_pos_emb,) * 2)
 
-        if inference_max_sequence_len:
+        if self.inference_paged_kv is not None:
+            # Sequences of the batch have different lengths, the paged memory returns the key-values
+            # of the whole sequences and masks out the padding.
+            key_layer, value_layer, attention_mask = self.inference_paged_kv.update(self, key_layer, value_layer)
+        elif inference_max_sequence_len:
             # Adjust the range variables.
             start = self.inference_current_sequence_len
             self.inference_current_sequence_len += key_layer.size(0)
@@ -992,6 +1007,9 @@ class ParallelAttention(MegatronModule, adapter_mixins.AdapterModuleMixin):
                     # In inference, we compute one token at a time.
                     # Select the correct positional embedding.
                     q_pos_emb = q_pos_emb[end - 1 : end]
+                elif start > 0:
+                    # The context is computed after a cached prefix.
+                    q_pos_emb = q_pos_emb[start:end]
                 k_pos_emb = k_pos_emb[:end, :, :, :]
                 rotary_pos_emb = (q_pos_emb, k_pos_emb)
 
@@ -0,0 +1,374 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Continuous (iteration-level) batching of text generation requests."""
+
+import itertools
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+import torch
+import torch.nn.functional as F
+
+from nemo.collections.nlp.modules.common.megatron.paged_kv_cache import PagedKVCache
+from nemo.collections.nlp.modules.common.text_generation_utils import repetition_penalty, top_k_logits
+from nemo.utils import logging
+
+try:
+    from apex.transformer import parallel_state, tensor_parallel
+
+    HAVE_APEX = True
+except (ImportError, ModuleNotFoundError):
+    HAVE_APEX = False
+
+__all__ = ['ContinuousBatchingScheduler', 'GenerationRequest', 'MegatronGPTPagedModelRunner']
+
+
+class GenerationRequest:
+    """ A text generation request and its state in the scheduler """
+
+    _ids = itertools.count()
+
+    def __init__(
+        self,
+        prompt_tokens: List[int],
+        tokens_to_generate: int,
+        greedy: bool = False,
+        temperature: float = 1.0,
+        top_k: int = 0,
+        top_p: float = 0.0,
+        repetition_penalty: float = 1.0,
+    ):
+        self.request_id = next(GenerationRequest._ids)
+        self.prompt_tokens = list(prompt_tokens)
+        self.tokens_to_generate = tokens_to_generate
+        self.greedy = greedy
+        self.temperature = temperature
+        self.top_k = top_k
+        self.top_p = top_p
+        self.repetition_penalty = repetition_penalty
+        self.generated_tokens = []
+        self.future = Future()
+        self.arrival_time = time.time()
+        self.first_token_time = None
+
+    @property
+    def tokens(self) -> List[int]:
+        return self.prompt_tokens + self.generated_tokens
+
+    def result(self) -> Dict:
+        return {
+            'token_ids': self.tokens,
+            'generated_token_ids': self.generated_tokens,
+            'time_to_first_token': self.first_token_time - self.arrival_time,
+        }
+
+
+class MegatronGPTPagedModelRunner:
+    """
+    Runs the inference steps of a MegatronGPTModel with a paged key-value memory.
+    Only supports models without tensor and pipeline model parallelism.
+    """
+
+    def __init__(self, model):
+        from nemo.collections.nlp.modules.common.megatron.transformer import ParallelAttention
+
+        assert (
+            parallel_state.get_tensor_model_parallel_world_size() == 1
+            and parallel_state.get_pipeline_model_parallel_world_size() == 1
+        ), 'Continuous batching does not support tensor or pipeline model parallelism'
+        self.model = model
+        self.model.eval()
+        self.attention_layers = [m for m in self.model.model.modules() if isinstance(m, ParallelAttention)]
+
+    def __call__(self, kv_cache: PagedKVCache, tokens: torch.Tensor, positions: torch.Tensor) -> torch.Tensor:
+        """ Returns the logits of the last token of every sequence """
+        for layer in self.attention_layers:
+            layer.inference_paged_kv = kv_cache
+        try:
+            # the attention layers use the mask of the paged memory, this one only sets the shape
+            attention_mask = torch.ones(1, 1, tokens.size(1), tokens.size(1), dtype=torch.bool, device=tokens.device)
+            dtype = self.model.autocast_dtype
+            with torch.no_grad(), torch.autocast(
+                device_type='cuda', dtype=dtype, enabled=dtype in [torch.half, torch.bfloat16]
+            ):
+                output = self.model.model(tokens, positions, attention_mask)
+            output = tensor_parallel.gather_from_tensor_model_parallel_region(output)
+        finally:
+            for layer in self.attention_layers:
+                layer.inference_paged_kv = None
+        return output[:, -1].float()
+
+
+class ContinuousBatchingScheduler:
+    """
+    Iteration-level scheduler for text generation.
+
+    Instead of running a fixed batch until its longest sequence finishes, every step admits waiting requests
+    into the free batch slots and retires the finished ones, so short completions don't wait for long ones.
+    The key-value memory of the sequences lives in a `PagedKVCache`. When it runs out of blocks, the most
+    recently admitted sequences are preempted and recomputed once memory is available again.
+
+    Args:
+        runner: callable(kv_cache, tokens [b, sq], positions [b, sq]) returning the logits [b, vocab] of the
+            last token of every sequence, e.g. a MegatronGPTPagedModelRunner
+        kv_cache: paged key-value memory shared by the running sequences
+        eos_id: end of sequence token id
+        max_batch_size: maximum number of sequences decoded together
+        max_sequence_length: maximum number of tokens of a sequence, including the prompt
+        vocab_size: tokens at or above this id are never sampled
+        device: device of the runner inputs
+    """
+
+    def __init__(
+        self,
+        runner: Callable,
+        kv_cache: PagedKVCache,
+        eos_id: int,
+        max_batch_size: int = 32,
+        max_sequence_length: int = 2048,
+        vocab_size: Optional[int] = None,
+        device: Optional[torch.device] = None,
+    ):
+        self.runner = runner
+        self.kv_cache = kv_cache
+        self.eos_id = eos_id
+        self.max_batch_size = max_batch_size
+        self.max_sequence_length = max_sequence_length
+        self.vocab_size = vocab_size
+        self.device = device
+
+        self.incoming = queue.Queue()
+        self.waiting = deque()
+        self.running = []
+        self.num_preemptions = 0
+        self._generated = deque()
+        self._time_to_first_token = deque(maxlen=1000)
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def submit(
+        self,
+        prompt_tokens: List[int],
+        tokens_to_generate: int,
+        greedy: bool = False,
+        temperature: float = 1.0,
+        top_k: int = 0,
+        top_p: float = 0.0,
+        repetition_penalty: float = 1.0,
+    ) -> Future:
+        """
+        Queues a generation request, can be called from any thread.
+        Returns a future of a dictionary with the `token_ids` of the whole sequence, the `generated_token_ids`
+        and the `time_to_first_token` in seconds.
+        """
+        request = GenerationRequest(
+            prompt_tokens, tokens_to_generate, greedy, temperature, top_k, top_p, repetition_penalty
+        )
+        self.incoming.put(request)
+        self._wakeup.set()
+        return request.future
+
+    def _finished(self, request: GenerationRequest) -> bool:
+        return (
+            len(request.generated_tokens) >= request.tokens_to_generate
+            or (len(request.generated_tokens) > 0 and request.generated_tokens[-1] == self.eos_id)
+            or len(request.tokens) >= self.max_sequence_length
+        )
+
+    def _retire(self, request: GenerationRequest):
+        self.kv_cache.free(request.request_id)
+        self._time_to_first_token.append(request.first_token_time - request.arrival_time)
+        request.future.set_result(request.result())
+
+    def _sample(self, logits: torch.Tensor, requests: List[GenerationRequest]) -> List[int]:
+        if self.vocab_size is not None:
+            logits[:, self.vocab_size :] = -float('Inf')
+        new_tokens = []
+        for row, request in zip(logits, requests):
+            row = row.unsqueeze(0)
+            if request.greedy:
+                new_tokens.append(int(torch.argmax(row, dim=-1)))
+                continue
+            row = row / request.temperature
+            used_tokens = torch.tensor([request.tokens], dtype=torch.long, device=row.device)
+            row = repetition_penalty(row, request.repetition_penalty, used_tokens)
+            row = top_k_logits(row, top_k=request.top_k, top_p=request.top_p)
+            new_tokens.append(int(torch.multinomial(F.softmax(row, dim=-1), num_samples=1)))
+        return new_tokens
+
+    def _append_tokens(self, requests: List[GenerationRequest], new_tokens: List[int]):
+        now = time.time()
+        for request, token in zip(requests, new_tokens):
+            request.generated_tokens.append(token)
+            if request.first_token_time is None:
+                request.first_token_time = now
+        self._generated.append((now, len(new_tokens)))
+
+    def _admit(self):
+        while not self.incoming.empty():
+            request = self.incoming.get()
+            if request.tokens_to_generate <= 0:
+                request.first_token_time = time.time()
+                request.future.set_result(request.result())
+            elif len(request.tokens) >= self.max_sequence_length:
+                request.future.set_exception(
+                    ValueError(
+                        f'Prompt of {len(request.tokens)} tokens leaves no room for generation, '
+                        f'the maximum sequence length is {self.max_sequence_length}'
+                    )
+                )
+            elif self.kv_cache.blocks_needed(len(request.tokens) + 1) > self.kv_cache.num_blocks:
+                request.future.set_exception(
+                    ValueError(f'Prompt of {len(request.tokens)} tokens does not fit into the paged KV cache')
+                )
+            else:
+                self.waiting.append(request)
+
+        while self.waiting and len(self.running) < self.max_batch_size:
+            request = self.waiting[0]
+            # keep room for the first decoding step
+            if not self.kv_cache.can_append(request.request_id, len(request.tokens) + 1):
+                break
+            self.waiting.popleft()
+            # prefill the prompt (and the tokens generated before a preemption)
+            tokens = torch.tensor([request.tokens], dtype=torch.long, device=self.device)
+            positions = torch.arange(tokens.size(1), dtype=torch.long, device=self.device).unsqueeze(0)
+            try:
+                self.kv_cache.begin_step([request.request_id], tokens.size(1), device=self.device)
+                try:
+                    logits = self.runner(self.kv_cache, tokens, positions)
+                finally:
+                    self.kv_cache.end_step()
+                new_tokens = self._sample(logits, [request])
+            except Exception as e:
+                # only this request fails, the running ones keep generating
+                logging.error(f'Prefill of generation request {request.request_id} failed: {e}')
+                self.kv_cache.free(request.request_id)
+                request.future.set_exception(e)
+                continue
+            self._append_tokens([request], new_tokens)
+            if self._finished(request):
+                self._retire(request)
+            else:
+                self.running.append(request)
+
+    def _preempt(self):
+        """ Frees the memory of the sequences admitted last until every running sequence can grow by a token """
+
+        def blocks_short():
+            needed = sum(
+                self.kv_cache.blocks_needed(len(r.tokens)) - len(self.kv_cache.block_tables[r.request_id])
+                for r in self.running
+            )
+            return needed > self.kv_cache.num_free_blocks
+
+        while len(self.running) > 1 and blocks_short():
+            request = self.running.pop()
+            self.kv_cache.free(request.request_id)
+            self.waiting.appendleft(request)
+            self.num_preemptions += 1
+            logging.debug(f'Preempted generation request {request.request_id}')
+        if blocks_short():
+            # a single sequence filled the whole memory, stop generating it
+            request = self.running.pop()
+            logging.warning(f'Generation request {request.request_id} was truncated, the paged KV cache is full')
+            self._retire(request)
+
+    def _decode(self):
+        if not self.running:
+            return
+        self._preempt()
+        if not self.running:
+            return
+        requests = self.running
+        tokens = torch.tensor([[r.generated_tokens[-1]] for r in requests], dtype=torch.long, device=self.device)
+        positions = torch.tensor([[len(r.tokens) - 1] for r in requests], dtype=torch.long, device=self.device)
+        self.kv_cache.begin_step([r.request_id for r in requests], 1, device=self.device)
+        try:
+            logits = self.runner(self.kv_cache, tokens, positions)
+        finally:
+            self.kv_cache.end_step()
+        self._append_tokens(requests, self._sample(logits, requests))
+        self.running = []
+        for request in requests:
+            if self._finished(request):
+                self._retire(request)
+            else:
+                self.running.append(request)
+
+    def step(self) -> bool:
+        """ Runs one scheduling iteration, returns False if there was nothing to do """
+        with torch.no_grad():
+            self._admit()
+            self._decode()
+        return bool(self.running or self.waiting or not self.incoming.empty())
+
+    def run_until_complete(self):
+        """ Serves the queued requests until all of them finish """
+        while self.step():
+            pass
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                busy = self.step()
+            except Exception as e:
+                logging.error(f'Continuous batching step failed: {e}')
+                for request in self.running + list(self.waiting):
+                    self.kv_cache.free(request.request_id)
+                    request.future.set_exception(e)
+                self.running, self.waiting = [], deque()
+                busy = False
+            if not busy:
+                self._wakeup.wait(timeout=0.1)
+                self._wakeup.clear()
+
+    def start(self):
+        """ Serves the requests in a background thread """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def metrics(self, window: float = 10.0) -> Dict[str, float]:
+        """ Queue depth, generation throughput over the last `window` seconds and mean time to first token """
+        now = time.time()
+        while self._generated and self._generated[0][0] < now - window:
+            self._generated.popleft()
+        generated = list(self._generated)
+        tokens_per_second = 0.0
+        if generated:
+            elapsed = max(now - generated[0][0], 1e-6)
+            tokens_per_second = sum(n for _, n in generated) / elapsed
+        ttft = list(self._time_to_first_token)
+        return {
+            'queue_depth': self.incoming.qsize() + len(self.waiting),
+            'running': len(self.running),
+            'tokens_per_second': tokens_per_second,
+            'mean_time_to_first_token': sum(ttft) / len(ttft) if ttft else 0.0,
+            'num_preemptions': self.num_preemptions,
+            'free_kv_blocks': self.kv_cache.num_free_blocks,
+            'kv_cache_memory_bytes': self.kv_cache.memory_bytes(),
+        }
@@ -45,9 +45,10 @@ API_ALLOWED_KEYS = set(
 
 
 class MegatronGenerate(Resource):
-    def __init__(self, model, inference_strategy=None):
+    def __init__(self, model, inference_strategy=None, scheduler=None):
         self.model = model
         self.inference_strategy = inference_strategy
+        self.scheduler = scheduler
 
     @staticmethod
     def send_do_generate():
@@ -160,6 +161,13 @@ class MegatronGenerate(Resource):
             if not (0.0 <= weights <= 1.0):
                 return "weights must be a positive number less than or equal to 1.0"
 
+        if self.scheduler is not None:
+            if isinstance(sentences, tuple) or all_probs or min_tokens_to_generate > 0 or task_ids is not None:
+                return "Continuous batching only supports text sentences without all_probs and min_tokens_to_generate"
+            return self.continuous_generate(
+                sentences, tokens_to_generate, add_BOS, greedy, temperature, top_k, top_p, repetition_penalty
+            )
+
         with lock:  # Need to get lock to keep multiple threads from hitting code
             MegatronGenerate.send_do_generate()  # Tell other ranks we're doing generate
             extra = {}
@@ -200,12 +208,62 @@ class MegatronGenerate(Resource):
                 output['retrieved'] = retrieved_doc
         return jsonify(output)
 
+    def continuous_generate(
+        self, sentences, tokens_to_generate, add_BOS, greedy, temperature, top_k, top_p, repetition_penalty
+    ):
+        """ Generates with the continuous batching scheduler, the sentences join the running batch """
+        tokenizer = self.model.tokenizer
+        futures = []
+        for sentence in sentences:
+            tokens = tokenizer.text_to_ids(sentence)
+            if add_BOS:
+                tokens = [tokenizer.bos_id] + tokens
+            futures.append(
+                self.scheduler.submit(
+                    tokens,
+                    tokens_to_generate,
+                    greedy=greedy,
+                    temperature=temperature,
+                    top_k=top_k,
+                    top_p=top_p,
+                    repetition_penalty=repetition_penalty,
+                )
+            )
+        results = [future.result() for future in futures]
+        output = {
+            'sentences': [tokenizer.ids_to_text(result['token_ids']) for result in results],
+            'token_ids': [result['token_ids'] for result in results],
+        }
+        return jsonify(output)
+
+
+class SchedulerMetrics(Resource):
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+
+    def get(self):
+        return jsonify(self.scheduler.metrics())
+
+
+class KVPrefixCacheStats(Resource):
+    def __init__(self, model):
+        self.model = model
+
+    def get(self):
+        cache = getattr(self.model, 'kv_prefix_cache', None)
+        if cache is None:
+            return jsonify({})
+        return jsonify(cache.stats())
+
 
 class MegatronServer(object):
-    def __init__(self, model, inference_strategy=None):
+    def __init__(self, model, inference_strategy=None, scheduler=None):
         self.app = Flask(__name__, static_url_path='')
         api = Api(self.app)
-        api.add_resource(MegatronGenerate, '/generate', resource_class_args=[model, inference_strategy])
+        api.add_resource(MegatronGenerate, '/generate', resource_class_args=[model, inference_strategy, scheduler])
+        api.add_resource(KVPrefixCacheStats, '/kv_cache_stats', resource_class_args=[model])
+        if scheduler is not None:
+            api.add_resource(SchedulerMetrics, '/metrics', resource_class_args=[scheduler])
 
     def run(self, url, port=5000):
         self.app.run(url, threaded=True, port=port, debug=False)
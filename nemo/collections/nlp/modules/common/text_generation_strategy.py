@@ -13,7 +13,7 @@
 # limitations under the License.
 
 import abc
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 import torch
 
@@ -148,11 +148,73 @@ class TextGenerationStrategy:
         """
         pass
 
+    def reuse_cached_prefix(self, tokens: torch.Tensor, context_length: int) -> Tuple[int, Optional[torch.Tensor]]:
+        """
+        Loads the key-value memory of the longest cached context prefix before the first inference step.
+        Args:
+            tokens  (torch.Tensor): the context tokens
+            context_length (int): the context token length
+        returns:
+            the reused prefix length and the log probs of the prefix tokens of shape [batch, prefix_length],
+            the log probs are only kept on the last pipeline stage
+        """
+        return 0, None
+
+    def cache_prefix(self, tokens: torch.Tensor, context_length: int, output_logits: Optional[torch.Tensor]):
+        """
+        Stores the key-value memory of the context after the first inference step.
+        Args:
+            tokens  (torch.Tensor): the context tokens
+            context_length (int): the context token length
+            output_logits (torch.Tensor): the log probs of the context tokens, only on the last pipeline stage
+        """
+        pass
+
 
 class GPTModelTextGenerationStrategy(TextGenerationStrategy):
     def __init__(self, model):
         super().__init__(model)
         self.forward_model = self.model.model
+        self.prefix_cache = getattr(self.model, 'kv_prefix_cache', None)
+        self.prefix_length = 0
+        self._attention_layers = None
+
+    def _get_attention_layers(self):
+        if self._attention_layers is None:
+            from nemo.collections.nlp.modules.common.megatron.transformer import ParallelAttention
+
+            modules = self.forward_model if isinstance(self.forward_model, list) else [self.forward_model]
+            self._attention_layers = [
+                m for module in modules for m in module.modules() if isinstance(m, ParallelAttention)
+            ]
+        return self._attention_layers
+
+    def reuse_cached_prefix(self, tokens: torch.Tensor, context_length: int) -> Tuple[int, Optional[torch.Tensor]]:
+        self.prefix_length = 0
+        if self.prefix_cache is None or len(self._get_attention_layers()) == 0:
+            return 0, None
+        # at least the last context token is computed to get the logits of the first generated token
+        prefix_length, keys, values, logprobs = self.prefix_cache.lookup(
+            tokens[:, :context_length].tolist(), context_length - 1
+        )
+        if prefix_length == 0:
+            return 0, None
+        for layer, key, value in zip(self._get_attention_layers(), keys, values):
+            layer.inference_prefix_key_value = (key, value)
+        self.prefix_length = prefix_length
+        return prefix_length, logprobs
+
+    def cache_prefix(self, tokens: torch.Tensor, context_length: int, output_logits: Optional[torch.Tensor]):
+        if self.prefix_cache is None or len(self._get_attention_layers()) == 0:
+            return
+        layers = self._get_attention_layers()
+        for i, sequence in enumerate(tokens[:, :context_length].tolist()):
+            self.prefix_cache.insert(
+                sequence,
+                [layer.inference_key_memory[:context_length, i] for layer in layers],
+                [layer.inference_value_memory[:context_length, i] for layer in layers],
+                None if output_logits is None else output_logits[i, : context_length - 1],
+            )
 
     def clip_max_len(self, maxlen: int) -> int:
         """ clip the max len based on the LM model max sequence length"""
@@ -165,6 +227,7 @@ class GPTModelTextGenerationStrategy(TextGenerationStrategy):
         # Move to GPU.
         tokenizer = self.model.tokenizer
         tokens = context_tokens.contiguous().cuda()
+        self.prefix_length = 0
         # Get the attention mask and postition ids.
         self.attention_mask, _, self.position_ids = get_ltor_masks_and_position_ids(
             tokens,
@@ -184,8 +247,9 @@ class GPTModelTextGenerationStrategy(TextGenerationStrategy):
         if step == 0:
             # Allocate memory for the entire context.
             set_inference_key_value_memory = True
-            tokens2use = tokens[:, :context_length]
-            positions2use = self.position_ids[:, :context_length]
+            # the key-values of a cached prefix are loaded into the memory, compute the rest of the context
+            tokens2use = tokens[:, self.prefix_length : context_length]
+            positions2use = self.position_ids[:, self.prefix_length : context_length]
             # not using type2use. uncomment it if it is used
             # if type_ids is not None:
             #     types2use = type_ids[:, :context_length]
@@ -580,6 +580,10 @@ def sample_sequence_batch(
     with torch.no_grad():
         context_length = context_lengths.min().item()
         inference_strategy.init_batch(context_tokens, context_length)
+        prefix_length, prefix_logprobs = 0, None
+        if not all_probs:
+            # the full log probs of a cached prefix are not kept, only the log probs of its tokens
+            prefix_length, prefix_logprobs = inference_strategy.reuse_cached_prefix(context_tokens, context_length)
         # added eos_id to support the function generate_samples_eval that passes
         # eos_id as an argument and needs termination when that id id found.
         eod_id = tokenizer.eos_id
@@ -646,7 +650,10 @@ def sample_sequence_batch(
                 if output_logits is None:
                     output = F.log_softmax(output[:, :context_length, :], 2)
                     indices = torch.unsqueeze(tokens[:, 1 : context_length + 1], 2)
-                    output_logits = torch.gather(output, 2, indices).squeeze(2)
+                    # the output starts after the reused cached prefix
+                    output_logits = torch.gather(output, 2, indices[:, prefix_length:]).squeeze(2)
+                    if prefix_logprobs is not None:
+                        output_logits = torch.cat([prefix_logprobs.to(output_logits), output_logits], 1)
                     all_generated_indices = indices[:, :, 0]
                     if all_probs:
                         full_logits = output
@@ -695,6 +702,10 @@ def sample_sequence_batch(
                 group = parallel_state.get_pipeline_model_parallel_group()
                 torch.distributed.broadcast(done, src, group)
 
+            if counter == 0:
+                # the key-value memory holds the whole context now
+                inference_strategy.cache_prefix(tokens, context_length, output_logits)
+
             context_length += 1
             counter += 1
             if done:
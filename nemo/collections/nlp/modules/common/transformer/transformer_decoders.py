@@ -16,11 +16,82 @@ import copy
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 from nemo.collections.common.parts import form_attention_mask
 from nemo.collections.nlp.modules.common.transformer.transformer_modules import MultiHeadAttention, PositionWiseFF
 
-__all__ = ["TransformerDecoder"]
+__all__ = ["TransformerDecoder", "TransformerDecoderKVCache"]
+
+
+class TransformerDecoderKVCache:
+    """
+    Per-layer key/value cache of TransformerDecoder for fast autoregressive generation.
+
+    The self-attention keys and values of the generated tokens are written into buffers pre-sized to
+    max_length, so every step only projects the new tokens instead of the whole hidden states history.
+    The cross-attention keys and values of the encoder states are computed once, at the first step.
+
+    Args:
+        num_layers: number of decoder layers
+        max_length: maximum number of tokens, including the starting ones
+    """
+
+    def __init__(self, num_layers: int, max_length: int):
+        self.max_length = max_length
+        self.length = 0
+        # tensors of shape B x num_heads x max_length x head_size
+        self.keys = [None] * num_layers
+        self.values = [None] * num_layers
+        # tensors of shape B x num_heads x L_enc x head_size
+        self.cross_keys = [None] * num_layers
+        self.cross_values = [None] * num_layers
+
+    def update(self, layer_idx, key, value):
+        """
+        Writes the keys and values of the new tokens of a layer into the cache.
+
+        Args:
+            layer_idx: index of the decoder layer
+            key: keys of the new tokens of shape B x num_heads x L_new x head_size
+            value: values of the new tokens of shape B x num_heads x L_new x head_size
+        Returns:
+            the keys and values of all the tokens of shape B x num_heads x (length + L_new) x head_size
+        """
+        end = self.length + key.size(2)
+        if end > self.max_length:
+            raise ValueError(f"Decoder KV cache is full, got {end} tokens and max_length is {self.max_length}")
+        if self.keys[layer_idx] is None:
+            shape = key.shape[:2] + (self.max_length, key.size(3))
+            self.keys[layer_idx] = key.new_zeros(shape)
+            self.values[layer_idx] = value.new_zeros(shape)
+        self.keys[layer_idx][:, :, self.length : end] = key
+        self.values[layer_idx][:, :, self.length : end] = value
+        return self.keys[layer_idx][:, :, :end], self.values[layer_idx][:, :, :end]
+
+    def advance(self, num_tokens):
+        self.length += num_tokens
+
+    def expand(self, beam_size):
+        """ Repeats every batch element beam_size times, in the order of the beam search hypotheses """
+        for buffers in (self.keys, self.values, self.cross_keys, self.cross_values):
+            for i, buffer in enumerate(buffers):
+                if buffer is not None:
+                    buffers[i] = buffer.repeat_interleave(beam_size, dim=0)
+
+    def reorder(self, indices):
+        """
+        Reorders the cached hypotheses in place after the beam search top-k selection.
+        The cross-attention keys and values are left as is, since hypotheses are only
+        reordered within the beam of the same batch element.
+
+        Args:
+            indices: index of the source hypothesis of every hypothesis, of shape B
+        """
+        for buffers in (self.keys, self.values):
+            for buffer in buffers:
+                if buffer is not None:
+                    buffer[:, :, : self.length] = buffer[:, :, : self.length].index_select(0, indices)
 
 
 class TransformerDecoderBlock(nn.Module):
@@ -63,20 +134,42 @@ class TransformerDecoderBlock(nn.Module):
         self.layer_norm_3 = nn.LayerNorm(hidden_size, eps=1e-5)
         self.third_sub_layer = PositionWiseFF(hidden_size, inner_size, ffn_dropout, hidden_act)
 
-    def forward_preln(self, decoder_query, decoder_mask, decoder_keys, encoder_states, encoder_mask):
+    def _self_attention(self, decoder_query, decoder_mask, decoder_keys, kv_cache=None, layer_idx=0):
+        if kv_cache is None:
+            return self.first_sub_layer(decoder_query, decoder_keys, decoder_keys, decoder_mask)
+        # keys and values of the previous tokens are taken from the cache
+        key, value = self.first_sub_layer.project_keys_values(decoder_query, decoder_query)
+        key, value = kv_cache.update(layer_idx, key, value)
+        return self.first_sub_layer.attend(decoder_query, key, value, decoder_mask)
+
+    def _cross_attention(self, decoder_query, encoder_states, encoder_mask, kv_cache=None, layer_idx=0):
+        if kv_cache is None:
+            return self.second_sub_layer(decoder_query, encoder_states, encoder_states, encoder_mask)
+        if kv_cache.cross_keys[layer_idx] is None:
+            key, value = self.second_sub_layer.project_keys_values(encoder_states, encoder_states)
+            kv_cache.cross_keys[layer_idx], kv_cache.cross_values[layer_idx] = key, value
+        key, value = kv_cache.cross_keys[layer_idx], kv_cache.cross_values[layer_idx]
+        return self.second_sub_layer.attend(decoder_query, key, value, encoder_mask)
+
+    def forward_preln(
+        self, decoder_query, decoder_mask, decoder_keys, encoder_states, encoder_mask, kv_cache=None, layer_idx=0
+    ):
         """
         Pre-LayerNorm block
         Order of operations: LN -> Self-Attn -> Residual -> LN -> Cross-Attn -> Residual -> LN -> FFN
         """
         residual = decoder_query
         decoder_query = self.layer_norm_1(decoder_query)
-        decoder_keys = self.layer_norm_1(decoder_keys)
-        self_attn_output = self.first_sub_layer(decoder_query, decoder_keys, decoder_keys, decoder_mask)
+        if kv_cache is None:
+            decoder_keys = self.layer_norm_1(decoder_keys)
+        self_attn_output = self._self_attention(decoder_query, decoder_mask, decoder_keys, kv_cache, layer_idx)
         self_attn_output += residual
 
         residual = self_attn_output
         self_attn_output = self.layer_norm_2(self_attn_output)
-        enc_dec_attn_output = self.second_sub_layer(self_attn_output, encoder_states, encoder_states, encoder_mask)
+        enc_dec_attn_output = self._cross_attention(
+            self_attn_output, encoder_states, encoder_mask, kv_cache, layer_idx
+        )
         enc_dec_attn_output += residual
 
         residual = enc_dec_attn_output
@@ -86,16 +179,20 @@ class TransformerDecoderBlock(nn.Module):
 
         return output_states
 
-    def forward_postln(self, decoder_query, decoder_mask, decoder_keys, encoder_states, encoder_mask):
+    def forward_postln(
+        self, decoder_query, decoder_mask, decoder_keys, encoder_states, encoder_mask, kv_cache=None, layer_idx=0
+    ):
         """
         Post-LayerNorm block
         Order of operations: Self-Attn -> Residual -> LN -> Cross-Attn -> Residual -> LN -> FFN -> Residual -> LN
         """
-        self_attn_output = self.first_sub_layer(decoder_query, decoder_keys, decoder_keys, decoder_mask)
+        self_attn_output = self._self_attention(decoder_query, decoder_mask, decoder_keys, kv_cache, layer_idx)
         self_attn_output += decoder_query
         self_attn_output = self.layer_norm_1(self_attn_output)
 
-        enc_dec_attn_output = self.second_sub_layer(self_attn_output, encoder_states, encoder_states, encoder_mask)
+        enc_dec_attn_output = self._cross_attention(
+            self_attn_output, encoder_states, encoder_mask, kv_cache, layer_idx
+        )
         enc_dec_attn_output += self_attn_output
         enc_dec_attn_output = self.layer_norm_2(enc_dec_attn_output)
 
@@ -103,11 +200,17 @@ class TransformerDecoderBlock(nn.Module):
         output_states += enc_dec_attn_output
         return self.layer_norm_3(output_states)
 
-    def forward(self, decoder_query, decoder_mask, decoder_keys, encoder_states, encoder_mask):
+    def forward(
+        self, decoder_query, decoder_mask, decoder_keys, encoder_states, encoder_mask, kv_cache=None, layer_idx=0
+    ):
         if self.pre_ln:
-            return self.forward_preln(decoder_query, decoder_mask, decoder_keys, encoder_states, encoder_mask)
+            return self.forward_preln(
+                decoder_query, decoder_mask, decoder_keys, encoder_states, encoder_mask, kv_cache, layer_idx
+            )
         else:
-            return self.forward_postln(decoder_query, decoder_mask, decoder_keys, encoder_states, encoder_mask)
+            return self.forward_postln(
+                decoder_query, decoder_mask, decoder_keys, encoder_states, encoder_mask, kv_cache, layer_idx
+            )
 
 
 class TransformerDecoder(nn.Module):
@@ -144,6 +247,10 @@ class TransformerDecoder(nn.Module):
         self.layers = nn.ModuleList([copy.deepcopy(layer) for _ in range(num_layers)])
         self.diagonal = 0
 
+    def init_kv_cache(self, max_length):
+        """ Returns an empty key/value cache to pass to forward for fast autoregressive generation """
+        return TransformerDecoderKVCache(len(self.layers), max_length)
+
     def _get_memory_states(self, decoder_states, decoder_mems_list=None, i=0):
         if decoder_mems_list is not None:
             inp1 = torch.transpose(decoder_mems_list[i], 1, 2)  # Putting seq_len to last dim to handle export cases
@@ -163,6 +270,7 @@ class TransformerDecoder(nn.Module):
         decoder_mems_list=None,
         return_mems=False,
         return_mems_as_list=True,
+        kv_cache=None,
     ):
         """
         Args:
@@ -176,7 +284,13 @@ class TransformerDecoder(nn.Module):
             return_mems: bool, whether to return outputs of all decoder layers
                 or the last layer only
             return_mems_as_list: bool, when True, mems returned are as a list; otherwise mems are Tensor
+            kv_cache: TransformerDecoderKVCache with the keys and values of the previous tokens,
+                which is updated with the new tokens; if not None, decoder_mems_list and return_mems
+                are ignored and the output of the last layer for the new tokens is returned
         """
+        if kv_cache is not None:
+            return self._forward_with_kv_cache(decoder_states, decoder_mask, encoder_states, encoder_mask, kv_cache)
+
         decoder_attn_mask = form_attention_mask(decoder_mask, diagonal=self.diagonal)
         encoder_attn_mask = form_attention_mask(encoder_mask)
         memory_states = self._get_memory_states(decoder_states, decoder_mems_list, 0)
@@ -206,6 +320,26 @@ class TransformerDecoder(nn.Module):
         else:
             return cached_mems_list[-1]
 
+    def _forward_with_kv_cache(self, decoder_states, decoder_mask, encoder_states, encoder_mask, kv_cache):
+        if kv_cache.length > 0:
+            # as with decoder_mems_list, padding is not masked once the generation has started
+            decoder_mask = torch.ones_like(decoder_mask)
+        decoder_attn_mask = form_attention_mask(decoder_mask, diagonal=self.diagonal)
+        if decoder_attn_mask is not None and kv_cache.length > 0:
+            # the new tokens attend to all the cached ones
+            decoder_attn_mask = F.pad(decoder_attn_mask, (kv_cache.length, 0))
+        encoder_attn_mask = form_attention_mask(encoder_mask)
+
+        for i, layer in enumerate(self.layers):
+            decoder_states = layer(
+                decoder_states, decoder_attn_mask, None, encoder_states, encoder_attn_mask, kv_cache, i
+            )
+        kv_cache.advance(decoder_states.size(1))
+
+        if self.final_layer_norm is not None:
+            decoder_states = self.final_layer_norm(decoder_states)
+        return decoder_states
+
     def input_example(self, max_batch=1, max_dim=256):
         """
         Generates input examples for tracing etc.
@@ -17,6 +17,10 @@ from contextlib import contextmanager
 import torch
 
 from nemo.collections.common.parts import NEG_INF, mask_padded_tokens
+from nemo.collections.nlp.modules.common.transformer.transformer_decoders import (
+    TransformerDecoder,
+    TransformerDecoderKVCache,
+)
 
 __all__ = [
     "GreedySequenceGenerator",
@@ -45,6 +49,14 @@ class GreedySequenceGenerator:
             source sequences plus max_delta_length
         batch_size: size of the batch of generated sequences if neither
             source nor target starting sequences are provided
+        use_kv_cache: whether to cache the attention keys and values of the
+            generated tokens when the decoder is a TransformerDecoder, so that
+            every step only processes the new tokens. In beam search with a
+            batch of several sentences, the cached states of every sentence are
+            repeated next to each other, matching the order of the hypotheses
+            and the encoder states. The decoder memory states of the uncached
+            path are tiled across the batch instead, so beam search results of
+            batches differ between the two paths.
     """
 
     def __init__(
@@ -58,6 +70,7 @@ class GreedySequenceGenerator:
         max_sequence_length=512,
         max_delta_length=20,
         batch_size=1,
+        use_kv_cache=True,
     ):
         super().__init__()
         self.embedding = embedding
@@ -67,6 +80,7 @@ class GreedySequenceGenerator:
         self.max_seq_length = max_sequence_length
         self.max_delta_len = max_delta_length
         self.batch_size = batch_size
+        self.use_kv_cache = use_kv_cache
 
     def _one_step_forward(
         self,
@@ -87,14 +101,25 @@ class GreedySequenceGenerator:
                 mode (e.g., language modeling)
             encoder_input_mask: input mask used in the encoder
             decoder_mems_list: list of size num_layers with cached activations
-                of sequence (x[1], ..., x[k-1]) for fast generation of x[k]
+                of sequence (x[1], ..., x[k-1]) for fast generation of x[k],
+                or TransformerDecoderKVCache with their attention keys and values
             pos: starting position in positional encoding
         """
 
         decoder_hidden_states = self.embedding.forward(decoder_input_ids, start_pos=pos)
         decoder_input_mask = mask_padded_tokens(decoder_input_ids, self.pad).float()
 
-        if encoder_hidden_states is not None:
+        if isinstance(decoder_mems_list, TransformerDecoderKVCache):
+            decoder_hidden_states = self.decoder.forward(
+                decoder_hidden_states,
+                decoder_input_mask,
+                encoder_hidden_states,
+                encoder_input_mask,
+                kv_cache=decoder_mems_list,
+            )
+            log_probs = self.log_softmax.forward(hidden_states=decoder_hidden_states[:, -1:])
+            return log_probs, decoder_mems_list
+        elif encoder_hidden_states is not None:
             decoder_mems_list = self.decoder.forward(
                 decoder_hidden_states,
                 decoder_input_mask,
@@ -141,6 +166,15 @@ class GreedySequenceGenerator:
 
         return tgt, batch_size, max_generation_length
 
+    def _init_kv_cache(self, tgt, encoder_hidden_states, max_generation_length):
+        """
+        Returns an empty key/value cache for encoder-decoder generation with a TransformerDecoder,
+        None if the decoder memory should be kept as the hidden states history instead.
+        """
+        if not self.use_kv_cache or encoder_hidden_states is None or not isinstance(self.decoder, TransformerDecoder):
+            return None
+        return self.decoder.init_kv_cache(tgt.size(1) + max_generation_length)
+
     def _forward(
         self, decoder_input_ids=None, encoder_hidden_states=None, encoder_input_mask=None, return_beam_scores=False
     ):
@@ -152,7 +186,7 @@ class GreedySequenceGenerator:
         decoder_parameter = next(self.decoder.parameters())
         pad_profile = torch.zeros(batch_size, 1).long().to(decoder_parameter.device)
 
-        decoder_mems_list = None
+        decoder_mems_list = self._init_kv_cache(tgt, encoder_hidden_states, max_generation_length)
         for i in range(max_generation_length):
 
             log_probs, decoder_mems_list = self._one_step_forward(
@@ -296,14 +330,21 @@ class BeamSearchSequenceGenerator(GreedySequenceGenerator):
         tgt, batch_size, max_generation_length = self._prepare_for_search(decoder_input_ids, encoder_hidden_states)
 
         # generate initial buffer of beam_size prefixes-hypotheses
-        log_probs, decoder_mems_list = self._one_step_forward(tgt, encoder_hidden_states, encoder_input_mask, None, 0)
+        kv_cache = self._init_kv_cache(tgt, encoder_hidden_states, max_generation_length)
+        log_probs, decoder_mems_list = self._one_step_forward(
+            tgt, encoder_hidden_states, encoder_input_mask, kv_cache, 0
+        )
         scores, prefixes = torch.topk(log_probs.permute(0, 2, 1), self.beam_size, dim=1)
         scores, prefixes = scores.view(-1, 1), prefixes.view(-1, 1)
 
         # repeat init target prefixes and cached memory states beam_size times
         prefixes = torch.cat((tgt.repeat(1, self.beam_size).view(-1, 1), prefixes), dim=1)
-        for j in range(len(decoder_mems_list)):
-            decoder_mems_list[j] = decoder_mems_list[j].repeat(self.beam_size, 1, 1)
+        if kv_cache is not None:
+            # [b0, b0, ..., b1, b1, ...] like the prefixes and the encoder states, unlike the tiled mems below
+            kv_cache.expand(self.beam_size)
+        else:
+            for j in range(len(decoder_mems_list)):
+                decoder_mems_list[j] = decoder_mems_list[j].repeat(self.beam_size, 1, 1)
 
         # repeat source sequence beam_size times for beam search
         if encoder_hidden_states is not None:
@@ -360,14 +401,18 @@ class BeamSearchSequenceGenerator(GreedySequenceGenerator):
 
             # reshuffle cached decoder memory states to restore the order
             # of hypotheses broken after top-k selection
-            mems_ids = indices_i.unsqueeze(2).unsqueeze(3).repeat(1, 1, p_len - 1, hidden_size) // self.beam_size
-            for j in range(len(decoder_mems_list)):
-                decoder_mems_list[j] = (
-                    decoder_mems_list[j]
-                    .view(-1, self.beam_size, p_len - 1, hidden_size)
-                    .gather(1, mems_ids)
-                    .view(-1, p_len - 1, hidden_size)
-                )
+            if kv_cache is not None:
+                beam_offsets = torch.arange(batch_size, device=indices_i.device).unsqueeze(1) * self.beam_size
+                kv_cache.reorder((indices_i // self.beam_size + beam_offsets).view(-1))
+            else:
+                mems_ids = indices_i.unsqueeze(2).unsqueeze(3).repeat(1, 1, p_len - 1, hidden_size) // self.beam_size
+                for j in range(len(decoder_mems_list)):
+                    decoder_mems_list[j] = (
+                        decoder_mems_list[j]
+                        .view(-1, self.beam_size, p_len - 1, hidden_size)
+                        .gather(1, mems_ids)
+                        .view(-1, p_len - 1, hidden_size)
+                    )
 
             # update prefixes_len and pad_profile
             not_eos_pad = prefixes.ne(self.eos) & prefixes.ne(self.pad)
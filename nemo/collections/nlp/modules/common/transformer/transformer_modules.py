@@ -183,17 +183,29 @@ class MultiHeadAttention(nn.Module):
         x = x.view(*new_x_shape)
         return x.permute(0, 2, 1, 3)
 
+    def project_keys_values(self, keys, values):
+        """
+        Computes the per-head keys and values of shape B x num_heads x L x head_size,
+        which can be cached for fast autoregressive generation.
+        """
+        key = self.key_net(keys)
+        value = self.value_net(values)
+        key = self.transpose_for_scores(key) / self.attn_scale
+        value = self.transpose_for_scores(value)
+        return key, value
+
     def forward(self, queries, keys, values, attention_mask):
+        key, value = self.project_keys_values(keys, values)
+        return self.attend(queries, key, value, attention_mask)
+
+    def attend(self, queries, key, value, attention_mask):
+        """ Attends with the queries to keys and values computed by project_keys_values """
 
         # attention_mask is needed to hide the tokens which correspond to [PAD]
         # in the case of BERT, or to hide the future tokens in the case of
         # vanilla language modeling and translation
         query = self.query_net(queries)
-        key = self.key_net(keys)
-        value = self.value_net(values)
         query = self.transpose_for_scores(query) / self.attn_scale
-        key = self.transpose_for_scores(key) / self.attn_scale
-        value = self.transpose_for_scores(value)
 
         # for numerical stability we pre-divide query and key by sqrt(sqrt(d))
         attention_scores = torch.matmul(query, key.transpose(-1, -2))
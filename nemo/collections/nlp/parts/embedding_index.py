@@ -0,0 +1,369 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Dense embedding index for retrieval models. Embeddings are stored in a directory as fp16 ``.npy`` shards which are
+memory mapped for search, so an index does not have to fit into memory. Search is done with a faiss IVF or HNSW
+index if one is built and faiss is installed, and with exact inner product search over the shards otherwise.
+"""
+
+import json
+import os
+import tempfile
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+from nemo.utils import logging
+
+try:
+    import faiss
+
+    HAVE_FAISS = True
+except (ImportError, ModuleNotFoundError):
+    HAVE_FAISS = False
+
+__all__ = ['EmbeddingIndex', 'EmbeddingIndexMixin']
+
+_MANIFEST_FILE = 'manifest.json'
+_ANN_INDEX_FILE = 'ann.index'
+
+
+class EmbeddingIndex:
+    """
+    Index of embeddings searched by inner product. Embeddings are added in shards with :meth:`add`, and the index
+    directory can be reopened and extended later. If an ANN index was built with :meth:`build_ann_index`,
+    embeddings added afterwards are added to the ANN index too.
+
+    Args:
+        index_dir: a directory with index files. If the directory contains an index, the index is opened.
+        dim: dimension of embeddings. Required if a new index is created.
+        search_chunk_size: number of embeddings scored at once by exact search
+        device: a device used for exact search
+    """
+
+    def __init__(
+        self,
+        index_dir: str,
+        dim: Optional[int] = None,
+        search_chunk_size: int = 65536,
+        device: Optional[torch.device] = None,
+    ):
+        self.index_dir = index_dir
+        self.search_chunk_size = search_chunk_size
+        self.device = device if device is not None else torch.device('cpu')
+        manifest_file = os.path.join(index_dir, _MANIFEST_FILE)
+        if os.path.exists(manifest_file):
+            with open(manifest_file, 'r') as f:
+                self.manifest = json.load(f)
+            if dim is not None and dim != self.manifest['dim']:
+                raise ValueError(
+                    f"Index in {index_dir} contains embeddings of dimension {self.manifest['dim']}, not {dim}."
+                )
+        else:
+            if dim is None:
+                raise ValueError(f"Parameter `dim` is required to create a new index in {index_dir}.")
+            os.makedirs(index_dir, exist_ok=True)
+            self.manifest = {'dim': dim, 'num_embeddings': 0, 'shards': [], 'ann': None}
+            self._write_manifest()
+        if self.manifest['ann'] is not None and not HAVE_FAISS:
+            logging.warning("faiss is not installed, so exact search is used instead of the saved ANN index.")
+        self._shards = None
+        self._ids = None
+        self._ann_index = None
+
+    @property
+    def dim(self) -> int:
+        return self.manifest['dim']
+
+    def __len__(self) -> int:
+        return self.manifest['num_embeddings']
+
+    def _write_manifest(self):
+        fd, tmp_path = tempfile.mkstemp(suffix='.json', dir=self.index_dir)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.index_dir, _MANIFEST_FILE))
+
+    def _save_array(self, file_name: str, array: np.ndarray):
+        fd, tmp_path = tempfile.mkstemp(suffix='.npy', dir=self.index_dir)
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp_path, os.path.join(self.index_dir, file_name))
+
+    def _get_shards(self) -> List[np.ndarray]:
+        if self._shards is None:
+            self._shards = [
+                np.load(os.path.join(self.index_dir, shard['embeddings']), mmap_mode='r')
+                for shard in self.manifest['shards']
+            ]
+        return self._shards
+
+    @property
+    def ids(self) -> np.ndarray:
+        """Ids of all embeddings in the order of adding"""
+        if self._ids is None:
+            ids = [np.load(os.path.join(self.index_dir, shard['ids'])) for shard in self.manifest['shards']]
+            self._ids = np.concatenate(ids) if ids else np.zeros(0, dtype=np.int64)
+        return self._ids
+
+    def _iterate_embeddings(self, start: int = 0, chunk_size: Optional[int] = None):
+        """Yields positions of first embeddings and float32 chunks of embeddings starting from ``start``"""
+        chunk_size = chunk_size or self.search_chunk_size
+        shard_start = 0
+        for shard in self._get_shards():
+            for chunk_start in range(max(start - shard_start, 0), len(shard), chunk_size):
+                yield shard_start + chunk_start, np.asarray(shard[chunk_start : chunk_start + chunk_size], np.float32)
+            shard_start += len(shard)
+
+    def add(self, embeddings: np.ndarray, ids: Optional[np.ndarray] = None):
+        """
+        Adds a shard of embeddings.
+
+        Args:
+            embeddings: an array of shape ``[num_embeddings, dim]``. Embeddings are stored in fp16.
+            ids: int ids returned by search for the embeddings. By default, positions of embeddings in the index.
+        """
+        if embeddings.ndim != 2 or embeddings.shape[1] != self.dim:
+            raise ValueError(f"Embeddings of shape [N, {self.dim}] are expected, got {embeddings.shape}.")
+        num_embeddings = len(self)
+        if ids is None:
+            ids = np.arange(num_embeddings, num_embeddings + len(embeddings), dtype=np.int64)
+        elif len(ids) != len(embeddings):
+            raise ValueError(f"Got {len(ids)} ids for {len(embeddings)} embeddings.")
+        shard_id = len(self.manifest['shards'])
+        shard = {'embeddings': f'embeddings_{shard_id:05d}.npy', 'ids': f'ids_{shard_id:05d}.npy'}
+        self._save_array(shard['embeddings'], np.asarray(embeddings, dtype=np.float16))
+        self._save_array(shard['ids'], np.asarray(ids, dtype=np.int64))
+        shard['size'] = len(embeddings)
+        self.manifest['shards'].append(shard)
+        self.manifest['num_embeddings'] = num_embeddings + len(embeddings)
+        self._write_manifest()
+        self._shards, self._ids = None, None
+
+        # the ANN index file is not rewritten, missing embeddings are added to the index when it is loaded
+        ann_index = self._get_ann_index()
+        if ann_index is not None:
+            for _, chunk in self._iterate_embeddings(start=ann_index.ntotal):
+                ann_index.add(chunk)
+
+    def add_texts(
+        self,
+        texts: List[str],
+        encode_fn: Callable[[List[str]], np.ndarray],
+        ids: Optional[np.ndarray] = None,
+        shard_size: int = 100000,
+    ):
+        """
+        Encodes texts with ``encode_fn`` and adds embeddings in shards of ``shard_size``, so embeddings of all
+        texts are never kept in memory.
+        """
+        for start in range(0, len(texts), shard_size):
+            self.add(
+                encode_fn(texts[start : start + shard_size]), None if ids is None else ids[start : start + shard_size]
+            )
+
+    def build_ann_index(
+        self,
+        index_type: str = 'ivf',
+        nlist: Optional[int] = None,
+        nprobe: int = 16,
+        hnsw_m: int = 32,
+        max_train_size: int = 256 * 1024,
+        seed: int = 0,
+    ):
+        """
+        Builds a faiss index of all embeddings and saves it to the index directory. If faiss is not installed,
+        exact search is used.
+
+        Args:
+            index_type: ``'ivf'`` for ``IndexIVFFlat`` or ``'hnsw'`` for ``IndexHNSWFlat``
+            nlist: number of IVF clusters. By default, ``4 * sqrt(len(self))``.
+            nprobe: number of IVF clusters visited by a query
+            hnsw_m: number of neighbors of a HNSW graph node
+            max_train_size: maximum number of embeddings used for IVF clustering
+            seed: random seed for selection of IVF training embeddings
+        """
+        if not HAVE_FAISS:
+            logging.warning("faiss is not installed, so exact search is used instead of an ANN index.")
+            return
+        if len(self) == 0:
+            raise ValueError(f"Cannot build an ANN index of an empty index in {self.index_dir}.")
+        if index_type == 'ivf':
+            nlist = min(nlist or max(1, int(4 * np.sqrt(len(self)))), len(self))
+            quantizer = faiss.IndexFlatIP(self.dim)
+            ann_index = faiss.IndexIVFFlat(quantizer, self.dim, nlist, faiss.METRIC_INNER_PRODUCT)
+            train_ids = np.random.RandomState(seed).permutation(len(self))[:max_train_size]
+            ann_index.train(self._gather(np.sort(train_ids)))
+            ann_index.nprobe = nprobe
+        elif index_type == 'hnsw':
+            ann_index = faiss.IndexHNSWFlat(self.dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        else:
+            raise ValueError(f"Unsupported ANN index type '{index_type}'. Supported types are 'ivf' and 'hnsw'.")
+
+        for _, chunk in self._iterate_embeddings():
+            ann_index.add(chunk)
+        self._ann_index = ann_index
+        self.manifest['ann'] = {'type': index_type, 'nprobe': nprobe}
+        self.save_ann_index()
+
+    def save_ann_index(self):
+        """Writes the ANN index with all added embeddings to the index directory"""
+        if self._ann_index is None:
+            return
+        fd, tmp_path = tempfile.mkstemp(suffix='.index', dir=self.index_dir)
+        os.close(fd)
+        faiss.write_index(self._ann_index, tmp_path)
+        os.replace(tmp_path, os.path.join(self.index_dir, _ANN_INDEX_FILE))
+        self._write_manifest()
+
+    def _get_ann_index(self):
+        if self._ann_index is None and self.manifest['ann'] is not None and HAVE_FAISS:
+            self._ann_index = faiss.read_index(os.path.join(self.index_dir, _ANN_INDEX_FILE))
+            if self.manifest['ann']['type'] == 'ivf':
+                self._ann_index.nprobe = self.manifest['ann']['nprobe']
+            for _, chunk in self._iterate_embeddings(start=self._ann_index.ntotal):
+                self._ann_index.add(chunk)
+        return self._ann_index
+
+    def _gather(self, positions: np.ndarray) -> np.ndarray:
+        """Returns float32 embeddings at sorted ``positions``"""
+        result = np.zeros((len(positions), self.dim), dtype=np.float32)
+        shard_start = 0
+        for shard in self._get_shards():
+            lo, hi = np.searchsorted(positions, [shard_start, shard_start + len(shard)])
+            result[lo:hi] = shard[positions[lo:hi] - shard_start]
+            shard_start += len(shard)
+        return result
+
+    def _positions_to_ids(self, positions: np.ndarray) -> np.ndarray:
+        if len(self) == 0:
+            return np.full(positions.shape, -1, dtype=np.int64)
+        ids = self.ids[np.maximum(positions, 0)]
+        ids[positions < 0] = -1
+        return ids
+
+    @torch.no_grad()
+    def exact_search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds ``k`` embeddings with the largest inner products with queries. Embeddings are scored in chunks of
+        ``search_chunk_size``, so memory used by scores does not depend on the size of the index.
+
+        Returns:
+            scores and ids of shape ``[num_queries, k]``. If the index has fewer than ``k`` embeddings, missing
+            results have score ``-inf`` and id ``-1``.
+        """
+        queries = torch.as_tensor(np.asarray(queries, dtype=np.float32), device=self.device)
+        best_scores = torch.full((len(queries), k), float('-inf'), device=self.device)
+        best_positions = torch.full((len(queries), k), -1, dtype=torch.long, device=self.device)
+        for start, chunk in self._iterate_embeddings():
+            scores = queries @ torch.from_numpy(chunk).to(self.device).T
+            scores = torch.cat([best_scores, scores], dim=1)
+            positions = torch.arange(start, start + len(chunk), device=self.device).expand(len(queries), -1)
+            positions = torch.cat([best_positions, positions], dim=1)
+            best_scores, top = scores.topk(k, dim=1)
+            best_positions = positions.gather(1, top)
+        return best_scores.cpu().numpy(), self._positions_to_ids(best_positions.cpu().numpy())
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds ``k`` nearest embeddings with the ANN index if it is available and with :meth:`exact_search`
+        otherwise. Returns scores and ids as :meth:`exact_search`.
+        """
+        ann_index = self._get_ann_index()
+        if ann_index is None:
+            return self.exact_search(queries, k)
+        scores, positions = ann_index.search(np.ascontiguousarray(queries, dtype=np.float32), k)
+        return scores, self._positions_to_ids(positions)
+
+    def recall_at_k(self, queries: np.ndarray, k: int) -> float:
+        """Returns average fraction of exact ``k`` nearest embeddings of queries found by :meth:`search`"""
+        _, exact_ids = self.exact_search(queries, k)
+        _, ids = self.search(queries, k)
+        num_found = sum(len(np.intersect1d(e[e >= 0], i[i >= 0])) for e, i in zip(exact_ids, ids))
+        return num_found / max(int((exact_ids >= 0).sum()), 1)
+
+
+class EmbeddingIndexMixin:
+    """
+    Adds an :class:`EmbeddingIndex` of encoded texts and a ``query`` API to a model which implements
+    :meth:`encode_index_texts` and :meth:`encode_queries`.
+    """
+
+    def encode_index_texts(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        """Returns fp16 embeddings of texts (passages, entities) stored in the index"""
+        raise NotImplementedError()
+
+    def encode_queries(self, queries: List[str], batch_size: int = 64) -> np.ndarray:
+        """Returns fp16 embeddings of queries"""
+        raise NotImplementedError()
+
+    @property
+    def embedding_index(self) -> Optional[EmbeddingIndex]:
+        return getattr(self, '_embedding_index', None)
+
+    def load_embedding_index(self, index_dir: str) -> EmbeddingIndex:
+        """Opens an index created by :meth:`add_to_embedding_index` and uses it in :meth:`query`"""
+        self._embedding_index = EmbeddingIndex(index_dir)
+        return self._embedding_index
+
+    def add_to_embedding_index(
+        self,
+        texts: List[str],
+        index_dir: Optional[str] = None,
+        ids: Optional[np.ndarray] = None,
+        batch_size: int = 64,
+        shard_size: int = 100000,
+    ) -> EmbeddingIndex:
+        """
+        Encodes texts and adds them to the index in ``index_dir``, or to the current index if ``index_dir`` is
+        ``None``. A new index is created if ``index_dir`` does not contain one.
+
+        Args:
+            texts: texts to index
+            index_dir: a directory with index files
+            ids: int ids of texts returned by :meth:`query`. By default, positions of texts in the index.
+            batch_size: number of texts encoded at once
+            shard_size: number of embeddings in a shard of the index
+        """
+
+        def encode_fn(shard_texts: List[str]) -> np.ndarray:
+            return self.encode_index_texts(shard_texts, batch_size=batch_size)
+
+        if index_dir is not None and (self.embedding_index is None or self.embedding_index.index_dir != index_dir):
+            if os.path.exists(os.path.join(index_dir, _MANIFEST_FILE)):
+                self._embedding_index = EmbeddingIndex(index_dir)
+            else:
+                first_shard = encode_fn(texts[:shard_size])
+                self._embedding_index = EmbeddingIndex(index_dir, dim=first_shard.shape[1])
+                self._embedding_index.add(first_shard, None if ids is None else ids[:shard_size])
+                texts, ids = texts[shard_size:], None if ids is None else ids[shard_size:]
+        if self.embedding_index is None:
+            raise ValueError("Parameter `index_dir` is required because the model has no embedding index.")
+        self.embedding_index.add_texts(texts, encode_fn, ids=ids, shard_size=shard_size)
+        return self.embedding_index
+
+    def query(self, texts: List[str], k: int = 10, batch_size: int = 64) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds ``k`` indexed texts with the largest inner products of embeddings with embeddings of ``texts``.
+
+        Returns:
+            scores and ids of found texts of shape ``[len(texts), k]``
+        """
+        if self.embedding_index is None:
+            raise ValueError(
+                "The model has no embedding index. Call `add_to_embedding_index` or `load_embedding_index` first."
+            )
+        return self.embedding_index.search(self.encode_queries(texts, batch_size=batch_size), k)
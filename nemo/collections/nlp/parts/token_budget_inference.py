@@ -0,0 +1,79 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Helpers for inference of BERT based classification models on many short queries. Queries are tokenized in a thread
+pool, sorted by length and packed into batches of a limited number of padded tokens, and every batch is padded to
+the length of its longest query instead of ``max_seq_length``.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterator, List, Sequence, Tuple
+
+import numpy as np
+import torch
+
+__all__ = ['iterate_token_budget_batches', 'pack_by_tokens', 'pad_sequences', 'tokenize_in_threads']
+
+
+def tokenize_in_threads(texts: List[str], tokenize_fn: Callable[[str], Any], num_threads: int = 4) -> List[Any]:
+    """
+    Applies ``tokenize_fn`` to texts in a thread pool and returns results in the order of texts. Fast HuggingFace
+    tokenizers release GIL, so threads tokenize in parallel.
+    """
+    if num_threads <= 1 or len(texts) <= 1:
+        return [tokenize_fn(text) for text in texts]
+    with ThreadPoolExecutor(max_workers=num_threads) as pool:
+        return list(pool.map(tokenize_fn, texts))
+
+
+def pack_by_tokens(lengths: Sequence[int], max_tokens: int) -> List[List[int]]:
+    """
+    Sorts sequences by length, longest first, and packs them into batches of at most ``max_tokens`` tokens
+    including padding. A sequence longer than ``max_tokens`` forms a batch on its own.
+
+    Returns:
+        indices of sequences in every batch
+    """
+    order = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+    batches = []
+    for i in order:
+        # the first sequence of a batch is the longest, so it sets the padded length
+        if batches and (len(batches[-1]) + 1) * lengths[batches[-1][0]] <= max_tokens:
+            batches[-1].append(i)
+        else:
+            batches.append([i])
+    return batches
+
+
+def pad_sequences(sequences: List[Sequence[int]], pad_value: int = 0) -> np.ndarray:
+    """Pads sequences to the length of the longest sequence and returns an int64 array"""
+    lengths = np.array([len(sequence) for sequence in sequences])
+    mask = np.arange(lengths.max()) < lengths[:, None]
+    padded = np.full(mask.shape, pad_value, dtype=np.int64)
+    padded[mask] = np.concatenate([np.asarray(sequence, dtype=np.int64) for sequence in sequences])
+    return padded
+
+
+def iterate_token_budget_batches(
+    input_ids: List[Sequence[int]], max_tokens: int, device: torch.device, pad_id: int = 0
+) -> Iterator[Tuple[List[int], torch.Tensor, torch.Tensor]]:
+    """
+    Yields indices of queries in a batch, ``input_ids`` and ``attention_mask`` tensors of the batch padded to the
+    longest query in the batch. Batches are formed by :func:`pack_by_tokens`.
+    """
+    for batch in pack_by_tokens([len(ids) for ids in input_ids], max_tokens):
+        batch_input_ids = pad_sequences([input_ids[i] for i in batch], pad_value=pad_id)
+        attention_mask = pad_sequences([np.ones(len(input_ids[i]), dtype=np.int64) for i in batch])
+        yield batch, torch.from_numpy(batch_input_ids).to(device), torch.from_numpy(attention_mask).to(device)
@@ -70,10 +70,42 @@ python scripts/nlp_language_modeling/build_knn_map_index.py  \
     --output_file=knn_final.save \
     --shard_index_input=knn_shard
 ```
+
+For billion-chunk datasets, pass `--embedding_dir` to run stage-1 (or the single stage build) as a resumable,
+streaming pipeline. The chunk range of the shard is split into slices of `--process_chunk_size` chunks.
+1. embedding: the Sentence-BERT embeddings of every slice are written to `embedding_dir` as fp16 `.npy` files.
+2. search: the embeddings of every slice are memory-mapped and searched in batches of `--search_batch_size`
+   against the trained IVF-PQ index. The KNN map of every slice is written to `<output_file>_<start>_<end>`.
+3. stitching: without `--stage`, the slice KNN maps are stitched by chunk offset into `output_file`. In
+   stage-1 they are stitched together with the other shards in stage-2, e.g. `--shard_index_input=knn_shard`.
+Slices that are already on disk are skipped, so an interrupted run resumes where it stopped. If `--shard_id`
+and `--total_shards` are not given, they are taken from the `RANK` and `WORLD_SIZE` environment variables.
+Every stage reports its throughput in chunks per second.
+
+```python
+python scripts/nlp_language_modeling/build_knn_map_index.py \
+    --input_file=PATH_TO_INPUT_TRAINING_DATA \
+    --tokenizer-library=megatron \
+    --tokenizer-type=GPT2BPETokenizer \
+    --merge-file=/dataset/gpt2-merges.txt \
+    --vocab-file=/dataset/gpt2-vocab.json \
+    --process_chunk_size=100000 \
+    --K_neighbors=16 \
+    --remove_duplicate \
+    --workers=2 \
+    --devices=0,1,2,3 \
+    --stage=1 \
+    --nprobe=10 \
+    --embedding_dir=embeddings \
+    --search_batch_size=65536 \
+    --output_file=knn_shard \
+    --faiss_index=faiss.index
+```
 """
 
 import argparse
 import multiprocessing
+import os
 import pathlib
 import sys
 import time
@@ -174,6 +206,46 @@ def calculate_start_end(total_chunks, total_shards, shard_id):
     return start, total_chunks
 
 
+def get_slice_ids(start: int, end: int, chunk_size: int):
+    """ Splits the chunk range [start, end) into slices of `chunk_size` chunks """
+    return [(i, min(i + chunk_size, end)) for i in range(start, end, chunk_size)]
+
+
+def embedding_slice_file(embedding_dir: str, slice_id):
+    return os.path.join(embedding_dir, 'emb_{:012d}_{:012d}.npy'.format(*slice_id))
+
+
+def knn_slice_file(output_file: str, slice_id):
+    return '{}_{:012d}_{:012d}'.format(output_file, *slice_id)
+
+
+def tmp_file(path: str):
+    """ Temporary file next to `path` that is not matched by the glob of the stitching stage """
+    dirname, basename = os.path.split(path)
+    return os.path.join(dirname, '.{}.tmp{}'.format(basename, os.getpid()))
+
+
+class Throughput(object):
+    """ Reports the progress and throughput of a pipeline stage """
+
+    def __init__(self, name: str, total_chunks: int, done_chunks: int = 0):
+        self.name = name
+        self.total_chunks = total_chunks
+        self.done_chunks = done_chunks
+        self.count = 0
+        self.start_time = time.time()
+
+    def update(self, num_chunks: int):
+        self.count += num_chunks
+        elapsed = time.time() - self.start_time
+        rate = self.count / max(elapsed, 1e-6)
+        remaining = self.total_chunks - self.done_chunks - self.count
+        logging.info(
+            f'{self.name}: {self.done_chunks + self.count}/{self.total_chunks} chunks, '
+            f'{rate:.1f} chunks/s, ETA {remaining / max(rate, 1e-6):.0f}s'
+        )
+
+
 def process_sentence_chunks(
     ds: MMapRetrievalIndexedDataset,
     tokenizer,
@@ -182,11 +254,13 @@ def process_sentence_chunks(
     workers: int,
     shard_id: int,
     total_shards: int,
+    slice_ids=None,
 ):
     """
     This function takes chunked tokens from the retrieval dataset and map it back to text.
     In stage 1, it divides the total work into `total_shards`, and process only at the `shard_id`.  
     If the stage is None, it process all the chunks.
+    If `slice_ids` is given, only the given (start, end) chunk slices are processed.
     """
     total_chunks = ds.chunks
     start = 0
@@ -198,17 +272,18 @@ def process_sentence_chunks(
         )
         logging.info(f'shard_id {shard_id}, create index from chunk {start} to {total_chunks}')
 
+    if slice_ids is None:
+        slice_ids = get_slice_ids(start, total_chunks, chunk_size)
+
     with Pool(workers) as p:
-        while start < total_chunks:
-            if start / total_chunks > threshold:
-                logging.info(f"sentence processing {start / total_chunks} is done")
+        for i, slice_id in enumerate(slice_ids):
+            if i / len(slice_ids) > threshold:
+                logging.info(f"sentence processing {i / len(slice_ids)} is done")
                 threshold += 0.1
-            slice_id = (start, min(start + chunk_size, total_chunks))
             beg = time.time()
             id_slices = ds.get_chunk(slice(*slice_id), force_no_cont_ids=True)
             end = time.time()
             logging.info(f"load {chunk_size} chunks takes {end-beg}")
-            start = min(start + chunk_size, total_chunks)
             sentences = p.map(tokenizer.ids_to_text, id_slices)
             end2 = time.time()
             logging.info(f"tokenize {chunk_size} chunks takes {end2-end}")
@@ -237,6 +312,109 @@ def get_emb():
     return emb_queue.get()
 
 
+def get_faiss_index(args, device_list, has_gpu):
+    index = faiss.read_index(args.faiss_index)
+    if has_gpu:
+        co = faiss.GpuMultipleClonerOptions()
+        co.useFloat16 = True
+        co.usePrecomputed = False
+        co.shard = True
+        index = faiss.index_cpu_to_all_gpus(index, co, ngpu=len(device_list))
+
+    index.nprobe = args.nprobe
+    return index
+
+
+def search_batched(index, emb: np.ndarray, neighbors: int, batch_size: int):
+    """ Searches the neighbors of the (memory-mapped, fp16) embeddings in batches of `batch_size` """
+    results = []
+    for i in range(0, len(emb), batch_size):
+        _, I = index.search(np.ascontiguousarray(emb[i : i + batch_size], dtype=np.float32), neighbors)
+        results.append(I)
+    return np.concatenate(results).astype(np.int64)
+
+
+def build_streaming(args, ds, tokenizer, device_list, has_gpu):
+    """
+    Resumable, streaming KNN map build: embeds the slices of this shard to fp16 files in `args.embedding_dir`,
+    searches them in batches against the faiss index and writes one KNN map per slice.
+    """
+    global model
+
+    start, total_chunks = 0, ds.chunks
+    if args.stage == 1:
+        start, total_chunks = calculate_start_end(
+            total_chunks=total_chunks, total_shards=args.total_shards, shard_id=args.shard_id
+        )
+        logging.info(f'shard_id {args.shard_id}, create index from chunk {start} to {total_chunks}')
+    slice_ids = get_slice_ids(start, total_chunks, args.process_chunk_size)
+    num_chunks = total_chunks - start
+
+    # embedding stage, the tokenizer and embedding processes stream into fp16 slice files
+    os.makedirs(args.embedding_dir, exist_ok=True)
+    todo = [i for i in slice_ids if not os.path.exists(embedding_slice_file(args.embedding_dir, i))]
+    done_chunks = num_chunks - sum(end - beg for beg, end in todo)
+    logging.info(f'{len(slice_ids) - len(todo)} out of {len(slice_ids)} embedding slices are already done')
+    if todo:
+        model = SentenceTransformer(args.sentence_transformer_model)
+        process = multiprocessing.Process(
+            target=process_sentence_chunks,
+            args=(ds, tokenizer, args.process_chunk_size, None, args.workers, None, None, todo),
+        )
+        process.start()
+        pool = model.start_multi_process_pool(device_list)
+        emb_process = multiprocessing.Process(target=calculate_embedding, args=(pool, args.batch_size))
+        emb_process.start()
+
+        meter = Throughput('embedding', num_chunks, done_chunks)
+        while True:
+            emb, slice_id = get_emb()
+            if emb is None:
+                break
+            filename = embedding_slice_file(args.embedding_dir, slice_id)
+            with open(tmp_file(filename), 'wb') as f:
+                np.save(f, emb.astype(np.float16))
+            os.replace(tmp_file(filename), filename)
+            meter.update(len(emb))
+
+        process.join()
+        emb_process.join()
+        model.stop_multi_process_pool(pool)
+
+    # search stage, one KNN map per slice
+    if ds._index.retrieval_db and args.remove_duplicate:
+        neighbors = args.K_neighbors + args.dedup_margin
+        # build the id maps for quick dedup
+        id_start = np.array(ds._index._chunk_id_start)
+        chunk_id_to_doc_id_map = np.zeros((total_chunks - start, 2), dtype=np.int64)
+        build_map(id_start, chunk_id_to_doc_id_map, ds.chunks, start, total_chunks)
+    else:
+        neighbors = args.K_neighbors
+
+    todo = [i for i in slice_ids if not os.path.exists(knn_slice_file(args.output_file, i))]
+    done_chunks = num_chunks - sum(end - beg for beg, end in todo)
+    logging.info(f'{len(slice_ids) - len(todo)} out of {len(slice_ids)} KNN map slices are already done')
+    if todo:
+        index = get_faiss_index(args, device_list, has_gpu)
+        meter = Throughput('search', num_chunks, done_chunks)
+        for slice_id in todo:
+            emb = np.load(embedding_slice_file(args.embedding_dir, slice_id), mmap_mode='r')
+            I = search_batched(index, emb, neighbors, args.search_batch_size)
+            if ds._index.retrieval_db and args.remove_duplicate:
+                tmp_neighbors = np.ones_like(I) * -1
+                dedup(chunk_id_to_doc_id_map, I, tmp_neighbors, slice_id[0], start)
+                I = tmp_neighbors[:, : args.K_neighbors]
+            filename = knn_slice_file(args.output_file, slice_id)
+            with KNNIndex.writer(tmp_file(filename), args.K_neighbors, offset=slice_id[0]) as w:
+                w.write(I)
+            os.replace(tmp_file(filename), filename)
+            meter.update(len(I))
+
+    # stitching stage, shards of a multi-stage build are stitched in stage 2
+    if args.stage is None:
+        merge_knn_files([knn_slice_file(args.output_file, i) for i in slice_ids], args.output_file)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="build Faiss index",)
     parser.add_argument(
@@ -317,9 +495,22 @@ if __name__ == "__main__":
         default=None,
         help='the knn sharding index files, which are created at stage 1',
     )
+    group.add_argument(
+        '--embedding_dir',
+        type=str,
+        default=None,
+        help='directory of the fp16 embedding slices, enables the resumable streaming build',
+    )
+    group.add_argument(
+        '--search_batch_size', type=int, default=65536, help='number of embeddings searched at once',
+    )
 
     args = parser.parse_args()
 
+    if args.stage == 1 and args.shard_id is None and 'RANK' in os.environ:
+        args.shard_id = int(os.environ['RANK'])
+        args.total_shards = int(os.environ['WORLD_SIZE'])
+
     has_gpu = torch.cuda.is_available() and hasattr(faiss, "index_gpu_to_cpu")
 
     if not hasattr(faiss, "index_gpu_to_cpu"):
@@ -341,7 +532,6 @@ if __name__ == "__main__":
         logging.info(f'Index chunk end id: {f.chunk_end_id}')
         sys.exit(0)
 
-    model = SentenceTransformer(args.sentence_transformer_model)
     tokenizer = get_tokenizer(args)
     ds = MMapRetrievalIndexedDataset(args.input_file)
 
@@ -350,15 +540,12 @@ if __name__ == "__main__":
     else:
         device_list = ['cuda:' + str(device) for device in args.devices.split(',')]
 
-    index = faiss.read_index(args.faiss_index)
-    if has_gpu:
-        co = faiss.GpuMultipleClonerOptions()
-        co.useFloat16 = True
-        co.usePrecomputed = False
-        co.shard = True
-        index = faiss.index_cpu_to_all_gpus(index, co, ngpu=len(device_list))
+    if args.embedding_dir is not None:
+        build_streaming(args, ds, tokenizer, device_list, has_gpu)
+        sys.exit(0)
 
-    index.nprobe = args.nprobe
+    model = SentenceTransformer(args.sentence_transformer_model)
+    index = get_faiss_index(args, device_list, has_gpu)
 
     start = 0
     total_chunks = ds.chunks
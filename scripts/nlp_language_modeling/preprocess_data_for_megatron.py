@@ -80,14 +80,21 @@ python scripts/nlp_language_modeling/preprocess_data_for_megatron.py \
     --chunk_size=64 \
     --workers=64 
 ```
+
+Each worker tokenizes a byte range of an input file (a whole file for .json.gz inputs) and writes it to its own
+shard in `<output-prefix>_shards`. A shard is marked as done once it is complete, so an interrupted run resumes
+from the shards that are not done yet when it is started again with the same arguments. When all shards are done,
+they are merged into the final .bin/.idx files by concatenating their indices and copying their data.
 """
 
 import argparse
 import gzip
 import json
+import math
 import multiprocessing
 import os
 import pathlib
+import shutil
 import sys
 import time
 
@@ -147,6 +154,11 @@ class Encoder(object):
     def initializer(self):
         # Use Encoder class as a container for global data
         Encoder.tokenizer = get_tokenizer(self.args)
+        # HF fast tokenizers can tokenize a batch of sentences at once in Rust
+        hf_tokenizer = getattr(Encoder.tokenizer, 'tokenizer', None)
+        Encoder.batch_tokenize = self.args.tokenizer_library == 'huggingface' and getattr(
+            hf_tokenizer, 'is_fast', False
+        )
 
         if self.args.split_sentences:
             if not nltk_available:
@@ -164,37 +176,204 @@ class Encoder(object):
         else:
             Encoder.splitter = IdentitySplitter()
 
-    def encode(self, json_line):
-        if not self.args.text_file:
-            data = json.loads(json_line)
-            ids = {}
-            for key in self.args.json_keys:
-                text = data[key]
+    def tokenize_sentences(self, sentences):
+        if len(sentences) == 0:
+            return []
+        if Encoder.batch_tokenize:
+            return Encoder.tokenizer.tokenizer(sentences, add_special_tokens=False)['input_ids']
+        return [Encoder.tokenizer.text_to_ids(sentence) for sentence in sentences]
+
+    def encode_batch(self, json_lines):
+        """Tokenize a batch of documents. Sentences of all documents are tokenized in a single batch."""
+        keys = ['text'] if self.args.text_file else self.args.json_keys
+        sentences, doc_sentence_counts = [], []
+        for json_line in json_lines:
+            if not self.args.text_file:
+                data = json.loads(json_line)
+                texts = [data[key] for key in keys]
+            else:
+                texts = [json_line.strip()]
+            for text in texts:
                 if self.args.apply_ftfy:
                     text = ftfy.fix_text(text)
+                doc_sentences = list(Encoder.splitter.tokenize(text))
+                sentences.extend(doc_sentences)
+                doc_sentence_counts.append(len(doc_sentences))
+
+        batch_ids = iter(self.tokenize_sentences(sentences))
+        docs = []
+        doc_sentence_counts = iter(doc_sentence_counts)
+        for _ in json_lines:
+            ids = {}
+            for key in keys:
                 doc_ids = []
-                for sentence in Encoder.splitter.tokenize(text):
-                    sentence_ids = Encoder.tokenizer.text_to_ids(sentence)
+                for _ in range(next(doc_sentence_counts)):
+                    sentence_ids = list(next(batch_ids))
                     if len(sentence_ids) > 0:
                         doc_ids.append(sentence_ids)
                 if len(doc_ids) > 0 and self.args.append_eod:
                     doc_ids[-1].append(Encoder.tokenizer.eos_id)
                 ids[key] = doc_ids
-        else:
-            data = json_line
-            ids = {}
-            text = data.strip()
-            if self.args.apply_ftfy:
-                text = ftfy.fix_text(text)
-            doc_ids = []
-            for sentence in Encoder.splitter.tokenize(text):
-                sentence_ids = Encoder.tokenizer.text_to_ids(sentence)
-                if len(sentence_ids) > 0:
-                    doc_ids.append(sentence_ids)
-            if len(doc_ids) > 0 and self.args.append_eod:
-                doc_ids[-1].append(Encoder.tokenizer.eos_id)
-            ids['text'] = doc_ids
-        return ids, len(json_line)
+            docs.append(ids)
+        return docs
+
+    def encode(self, json_line):
+        return self.encode_batch([json_line])[0], len(json_line)
+
+    def encode_shard(self, shard):
+        """
+        Tokenize the lines of an input file in the byte range of `shard` and write them to the shard's own
+        indexed dataset files. The shard is marked as done only after all its files are written.
+        """
+        builders = {}
+        for key in shard['keys']:
+            builders[key] = indexed_dataset.make_builder(
+                shard_data_prefix(shard, key) + '.bin',
+                impl=self.args.dataset_impl,
+                chunk_size=self.args.chunk_size,
+                pad_id=Encoder.tokenizer.pad_id if hasattr(Encoder.tokenizer, "pad_id") else 0,
+                retrieval_db=self.args.retrieval_db,
+                vocab_size=Encoder.tokenizer.vocab_size,
+            )
+
+        num_docs, bytes_processed = 0, 0
+        for json_lines in read_shard_lines(shard, self.args.batch_size):
+            bytes_processed += sum(len(json_line) for json_line in json_lines)
+            for doc in self.encode_batch(json_lines):
+                num_docs += 1
+                for key, sentences in doc.items():
+                    if len(sentences) == 0:
+                        continue
+                    for sentence in sentences:
+                        builders[key].add_item(torch.IntTensor(sentence))
+                    builders[key].end_document()
+
+        for key in shard['keys']:
+            builders[key].finalize(shard_data_prefix(shard, key) + '.idx')
+        stats = {'num_docs': num_docs, 'bytes_processed': bytes_processed}
+        with open(shard['prefix'] + '.done', 'w') as f:
+            json.dump(stats, f)
+        return stats
+
+
+def open_input_file(json_file):
+    if json_file.endswith('.gz'):
+        return gzip.open(json_file, 'rt', encoding='utf-8')
+    return open(json_file, 'r', encoding='utf-8')
+
+
+def read_shard_lines(shard, batch_size):
+    """Yield batches of lines from the byte range [start, end) of the shard's input file."""
+    batch = []
+    if shard['end'] is None:
+        with open_input_file(shard['input']) as fin:
+            for line in fin:
+                batch.append(line)
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+    else:
+        with open(shard['input'], 'rb') as fin:
+            fin.seek(shard['start'])
+            while fin.tell() < shard['end']:
+                line = fin.readline()
+                if not line:
+                    break
+                batch.append(line.decode('utf-8'))
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def split_input_file(json_file, num_shards):
+    """
+    Split an input file into `num_shards` byte ranges that start at the beginning of a line.
+    Compressed files cannot be seeked, so they are always processed as a single shard with `end=None`.
+    """
+    if json_file.endswith('.gz'):
+        return [(0, None)]
+    file_size = os.path.getsize(json_file)
+    boundaries = [0]
+    with open(json_file, 'rb') as fin:
+        for i in range(1, num_shards):
+            position = max(file_size * i // num_shards, boundaries[-1])
+            if position > 0:
+                # move to the beginning of the first line that starts at or after `position`
+                fin.seek(position - 1)
+                fin.readline()
+                position = fin.tell()
+            boundaries.append(min(position, file_size))
+    boundaries.append(file_size)
+    return [(stt, end) for stt, end in zip(boundaries[:-1], boundaries[1:]) if end > stt]
+
+
+def shard_data_prefix(shard, key):
+    return "{}_{}_{}".format(shard['prefix'], key, shard['level'])
+
+
+def get_shard_plan(args, json_files, keys, level):
+    """
+    Create the list of shards, or load the list of an interrupted run with the same inputs so that
+    the shards that are already done can be reused.
+    """
+    shard_dir = args.output_prefix + '_shards'
+    plan_file = os.path.join(shard_dir, 'plan.json')
+    config = {
+        'inputs': json_files,
+        'input_sizes': [os.path.getsize(json_file) for json_file in json_files],
+        'keys': keys,
+        'level': level,
+        'dataset_impl': args.dataset_impl,
+        # every argument that changes the contents of the shards
+        'text_file': args.text_file,
+        'split_sentences': args.split_sentences,
+        'keep_newlines': args.keep_newlines,
+        'keep_empty': args.keep_empty,
+        'apply_ftfy': args.apply_ftfy,
+        'append_eod': args.append_eod,
+        'tokenizer_library': args.tokenizer_library,
+        'tokenizer_type': args.tokenizer_type,
+        'tokenizer_model': args.tokenizer_model,
+        'vocab_file': args.vocab_file,
+        'merge_file': args.merge_file,
+        'tokenizer_file_sizes': [
+            os.path.getsize(fn) if fn is not None and os.path.isfile(fn) else None
+            for fn in [args.tokenizer_model, args.vocab_file, args.merge_file]
+        ],
+        'delimiter': args.delimiter,
+        'need_pad_id': args.need_pad_id,
+        'retrieval_db': args.retrieval_db,
+        'chunk_size': args.chunk_size,
+    }
+    if os.path.exists(plan_file):
+        with open(plan_file, 'r') as f:
+            plan = json.load(f)
+        if plan['config'] == config:
+            print(f'Resuming from {plan_file}')
+            return plan['shards']
+        print(f'Inputs do not match {plan_file}, starting over.')
+        shutil.rmtree(shard_dir)
+
+    os.makedirs(shard_dir, exist_ok=True)
+    num_shards_per_file = args.shards_per_file or math.ceil(args.workers / len(json_files))
+    shards = []
+    for file_idx, json_file in enumerate(json_files):
+        for shard_idx, (start, end) in enumerate(split_input_file(json_file, num_shards_per_file)):
+            shards.append(
+                {
+                    'input': json_file,
+                    'start': start,
+                    'end': end,
+                    'keys': keys,
+                    'level': level,
+                    'prefix': os.path.join(shard_dir, f'shard_{file_idx:06d}_{shard_idx:04d}'),
+                }
+            )
+    with open(plan_file, 'w') as f:
+        json.dump({'config': config, 'shards': shards}, f)
+    return shards
 
 
 def get_args():
@@ -239,6 +418,18 @@ def get_args():
 
     group = parser.add_argument_group(title='runtime')
     group.add_argument('--workers', type=int, default=1, help='Number of worker processes to launch')
+    group.add_argument(
+        '--shards-per-file',
+        type=int,
+        default=None,
+        help='Number of shards each (uncompressed) input file is split into. Defaults to workers / number of files.',
+    )
+    group.add_argument(
+        '--batch-size', type=int, default=1000, help='Number of documents tokenized in a batch by each worker'
+    )
+    group.add_argument(
+        '--keep-shards', action='store_true', help='Keep the shard files after they are merged into the output files'
+    )
     group.add_argument('--chunk_size', type=int, default=64, help='chunk size used for retrieval')
 
     group.add_argument('--log-interval', type=int, default=100, help='Interval between progress updates')
@@ -272,7 +463,7 @@ def main():
         print('Searching folder for .json or .json.gz files...')
         assert os.path.exists(args.input), f'Folder does not exist: {args.input}'
         json_files = (str(f) for f in pathlib.Path(args.input).glob(args.files_filter))
-        json_files = [f for f in json_files if f.endswith('.json') or f.endswith('.json.gz')]
+        json_files = sorted(f for f in json_files if f.endswith('.json') or f.endswith('.json.gz'))
         if len(json_files) == 0:
             raise FileNotFoundError('No .json or .json.gz files found in folder.')
         else:
@@ -293,56 +484,51 @@ def main():
     level = "document"
     if args.split_sentences:
         level = "sentence"
+    keys = ['text'] if args.text_file else args.json_keys
 
     print(f"Vocab size: {tokenizer.vocab_size}")
     print(f"Output prefix: {args.output_prefix}")
-    output_bin_files = {}
-    output_idx_files = {}
-    builders = {}
-    for key in args.json_keys:
-        output_bin_files[key] = "{}_{}_{}.bin".format(args.output_prefix, key, level)
-        output_idx_files[key] = "{}_{}_{}.idx".format(args.output_prefix, key, level)
-        builders[key] = indexed_dataset.make_builder(
-            output_bin_files[key],
-            impl=args.dataset_impl,
-            chunk_size=args.chunk_size,
-            pad_id=tokenizer.pad_id if hasattr(tokenizer, "pad_id") else 0,
-            retrieval_db=args.retrieval_db,
-            vocab_size=tokenizer.vocab_size,
-        )
+    shards = get_shard_plan(args, json_files, keys, level)
+    pending_shards = [shard for shard in shards if not os.path.exists(shard['prefix'] + '.done')]
+    print(f"{len(shards) - len(pending_shards)}/{len(shards)} shards are already done.")
 
     startup_end = time.time()
     proc_start = time.time()
-    total_bytes_processed = 0
+    total_bytes_processed, total_docs = 0, 0
     print("Time to startup:", startup_end - startup_start)
 
-    pool = multiprocessing.Pool(args.workers, initializer=encoder.initializer)
-
-    for idx, json_file in enumerate(json_files):
-        print(f'Processing file {json_file} {idx + 1}/{len(json_files)}')
-        if json_file.endswith('.gz'):
-            fin = gzip.open(json_file, 'r')
-        else:
-            fin = open(args.input, 'r', encoding='utf-8')
-
-        encoded_docs = pool.imap(encoder.encode, fin, 25)
-
-        for i, (doc, bytes_processed) in enumerate(encoded_docs, start=1):
-            total_bytes_processed += bytes_processed
-            for key, sentences in doc.items():
-                if len(sentences) == 0:
-                    continue
-                for sentence in sentences:
-                    builders[key].add_item(torch.IntTensor(sentence))
-                builders[key].end_document()
-            if i % args.log_interval == 0:
-                current = time.time()
-                elapsed = current - proc_start
+    if len(pending_shards) > 0:
+        with multiprocessing.Pool(args.workers, initializer=encoder.initializer) as pool:
+            for i, stats in enumerate(pool.imap_unordered(encoder.encode_shard, pending_shards), start=1):
+                total_bytes_processed += stats['bytes_processed']
+                total_docs += stats['num_docs']
+                elapsed = time.time() - proc_start
                 mbs = total_bytes_processed / elapsed / 1024 / 1024
-                print(f"Processed {i} documents", f"({i/elapsed} docs/s, {mbs} MB/s).", file=sys.stderr)
+                print(
+                    f"Processed {i}/{len(pending_shards)} shards, {total_docs} documents",
+                    f"({total_docs/elapsed} docs/s, {mbs} MB/s).",
+                    file=sys.stderr,
+                )
+
+    # merge the shards in the order of the input files
+    for key in keys:
+        output_bin_file = "{}_{}_{}.bin".format(args.output_prefix, key, level)
+        output_idx_file = "{}_{}_{}.idx".format(args.output_prefix, key, level)
+        builder = indexed_dataset.make_builder(
+            output_bin_file,
+            impl=args.dataset_impl,
+            chunk_size=args.chunk_size,
+            pad_id=tokenizer.pad_id if hasattr(tokenizer, "pad_id") else 0,
+            retrieval_db=args.retrieval_db,
+            vocab_size=tokenizer.vocab_size,
+        )
+        for shard in shards:
+            builder.merge_file_(shard_data_prefix(shard, key))
+        builder.finalize(output_idx_file)
+        print(f"Merged {len(shards)} shards into {output_bin_file}")
 
-    for key in args.json_keys:
-        builders[key].finalize(output_idx_files[key])
+    if not args.keep_shards:
+        shutil.rmtree(args.output_prefix + '_shards')
 
 
 if __name__ == '__main__':
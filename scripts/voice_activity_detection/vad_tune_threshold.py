@@ -16,7 +16,7 @@ import argparse
 
 import numpy as np
 
-from nemo.collections.asr.parts.utils.vad_utils import vad_tune_threshold_on_dev
+from nemo.collections.asr.parts.utils.vad_utils import vad_tune_threshold_on_dev, vad_tune_threshold_on_dev_parallel
 from nemo.utils import logging
 
 """
@@ -28,8 +28,11 @@ python vad_tune_threshold.py \
 --onset_range="0,1,0.2" --offset_range="0,1,0.2" --min_duration_on_range="0.1,0.8,0.05" --min_duration_off_range="0.1,0.8,0.05" --not_filter_speech_first \
 --vad_pred=<FULL PATH OF FOLDER OF FRAME LEVEL PREDICTION FILES> \
 --groundtruth_RTTM=<DIRECTORY OF VAD PREDICTIONS OR A FILE CONTAINS THE PATHS OF THEM> \
---vad_pred_method="median"
+--vad_pred_method="median" \
+--num_workers=20 --num_refine_rounds=2
 
+By default predictions and rttms are loaded once and all combinations are evaluated in parallel with a vectorized
+detection error rate. Use --use_pyannote to evaluate with pyannote.metrics as before.
 """
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -84,6 +87,23 @@ if __name__ == "__main__":
     parser.add_argument(
         "--frame_length_in_sec", help="frame_length_in_sec ", type=float, default=0.01,
     )
+    parser.add_argument(
+        "--num_workers", help="number of processes used to evaluate parameter combinations", type=int, default=20,
+    )
+    parser.add_argument(
+        "--num_refine_rounds",
+        help="number of rounds of adaptive search around the best combinations after the grid search",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--refine_top_k", help="number of best combinations to refine around in every round", type=int, default=3,
+    )
+    parser.add_argument(
+        "--use_pyannote",
+        help="Use the serial tuner which writes segment tables and evaluates with pyannote.metrics",
+        action='store_true',
+    )
     args = parser.parse_args()
 
     params = {}
@@ -127,15 +147,30 @@ if __name__ == "__main__":
             "Theshold input is invalid! Please enter it as a 'START,STOP,STEP' for onset, offset, min_duration_on and min_duration_off, and enter True/False for filter_speech_first"
         )
 
-    best_threhsold, optimal_scores = vad_tune_threshold_on_dev(
-        params,
-        args.vad_pred,
-        args.groundtruth_RTTM,
-        args.result_file,
-        args.vad_pred_method,
-        args.focus_metric,
-        args.frame_length_in_sec,
-    )
+    if args.use_pyannote:
+        best_threhsold, optimal_scores = vad_tune_threshold_on_dev(
+            params,
+            args.vad_pred,
+            args.groundtruth_RTTM,
+            args.result_file,
+            args.vad_pred_method,
+            args.focus_metric,
+            args.frame_length_in_sec,
+            args.num_workers,
+        )
+    else:
+        best_threhsold, optimal_scores = vad_tune_threshold_on_dev_parallel(
+            params,
+            args.vad_pred,
+            args.groundtruth_RTTM,
+            args.result_file,
+            args.vad_pred_method,
+            args.focus_metric,
+            args.frame_length_in_sec,
+            args.num_workers,
+            args.num_refine_rounds,
+            args.refine_top_k,
+        )
     logging.info(
         f"Best combination of thresholds for binarization selected from input ranges is {best_threhsold}, and the optimal score is {optimal_scores}"
     )
@@ -17,17 +17,24 @@ from typing import List, Type, Union
 
 import numpy as np
 import pytest
+import soundfile as sf
 from numpy.random import default_rng
+from omegaconf import OmegaConf
+from scipy.signal import convolve
 
 from nemo.collections.asr.data.data_simulation import (
     ArrayGeometry,
+    AudioFileCache,
+    MultiSpeakerSimulator,
     check_angle,
     convert_placement_to_range,
     convert_rir_to_multichannel,
+    convolve_rir,
     simulate_room_mix,
     wrap_to_180,
 )
 from nemo.collections.asr.parts.preprocessing.segment import AudioSegment
+from nemo.collections.asr.parts.utils.manifest_utils import write_manifest
 
 
 class TestDataSimulationUtils:
@@ -393,3 +400,85 @@ class TestRoomSimulation:
             assert mix_uut.duration == mix_golden.duration
             max_diff = np.max(np.abs(mix_uut_samples - mix_golden.samples))
             assert max_diff < self.max_diff_tol
+
+
+class TestMultiSpeakerSimulator:
+    @staticmethod
+    def _create_source_data(data_dir: str, num_speakers: int = 3, files_per_speaker: int = 2, sr: int = 16000):
+        random = default_rng(0)
+        manifest = []
+        for spk in range(num_speakers):
+            for n in range(files_per_speaker):
+                audio_filepath = os.path.join(data_dir, f'spk{spk}_{n}.wav')
+                sf.write(audio_filepath, 0.1 * random.standard_normal(2 * sr), sr)
+                manifest.append(
+                    {
+                        'audio_filepath': audio_filepath,
+                        'speaker_id': str(spk),
+                        'words': ['', 'a', 'b', '', 'c', 'd'],
+                        'alignments': [0.2, 0.5, 0.8, 1.3, 1.6, 1.9],
+                    }
+                )
+        manifest_filepath = os.path.join(data_dir, 'source_manifest.json')
+        write_manifest(manifest_filepath, manifest)
+        return manifest_filepath
+
+    @staticmethod
+    def _get_config(manifest_filepath: str, output_dir: str, num_workers: int):
+        config_path = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            '../../../tools/speech_data_simulator/conf/data_simulator.yaml',
+        )
+        cfg = OmegaConf.load(config_path)
+        cfg.data_simulator.manifest_filepath = manifest_filepath
+        cfg.data_simulator.num_workers = num_workers
+        cfg.data_simulator.session_config.num_speakers = 2
+        cfg.data_simulator.session_config.num_sessions = 3
+        cfg.data_simulator.session_config.session_length = 8
+        cfg.data_simulator.outputs.output_dir = output_dir
+        return cfg
+
+    @pytest.mark.unit
+    def test_audio_file_cache(self, tmp_path):
+        sr = 16000
+        filepaths = []
+        for n in range(3):
+            filepaths.append(os.path.join(str(tmp_path), f'audio_{n}.wav'))
+            sf.write(filepaths[-1], np.full((sr, 2), 0.1 * (n + 1)), sr)
+        cache = AudioFileCache(max_size=2)
+        for filepath in filepaths:
+            audio_file = cache.read(filepath)
+            assert audio_file.ndim == 1 and len(audio_file) == sr
+        assert len(cache) == 2
+        assert cache.read(filepaths[-1]) is cache.read(filepaths[-1])
+
+    @pytest.mark.unit
+    def test_convolve_rir_multichannel(self):
+        random = default_rng(0)
+        signal = random.standard_normal(1000)
+        rir = random.standard_normal((200, 3))
+        out = convolve_rir(signal, rir)
+        assert out.shape == (1000, 3)
+        for m in range(rir.shape[1]):
+            assert np.allclose(out[:, m], convolve(signal, rir[:, m])[:1000])
+
+    @pytest.mark.unit
+    def test_generate_sessions_deterministic_with_workers(self, tmp_path):
+        manifest_filepath = self._create_source_data(str(tmp_path))
+        outputs = {}
+        for num_workers in [1, 2]:
+            output_dir = os.path.join(str(tmp_path), f'output_{num_workers}')
+            simulator = MultiSpeakerSimulator(cfg=self._get_config(manifest_filepath, output_dir, num_workers))
+            simulator.generate_sessions()
+            outputs[num_workers] = output_dir
+
+        for i in range(3):
+            filename = f'multispeaker_session_{i}'
+            for ext in ['.rttm', '.ctm', '.txt']:
+                with open(os.path.join(outputs[1], filename + ext)) as f1, open(
+                    os.path.join(outputs[2], filename + ext)
+                ) as f2:
+                    assert f1.read() == f2.read()
+            audio_1, _ = sf.read(os.path.join(outputs[1], filename + '.wav'))
+            audio_2, _ = sf.read(os.path.join(outputs[2], filename + '.wav'))
+            assert np.array_equal(audio_1, audio_2)
@@ -12,10 +12,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+from types import SimpleNamespace
+
 import pytest
 import torch
 from omegaconf import DictConfig
 
+from nemo.collections.asr.data.audio_to_diar_label import MSDDTargetCache
 from nemo.collections.asr.models import EncDecDiarLabelModel
 
 
@@ -165,3 +169,67 @@ class TestEncDecDiarLabelModel:
         assert diff <= 1e-6
         diff = torch.max(torch.abs(scale_weights_instance - scale_weights_batch))
         assert diff <= 1e-6
+
+
+class _StubMSDDTrainDataset:
+    """Provides the attributes and target functions of `_AudioMSDDTrainDataset` used by `MSDDTargetCache`."""
+
+    def __init__(self, manifest_filepath, rttm_file, seg_lens):
+        self.manifest_filepath = manifest_filepath
+        self.collection = [SimpleNamespace(rttm_file=rttm_file, offset=None) for _ in seg_lens]
+        self.multiscale_args_dict = {'scale_dict': {0: [1.5, 0.75], 1: [0.5, 0.25]}}
+        self.frame_per_sec, self.soft_label_thres, self.round_digits, self.max_spks = 100, 0.5, 2, 2
+        self.seg_lens = list(seg_lens)
+        self._sample_index = 0
+
+    def parse_rttm_for_ms_targets(self, sample):
+        seg_len = self.seg_lens[self._sample_index]
+        clus_label_index = torch.arange(seg_len + seg_len // 2) % 3 - 1
+        targets = (torch.arange(seg_len * 2).reshape(seg_len, 2) % 3 == 0).float()
+        scale_mapping = torch.stack([torch.arange(seg_len) // 2, torch.arange(seg_len)])
+        return clus_label_index, targets, scale_mapping
+
+    def get_ms_seg_timestamps(self, sample):
+        seg_len = self.seg_lens[self._sample_index]
+        self._sample_index += 1
+        ms_seg_timestamps = torch.arange(2 * seg_len * 2, dtype=torch.float32).reshape(2, seg_len, 2)
+        ms_seg_counts = torch.tensor([seg_len // 2, seg_len])
+        return ms_seg_timestamps, ms_seg_counts
+
+
+class TestMSDDTargetCache:
+    @pytest.mark.unit
+    def test_build_and_load(self, tmp_path):
+        manifest_filepath, rttm_file = str(tmp_path / 'manifest.json'), str(tmp_path / 'sess.rttm')
+        for path in [manifest_filepath, rttm_file]:
+            with open(path, 'w') as f:
+                f.write('dummy\n')
+        dataset = _StubMSDDTrainDataset(manifest_filepath, rttm_file, seg_lens=[4, 7, 5])
+        cache_dir = os.path.join(str(tmp_path), MSDDTargetCache.get_cache_key(dataset))
+        assert not MSDDTargetCache.exists(cache_dir)
+        cache = MSDDTargetCache.build(dataset, cache_dir)
+        assert MSDDTargetCache.exists(cache_dir)
+        assert len(cache) == 3
+
+        reference = _StubMSDDTrainDataset(manifest_filepath, rttm_file, seg_lens=[4, 7, 5])
+        for index, sample in enumerate(reference.collection):
+            clus_label_index, targets, scale_mapping = reference.parse_rttm_for_ms_targets(sample)
+            ms_seg_timestamps, ms_seg_counts = reference.get_ms_seg_timestamps(sample)
+            cached = cache[index]
+            for expected, loaded in zip(
+                [clus_label_index, targets, scale_mapping, ms_seg_timestamps, ms_seg_counts], cached
+            ):
+                assert loaded.dtype == expected.dtype
+                assert torch.equal(loaded, expected)
+
+    @pytest.mark.unit
+    def test_cache_key_changes_with_config(self, tmp_path):
+        manifest_filepath, rttm_file = str(tmp_path / 'manifest.json'), str(tmp_path / 'sess.rttm')
+        for path in [manifest_filepath, rttm_file]:
+            with open(path, 'w') as f:
+                f.write('dummy\n')
+        dataset = _StubMSDDTrainDataset(manifest_filepath, rttm_file, seg_lens=[4])
+        key = MSDDTargetCache.get_cache_key(dataset)
+        assert key == MSDDTargetCache.get_cache_key(dataset)
+        dataset.soft_label_thres = 0.6
+        assert key != MSDDTargetCache.get_cache_key(dataset)
@@ -25,7 +25,9 @@ from nemo.collections.asr.parts.utils.offline_clustering import (
     split_input_data,
 )
 from nemo.collections.asr.parts.utils.online_clustering import (
+    IncrementalOnlineSpeakerClustering,
     OnlineSpeakerClustering,
+    OnlineSpeakerClusteringSessionManager,
     get_closest_embeddings,
     get_merge_quantity,
     get_minimal_indices,
@@ -33,7 +35,13 @@ from nemo.collections.asr.parts.utils.online_clustering import (
     run_reducer,
     stitch_cluster_labels,
 )
-from nemo.collections.asr.parts.utils.speaker_utils import get_subsegments
+from nemo.collections.asr.parts.utils.speaker_utils import (
+    IntervalSet,
+    combine_float_overlaps,
+    get_subsegments,
+    get_subsegments_array,
+    getSubRangeList,
+)
 
 MAX_SEED_COUNT = 2
 
@@ -303,6 +311,76 @@ class TestDiarizationUtilFunctions:
         assert all(class_target_vol == torch.tensor([2, 0, 0, 0]))
 
 
+class TestIntervalSet:
+    """Tests the vectorized interval algebra in speaker_utils.
+    """
+
+    @pytest.mark.unit
+    def test_interval_set_merge(self):
+        intervals = IntervalSet([[5.0, 6.0], [0.0, 1.5], [1.0, 3.0], [3.0, 4.0], [7.0, 7.0]])
+        assert intervals.to_list() == [[0.0, 4.0], [5.0, 6.0]]
+        assert intervals.duration == pytest.approx(5.0)
+
+    @pytest.mark.unit
+    def test_interval_set_operations(self):
+        a = IntervalSet([[0.0, 2.0], [4.0, 6.0]])
+        b = IntervalSet([[1.0, 5.0]])
+        assert (a | b).to_list() == [[0.0, 6.0]]
+        assert (a & b).to_list() == [[1.0, 2.0], [4.0, 5.0]]
+        assert (a - b).to_list() == [[0.0, 1.0], [5.0, 6.0]]
+        assert (b - a).to_list() == [[2.0, 4.0]]
+        assert len(a & IntervalSet()) == 0
+        assert a.clip(1.0, 4.5).to_list() == [[1.0, 2.0], [4.0, 4.5]]
+
+    @pytest.mark.unit
+    def test_interval_set_rttm_lines(self):
+        lines = IntervalSet([[0.5, 1.25]]).to_rttm_lines('abc', 'speaker_0')
+        assert lines == ["SPEAKER abc 1 0.500 0.750 <NA> <NA> speaker_0 <NA> <NA>\n"]
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize(
+        "offset, duration, target",
+        [
+            (0.0, 0.3, [(0.0, 0.3)]),
+            (10.0, 1.5, [(10.0, 1.5)]),
+            (0.0, 2.0, [(0.0, 1.5), (0.75, 1.25)]),
+            # the duration minus the window is an exact multiple of the shift
+            (0.0, 3.0, [(0.0, 1.5), (0.75, 1.5), (1.5, 1.5)]),
+            (5.0, 0.0, [(5.0, 0.0)]),
+        ],
+    )
+    def test_subsegments(self, offset, duration, target):
+        assert get_subsegments(offset=offset, window=1.5, shift=0.75, duration=duration) == target
+
+    @pytest.mark.unit
+    def test_subsegments_array(self):
+        offsets, durations = np.array([0.0, 10.0, 20.0]), np.array([3.0, 0.0, 2.0])
+        subsegments, seg_idx = get_subsegments_array(
+            offsets, durations, window=1.5, shift=0.75, return_segment_index=True
+        )
+        # zero-length subsegments are excluded
+        assert subsegments.tolist() == [[0.0, 1.5], [0.75, 1.5], [1.5, 1.5], [20.0, 1.5], [20.75, 1.25]]
+        assert seg_idx.tolist() == [0, 0, 0, 2, 2]
+
+        subsegments = get_subsegments_array(offsets, durations, window=1.5, shift=0.75, min_subsegment_duration=1.25)
+        assert subsegments.tolist() == [[0.0, 1.5], [0.75, 1.5], [1.5, 1.5], [20.0, 1.5]]
+        assert get_subsegments_array(np.zeros(0), np.zeros(0), window=1.5, shift=0.75).shape == (0, 2)
+
+    @pytest.mark.unit
+    def test_combine_float_overlaps(self):
+        ranges = [[10.2, 10.83], [10.42, 10.91], [10.45, 12.09], [12.09, 13.0], [15.0, 16.0]]
+        assert combine_float_overlaps(ranges, decimals=5) == [[10.2, 12.09], [12.09, 13.0], [15.0, 16.0]]
+
+    @pytest.mark.unit
+    def test_sub_range_list(self):
+        source = [[0.0, 1.0], [2.0, 3.0], [4.0, 5.0]]
+        assert getSubRangeList(target_range=[0.5, 4.5], source_range_list=source) == [
+            [0.5, 1.0],
+            [2.0, 3.0],
+            [4.0, 4.5],
+        ]
+
+
 class TestSpeakerClustering:
     """
     Test speaker clustering module
@@ -592,3 +670,71 @@ class TestSpeakerClustering:
     @pytest.mark.parametrize("seed", [0])
     def test_online_speaker_clustering_cpu(self, n_spks, total_sec, buffer_size, sigma, seed):
         self.test_online_speaker_clustering(n_spks, total_sec, buffer_size, sigma, seed)
+
+    @pytest.mark.run_only_on('CPU')
+    @pytest.mark.unit
+    @pytest.mark.parametrize("n_spks", [2, 3])
+    @pytest.mark.parametrize("buffer_size", [10])
+    @pytest.mark.parametrize("recluster_interval", [0, 5])
+    def test_incremental_online_speaker_clustering(self, n_spks, buffer_size, recluster_interval):
+        step_per_frame = 2
+        em, ts, mc, _, _, gt = generate_toy_data(n_spks, spk_dur=30 / n_spks, perturb_sigma=0.1, torch_seed=0)
+        em_s, _ = split_input_data(em, ts, mc)
+        emb_gen = em_s[-1]
+
+        online_clus = IncrementalOnlineSpeakerClustering(
+            max_num_speakers=8,
+            emb_dim=emb_gen.shape[1],
+            recluster_interval=recluster_interval,
+            history_buffer_size=buffer_size,
+            current_buffer_size=buffer_size,
+        )
+        memory_footprint = online_clus.get_memory_footprint()
+        labels = []
+        for stt in range(0, emb_gen.shape[0], step_per_frame):
+            labels.append(online_clus.forward_incremental(emb_gen[stt : stt + step_per_frame]))
+            assert online_clus.get_memory_footprint() == memory_footprint
+        labels = torch.cat(labels)
+
+        assert len(labels) == len(gt)
+        assert online_clus.num_buffered == 2 * buffer_size
+        matched_labels = stitch_cluster_labels(Y_old=gt, Y_new=labels)
+        assert (matched_labels == gt).float().mean() > 0.9
+        assert online_clus.get_latency_stats()['num_steps'] == online_clus.step_count
+
+    @pytest.mark.run_only_on('CPU')
+    @pytest.mark.unit
+    def test_online_speaker_clustering_session_manager(self):
+        step_per_frame = 3
+        streams = {}
+        for session_idx, n_spks in enumerate([2, 3]):
+            em, ts, mc, _, _, gt = generate_toy_data(n_spks, spk_dur=6, perturb_sigma=0.1, torch_seed=session_idx)
+            em_s, _ = split_input_data(em, ts, mc)
+            streams[f"session_{session_idx}"] = (em_s[-1], gt)
+
+        manager = OnlineSpeakerClusteringSessionManager(
+            max_sessions=2,
+            max_num_speakers=8,
+            emb_dim=192,
+            history_buffer_size=10,
+            current_buffer_size=10,
+            recluster_interval=0,
+        )
+        labels = {session_id: [] for session_id in streams}
+        max_len = max(emb.shape[0] for emb, _ in streams.values())
+        for stt in range(0, max_len, step_per_frame):
+            session_embs = {
+                session_id: emb[stt : stt + step_per_frame]
+                for session_id, (emb, _) in streams.items()
+                if stt < emb.shape[0]
+            }
+            for session_id, session_labels in manager.step(session_embs).items():
+                labels[session_id].append(session_labels)
+
+        for session_id, (_, gt) in streams.items():
+            session_labels = torch.cat(labels[session_id])
+            matched_labels = stitch_cluster_labels(Y_old=gt, Y_new=session_labels)
+            assert (matched_labels == gt).float().mean() > 0.9
+            manager.close_session(session_id)
+        assert len(manager.free_slots) == 2
+        assert manager.get_latency_stats()['num_steps'] > 0
@@ -0,0 +1,64 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+import torch
+
+from nemo.collections.asr.parts.utils.vad_utils import (
+    cal_vad_detection_error,
+    get_refined_parameter_grid,
+    get_vad_segments_support,
+    vad_evaluate_param_on_data,
+)
+
+
+class TestVADTuneUtils:
+    @pytest.mark.unit
+    def test_segments_support(self):
+        segments = np.array([[3.0, 4.0], [0.0, 1.5], [1.0, 2.0], [5.0, 5.0]])
+        support = get_vad_segments_support(segments)
+        assert np.allclose(support, np.array([[0.0, 2.0], [3.0, 4.0]]))
+
+    @pytest.mark.unit
+    def test_detection_error(self):
+        reference = np.array([[0.0, 2.0], [4.0, 6.0]])
+        hypothesis = np.array([[1.0, 3.0], [4.5, 7.0]])
+        total, false_alarm, miss = cal_vad_detection_error(reference, hypothesis)
+        assert total == pytest.approx(4.0)
+        assert false_alarm == pytest.approx(2.0)
+        assert miss == pytest.approx(1.5)
+
+    @pytest.mark.unit
+    def test_detection_error_empty_hypothesis(self):
+        reference = np.array([[0.0, 2.0]])
+        total, false_alarm, miss = cal_vad_detection_error(reference, np.zeros((0, 2)))
+        assert (total, false_alarm, miss) == (2.0, 0.0, 2.0)
+
+    @pytest.mark.unit
+    def test_evaluate_param_on_data(self):
+        sequence = torch.tensor([0.0] * 100 + [1.0] * 100 + [0.0] * 100)
+        reference = np.array([[1.0, 2.0]])
+        perf = vad_evaluate_param_on_data({'onset': 0.5, 'offset': 0.5}, {'a': (sequence, reference)})
+        assert perf['MISS (%)'] == pytest.approx(0.0)
+        assert perf['DetER (%)'] == pytest.approx(perf['FA (%)'])
+        assert perf['DetER (%)'] < 2.0
+
+    @pytest.mark.unit
+    def test_refined_parameter_grid(self):
+        center = {'offset': 0.5, 'onset': 1.0, 'filter_speech_first': False}
+        grid = get_refined_parameter_grid(center, {'onset': 0.1, 'offset': 0.1})
+        assert len(grid) == 6
+        assert all(0 <= param['onset'] <= 1 for param in grid)
+        assert all(param['filter_speech_first'] is False for param in grid)
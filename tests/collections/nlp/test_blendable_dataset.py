@@ -0,0 +1,65 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pickle
+
+import numpy as np
+import pytest
+
+from nemo.collections.nlp.data.language_modeling.megatron.blendable_dataset import (
+    BlendableDataset,
+    build_exact_blending_indices,
+)
+
+
+class TestBlendableDataset:
+    @pytest.mark.unit
+    def test_exact_blending_ratios(self):
+        weights = np.array([[0.5, 0.3, 0.2]])
+        dataset_index, dataset_sample_index = build_exact_blending_indices(weights, 100)
+
+        assert np.array_equal(np.bincount(dataset_index, minlength=3), [50, 30, 20])
+        # samples are taken from every dataset in order
+        for i in range(3):
+            assert np.array_equal(dataset_sample_index[dataset_index == i], np.arange((dataset_index == i).sum()))
+        # every window is close to the blending ratio
+        assert abs((dataset_index[:10] == 0).sum() - 5) <= 1
+
+    @pytest.mark.unit
+    def test_many_datasets_and_epoch_weights(self):
+        weights = np.full((2, 300), 1.0 / 300)
+        weights[1] = 0.0
+        weights[1, 0] = 1.0
+        dataset_index, dataset_sample_index = build_exact_blending_indices(weights, 1200)
+
+        assert dataset_index.dtype == np.uint16
+        assert np.array_equal(np.bincount(dataset_index[:600], minlength=300), np.full(300, 2))
+        assert (dataset_index[600:] == 0).all()
+        # the reweighted dataset continues where the first epoch stopped
+        assert np.array_equal(dataset_sample_index[600:], np.arange(2, 602))
+
+    @pytest.mark.unit
+    def test_cached_indices(self, tmp_path):
+        datasets = [list(range(100)), list(range(100, 200))]
+        dataset = BlendableDataset(datasets, [0.75, 0.25], 40, index_cache_dir=str(tmp_path))
+        assert dataset._dataset_index is None
+
+        samples = [dataset[i] for i in range(len(dataset))]
+        assert sum(sample < 100 for sample in samples) == 30
+        assert isinstance(dataset.dataset_index, np.memmap)
+
+        # workers reload the indices from the cache
+        state = pickle.loads(pickle.dumps(dataset))
+        assert state._dataset_index is None
+        assert [state[i] for i in range(len(state))] == samples
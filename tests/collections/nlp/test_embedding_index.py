@@ -0,0 +1,110 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+import numpy as np
+import pytest
+
+from nemo.collections.nlp.parts.embedding_index import HAVE_FAISS, EmbeddingIndex, EmbeddingIndexMixin
+
+DIM = 16
+
+
+def _embeddings(num_embeddings, seed=0):
+    return np.random.RandomState(seed).randn(num_embeddings, DIM).astype(np.float16)
+
+
+class HashEncoder(EmbeddingIndexMixin):
+    def encode_index_texts(self, texts, batch_size=64):
+        embeddings = np.stack([_embeddings(1, seed=sum(map(ord, text)))[0] for text in texts]).astype(np.float32)
+        # normalized embeddings are the nearest to themselves
+        return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    def encode_queries(self, queries, batch_size=64):
+        return self.encode_index_texts(queries, batch_size=batch_size)
+
+
+class TestEmbeddingIndex:
+    @pytest.mark.unit
+    def test_exact_search(self, tmpdir):
+        index = EmbeddingIndex(str(tmpdir), dim=DIM, search_chunk_size=7)
+        embeddings = _embeddings(50)
+        index.add(embeddings[:20], ids=np.arange(100, 120))
+        index.add(embeddings[20:])
+        assert len(index) == 50 and index.ids.tolist() == list(range(100, 120)) + list(range(20, 50))
+
+        queries = _embeddings(5, seed=1).astype(np.float32)
+        scores, ids = index.exact_search(queries, k=4)
+        expected_scores = queries @ embeddings.astype(np.float32).T
+        expected_positions = np.argsort(-expected_scores, axis=1)[:, :4]
+        assert np.array_equal(ids, index.ids[expected_positions])
+        assert np.allclose(scores, np.take_along_axis(expected_scores, expected_positions, axis=1), atol=1e-4)
+
+        # fewer embeddings than k
+        scores, ids = index.exact_search(queries, k=60)
+        assert (ids[:, 50:] == -1).all() and np.isneginf(scores[:, 50:]).all()
+
+    @pytest.mark.unit
+    def test_reopen_and_add(self, tmpdir):
+        index = EmbeddingIndex(str(tmpdir), dim=DIM)
+        index.add(_embeddings(10))
+        with pytest.raises(ValueError):
+            EmbeddingIndex(str(tmpdir), dim=DIM + 1)
+
+        reopened = EmbeddingIndex(str(tmpdir))
+        reopened.add(_embeddings(5, seed=1))
+        assert len(EmbeddingIndex(str(tmpdir))) == 15
+        assert sorted(f for f in os.listdir(str(tmpdir)) if f.startswith('embeddings')) == [
+            'embeddings_00000.npy',
+            'embeddings_00001.npy',
+        ]
+        assert np.load(os.path.join(str(tmpdir), 'embeddings_00001.npy')).dtype == np.float16
+
+    @pytest.mark.unit
+    def test_search_without_ann_index_is_exact(self, tmpdir):
+        index = EmbeddingIndex(str(tmpdir), dim=DIM)
+        index.add(_embeddings(30))
+        queries = _embeddings(4, seed=2)
+        assert np.array_equal(index.search(queries, k=3)[1], index.exact_search(queries, k=3)[1])
+        assert index.recall_at_k(queries, k=3) == 1.0
+
+    @pytest.mark.unit
+    @pytest.mark.skipif(not HAVE_FAISS, reason="faiss is not installed")
+    def test_ivf_index_with_incremental_adds(self, tmpdir):
+        index = EmbeddingIndex(str(tmpdir), dim=DIM)
+        index.add(_embeddings(200))
+        # all clusters are visited, so the search is exact
+        index.build_ann_index(index_type='ivf', nlist=4, nprobe=4)
+        index.add(_embeddings(50, seed=1))
+        queries = _embeddings(10, seed=2)
+        assert index.recall_at_k(queries, k=5) == 1.0
+
+        # embeddings added after the ANN index was saved are added when the index is loaded
+        reopened = EmbeddingIndex(str(tmpdir))
+        assert np.array_equal(reopened.search(queries, k=5)[1], index.search(queries, k=5)[1])
+
+    @pytest.mark.unit
+    def test_mixin(self, tmpdir):
+        encoder = HashEncoder()
+        with pytest.raises(ValueError):
+            encoder.query(['a'])
+        texts = [f'entity {i}' for i in range(25)]
+        encoder.add_to_embedding_index(texts[:10], index_dir=str(tmpdir), ids=np.arange(10) * 2, shard_size=4)
+        encoder.add_to_embedding_index(texts[10:], ids=np.arange(10, 25) * 2, shard_size=4)
+        assert len(encoder.embedding_index) == 25
+
+        _, ids = encoder.query(texts[3:6], k=1)
+        assert ids[:, 0].tolist() == [6, 8, 10]
+        assert len(HashEncoder().load_embedding_index(str(tmpdir))) == 25
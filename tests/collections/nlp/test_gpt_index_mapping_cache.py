@@ -0,0 +1,115 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import torch
+
+from nemo.collections.nlp.data.language_modeling import megatron
+from nemo.collections.nlp.data.language_modeling.megatron import dataset_utils, gpt_dataset, index_cache
+from nemo.collections.nlp.data.language_modeling.megatron.gpt_dataset import IndexMappingCache
+
+
+@pytest.fixture
+def python_helpers(monkeypatch):
+    """Replaces the compilation of the C++ helpers and their build_sample_idx by the python implementation"""
+    compiled = []
+    monkeypatch.setattr(dataset_utils, 'compile_helper', lambda: compiled.append(True))
+    monkeypatch.setattr(index_cache, '_HELPERS_COMPILED', False)
+    helpers = SimpleNamespace(build_sample_idx=gpt_dataset._build_sample_idx)
+    monkeypatch.setattr(megatron, 'helpers', helpers, raising=False)
+    monkeypatch.setitem(sys.modules, 'nemo.collections.nlp.data.language_modeling.megatron.helpers', helpers)
+    return compiled
+
+
+@pytest.fixture
+def single_process(monkeypatch):
+    """Lets _build_index_mappings run without a process group"""
+    monkeypatch.setattr(torch.distributed, 'get_rank', lambda group=None: 0)
+    monkeypatch.setattr(torch.distributed, 'get_world_size', lambda group=None: 1)
+    monkeypatch.setattr(torch.distributed, 'barrier', lambda group=None: None)
+    monkeypatch.setattr(torch.distributed, 'all_reduce', lambda tensor, group=None: None)
+    monkeypatch.setattr(torch.cuda, 'LongTensor', torch.LongTensor)
+    parallel_state = SimpleNamespace(
+        get_data_parallel_group=lambda: None,
+        get_pipeline_model_parallel_group=lambda: None,
+        get_tensor_model_parallel_group=lambda: None,
+    )
+    monkeypatch.setattr(gpt_dataset, 'parallel_state', parallel_state, raising=False)
+
+
+def _cache(cache_dir, data_prefix, documents, sizes, num_samples=10):
+    return IndexMappingCache(
+        str(cache_dir), data_prefix, documents, sizes, num_samples=num_samples, seq_length=8, seed=1234
+    )
+
+
+class TestIndexMappingCache:
+    @pytest.mark.unit
+    def test_splits_with_equal_sizes_do_not_share_mappings(self, tmpdir):
+        # documents of a fixed length, so the size profiles of the splits are equal
+        sizes = np.full(30, 16, dtype=np.int32)
+        train = _cache(tmpdir, 'data/text_document', np.arange(0, 10, dtype=np.int32), sizes)
+        validation = _cache(tmpdir, 'data/text_document', np.arange(10, 20, dtype=np.int32), sizes)
+        test = _cache(tmpdir, 'data/text_document', np.arange(20, 30, dtype=np.int32), sizes)
+        assert len({train.key, validation.key, test.key}) == 3
+        assert len({train.prefix, validation.prefix, test.prefix}) == 3
+
+    @pytest.mark.unit
+    def test_key_is_content_addressed(self, tmpdir):
+        sizes = np.arange(1, 21, dtype=np.int32)
+        documents = np.arange(5, 15, dtype=np.int32)
+        cache = _cache(tmpdir, 'a/text_document', documents, sizes)
+        # data file names and the dtype of document indices do not change the key
+        assert _cache(tmpdir, 'b/other_document', documents.astype(np.int64), sizes).key == cache.key
+        assert _cache(tmpdir, 'a/text_document', documents, sizes, num_samples=11).key != cache.key
+        assert _cache(tmpdir, 'a/text_document', documents, sizes + 1).key != cache.key
+        assert not cache.exists()
+
+    @pytest.mark.unit
+    def test_build_and_load(self, tmpdir, monkeypatch, python_helpers, single_process):
+        sizes = np.random.RandomState(0).randint(1, 40, size=30).astype(np.int32)
+        documents = np.arange(5, 25, dtype=np.int32)
+        cache_dir = os.path.join(str(tmpdir), 'cache')
+        cache = _cache(cache_dir, 'a/text_document', documents, sizes, num_samples=50)
+        assert not cache.exists()
+
+        published = []
+        replace = os.replace
+
+        def record_replace(src, dst):
+            published.append((os.path.basename(dst), cache.exists()))
+            replace(src, dst)
+
+        monkeypatch.setattr(os, 'replace', record_replace)
+        cache.build_if_needed()
+        monkeypatch.setattr(os, 'replace', replace)
+        # the mappings are published before the meta file, which makes them visible
+        assert [name.split('_')[-1] for name, _ in published] == ['idx.npy'] * 3 + ['meta.json']
+        assert not any(exists for _, exists in published)
+        assert cache.exists()
+        assert len(python_helpers) == 1
+
+        # another instance, e.g. on another rank, loads the mappings
+        loaded = _cache(cache_dir, 'b/text_document', documents, sizes, num_samples=50).load()
+        expected = gpt_dataset._build_index_mappings(
+            'train', os.path.join(str(tmpdir), 'text_document'), documents, sizes, 50, 8, 1234
+        )
+        assert len(python_helpers) == 2
+        for loaded_array, expected_array in zip(loaded, expected):
+            assert np.array_equal(loaded_array, expected_array)
@@ -0,0 +1,57 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+import numpy as np
+import pytest
+import torch
+
+from nemo.collections.nlp.data.language_modeling.megatron.indexed_dataset import (
+    MMapIndexedDataset,
+    MMapIndexedDatasetBuilder,
+)
+
+
+def _write_shard(prefix, documents):
+    builder = MMapIndexedDatasetBuilder(prefix + '.bin', dtype=np.int32)
+    for document in documents:
+        for sentence in document:
+            builder.add_item(torch.IntTensor(sentence))
+        builder.end_document()
+    builder.finalize(prefix + '.idx')
+
+
+class TestMMapIndexedDatasetBuilder:
+    @pytest.mark.unit
+    def test_merge_file_keeps_documents(self, tmp_path):
+        shard_documents = [
+            [[[1, 2, 3], [4, 5]], [[6]]],
+            [[[7, 8], [9], [10, 11, 12]]],
+        ]
+        for i, documents in enumerate(shard_documents):
+            _write_shard(os.path.join(str(tmp_path), f'shard_{i}'), documents)
+
+        merged_prefix = os.path.join(str(tmp_path), 'merged')
+        builder = MMapIndexedDatasetBuilder(merged_prefix + '.bin', dtype=np.int32)
+        for i in range(len(shard_documents)):
+            builder.merge_file_(os.path.join(str(tmp_path), f'shard_{i}'))
+        builder.finalize(merged_prefix + '.idx')
+
+        dataset = MMapIndexedDataset(merged_prefix)
+        sentences = [sentence for documents in shard_documents for document in documents for sentence in document]
+        assert len(dataset) == len(sentences)
+        for i, sentence in enumerate(sentences):
+            assert np.array_equal(dataset[i], np.array(sentence))
+        assert np.array_equal(dataset.doc_idx, np.array([0, 2, 3, 6]))
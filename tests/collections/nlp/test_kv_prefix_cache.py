@@ -0,0 +1,78 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+import torch
+
+from nemo.collections.nlp.modules.common.megatron.kv_prefix_cache import KVPrefixCache
+
+NUM_LAYERS = 2
+
+
+def _memory(tokens):
+    # the key-values of a position are a function of the tokens up to that position
+    prefix_sums = torch.tensor(tokens, dtype=torch.float32).cumsum(0)
+    keys = [prefix_sums.view(-1, 1, 1) * (layer + 1) for layer in range(NUM_LAYERS)]
+    values = [-k for k in keys]
+    logprobs = -torch.tensor(tokens[1:], dtype=torch.float32)
+    return keys, values, logprobs
+
+
+def _insert(cache, tokens):
+    cache.insert(tokens, *_memory(tokens))
+
+
+class TestKVPrefixCache:
+    @pytest.mark.unit
+    def test_shared_prefix_is_reused(self):
+        cache = KVPrefixCache(max_tokens=100)
+        _insert(cache, [1, 2, 3, 4, 5])
+        _insert(cache, [1, 2, 3, 7])
+
+        batch = [[1, 2, 3, 4, 9, 9], [1, 2, 3, 7, 8, 8]]
+        prefix_length, keys, values, logprobs = cache.lookup(batch, max_length=5)
+
+        # the prefix stops before the last matched token, whose following token log prob is needed
+        assert prefix_length == 3
+        for i, tokens in enumerate(batch):
+            expected_keys, expected_values, _ = _memory(tokens)
+            for layer in range(NUM_LAYERS):
+                assert torch.equal(keys[layer][:, i], expected_keys[layer][:prefix_length])
+                assert torch.equal(values[layer][:, i], expected_values[layer][:prefix_length])
+            assert torch.equal(logprobs[i], -torch.tensor(tokens[1 : prefix_length + 1], dtype=torch.float32))
+        assert cache.num_tokens == 6
+        assert cache.stats()['token_hit_rate'] == pytest.approx(3 / 5)
+
+    @pytest.mark.unit
+    def test_miss(self):
+        cache = KVPrefixCache(max_tokens=100, min_prefix_length=2)
+        _insert(cache, [1, 2, 3])
+        assert cache.lookup([[1, 2, 5]], max_length=2)[0] == 0
+        assert cache.lookup([[4, 2, 3]], max_length=2)[0] == 0
+        assert cache.lookup([[1, 2, 3, 4]], max_length=3)[0] == 2
+        assert cache.stats()['hit_rate'] == pytest.approx(1 / 3)
+
+    @pytest.mark.unit
+    def test_lru_eviction(self):
+        cache = KVPrefixCache(max_tokens=8)
+        _insert(cache, [1, 2, 3, 4])
+        _insert(cache, [5, 6, 7, 8])
+        cache.lookup([[1, 2, 3, 4]], max_length=3)
+        _insert(cache, [9, 10, 11])
+
+        assert cache.num_tokens == 7
+        assert cache.lookup([[5, 6, 7, 8]], max_length=3)[0] == 0
+        assert cache.lookup([[1, 2, 3, 4, 5]], max_length=4)[0] == 3
+        # float32 keys and values of every layer and the token log probs
+        assert cache.memory_bytes == 7 * (2 * NUM_LAYERS + 1) * 4
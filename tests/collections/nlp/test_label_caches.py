@@ -0,0 +1,124 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import pytest
+import torch
+import torch.nn.functional as F
+
+from nemo.collections.nlp.data.zero_shot_intent_recognition.zero_shot_intent_dataset import (
+    ZeroShotIntentInferenceDataset,
+)
+from nemo.collections.nlp.models.dialogue.dialogue_nearest_neighbour_model import DialogueNearestNeighbourModel
+from nemo.collections.nlp.models.zero_shot_intent_recognition.zero_shot_intent_model import ZeroShotIntentModel
+
+
+class WordTokenizer:
+    eos_token, pad_token, cls_token = '[SEP]', '[PAD]', '[CLS]'
+
+    def __init__(self, name='bert'):
+        self.name = name
+        self.vocab = {self.pad_token: 0, self.cls_token: 1, self.eos_token: 2}
+
+    def text_to_tokens(self, text):
+        return text.split()
+
+    def tokens_to_ids(self, tokens):
+        return [self.vocab.setdefault(token, len(self.vocab)) for token in tokens]
+
+
+def _zero_shot_model(tokenizer, max_seq_length):
+    return SimpleNamespace(
+        tokenizer=tokenizer,
+        _cfg=SimpleNamespace(dataset=SimpleNamespace(max_seq_length=max_seq_length)),
+        _hypothesis_ids_cache=OrderedDict(),
+        HYPOTHESIS_CACHE_SIZE=2,
+    )
+
+
+class TestLabelCaches:
+    @pytest.mark.unit
+    @pytest.mark.parametrize("name", ["bert", "roberta"])
+    def test_zero_shot_pair_features_match_dataset(self, name):
+        tokenizer = WordTokenizer(name)
+        model = _zero_shot_model(tokenizer, max_seq_length=12)
+        queries = ["turn off the lights", "i would like a veggie burger fries and a coke please"]
+        labels = ["lighting", "food order with a very long label name"]
+        dataset = ZeroShotIntentInferenceDataset(queries, labels, tokenizer, 12, 'This example is {}.')
+
+        features = iter(dataset.features)
+        for query in queries:
+            for label in labels:
+                expected = next(features)
+                length = sum(expected.input_mask)
+                input_ids, segment_ids = ZeroShotIntentModel._build_pair_features(
+                    model,
+                    tokenizer.tokens_to_ids(tokenizer.text_to_tokens(query)),
+                    ZeroShotIntentModel._get_hypothesis_ids(model, 'This example is {}.'.format(label)),
+                )
+                assert input_ids == expected.input_ids[:length]
+                assert segment_ids == expected.segment_ids[:length]
+
+    @pytest.mark.unit
+    def test_zero_shot_hypothesis_cache(self):
+        model = _zero_shot_model(WordTokenizer(), max_seq_length=12)
+        for hypothesis in ['a b', 'c', 'a b', 'd']:
+            ZeroShotIntentModel._get_hypothesis_ids(model, hypothesis)
+        assert list(model._hypothesis_ids_cache) == ['a b', 'd']
+
+    @pytest.mark.unit
+    def test_nearest_neighbour_label_embeddings_cache(self):
+        calls = []
+
+        def encode(input_ids, attention_mask):
+            calls.append(input_ids)
+            return F.normalize(input_ids.float() * attention_mask, p=2, dim=1)
+
+        model = SimpleNamespace(_encode=encode, _label_embeddings=None, _label_embeddings_key=None)
+        label_ids = torch.tensor([[1, 2, 3], [4, 5, 0]])
+        label_mask = torch.tensor([[1, 1, 1], [1, 1, 0]])
+        get_label_embeddings = DialogueNearestNeighbourModel.get_label_embeddings
+        embeddings = get_label_embeddings(model, label_ids, label_mask)
+        assert torch.equal(get_label_embeddings(model, label_ids, label_mask), embeddings)
+        assert len(calls) == 1
+
+        # changed labels invalidate the cache
+        get_label_embeddings(model, label_ids + 1, label_mask)
+        assert len(calls) == 2
+
+    @pytest.mark.unit
+    def test_nearest_neighbour_label_embeddings_state_dict(self):
+        def nearest_neighbour_model():
+            model = DialogueNearestNeighbourModel.__new__(DialogueNearestNeighbourModel)
+            torch.nn.Module.__init__(model)
+            model.language_model = torch.nn.Linear(4, 4)
+            model._label_embeddings, model._label_embeddings_key = None, None
+            return model
+
+        model = nearest_neighbour_model()
+        model._label_embeddings, model._label_embeddings_key = torch.randn(3, 4), bytes(range(16))
+        state_dict = model.state_dict()
+
+        restored = nearest_neighbour_model()
+        restored.load_state_dict(state_dict)
+        assert torch.equal(restored._label_embeddings, model._label_embeddings)
+        assert restored._label_embeddings_key == model._label_embeddings_key
+        assert torch.equal(restored.language_model.weight, model.language_model.weight)
+
+        # weights without cached label embeddings drop the embeddings of the previous weights
+        del state_dict['label_embeddings'], state_dict['label_embeddings_key']
+        restored.load_state_dict(state_dict)
+        assert restored._label_embeddings is None and restored._label_embeddings_key is None
@@ -0,0 +1,123 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+from nemo.collections.nlp.data.language_modeling.megatron.dataset_utils import (
+    create_extreme_masked_lm_predictions,
+    create_masked_lm_predictions,
+    get_word_start_bitmap,
+)
+from nemo.collections.nlp.data.language_modeling.megatron.length_distribution_type import LengthDistribution
+
+CLS_ID, SEP_ID, MASK_ID = 0, 1, 2
+VOCAB = {0: '[CLS]', 1: '[SEP]', 2: '[MASK]', 3: 'the', 4: 'cat', 5: '##s', 6: 'sat', 7: '##ting', 8: 'on'}
+
+
+def _tokens(num_words=40):
+    words = [[3], [4, 5], [6, 7], [8]]
+    tokens = [CLS_ID]
+    for i in range(num_words):
+        tokens.extend(words[i % len(words)])
+    return tokens + [SEP_ID]
+
+
+class TestMasking:
+    @pytest.mark.unit
+    def test_word_start_bitmap(self):
+        bitmap = get_word_start_bitmap(VOCAB)
+        assert bitmap.tolist() == [True, True, True, True, True, False, True, False, True]
+        assert get_word_start_bitmap(VOCAB) is bitmap
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("masking_style", ["bert", "t5"])
+    def test_whole_word_masking(self, masking_style):
+        tokens = _tokens()
+        for seed in range(20):
+            output_tokens, positions, labels, token_boundary, spans = create_masked_lm_predictions(
+                tokens,
+                list(VOCAB.keys()),
+                VOCAB,
+                masked_lm_prob=0.15,
+                cls_id=CLS_ID,
+                sep_id=SEP_ID,
+                mask_id=MASK_ID,
+                max_predictions_per_seq=20,
+                np_rng=np.random.RandomState(seed),
+                masking_style=masking_style,
+            )
+            assert len(output_tokens) == len(tokens)
+            assert 0 < len(positions) <= 15
+            assert positions == sorted(positions)
+            assert labels == [tokens[i] for i in positions]
+            assert token_boundary == [int(not VOCAB[t].startswith('##')) for t in tokens]
+            # special tokens are never masked and words are masked whole
+            masked = set(positions)
+            assert 0 not in masked and len(tokens) - 1 not in masked
+            for i in masked:
+                if tokens[i] in [5, 7]:
+                    assert i - 1 in masked
+                if i + 1 < len(tokens) and tokens[i + 1] in [5, 7]:
+                    assert i + 1 in masked
+            assert sorted(i for span in spans for i in span.index) == positions
+            if masking_style == "t5":
+                assert all(output_tokens[i] == MASK_ID for i in positions)
+
+    @pytest.mark.unit
+    def test_masked_fraction(self):
+        tokens = _tokens(200)
+        num_masked = []
+        for seed in range(50):
+            _, positions, _, _, _ = create_masked_lm_predictions(
+                tokens,
+                list(VOCAB.keys()),
+                VOCAB,
+                masked_lm_prob=0.15,
+                cls_id=CLS_ID,
+                sep_id=SEP_ID,
+                mask_id=MASK_ID,
+                max_predictions_per_seq=1000,
+                np_rng=np.random.RandomState(seed),
+                masking_style="t5",
+            )
+            num_masked.append(len(positions))
+        target = round(len(tokens) * 0.15)
+        assert max(num_masked) <= target
+        assert np.mean(num_masked) > 0.9 * target
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize(
+        "distribution",
+        [LengthDistribution.uniform, LengthDistribution.geometric, LengthDistribution.truncated_normal],
+    )
+    def test_extreme_masking(self, distribution):
+        tokens = list(range(3, 203))
+        output_tokens, positions, labels, spans = create_extreme_masked_lm_predictions(
+            tokens,
+            masked_lm_prob=0.5,
+            mask_id=MASK_ID,
+            max_predictions_per_seq=100,
+            np_rng=np.random.RandomState(0),
+            max_ngram_size=20,
+            min_ngram_size=5,
+            mean_ngram_size=10,
+            span_length_distribution=distribution,
+        )
+        assert 0 < len(positions) <= 100
+        assert labels == [tokens[i] for i in positions]
+        assert all(output_tokens[i] == MASK_ID for i in positions)
+        for span in spans:
+            assert span.index == list(range(span.index[0], span.index[-1] + 1))
+            assert len(span.index) <= 20
@@ -110,6 +110,41 @@ class TestMTEncDecModel:
         eval_loss = model.eval_loss_fn(log_probs=log_probs, labels=tgt_ids)
         assert torch.allclose(train_loss, eval_loss)
 
+    @pytest.mark.unit
+    def test_pack_inference_batches(self):
+        lengths = [3, 10, 4, 10, 2, 6]
+        batches = MTEncDecModel.pack_inference_batches(lengths, max_tokens=24, beam_size=2)
+        # longest first, ties in the input order, padded tokens times beam size within the budget
+        assert batches == [[1], [3], [5, 2], [0, 4]]
+        assert MTEncDecModel.pack_inference_batches(lengths, max_tokens=10) == [[1], [3], [5], [2, 0], [4]]
+
+    @pytest.mark.unit
+    def test_translate_max_tokens(self):
+        model = MTEncDecModel(cfg=get_cfg())
+
+        def batch_translate(src, src_mask, return_beam_scores=False, cache={}):
+            # a translation of every sentence is its number of tokens
+            translations = [str(int(mask.sum())) for mask in src_mask]
+            if return_beam_scores:
+                all_translations = [t for t in translations for _ in range(2)]
+                return None, all_translations, [float(t) for t in all_translations], translations
+            return None, translations
+
+        model.batch_translate = batch_translate
+        text = ['a b c d e', 'a', 'a b c', 'a b c d e f g', 'a b']
+        expected = model.translate(text)
+        assert model.translate(text, max_tokens=16) == expected
+        all_translations, scores, best_translations = model.translate(text, return_beam_scores=True, max_tokens=16)
+        assert best_translations == expected
+        assert all_translations == [t for t in expected for _ in range(2)]
+        assert scores == [float(t) for t in all_translations]
+
+        streamed = [None] * len(text)
+        for indices, translations in model.translate_stream(text, max_tokens=16):
+            for idx, translation in zip(indices, translations):
+                streamed[idx] = translation
+        assert streamed == expected
+
     @pytest.mark.skipif(not os.path.exists('/home/TestData/nlp'), reason='Not a Jenkins machine')
     @pytest.mark.run_only_on('GPU')
     @pytest.mark.unit
@@ -0,0 +1,123 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import pickle
+import tarfile
+
+import numpy as np
+import pytest
+
+from nemo.collections.nlp.data.machine_translation.parallel_tarred_dataset_builder import build_parallel_tarred_dataset
+from nemo.collections.nlp.data.machine_translation.translation_batch_format import decode_translation_batch
+
+
+class CharTokenizer:
+    pad_id = 0
+    bos_id = 1
+    eos_id = 2
+    vocab_size = 260
+
+    def text_to_ids(self, text):
+        return [ord(char) + 3 for char in text]
+
+
+def get_tokenizers():
+    return CharTokenizer(), CharTokenizer()
+
+
+def _write_corpus(tmpdir, num_lines=200):
+    rng = np.random.RandomState(0)
+    src_fname, tgt_fname = os.path.join(tmpdir, 'train.src'), os.path.join(tmpdir, 'train.tgt')
+    with open(src_fname, 'w') as src_f, open(tgt_fname, 'w') as tgt_f:
+        for i in range(num_lines):
+            src_f.write(f'{i} ' + 'a' * rng.randint(1, 30) + '\n')
+            tgt_f.write(f'{i} ' + 'b' * rng.randint(1, 30) + '\n')
+    return src_fname, tgt_fname
+
+
+def _build(tmpdir, out_dir, lines_per_dataset_fragment, binary_batches=False, tokens_in_batch=128):
+    src_fname, tgt_fname = _write_corpus(tmpdir)
+    return build_parallel_tarred_dataset(
+        src_fname=src_fname,
+        tgt_fname=tgt_fname,
+        out_dir=os.path.join(tmpdir, out_dir),
+        get_tokenizers=get_tokenizers,
+        tokens_in_batch=tokens_in_batch,
+        num_batches_per_tarfile=4,
+        lines_per_dataset_fragment=lines_per_dataset_fragment,
+        n_jobs=1,
+        seed=1,
+        binary_batches=binary_batches,
+    )
+
+
+class TestParallelTarredDatasetBuilder:
+    @pytest.mark.unit
+    def test_deterministic_batches(self, tmpdir):
+        tar_files, metadata_path = _build(str(tmpdir), 'a', lines_per_dataset_fragment=1000)
+        other_tar_files, _ = _build(str(tmpdir), 'b', lines_per_dataset_fragment=7)
+        assert len(tar_files) == len(other_tar_files) > 1
+        for tar_file, other_tar_file in zip(tar_files, other_tar_files):
+            with open(tar_file, 'rb') as f, open(other_tar_file, 'rb') as other_f:
+                assert f.read() == other_f.read()
+        assert not os.path.exists(os.path.join(str(tmpdir), 'a', 'preproc_work_dir'))
+
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+        assert metadata['tar_files'] == tar_files
+        assert metadata['num_batches'] == 4 * len(tar_files)
+
+        sentences = []
+        for tar_file in tar_files:
+            with tarfile.open(tar_file) as tar:
+                for member in tar.getmembers():
+                    batch = pickle.load(tar.extractfile(member))
+                    assert batch['src'].dtype == np.int16 and batch['tgt'].dtype == np.int16
+                    # batches of up to 8 sentence pairs keep the pair that overflows them
+                    assert batch['src'].size + batch['tgt'].size <= 128 or len(batch['src']) <= 8
+                    assert np.all(batch['src'][:, 0] == CharTokenizer.bos_id)
+                    sentences.extend(''.join(chr(i - 3) for i in src if i > 2) for src in batch['src'].tolist())
+        # every kept sentence pair is written once
+        line_numbers = [int(sentence.split()[0]) for sentence in sentences]
+        assert len(set(line_numbers)) == len(line_numbers)
+
+    @pytest.mark.unit
+    def test_binary_batches(self, tmpdir):
+        tar_files, _ = _build(str(tmpdir), 'pickle', lines_per_dataset_fragment=50)
+        binary_tar_files, _ = _build(str(tmpdir), 'binary', lines_per_dataset_fragment=50, binary_batches=True)
+        for tar_file, binary_tar_file in zip(tar_files, binary_tar_files):
+            with tarfile.open(tar_file) as tar, tarfile.open(binary_tar_file) as binary_tar:
+                for member, binary_member in zip(tar.getmembers(), binary_tar.getmembers()):
+                    assert binary_member.name == member.name.replace('.pkl', '.bin')
+                    batch = pickle.load(tar.extractfile(member))
+                    src, tgt = decode_translation_batch(
+                        binary_tar.extractfile(binary_member).read(), CharTokenizer.pad_id, CharTokenizer.pad_id
+                    )
+                    assert np.array_equal(src, batch['src']) and np.array_equal(tgt, batch['tgt'])
+
+    @pytest.mark.unit
+    def test_batch_sizes_are_multiples_of_8(self, tmpdir):
+        tar_files, _ = _build(str(tmpdir), 'large', lines_per_dataset_fragment=50, tokens_in_batch=1024)
+        batch_sizes = []
+        for tar_file in tar_files:
+            with tarfile.open(tar_file) as tar:
+                for member in tar.getmembers():
+                    batch = pickle.load(tar.extractfile(member))
+                    assert batch['src'].size + batch['tgt'].size <= 1024
+                    batch_sizes.append(len(batch['src']))
+        assert max(batch_sizes) > 8
+        # only the last batch of the corpus is not cut to a multiple of 8 sentence pairs
+        assert sum(batch_size % 8 != 0 for batch_size in batch_sizes) <= 1
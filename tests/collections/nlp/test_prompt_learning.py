@@ -19,6 +19,7 @@ import pytest
 import torch
 
 from nemo.collections.nlp.data.language_modeling.megatron.gpt_prompt_learning_dataset import GPTPromptLearningDataset
+from nemo.collections.nlp.data.language_modeling.megatron.packed_dataset import PackedSequenceDataset
 from nemo.collections.nlp.models.language_modeling.megatron_gpt_prompt_learning_model import get_pseudo_tokens
 from nemo.collections.nlp.modules.common import VirtualPromptSource
 from nemo.collections.nlp.modules.common.tokenizer_utils import get_nmt_tokenizer
@@ -171,10 +172,59 @@ class TestMegatronGPTPromptLearningDataset:
 
         os.remove(dataset_path)
 
+    @pytest.mark.run_only_on('GPU')
+    @pytest.mark.unit
+    def test_prompt_learning_dataset_packed_collate_fn(self):
+        tokenizer = get_nmt_tokenizer(library='megatron', model_name='GPT2BPETokenizer')
+        task_templates = get_task_templates()
+        dataset_path = create_temp_dataset()
+
+        # Setup virtual token place holders
+        total_virtual_tokens = 10
+        pseudo_tokens = get_pseudo_tokens(total_virtual_tokens)
+        tokenizer.add_special_tokens({'additional_special_tokens': pseudo_tokens})
+
+        dataset = get_prompt_tuning_dataset(
+            dataset_path, tokenizer, VirtualPromptSource.PROMPT_TABLE, task_templates, pseudo_tokens,
+        )
+        packed_dataset = PackedSequenceDataset(
+            dataset,
+            max_seq_length=64,
+            length_fn=dataset.packed_length,
+            group_fn=dataset.packing_group,
+            shuffle_buffer_size=16,
+        )
+
+        assert len(packed_dataset) < len(dataset)
+        assert sum(len(packed_dataset[i]) for i in range(len(packed_dataset))) == len(dataset)
+        assert 0.0 < packed_dataset.packing_efficiency() <= 1.0
+
+        batch = [packed_dataset[i] for i in range(4)]
+        batch = packed_dataset.collate_fn(batch, return_cu_seqlens=True)
+
+        assert len(batch) == 7
+
+        input_ids, labels, loss_mask, position_ids, attention_mask, taskname_ids, cu_seqlens = batch
+
+        assert input_ids.shape == labels.shape == loss_mask.shape == position_ids.shape
+        assert attention_mask.shape == (4, 1, input_ids.shape[1], input_ids.shape[1])
+        assert cu_seqlens[-1] == input_ids.numel()
+
+        # Position ids restart and attention is blocked at the start of every packed example
+        examples = packed_dataset[0]
+        second_start = len(examples[0][1]) - 1
+        if len(examples) > 1:
+            assert position_ids[0, second_start] == 0
+            assert attention_mask[0, 0, second_start, second_start - 1]
+            assert not attention_mask[0, 0, second_start, second_start]
+
+        os.remove(dataset_path)
+
 
 if __name__ == "__main__":
     t = TestMegatronGPTPromptLearningDataset()
     t.test_init_prompt_learning_dataset()
     t.test_prompt_learning_dataset_collate_fn_prompt_table()
     t.test_prompt_learning_dataset_collate_fn_prompt_encoder()
+    t.test_prompt_learning_dataset_packed_collate_fn()
     print('-' * 50 + '\nALL PROMPT TUNING UNIT TESTS PASS!\n' + '-' * 50)
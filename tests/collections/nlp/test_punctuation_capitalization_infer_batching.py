@@ -0,0 +1,117 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+import torch
+
+from nemo.collections.nlp.data.token_classification.punctuation_capitalization_infer_batching import (
+    WordLogProbAccumulator,
+    collate_segments,
+    get_infer_segments,
+    pack_segments,
+)
+from nemo.collections.nlp.data.token_classification.punctuation_capitalization_infer_dataset import (
+    BertPunctuationCapitalizationInferDataset,
+)
+from nemo.collections.nlp.models import PunctuationCapitalizationModel
+
+NUM_LABELS = 4
+QUERIES = [
+    'hello world',
+    'the quick brown fox jumps over the lazy dog again and again',
+    'a',
+    'punctuation and capitalization of very long queries is split into overlapping segments',
+]
+
+
+class CharTokenizer:
+    cls_token, sep_token = '[CLS]', '[SEP]'
+    cls_id, sep_id = 1, 2
+
+    def text_to_tokens(self, text):
+        # the first token of a word is the word's first character, the others are pairs of characters
+        return [text[0]] + [text[i : i + 2] for i in range(1, len(text), 2)]
+
+    def tokens_to_ids(self, tokens):
+        special_tokens = {self.cls_token: self.cls_id, self.sep_token: self.sep_id}
+        return [special_tokens.get(token, sum(ord(char) for char in token) % 97 + 3) for token in tokens]
+
+
+def _logits(input_ids):
+    """ Logits depend on tokens and their positions, so a segment gets the same logits in any batch """
+    rng = np.random.RandomState(0)
+    token_logits, position_logits = rng.randn(100, NUM_LABELS), rng.randn(128, NUM_LABELS)
+    return (token_logits[input_ids] + position_logits[: input_ids.shape[1]]).astype(np.float32)
+
+
+def _reference_predictions(max_seq_length, step, margin):
+    """ Predictions computed as in PunctuationCapitalizationModel.add_punctuation_capitalization """
+    dataset = BertPunctuationCapitalizationInferDataset(QUERIES, CharTokenizer(), max_seq_length, step, margin)
+    batch = dataset.collate_fn([dataset[i] for i in range(len(dataset))])
+    input_ids, _, _, subtokens_mask, start_word_ids, query_ids, is_first, is_last = batch
+    logits = torch.from_numpy(_logits(input_ids.numpy()))
+    transform = PunctuationCapitalizationModel._transform_logit_to_prob_and_remove_margins_and_extract_word_probs
+    probs, _, start_word_ids = transform(
+        PunctuationCapitalizationModel, logits, logits, subtokens_mask, start_word_ids, margin, is_first, is_last
+    )
+    preds, acc_probs = [[] for _ in QUERIES], [None for _ in QUERIES]
+    for q_i, start_word_id, probs_i in zip(query_ids, start_word_ids, probs):
+        if acc_probs[q_i] is None:
+            acc_probs[q_i] = probs_i
+        else:
+            preds[q_i], acc_probs[q_i] = PunctuationCapitalizationModel._move_acc_probs_to_token_preds(
+                preds[q_i], acc_probs[q_i], start_word_id - len(preds[q_i])
+            )
+            acc_probs[q_i] = PunctuationCapitalizationModel._update_accumulated_probabilities(acc_probs[q_i], probs_i)
+    return [
+        PunctuationCapitalizationModel._move_acc_probs_to_token_preds(pred, prob, len(prob))[0]
+        for pred, prob in zip(preds, acc_probs)
+    ]
+
+
+class TestPunctuationCapitalizationInferBatching:
+    @pytest.mark.unit
+    @pytest.mark.parametrize("max_seq_length,step,margin", [(10, 2, 1), (12, 8, 2), (128, 8, 16)])
+    def test_segments(self, max_seq_length, step, margin):
+        dataset = BertPunctuationCapitalizationInferDataset(QUERIES, CharTokenizer(), max_seq_length, step, margin)
+        segments = get_infer_segments(QUERIES, CharTokenizer(), max_seq_length, step, margin)
+        assert len(segments) == len(dataset)
+        for i in range(len(dataset)):
+            input_ids, _, _, subtokens_mask, preceding_words, query_id, is_first, is_last = dataset[i]
+            assert segments.input_ids[i].tolist() == input_ids.tolist()
+            assert segments.word_masks[i].tolist() == subtokens_mask.tolist()
+            assert segments.query_ids[i] == query_id
+            assert segments.first_word_ids[i] == segments.query_word_offsets[query_id] + preceding_words
+            assert segments.is_first[i] == is_first and segments.is_last[i] == is_last
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("max_seq_length,step,margin", [(10, 2, 1), (12, 8, 2), (128, 8, 16)])
+    def test_merge_overlapping_segments(self, max_seq_length, step, margin):
+        segments = get_infer_segments(QUERIES, CharTokenizer(), max_seq_length, step, margin)
+        accumulator = WordLogProbAccumulator(segments, NUM_LABELS, margin)
+        batches = pack_segments([len(input_ids) for input_ids in segments.input_ids], max_tokens=40)
+        assert sorted(i for batch in batches for i in batch) == list(range(len(segments)))
+        for batch in batches:
+            input_ids, attention_mask, word_mask = collate_segments(segments, batch)
+            assert input_ids.size <= 40 or len(batch) == 1
+            accumulator.update(batch, _logits(input_ids), word_mask, attention_mask)
+
+        predictions = accumulator.get_query_predictions()
+        assert [len(query_predictions) for query_predictions in predictions] == [len(q.split()) for q in QUERIES]
+        assert predictions == _reference_predictions(max_seq_length, step, margin)
+
+    @pytest.mark.unit
+    def test_pack_segments(self):
+        assert pack_segments([3, 8, 5, 8, 2], max_tokens=16) == [[1, 3], [2, 0, 4]]
@@ -0,0 +1,131 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from nemo.collections.nlp.data.token_classification.punctuation_capitalization_dataset import (
+    BertPunctuationCapitalizationDataset,
+)
+from nemo.collections.nlp.data.token_classification.punctuation_capitalization_mmap_features import (
+    PunctuationCapitalizationMMapFeatures,
+)
+
+
+class CharTokenizer:
+    name = 'char'
+    vocab_size = 260
+    pad_id, cls_id, sep_id, unk_id = 0, 1, 2, 3
+
+    def text_to_ids(self, text):
+        return [ord(char) % 256 + 4 for char in text[::2]]
+
+
+def _write_dataset(tmpdir, num_lines=100):
+    rng = np.random.RandomState(0)
+    text_file, labels_file = os.path.join(tmpdir, 'text.txt'), os.path.join(tmpdir, 'labels.txt')
+    with open(text_file, 'w') as text_f, open(labels_file, 'w') as labels_f:
+        for _ in range(num_lines):
+            num_words = rng.randint(1, 20)
+            words = [''.join(rng.choice(list('abcdef'), size=rng.randint(1, 10))) for _ in range(num_words)]
+            labels = [rng.choice(['O', ',', '.']) + rng.choice(['O', 'U']) for _ in range(num_words)]
+            text_f.write(' '.join(words) + '\n')
+            labels_f.write(' '.join(labels) + '\n')
+    return text_file, labels_file
+
+
+def _create_dataset(tmpdir, use_mmap_features):
+    os.makedirs(tmpdir, exist_ok=True)
+    text_file, labels_file = _write_dataset(tmpdir)
+    return BertPunctuationCapitalizationDataset(
+        text_file,
+        labels_file,
+        max_seq_length=32,
+        tokenizer=CharTokenizer(),
+        tokens_in_batch=128,
+        punct_label_ids={'O': 0, ',': 1, '.': 2},
+        capit_label_ids={'O': 0, 'U': 1},
+        verbose=False,
+        use_mmap_features=use_mmap_features,
+    )
+
+
+def _queries_from_batches(batches):
+    queries = []
+    for batch in batches:
+        for row in range(batch['input_ids'].shape[0]):
+            length = np.count_nonzero(batch['input_ids'][row])
+            queries.append(
+                tuple(
+                    tuple(batch[key][row, :length].tolist())
+                    for key in ['input_ids', 'subtokens_mask', 'punct_labels', 'capit_labels']
+                )
+            )
+    return sorted(queries)
+
+
+class TestPunctuationCapitalizationMMapFeatures:
+    @pytest.mark.unit
+    def test_save_and_load(self, tmpdir):
+        rng = np.random.RandomState(0)
+        input_ids = [rng.randint(0, 30000, size=length).astype(np.int32) for length in [5, 3, 5, 1, 3, 5]]
+        subtokens_mask = [rng.rand(len(inp)) > 0.5 for inp in input_ids]
+        punct_labels = [rng.randint(0, 3, size=len(inp)).astype(np.int32) for inp in input_ids]
+        capit_labels = [rng.randint(0, 2, size=len(inp)).astype(np.int32) for inp in input_ids]
+        prefix = os.path.join(str(tmpdir), 'features')
+        PunctuationCapitalizationMMapFeatures.save(
+            prefix, input_ids, subtokens_mask, punct_labels, capit_labels, {'O': 0, ',': 1, '.': 2}, {'O': 0, 'U': 1}
+        )
+        assert os.path.isfile(prefix + '.bin') and os.path.isfile(prefix + '.idx')
+
+        # features are opened lazily and memory maps are not pickled
+        features = pickle.loads(pickle.dumps(PunctuationCapitalizationMMapFeatures(prefix)))
+        assert len(features) == 6
+        assert features.punct_label_ids == {'O': 0, ',': 1, '.': 2} and features.capit_label_ids == {'O': 0, 'U': 1}
+        assert features.lengths.tolist() == [5, 3, 5, 1, 3, 5]
+        for i in range(len(features)):
+            for expected, loaded in zip(
+                [input_ids[i], subtokens_mask[i], punct_labels[i], capit_labels[i]], features.get_query(i)
+            ):
+                assert np.array_equal(expected, loaded)
+
+        order = features.get_length_sorted_order(np.random.RandomState(1))
+        assert sorted(order.tolist()) == list(range(6))
+        assert np.all(np.diff(features.lengths[order]) >= 0)
+
+    @pytest.mark.unit
+    def test_dataset_batches_match_pickled_features(self, tmpdir):
+        pkl_dataset = _create_dataset(os.path.join(str(tmpdir), 'pkl'), use_mmap_features=False)
+        mmap_dataset = _create_dataset(os.path.join(str(tmpdir), 'mmap'), use_mmap_features=True)
+        assert all(path.is_file() for path in mmap_dataset.features_files)
+        assert not mmap_dataset.features_pkl.exists()
+        assert mmap_dataset.punct_label_ids == pkl_dataset.punct_label_ids
+
+        batches = [mmap_dataset[i] for i in range(len(mmap_dataset))]
+        for batch in batches:
+            assert batch['input_ids'].size <= 128 and batch['input_ids'].shape[1] % 8 == 0
+            assert set(batch) == set(pkl_dataset[0])
+            assert batch['punct_labels'].dtype == np.int64
+        expected_queries = _queries_from_batches([pkl_dataset[i] for i in range(len(pkl_dataset))])
+        assert _queries_from_batches(batches) == expected_queries
+
+        mmap_dataset.repack_batches_with_shuffle()
+        assert _queries_from_batches([mmap_dataset[i] for i in range(len(mmap_dataset))]) == expected_queries
+
+        # features are restored from cache
+        restored_dataset = _create_dataset(os.path.join(str(tmpdir), 'mmap'), use_mmap_features=True)
+        assert _queries_from_batches([restored_dataset[i] for i in range(len(restored_dataset))]) == expected_queries
@@ -13,13 +13,17 @@
 # limitations under the License.
 
 import collections
+from types import SimpleNamespace
 
+import numpy as np
 import pytest
 import torch
 
+from nemo.collections.nlp.data.question_answering.dataset.qa_bert_dataset import BERTQAContextCache, BERTQADataset
 from nemo.collections.nlp.data.question_answering.dataset.qa_dataset import QADataset
 from nemo.collections.nlp.data.question_answering.dataset.qa_gpt_dataset import GPTQADataset
 from nemo.collections.nlp.metrics.qa_metrics import QAMetrics
+from nemo.collections.nlp.models.question_answering.qa_bert_model import BERTQAModel
 
 
 @pytest.mark.unit
@@ -238,3 +242,98 @@ def test_gpt_no_pad_loss_masking():
     labels = GPTQADataset.update_labels_for_no_pad_loss(input_ids, training_mask_end, input_attn_mask)
 
     assert torch.all(labels.eq(expected_labels))
+
+
+@pytest.mark.unit
+def test_bert_context_cache():
+    class WordTokenizer:
+        def __init__(self):
+            self.num_calls = 0
+
+        def text_to_tokens(self, text):
+            self.num_calls += 1
+            return [text[:2], text[2:]] if len(text) > 2 else [text]
+
+        def tokens_to_ids(self, tokens):
+            return [len(token) for token in tokens]
+
+    dataset = BERTQADataset.__new__(BERTQADataset)
+    dataset.tokenizer = WordTokenizer()
+    dataset.context_cache = BERTQAContextCache(max_num_contexts=1)
+
+    context = dataset._get_context('hello big world', {})
+    assert context.all_doc_tokens == ['he', 'llo', 'bi', 'g', 'wo', 'rld']
+    assert context.tok_to_orig_index == [0, 0, 1, 1, 2, 2]
+    assert context.orig_to_tok_index == [0, 2, 4]
+    assert dataset._get_context('hello big world', {}) is context
+    assert dataset.tokenizer.num_calls == 3
+
+    doc_spans = tuple(QADataset.get_docspans(context.all_doc_tokens, 4, 2))
+    doc_span_features = dataset._get_doc_span_features(context, doc_spans)
+    assert [feature.tokens for feature in doc_span_features] == [['he', 'llo', 'bi', 'g'], ['bi', 'g', 'wo', 'rld']]
+    assert doc_span_features[1].input_ids == [2, 1, 2, 3]
+    assert doc_span_features[1].orig_indices == [1, 1, 2, 2]
+    assert doc_span_features[0].is_max_context == [True, True, True, False]
+    assert dataset._get_doc_span_features(context, doc_spans) is doc_span_features
+
+    # the least recently used context is evicted
+    dataset._get_context('another context', {})
+    assert len(dataset.context_cache) == 1
+    assert dataset._get_context('hello big world', {}) is not context
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("version_2_with_negative", [False, True])
+def test_bert_batched_span_search(version_2_with_negative):
+    rng = np.random.RandomState(0)
+    seq_length, num_examples = 16, 5
+    words = [f'w{i}' for i in range(12)]
+    context_text = ' '.join(words)
+    examples, features = [], []
+    for example_index in range(num_examples):
+        examples.append(
+            SimpleNamespace(
+                context_id=0,
+                start_position_character=None,
+                is_impossible=False,
+                answer_text='',
+                question_text=f'q{example_index}',
+                qas_id=f'id{example_index}',
+            )
+        )
+        for doc_start in [0, 6]:
+            # question takes first 4 tokens of a feature
+            token_to_orig_map = {4 + i: doc_start + i for i in range(6)}
+            features.append(
+                SimpleNamespace(
+                    unique_id=len(features),
+                    example_index=example_index,
+                    tokens=['[CLS]'] * 4 + words[doc_start : doc_start + 6],
+                    token_to_orig_map=token_to_orig_map,
+                    token_is_max_context={i: bool(rng.rand() > 0.3) for i in token_to_orig_map},
+                )
+            )
+    unique_ids = [feature.unique_id for feature in features]
+    start_logits = rng.randn(len(features), seq_length).tolist()
+    end_logits = rng.randn(len(features), seq_length).tolist()
+    processor = SimpleNamespace(doc_id_to_context_text={0: context_text})
+
+    model = BERTQAModel.__new__(BERTQAModel)
+    predictions = [
+        model.get_predictions(
+            features,
+            examples,
+            processor,
+            unique_ids,
+            start_logits,
+            end_logits,
+            n_best_size=5,
+            max_answer_length=3,
+            do_lower_case=False,
+            version_2_with_negative=version_2_with_negative,
+            null_score_diff_threshold=0.0,
+            batched_span_search=batched_span_search,
+        )
+        for batched_span_search in [False, True]
+    ]
+    assert predictions[0] == predictions[1]
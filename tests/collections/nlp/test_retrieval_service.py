@@ -0,0 +1,90 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+try:
+    from nemo.collections.nlp.modules.common.megatron import retrieval_service
+    from nemo.collections.nlp.modules.common.megatron.retrieval_service import (
+        RetrievalClient,
+        array_to_bytes,
+        bytes_to_array,
+    )
+
+    HAVE_RETRIEVAL_DEPS = True
+except (ImportError, ModuleNotFoundError):
+    HAVE_RETRIEVAL_DEPS = False
+
+
+def _fake_knn(requests_log, generation=None):
+    generation = [0] if generation is None else generation
+
+    def request_knn_batch_with_generation(sentences, neighbors, port=None, session=None):
+        requests_log.append((list(sentences), neighbors))
+        # the neighbors of a sentence are its length followed by the neighbor rank and the index generation
+        knn = np.array([[[len(s), k, generation[0]] for k in range(neighbors)] for s in sentences], dtype=np.int64)
+        return knn, generation[0]
+
+    return request_knn_batch_with_generation
+
+
+@pytest.mark.skipif(not HAVE_RETRIEVAL_DEPS, reason="retrieval service dependencies are not installed")
+class TestRetrievalClient:
+    @pytest.mark.unit
+    def test_binary_payload(self):
+        sentences = np.array(['a query', 'another query'], dtype=np.str_)
+        assert bytes_to_array(array_to_bytes(sentences)).tolist() == sentences.tolist()
+
+    @pytest.mark.unit
+    def test_coalescing_and_cache(self, monkeypatch):
+        log = []
+        monkeypatch.setattr(retrieval_service, 'request_knn_batch_with_generation', _fake_knn(log))
+        client = RetrievalClient(port=0, cache_size=2, batch_window=0.5)
+
+        first = client.get_knn_async(['a', 'bb'], 2)
+        second = client.get_knn_async(['bb', 'ccc'], 3)
+        assert first.result().tolist() == [[[1, 0, 0], [1, 1, 0]], [[2, 0, 0], [2, 1, 0]]]
+        assert second.result().shape == (2, 3, 3)
+        # concurrent queries are sent as one request with the largest number of neighbors
+        assert log == [(['a', 'bb', 'ccc'], 3)]
+
+        # the two most recent queries are cached
+        assert client.get_knn(['ccc', 'bb'], 2).tolist() == [[[3, 0, 0], [3, 1, 0]], [[2, 0, 0], [2, 1, 0]]]
+        assert len(log) == 1
+        client.get_knn(['a'], 1)
+        assert log[-1] == (['a'], 1)
+
+        client.clear_cache()
+        client.get_knn(['bb'], 1)
+        assert log[-1] == (['bb'], 1)
+
+    @pytest.mark.unit
+    def test_cache_follows_index_generation(self, monkeypatch):
+        log, generation = [], [0]
+        monkeypatch.setattr(
+            retrieval_service, 'request_knn_batch_with_generation', _fake_knn(log, generation=generation)
+        )
+        client = RetrievalClient(port=0, cache_size=10, batch_window=0.0)
+        client.get_knn(['a', 'bb'], 1)
+        cached = client._cache['a']
+        # cached rows don't share memory with the response
+        assert cached.base is None
+
+        # another client updates the index, the next response drops the neighbors retrieved before
+        generation[0] = 1
+        assert client.get_knn(['ccc'], 1).tolist() == [[[3, 0, 1]]]
+        assert 'a' not in client._cache
+        assert client.get_knn(['a'], 1).tolist() == [[[1, 0, 1]]]
+        assert log[-1] == (['a'], 1)
@@ -0,0 +1,253 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+import pytest
+import torch
+from omegaconf import DictConfig
+from pytorch_lightning import Trainer
+
+from nemo.collections.nlp.models.language_modeling.megatron_gpt_model import MegatronGPTModel
+from nemo.collections.nlp.modules.common.megatron.paged_kv_cache import PagedKVCache
+from nemo.collections.nlp.modules.common.megatron.utils import get_ltor_masks_and_position_ids
+from nemo.collections.nlp.modules.common.text_generation_scheduler import (
+    ContinuousBatchingScheduler,
+    MegatronGPTPagedModelRunner,
+)
+from nemo.collections.nlp.parts.nlp_overrides import NLPDDPStrategy
+
+VOCAB_SIZE = 32
+
+
+class TinyAttention(torch.nn.Module):
+    def __init__(self, hidden_size, num_heads):
+        super().__init__()
+        self.num_heads = num_heads
+        self.head_size = hidden_size // num_heads
+        self.qkv = torch.nn.Linear(hidden_size, 3 * hidden_size)
+        self.dense = torch.nn.Linear(hidden_size, hidden_size)
+
+    def forward(self, hidden_states, kv_cache=None):
+        sq, b, _ = hidden_states.shape
+        query, key, value = self.qkv(hidden_states).view(sq, b, self.num_heads, -1).chunk(3, dim=-1)
+        if kv_cache is not None:
+            key, value, mask = kv_cache.update(self, key, value)
+        else:
+            mask = torch.ones(sq, sq, dtype=torch.bool).triu(1)[None, None]
+        scores = torch.einsum('qbnd,kbnd->bnqk', query, key) / self.head_size ** 0.5
+        probs = scores.masked_fill(mask, -float('inf')).softmax(dim=-1)
+        context = torch.einsum('bnqk,kbnd->qbnd', probs, value).reshape(sq, b, -1)
+        return self.dense(context)
+
+
+class TinyGPT(torch.nn.Module):
+    def __init__(self, hidden_size=16, num_heads=2, num_layers=2, max_position_embeddings=64):
+        super().__init__()
+        self.word_embeddings = torch.nn.Embedding(VOCAB_SIZE, hidden_size)
+        self.position_embeddings = torch.nn.Embedding(max_position_embeddings, hidden_size)
+        self.layers = torch.nn.ModuleList([TinyAttention(hidden_size, num_heads) for _ in range(num_layers)])
+        self.output_layer = torch.nn.Linear(hidden_size, VOCAB_SIZE)
+
+    def forward(self, tokens, positions, kv_cache=None):
+        hidden_states = (self.word_embeddings(tokens) + self.position_embeddings(positions)).transpose(0, 1)
+        for layer in self.layers:
+            hidden_states = hidden_states + layer(hidden_states, kv_cache)
+        return self.output_layer(hidden_states).transpose(0, 1)
+
+
+def _greedy_reference(model, prompt, tokens_to_generate):
+    tokens = list(prompt)
+    for _ in range(tokens_to_generate):
+        logits = model(torch.tensor([tokens]), torch.arange(len(tokens)).unsqueeze(0))
+        tokens.append(int(logits[0, -1].argmax()))
+    return tokens
+
+
+def _tiny_megatron_gpt_model(test_data_dir):
+    model_cfg = {
+        'precision': 32,
+        'micro_batch_size': 1,
+        'global_batch_size': 1,
+        'tensor_model_parallel_size': 1,
+        'pipeline_model_parallel_size': 1,
+        'resume_from_checkpoint': None,
+        'encoder_seq_length': 64,
+        'max_position_embeddings': 64,
+        'num_layers': 2,
+        'hidden_size': 32,
+        'ffn_hidden_size': 64,
+        'num_attention_heads': 2,
+        'init_method_std': 0.02,
+        'hidden_dropout': 0.0,
+        'attention_dropout': 0.0,
+        'kv_channels': None,
+        'apply_query_key_layer_scaling': True,
+        'layernorm_epsilon': 1e-5,
+        'make_vocab_size_divisible_by': 128,
+        'pre_process': True,
+        'post_process': True,
+        'persist_layer_norm': True,
+        'tokenizer': {
+            'library': 'megatron',
+            'type': 'GPT2BPETokenizer',
+            'model': None,
+            'vocab_file': os.path.join(test_data_dir, 'nlp/gpt_vocab_merges/vocab.json'),
+            'merge_file': os.path.join(test_data_dir, 'nlp/gpt_vocab_merges/merges.txt'),
+            'delimiter': None,
+        },
+        'native_amp_init_scale': 4294967296,
+        'native_amp_growth_interval': 1000,
+        'hysteresis': 2,
+        'fp32_residual_connection': False,
+        'fp16_lm_cross_entropy': False,
+        'megatron_amp_O2': False,
+        'seed': 1234,
+        'use_cpu_initialization': False,
+        'onnx_safe': False,
+        'apex_transformer_log_level': 30,
+        'activations_checkpoint_method': None,
+        'activations_checkpoint_num_layers': 1,
+        'data': {'data_prefix': '???', 'data_impl': 'mmap', 'splits_string': '900,50,50', 'seq_length': 64},
+        'optim': {'name': 'fused_adam', 'lr': 2e-4, 'weight_decay': 0.01},
+    }
+    trainer = Trainer(
+        strategy=NLPDDPStrategy(),
+        devices=1,
+        accelerator='gpu',
+        precision=32,
+        logger=False,
+        enable_checkpointing=False,
+        replace_sampler_ddp=False,
+    )
+    return MegatronGPTModel(cfg=DictConfig(model_cfg), trainer=trainer).cuda().eval()
+
+
+class TestContinuousBatchingScheduler:
+    @pytest.mark.unit
+    def test_paged_kv_cache_blocks(self):
+        kv_cache = PagedKVCache(num_blocks=4, block_size=4)
+        kv_cache.begin_step(['a', 'b'], 5)
+        kv_cache.end_step()
+        assert kv_cache.num_free_blocks == 0
+        assert not kv_cache.can_append('a', 4)
+
+        kv_cache.free('a')
+        assert kv_cache.num_free_blocks == 2
+        assert kv_cache.can_append('b', 11) and not kv_cache.can_append('b', 12)
+
+    @pytest.mark.unit
+    def test_matches_sequential_generation(self):
+        torch.manual_seed(0)
+        model = TinyGPT().double().eval()
+
+        def runner(kv_cache, tokens, positions):
+            return model(tokens, positions, kv_cache)[:, -1]
+
+        # the memory only fits some of the sequences, so running sequences get preempted and recomputed
+        kv_cache = PagedKVCache(num_blocks=10, block_size=4)
+        scheduler = ContinuousBatchingScheduler(runner, kv_cache, eos_id=-1, max_batch_size=3)
+
+        prompts = [[1, 2, 3, 4, 5], [6, 7, 8, 9, 10, 11, 12], [13, 14], [15, 16, 17, 18, 19, 20, 21, 22, 23]]
+        tokens_to_generate = [10, 3, 12, 8]
+        futures = [scheduler.submit(prompt, n, greedy=True) for prompt, n in zip(prompts, tokens_to_generate)]
+        scheduler.run_until_complete()
+
+        with torch.no_grad():
+            for future, prompt, n in zip(futures, prompts, tokens_to_generate):
+                result = future.result(timeout=0)
+                assert result['token_ids'] == _greedy_reference(model, prompt, n)
+                assert len(result['generated_token_ids']) == n
+        assert scheduler.num_preemptions > 0
+        assert kv_cache.num_free_blocks == kv_cache.num_blocks
+
+        metrics = scheduler.metrics()
+        assert metrics['queue_depth'] == 0 and metrics['running'] == 0
+        assert metrics['tokens_per_second'] > 0
+        assert metrics['mean_time_to_first_token'] >= 0
+
+    @pytest.mark.unit
+    def test_rejects_prompts_without_room_for_generation(self):
+        model = TinyGPT().double().eval()
+
+        def runner(kv_cache, tokens, positions):
+            return model(tokens, positions, kv_cache)[:, -1]
+
+        kv_cache = PagedKVCache(num_blocks=10, block_size=4)
+        scheduler = ContinuousBatchingScheduler(runner, kv_cache, eos_id=-1, max_sequence_length=8)
+        too_long = scheduler.submit(list(range(8)), 4, greedy=True)
+        valid = scheduler.submit([1, 2, 3], 4, greedy=True)
+        scheduler.run_until_complete()
+
+        with pytest.raises(ValueError):
+            too_long.result(timeout=0)
+        assert len(valid.result(timeout=0)['generated_token_ids']) == 4
+        assert kv_cache.num_free_blocks == kv_cache.num_blocks
+
+    @pytest.mark.unit
+    def test_failed_prefill_fails_only_its_request(self):
+        model = TinyGPT().double().eval()
+
+        def runner(kv_cache, tokens, positions):
+            if tokens.size(1) > 1 and tokens[0, 0] == 0:
+                raise RuntimeError('prefill failed')
+            return model(tokens, positions, kv_cache)[:, -1]
+
+        kv_cache = PagedKVCache(num_blocks=10, block_size=4)
+        scheduler = ContinuousBatchingScheduler(runner, kv_cache, eos_id=-1)
+        running = scheduler.submit([1, 2, 3], 6, greedy=True)
+        failing = scheduler.submit([0, 1, 2, 3, 4], 6, greedy=True)
+        waiting = scheduler.submit([5, 6], 6, greedy=True)
+        scheduler.run_until_complete()
+
+        with pytest.raises(RuntimeError):
+            failing.result(timeout=0)
+        with torch.no_grad():
+            assert running.result(timeout=0)['token_ids'] == _greedy_reference(model, [1, 2, 3], 6)
+            assert waiting.result(timeout=0)['token_ids'] == _greedy_reference(model, [5, 6], 6)
+        assert kv_cache.num_free_blocks == kv_cache.num_blocks
+
+    @pytest.mark.run_only_on('GPU')
+    @pytest.mark.unit
+    def test_megatron_gpt_paged_runner(self, test_data_dir):
+        model = _tiny_megatron_gpt_model(test_data_dir)
+        vocab_size = model.tokenizer.vocab_size
+        kv_cache = PagedKVCache(num_blocks=8, block_size=4)
+        scheduler = ContinuousBatchingScheduler(
+            MegatronGPTPagedModelRunner(model),
+            kv_cache,
+            eos_id=-1,
+            max_batch_size=3,
+            max_sequence_length=64,
+            vocab_size=vocab_size,
+            device=torch.device('cuda'),
+        )
+        prompts = [[31373, 11, 995], [14337, 4776, 290, 3598, 812, 2084], [7120, 640]]
+        tokens_to_generate = [6, 4, 8]
+        futures = [scheduler.submit(prompt, n, greedy=True) for prompt, n in zip(prompts, tokens_to_generate)]
+        scheduler.run_until_complete()
+
+        with torch.no_grad():
+            for future, prompt, n in zip(futures, prompts, tokens_to_generate):
+                # greedy decoding of the whole sequence at every step, without any key-value memory
+                tokens = list(prompt)
+                for _ in range(n):
+                    tokens_tensor = torch.tensor([tokens], device='cuda')
+                    attention_mask, _, position_ids = get_ltor_masks_and_position_ids(
+                        tokens_tensor, -1, False, False, False
+                    )
+                    logits = model(tokens_tensor, position_ids, attention_mask, labels=None)
+                    tokens.append(int(logits[0, -1, :vocab_size].argmax()))
+                assert future.result(timeout=0)['token_ids'] == tokens
+        assert kv_cache.num_free_blocks == kv_cache.num_blocks
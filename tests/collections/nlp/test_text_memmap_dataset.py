@@ -0,0 +1,100 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+
+import pytest
+
+from nemo.collections.nlp.data.language_modeling.text_memmap_dataset import (
+    JSONLMemMapDataset,
+    TextMemMapDataset,
+    build_index_files,
+)
+
+
+class CharTokenizer:
+    vocab_size = 256
+
+    def text_to_ids(self, text):
+        return [ord(c) for c in text]
+
+
+class ShiftedCharTokenizer:
+    vocab_size = 256
+
+    def __init__(self, shift):
+        self.shift = shift
+
+    def text_to_ids(self, text):
+        return [(ord(c) + self.shift) % self.vocab_size for c in text]
+
+
+def _write_lines(fn, lines):
+    with open(fn, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+class TestTextMemMapDataset:
+    @pytest.mark.unit
+    def test_index_rebuilt_only_for_changed_files(self, tmp_path):
+        fn_a, fn_b = str(tmp_path / 'a.txt'), str(tmp_path / 'b.txt')
+        _write_lines(fn_a, ['one', 'two'])
+        _write_lines(fn_b, ['three'])
+        build_index_files([fn_a, fn_b], newline_int=10, workers=1)
+        mtime_b = os.path.getmtime(fn_b + '.idx.npy')
+
+        _write_lines(fn_a, ['one', 'two', 'four'])
+        dataset = TextMemMapDataset([fn_a, fn_b], workers=1)
+
+        assert len(dataset) == 4
+        assert dataset[2] == 'four'
+        assert os.path.getmtime(fn_b + '.idx.npy') == mtime_b
+
+    @pytest.mark.unit
+    def test_tokenized_sample_cache(self, tmp_path):
+        fn = str(tmp_path / 'data.txt')
+        _write_lines(fn, ['hello', 'memmap', 'world'])
+        dataset = TextMemMapDataset([fn], workers=1, tokenizer=CharTokenizer(), cache_tokenized=True)
+
+        assert os.path.exists(fn + '.tok.bin') and os.path.exists(fn + '.tok.idx')
+        assert dataset[1] == [ord(c) for c in 'memmap']
+
+        # a changed file invalidates its sidecar
+        _write_lines(fn, ['hello', 'again'])
+        dataset = TextMemMapDataset([fn], workers=1, tokenizer=CharTokenizer(), cache_tokenized=True)
+        assert len(dataset) == 2
+        assert dataset[1] == [ord(c) for c in 'again']
+
+    @pytest.mark.unit
+    def test_tokenized_sample_cache_of_another_tokenizer(self, tmp_path):
+        fn = str(tmp_path / 'data.txt')
+        _write_lines(fn, ['hello', 'memmap'])
+
+        # tokenizers of the same class and vocabulary size, but different models, invalidate each other's sidecar
+        for shift in [1, 2, 1]:
+            tokenizer = ShiftedCharTokenizer(shift)
+            dataset = TextMemMapDataset([fn], workers=1, tokenizer=tokenizer, cache_tokenized=True)
+            assert dataset[1] == tokenizer.text_to_ids('memmap')
+
+    @pytest.mark.unit
+    def test_lru_cache(self, tmp_path):
+        fn = str(tmp_path / 'data.jsonl')
+        _write_lines(fn, [json.dumps({'text': str(i)}) for i in range(5)])
+        dataset = JSONLMemMapDataset([fn], header_lines=0, workers=1, lru_cache_size=2)
+
+        assert dataset[0] == {'text': '0'}
+        assert dataset[1] is dataset[1]
+        dataset[2]
+        assert list(dataset._lru_cache.keys()) == [1, 2]
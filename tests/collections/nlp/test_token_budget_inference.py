@@ -0,0 +1,169 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import torch
+
+from nemo.collections.nlp.data.intent_slot_classification.intent_slot_classification_dataset import get_features
+from nemo.collections.nlp.data.text_classification.text_classification_dataset import TextClassificationDataset
+from nemo.collections.nlp.models.intent_slot_classification.intent_slot_classification_model import (
+    IntentSlotClassificationModel,
+)
+from nemo.collections.nlp.models.text_classification.text_classification_model import TextClassificationModel
+from nemo.collections.nlp.parts.token_budget_inference import (
+    iterate_token_budget_batches,
+    pack_by_tokens,
+    pad_sequences,
+    tokenize_in_threads,
+)
+
+QUERIES = [
+    "set an alarm for seven",
+    "play",
+    "what is the weather like in san francisco tomorrow morning",
+    "book a table 🙂 for two",
+    "turn off the lights in the living room please",
+    "hi",
+]
+
+
+class SubwordTokenizer:
+    cls_token, sep_token = '[CLS]', '[SEP]'
+    pad_id, unk_id = 0, 1
+
+    def __init__(self):
+        self.vocab = {'[PAD]': 0, '[UNK]': 1, self.cls_token: 2, self.sep_token: 3}
+
+    def text_to_tokens(self, text):
+        # words of non-ascii characters are dropped, as some tokenizers drop emojis
+        if not text.isascii():
+            return []
+        return [text[i : i + 3] for i in range(0, len(text), 3)]
+
+    def tokens_to_ids(self, tokens):
+        if isinstance(tokens, str):
+            return self.vocab.setdefault(tokens, len(self.vocab))
+        return [self.tokens_to_ids(token) for token in tokens]
+
+    def ids_to_tokens(self, ids):
+        tokens = {i: token for token, i in self.vocab.items()}
+        return tokens[ids] if isinstance(ids, int) else [tokens[i] for i in ids]
+
+
+def _model(**kwargs):
+    model = SimpleNamespace(tokenizer=SubwordTokenizer(), training=False, **kwargs)
+    model.parameters = lambda: iter([torch.zeros(1)])
+    model.eval = lambda: None
+    model.train = lambda mode=True: None
+    return model
+
+
+def _length_logits(attention_mask, num_classes):
+    """ Logits whose argmax is the number of tokens of a query modulo num_classes """
+    return torch.nn.functional.one_hot(attention_mask.sum(-1) % num_classes, num_classes).float()
+
+
+class TestTokenBudgetInference:
+    @pytest.mark.unit
+    def test_pack_by_tokens(self):
+        # a sequence longer than max_tokens forms a batch on its own
+        assert pack_by_tokens([20, 1], max_tokens=16) == [[0], [1]]
+        assert pack_by_tokens([4, 4, 4, 4], max_tokens=8) == [[0, 1], [2, 3]]
+
+    @pytest.mark.unit
+    def test_pad_sequences(self):
+        assert pad_sequences([[1, 2], [3], [4, 5, 6]], pad_value=-1).tolist() == [[1, 2, -1], [3, -1, -1], [4, 5, 6]]
+
+    @pytest.mark.unit
+    def test_tokenize_in_threads(self):
+        texts = [f'query {i}' for i in range(100)]
+        assert tokenize_in_threads(texts, str.split, num_threads=4) == [text.split() for text in texts]
+
+    @pytest.mark.unit
+    def test_iterate_token_budget_batches(self):
+        rng = np.random.RandomState(0)
+        input_ids = [rng.randint(1, 100, size=rng.randint(3, 20)).tolist() for _ in range(50)]
+        seen = []
+        for batch, batch_input_ids, attention_mask in iterate_token_budget_batches(
+            input_ids, max_tokens=64, device=torch.device('cpu'), pad_id=0
+        ):
+            assert batch_input_ids.numel() <= 64 or len(batch) == 1
+            assert batch_input_ids.shape[1] == max(len(input_ids[i]) for i in batch)
+            for row, i in enumerate(batch):
+                length = int(attention_mask[row].sum())
+                assert batch_input_ids[row, :length].tolist() == input_ids[i]
+                assert (batch_input_ids[row, length:] == 0).all()
+            seen.extend(batch)
+        assert sorted(seen) == list(range(50))
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("max_seq_length", [-1, 6])
+    def test_text_classification_input_ids_match_dataset(self, max_seq_length):
+        model = _model()
+        features = TextClassificationDataset.get_features(
+            [query.strip().split() for query in QUERIES], model.tokenizer, max_seq_length, verbose=False
+        )
+        for query, feature in zip(QUERIES, features):
+            assert TextClassificationModel._query_to_input_ids(model, query, max_seq_length) == feature[0].tolist()
+
+    @pytest.mark.unit
+    def test_text_classification_predictions_in_input_order(self):
+        model = _model()
+        model.forward = lambda input_ids, token_type_ids, attention_mask: _length_logits(attention_mask, 64)
+        model._query_to_input_ids = lambda query, max_seq_length: TextClassificationModel._query_to_input_ids(
+            model, query, max_seq_length
+        )
+        preds = TextClassificationModel._classifytext_by_tokens(
+            model, QUERIES, max_seq_length=-1, max_tokens=24, num_tokenizer_threads=2
+        )
+        assert preds == [len(TextClassificationModel._query_to_input_ids(model, query)) for query in QUERIES]
+
+    @pytest.mark.unit
+    def test_intent_slot_features_match_dataset(self):
+        model = _model()
+        input_ids, _, input_mask, _, subtokens_mask, _ = get_features(QUERIES, -1, model.tokenizer)
+        for i, query in enumerate(QUERIES):
+            length = sum(input_mask[i])
+            assert IntentSlotClassificationModel._query_to_input_ids_and_subtokens_mask(model, query) == (
+                input_ids[i][:length],
+                subtokens_mask[i][:length],
+            )
+
+    @pytest.mark.unit
+    def test_intent_slot_predictions_in_input_order(self):
+        intent_labels = [f'intent_{i}' for i in range(64)]
+        slot_labels = [f'slot_{i}' for i in range(256)]
+
+        def forward(input_ids, token_type_ids, attention_mask):
+            # the slot of a token is its id
+            return _length_logits(attention_mask, 64), torch.nn.functional.one_hot(input_ids, 256).float()
+
+        model = _model(
+            forward=forward,
+            cfg=SimpleNamespace(data_desc=SimpleNamespace(intent_labels=intent_labels, slot_labels=slot_labels)),
+            _convert_predictions_to_labels=IntentSlotClassificationModel._convert_predictions_to_labels,
+        )
+        model._query_to_input_ids_and_subtokens_mask = lambda query: (
+            IntentSlotClassificationModel._query_to_input_ids_and_subtokens_mask(model, query)
+        )
+        intents, slots = IntentSlotClassificationModel._predict_by_tokens(
+            model, QUERIES, max_tokens=24, num_tokenizer_threads=2
+        )
+        for query, intent, query_slots in zip(QUERIES, intents, slots):
+            input_ids, subtokens_mask = model._query_to_input_ids_and_subtokens_mask(query)
+            assert intent == intent_labels[len(input_ids)]
+            assert query_slots == ' '.join(slot_labels[i] for i, mask in zip(input_ids, subtokens_mask) if mask)
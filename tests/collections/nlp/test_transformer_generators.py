@@ -0,0 +1,129 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+import torch
+
+from nemo.collections.nlp.modules.common.transformer import (
+    BeamSearchSequenceGenerator,
+    GreedySequenceGenerator,
+    TransformerDecoder,
+    TransformerEmbedding,
+)
+
+VOCAB_SIZE = 16
+HIDDEN_SIZE = 16
+
+
+class LogSoftmax(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.dense = torch.nn.Linear(HIDDEN_SIZE, VOCAB_SIZE)
+
+    def forward(self, hidden_states):
+        return torch.log_softmax(self.dense(hidden_states), dim=-1)
+
+
+def _modules(pre_ln):
+    torch.manual_seed(0)
+    embedding = TransformerEmbedding(VOCAB_SIZE, HIDDEN_SIZE, num_token_types=0).double()
+    decoder = TransformerDecoder(
+        num_layers=2, hidden_size=HIDDEN_SIZE, inner_size=32, num_attention_heads=2, pre_ln=pre_ln
+    ).double()
+    return embedding, decoder, LogSoftmax().double()
+
+
+def _encoder_output(batch_size, src_length=6):
+    encoder_hidden_states = torch.randn(batch_size, src_length, HIDDEN_SIZE, dtype=torch.float64)
+    encoder_input_mask = torch.ones(batch_size, src_length, dtype=torch.float64)
+    encoder_input_mask[0, -2:] = 0
+    return encoder_hidden_states, encoder_input_mask
+
+
+class TestTransformerGenerators:
+    @pytest.mark.unit
+    @pytest.mark.parametrize("pre_ln", [False, True])
+    def test_greedy_kv_cache(self, pre_ln):
+        modules = _modules(pre_ln)
+        encoder_hidden_states, encoder_input_mask = _encoder_output(batch_size=3)
+
+        outputs = []
+        for use_kv_cache in [False, True]:
+            generator = GreedySequenceGenerator(*modules, eos=-1, max_delta_length=5, use_kv_cache=use_kv_cache)
+            outputs.append(
+                generator(encoder_hidden_states=encoder_hidden_states, encoder_input_mask=encoder_input_mask)
+            )
+        assert outputs[0].shape == (3, 11)
+        assert torch.equal(outputs[0], outputs[1])
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("pre_ln", [False, True])
+    def test_beam_search_kv_cache(self, pre_ln):
+        modules = _modules(pre_ln)
+        encoder_hidden_states, encoder_input_mask = _encoder_output(batch_size=2)
+
+        def beam_search(use_kv_cache, batch_slice):
+            generator = BeamSearchSequenceGenerator(
+                *modules, beam_size=3, len_pen=0.6, eos=-1, max_delta_length=5, use_kv_cache=use_kv_cache
+            )
+            return generator(
+                encoder_hidden_states=encoder_hidden_states[batch_slice],
+                encoder_input_mask=encoder_input_mask[batch_slice],
+                return_beam_scores=True,
+            )
+
+        # hypotheses of every batch element are reordered within their own beam
+        batched = beam_search(True, slice(0, 2))
+        for i in range(2):
+            cached = beam_search(True, slice(i, i + 1))
+            uncached = beam_search(False, slice(i, i + 1))
+            assert torch.equal(cached[0], uncached[0]) and torch.equal(cached[2], uncached[2])
+            assert torch.allclose(cached[1], uncached[1])
+            assert torch.equal(batched[2][i], cached[2][0])
+
+    @pytest.mark.unit
+    def test_batched_beam_search_matches_per_sentence(self):
+        modules = _modules(pre_ln=False)
+        encoder_hidden_states, encoder_input_mask = _encoder_output(batch_size=3)
+        encoder_input_mask[2, -1:] = 0
+        generator = BeamSearchSequenceGenerator(*modules, beam_size=3, len_pen=0.6, eos=-1, max_delta_length=5)
+
+        hypotheses, scores, best = generator(
+            encoder_hidden_states=encoder_hidden_states, encoder_input_mask=encoder_input_mask, return_beam_scores=True
+        )
+        for i in range(3):
+            sentence_hypotheses, sentence_scores, sentence_best = generator(
+                encoder_hidden_states=encoder_hidden_states[i : i + 1],
+                encoder_input_mask=encoder_input_mask[i : i + 1],
+                return_beam_scores=True,
+            )
+            # every sentence has its own beam of 3 hypotheses
+            assert torch.equal(hypotheses[3 * i : 3 * i + 3], sentence_hypotheses)
+            assert torch.allclose(scores[3 * i : 3 * i + 3], sentence_scores)
+            assert torch.equal(best[i], sentence_best[0])
+
+    @pytest.mark.unit
+    def test_kv_cache_reorder(self):
+        _, decoder, _ = _modules(pre_ln=False)
+        kv_cache = decoder.init_kv_cache(max_length=4)
+        key = torch.arange(3, dtype=torch.float64).view(3, 1, 1, 1).repeat(1, 2, 2, 5)
+        keys, values = kv_cache.update(0, key, -key)
+        kv_cache.advance(2)
+        assert keys.shape == (3, 2, 2, 5) and kv_cache.keys[0].shape == (3, 2, 4, 5)
+
+        kv_cache.reorder(torch.tensor([2, 2, 0]))
+        assert kv_cache.keys[0][:, 0, 0, 0].tolist() == [2, 2, 0]
+        assert kv_cache.values[0][:, 0, 0, 0].tolist() == [-2, -2, 0]
+        with pytest.raises(ValueError):
+            kv_cache.update(0, torch.cat([key, key], dim=2), -key)
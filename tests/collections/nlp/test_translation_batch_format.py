@@ -0,0 +1,89 @@
+# Copyright (c) 2022, NVIDIA CORPORATION.  All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import json
+import os
+import pickle
+import tarfile
+
+import numpy as np
+import pytest
+
+from nemo.collections.nlp.data.machine_translation.translation_batch_format import (
+    _unpad,
+    convert_tarred_dataset_to_binary,
+    decode_translation_batch,
+    encode_translation_batch,
+    is_binary_translation_batch,
+)
+
+
+class TestTranslationBatchFormat:
+    @pytest.mark.unit
+    @pytest.mark.parametrize("max_token_id", [100, 40000])
+    def test_encode_decode(self, max_token_id):
+        src_sentences = [np.array([1, 5, max_token_id, 2]), np.array([1, 2])]
+        tgt_sentences = [np.array([1, 7, 2]), np.array([1, 8, 9, 10, 2])]
+        data = encode_translation_batch(src_sentences, tgt_sentences)
+        assert is_binary_translation_batch(data)
+        # header, lengths table and unpadded tokens
+        itemsize = 2 if max_token_id < 2 ** 15 else 4
+        assert len(data) == 32 + 4 * 4 + itemsize * 14
+
+        src, tgt = decode_translation_batch(data, src_pad_id=0, tgt_pad_id=3)
+        assert src.dtype == np.int64 and tgt.dtype == np.int64
+        assert src.tolist() == [[1, 5, max_token_id, 2], [1, 2, 0, 0]]
+        assert tgt.tolist() == [[1, 7, 2, 3, 3], [1, 8, 9, 10, 2]]
+        assert not is_binary_translation_batch(pickle.dumps({'src': src, 'tgt': tgt}))
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("num_sentences", [0, 2])
+    def test_encode_decode_empty_sentences(self, num_sentences):
+        sentences = [np.array([], dtype=np.int64)] * num_sentences
+        data = encode_translation_batch(sentences, sentences)
+        assert len(data) == 32 + 4 * 2 * num_sentences
+
+        src, tgt = decode_translation_batch(data, src_pad_id=0, tgt_pad_id=0)
+        assert src.shape == tgt.shape == (num_sentences, 0)
+
+    @pytest.mark.unit
+    def test_convert_tarred_dataset(self, tmpdir):
+        tmpdir = str(tmpdir)
+        batch = {'src': np.array([[1, 4, 5, 2], [1, 6, 2, 0]]), 'tgt': np.array([[1, 7, 2], [1, 2, 0]])}
+        tar_file = os.path.join(tmpdir, 'parallel.batches.tokens.16.0.tar')
+        with tarfile.open(tar_file, 'w') as tar:
+            data = pickle.dumps(batch)
+            info = tarfile.TarInfo(name='batch-0.pkl')
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+        metadata_path = os.path.join(tmpdir, 'metadata.tokens.16.json')
+        with open(metadata_path, 'w') as f:
+            json.dump({'num_batches': 1, 'tar_files': [tar_file]}, f)
+
+        out_dir = os.path.join(tmpdir, 'binary')
+        out_metadata_path = convert_tarred_dataset_to_binary(metadata_path, out_dir, 0, 0, n_jobs=1)
+        with open(out_metadata_path) as f:
+            metadata = json.load(f)
+        assert metadata == {'num_batches': 1, 'tar_files': [os.path.join(out_dir, os.path.basename(tar_file))]}
+        with tarfile.open(metadata['tar_files'][0]) as tar:
+            members = tar.getmembers()
+            assert [member.name for member in members] == ['batch-0.bin']
+            src, tgt = decode_translation_batch(tar.extractfile(members[0]).read(), 0, 0)
+        assert np.array_equal(src, batch['src']) and np.array_equal(tgt, batch['tgt'])
+
+    @pytest.mark.unit
+    def test_unpad_keeps_pad_tokens_inside_sentences(self):
+        batch = np.array([[1, 0, 5, 2], [1, 0, 0, 0], [0, 0, 0, 0]])
+        assert [sentence.tolist() for sentence in _unpad(batch, pad_id=0)] == [[1, 0, 5, 2], [1], []]